@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+"""Measure the throughput of the ticket notifications.
+
+The notifications are formatted and passed to an e-mail sender which
+discards them, for a batch modification of `--tickets` tickets and for
+the same number of individual ticket changes.
+"""
+
+import argparse
+import time
+
+import trac.ticket.web_ui  # provides the notification templates
+from trac.core import Component, implements
+from trac.notification.api import IEmailSender, NotificationSystem
+from trac.test import EnvironmentStub
+from trac.ticket.model import Ticket
+from trac.ticket.notification import (BatchTicketChangeEvent,
+                                      TicketChangeEvent)
+from trac.util.datefmt import datetime_now, utc
+from trac.util.text import printout
+
+
+class NullEmailSender(Component):
+
+    implements(IEmailSender)
+
+    messages = 0
+
+    def send(self, from_addr, recipients, message):
+        self.messages += 1
+
+
+def create_env(count):
+    env = EnvironmentStub(default_data=True,
+                          enable=['trac.*', NullEmailSender])
+    config = env.config
+    config.set('notification', 'smtp_enabled', 'enabled')
+    config.set('notification', 'email_sender', 'NullEmailSender')
+    config.set('notification-subscriber', 'always_notify_reporter',
+               'TicketReporterSubscriber')
+    config.set('notification-subscriber', 'always_notify_owner',
+               'TicketOwnerSubscriber')
+    tickets = []
+    with env.db_transaction:
+        for idx in xrange(count):
+            ticket = Ticket(env)
+            ticket['reporter'] = 'reporter%d@example.org' % idx
+            ticket['owner'] = 'owner%d@example.org' % (idx % 10)
+            ticket['summary'] = 'Ticket %d' % idx
+            ticket['description'] = 'Description of ticket %d' % idx
+            ticket.insert()
+            tickets.append(ticket)
+    return env, tickets
+
+
+def measure(env, name, events):
+    sender = NullEmailSender(env)
+    notify_sys = NotificationSystem(env)
+    sender.messages = 0
+    start = time.time()
+    for event in events:
+        notify_sys.notify(event)
+    elapsed = time.time() - start
+    printout("%-16s %6d messages in %7.3f s (%8.1f messages/s)"
+             % (name, sender.messages, elapsed,
+                sender.messages / elapsed if elapsed else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tickets', type=int, default=1000,
+                        help="number of tickets (default: %(default)s)")
+    args = parser.parse_args()
+
+    env, tickets = create_env(args.tickets)
+    try:
+        now = datetime_now(utc)
+        measure(env, 'Batch change', [
+            BatchTicketChangeEvent([t.id for t in tickets], now, 'admin',
+                                   'Batch comment', {'priority': 'major'},
+                                   'leave')])
+        measure(env, 'Ticket changes', [
+            TicketChangeEvent('changed', t, now, 'admin', 'Comment')
+            for t in tickets])
+    finally:
+        env.reset_db()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+"""Compare the search with and without a full-text index.
+
+A new environment is filled with `--size` megabytes of wiki pages and
+tickets made of random words following a Zipf distribution. The
+queries are a frequent, a less frequent and a rare word, a prefix and
+two words. They are timed with the `LIKE` conditions of
+`search_to_sql`, then with each index backend after building its index.
+"""
+
+import argparse
+import bisect
+import os
+import random
+import shutil
+import string
+import tempfile
+import time
+
+import trac.search.fileindex  # provides the FileSearchIndexer
+import trac.ticket.web_ui  # provides the search sources
+import trac.wiki.web_ui
+from trac.core import TracError
+from trac.env import Environment
+from trac.search.index import SearchIndex
+from trac.search.web_ui import SearchModule
+from trac.test import MockRequest
+from trac.util.text import printout
+from trac.wiki.model import update_latest_version
+
+
+def create_vocabulary(count):
+    words = set()
+    while len(words) < count:
+        words.add(''.join(random.choice(string.ascii_lowercase)
+                          for idx in xrange(random.randint(3, 10))))
+    words = sorted(words, key=lambda word: random.random())
+    # Zipf distribution: the frequency of a word is inversely
+    # proportional to its rank.
+    cumulated = []
+    total = 0
+    for rank in xrange(1, count + 1):
+        total += 1.0 / rank
+        cumulated.append(total)
+    return words, cumulated
+
+
+def random_text(words, cumulated, size):
+    text = []
+    length = 0
+    while length < size:
+        word = words[bisect.bisect(cumulated,
+                                   random.random() * cumulated[-1])]
+        text.append(word)
+        length += len(word) + 1
+    return ' '.join(text)
+
+
+def fill_env(env, megabytes, words, cumulated):
+    size = megabytes * 1024 * 1024
+    pages = tickets = 0
+    with env.db_transaction as db:
+        while size > 0:
+            text = random_text(words, cumulated, 4000)
+            db("""INSERT INTO wiki (name, version, time, author, text)
+                  VALUES (%s,1,0,'joe',%s)""", ('Page%d' % pages, text))
+            update_latest_version(db, 'Page%d' % pages)
+            pages += 1
+            size -= len(text)
+            summary = random_text(words, cumulated, 60)
+            description = random_text(words, cumulated, 1000)
+            cursor = db.cursor()
+            cursor.execute("""
+                INSERT INTO ticket (type, time, changetime, status,
+                                    reporter, summary, description)
+                VALUES ('defect',0,0,'new','joe',%s,%s)""",
+                (summary, description))
+            id_ = db.get_last_id(cursor, 'ticket')
+            tickets += 1
+            size -= len(summary) + len(description)
+            for idx in xrange(3):
+                comment = random_text(words, cumulated, 300)
+                db("""INSERT INTO ticket_change (ticket, time, author,
+                                                 field, oldvalue, newvalue)
+                      VALUES (%s,%s,'jane','comment',%s,%s)""",
+                   (id_, idx, str(idx + 1), comment))
+                size -= len(comment)
+    return pages, tickets
+
+
+def get_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(dirpath, name))
+               for dirpath, dirnames, filenames in os.walk(path)
+               for name in filenames)
+
+
+def measure(env, name, queries):
+    search = SearchModule(env)
+    req = MockRequest(env)
+    for query in queries:
+        start = time.time()
+        results, count = search._do_search(req, query.split(),
+                                           ['ticket', 'wiki'],
+                                           search.RESULTS_PER_PAGE)
+        elapsed = time.time() - start
+        printout("%-24s %-20s %8d results in %8.3f s"
+                 % (name, query, count, elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=10,
+                        help="size of the corpus in megabytes "
+                             "(default: %(default)s)")
+    parser.add_argument('--words', type=int, default=50000,
+                        help="size of the vocabulary (default: %(default)s)")
+    parser.add_argument('--backends', nargs='*',
+                        default=['FileSearchIndexer', 'DatabaseSearchIndexer'],
+                        help="index backends (default: %(default)s)")
+    args = parser.parse_args()
+
+    words, cumulated = create_vocabulary(args.words)
+    queries = [words[0], words[100], words[args.words // 2],
+               words[10][:3], '%s %s' % (words[5], words[50])]
+    path = tempfile.mkdtemp(prefix='trac-search-')
+    try:
+        env = Environment(path, create=True)
+        start = time.time()
+        pages, tickets = fill_env(env, args.size, words, cumulated)
+        printout("%d wiki pages and %d tickets created in %.1f s, "
+                 "database of %d MB"
+                 % (pages, tickets, time.time() - start,
+                    get_size(os.path.join(path, 'db')) / 1024 / 1024))
+        measure(env, 'search_to_sql', queries)
+        for backend in args.backends:
+            env.config.set('search', 'index_backend', backend)
+            start = time.time()
+            try:
+                count = SearchIndex(env).reindex()
+            except TracError as e:
+                printout("%s: %s" % (backend, e))
+                continue
+            printout("%s: %d documents indexed in %.1f s"
+                     % (backend, count, time.time() - start))
+            measure(env, backend, queries)
+        printout("Index size: files/search-index %d MB"
+                 % (get_size(env.files_dir) / 1024 / 1024))
+        env.shutdown()
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
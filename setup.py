@@ -125,10 +125,14 @@ setup(
         trac.mimeview.rst = trac.mimeview.rst[rest]
         trac.mimeview.txtl = trac.mimeview.txtl[textile]
         trac.notification.api = trac.notification.api
+        trac.notification.digest = trac.notification.digest
         trac.notification.mail = trac.notification.mail
         trac.notification.prefs = trac.notification.prefs
+        trac.notification.spool = trac.notification.spool
         trac.prefs = trac.prefs.web_ui
         trac.search = trac.search.web_ui
+        trac.search.fileindex = trac.search.fileindex
+        trac.search.index = trac.search.index
         trac.ticket.admin = trac.ticket.admin
         trac.ticket.batch = trac.ticket.batch
         trac.ticket.query = trac.ticket.query
@@ -137,6 +141,7 @@ setup(
         trac.ticket.roadmap = trac.ticket.roadmap
         trac.ticket.web_ui = trac.ticket.web_ui
         trac.timeline = trac.timeline.web_ui
+        trac.timeline.index = trac.timeline.index
         trac.versioncontrol.admin = trac.versioncontrol.admin
         trac.versioncontrol.svn_authz = trac.versioncontrol.svn_authz
         trac.versioncontrol.web_ui = trac.versioncontrol.web_ui
@@ -144,6 +149,8 @@ setup(
         trac.web.main = trac.web.main
         trac.web.session = trac.web.session
         trac.wiki.admin = trac.wiki.admin
+        trac.wiki.htmlcache = trac.wiki.htmlcache
+        trac.wiki.links = trac.wiki.links
         trac.wiki.interwiki = trac.wiki.interwiki
         trac.wiki.macros = trac.wiki.macros
         trac.wiki.web_ui = trac.wiki.web_ui
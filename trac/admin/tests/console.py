@@ -21,6 +21,7 @@ from subprocess import PIPE
 # IAdminCommandProvider implementations
 import trac.admin.api
 import trac.attachment
+import trac.notification.spool
 import trac.perm
 import trac.ticket.admin
 import trac.versioncontrol.admin
@@ -17,6 +17,7 @@
 #         Christopher Lenz <cmlenz@gmx.de>
 
 from datetime import datetime
+from functools import partial
 from tempfile import TemporaryFile
 from zipfile import ZipFile, ZIP_DEFLATED
 import errno
@@ -32,7 +33,8 @@ from trac.core import *
 from trac.mimeview import *
 from trac.perm import IPermissionPolicy
 from trac.resource import *
-from trac.search import search_to_sql, shorten_result
+from trac.search import search_to_sql, shorten_result, \
+                        sorted_search_results
 from trac.util import content_disposition, create_zipinfo, file_or_std, \
                       get_reporter_id, normalize_filename
 from trac.util.datefmt import datetime_now, format_datetime, \
@@ -314,6 +316,18 @@ class AttachmentModule(Component):
             if 'ATTACHMENT_VIEW' in req.perm(attachment):
                 yield 'attachment', time, author, (attachment, descr), self
 
+    def get_timeline_last_modified(self, req, resource_realm):
+        """Return the time of the last change to attachments on resources
+        of the given `resource_realm.realm`, suitable for
+        `ITimelineEventProvider.get_timeline_last_modified`.
+
+        :since: 1.3.3
+        """
+        for ts, in self.env.db_query("""
+                SELECT MAX(time) FROM attachment WHERE type=%s
+                """, (resource_realm.realm,)):
+            return from_utimestamp(ts)
+
     def render_timeline_event(self, context, field, event):
         attachment, descr = event[3]
         if field == 'url':
@@ -335,19 +349,64 @@ class AttachmentModule(Component):
         `resource_realm.realm` whose filename, description or author match
         the given terms.
         """
+        from trac.search.index import SearchIndex
+        matches = SearchIndex(self.env).search(self.realm, terms)
+        with self.env.db_query as db:
+            if matches is None:
+                where, args = search_to_sql(
+                        db, ['filename', 'description', 'author'], terms)
+                rows = db(self._search_query + where,
+                          (resource_realm.realm,) + args)
+            else:
+                rows = []
+                for id, filename in self._get_matching_attachments(
+                        resource_realm, matches):
+                    rows.extend(db(self._search_query +
+                                   "id = %s AND filename = %s",
+                                   (resource_realm.realm, id, filename)))
+            for row in rows:
+                result = self._make_search_result(req, resource_realm, terms,
+                                                  matches, row)
+                if result is not None:
+                    yield result
+
+    def get_sorted_search_results(self, req, resource_realm, terms, limit):
+        """Return the first `limit` search results and the total number
+        of results, suitable for `ISearchSource.get_sorted_search_results`.
+
+        :since: 1.3.3
+        """
+        from trac.search.index import SearchIndex, attachment_resource
+        matches = SearchIndex(self.env).search(self.realm, terms)
         with self.env.db_query as db:
-            sql_query, args = search_to_sql(
-                    db, ['filename', 'description', 'author'], terms)
-            for id, time, filename, desc, author in db("""
-                    SELECT id, time, filename, description, author
-                    FROM attachment WHERE type = %s AND """ + sql_query,
-                    (resource_realm.realm,) + args):
-                attachment = resource_realm(id=id).child(self.realm, filename)
-                if 'ATTACHMENT_VIEW' in req.perm(attachment):
-                    yield (get_resource_url(self.env, attachment, req.href),
-                           get_resource_shortname(self.env, attachment),
-                           from_utimestamp(time), author,
-                           shorten_result(desc, terms))
+            if matches is None:
+                where, args = search_to_sql(
+                        db, ['filename', 'description', 'author'], terms)
+                args = (resource_realm.realm,) + args
+                count = db("""SELECT COUNT(*) FROM attachment
+                              WHERE type = %s AND """ + where, args)[0][0]
+                def fetch(offset, size):
+                    return db(self._search_query + where +
+                              " ORDER BY time DESC LIMIT %d OFFSET %d"
+                              % (size, offset), args)
+            else:
+                attachments = sorted(
+                    self._get_matching_attachments(resource_realm, matches),
+                    key=lambda item: matches[attachment_resource(
+                        resource_realm.realm, *item)],
+                    reverse=True)
+                count = len(attachments)
+                def fetch(offset, size):
+                    rows = []
+                    for id, filename in attachments[offset:offset + size]:
+                        rows.extend(db(self._search_query +
+                                       "id = %s AND filename = %s",
+                                       (resource_realm.realm, id, filename)))
+                    return rows
+            return sorted_search_results(
+                fetch, partial(self._make_search_result, req, resource_realm,
+                               terms, matches),
+                limit), count
 
     # IResourceManager methods
 
@@ -400,6 +459,32 @@ class AttachmentModule(Component):
 
     # Internal methods
 
+    _search_query = """
+        SELECT id, time, filename, description, author
+        FROM attachment WHERE type = %s AND """
+
+    def _get_matching_attachments(self, resource_realm, matches):
+        """Yield the `(id, filename)` of the attachments of the index
+        `matches` which are attached to resources of `resource_realm`.
+        """
+        prefix = resource_realm.realm + ':'
+        for resource in matches:
+            if resource.startswith(prefix):
+                yield tuple(resource[len(prefix):].rsplit('/', 1))
+
+    def _make_search_result(self, req, resource_realm, terms, matches, row):
+        from trac.search.index import attachment_resource
+        id, time, filename, desc, author = row
+        attachment = resource_realm(id=id).child(self.realm, filename)
+        if 'ATTACHMENT_VIEW' in req.perm(attachment):
+            score = () if matches is None else \
+                    (matches[attachment_resource(resource_realm.realm,
+                                                 id, filename)],)
+            return (get_resource_url(self.env, attachment, req.href),
+                    get_resource_shortname(self.env, attachment),
+                    from_utimestamp(time), author,
+                    shorten_result(desc, terms)) + score
+
     def _do_save(self, req, attachment):
         req.perm(attachment.resource).require('ATTACHMENT_CREATE')
         parent_resource = attachment.resource.parent
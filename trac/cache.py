@@ -14,6 +14,7 @@
 import functools
 
 from trac.core import Component
+from trac.db.api import DatabaseManager
 from trac.util.concurrency import ThreadLocal, threading
 
 __all__ = ['CacheManager', 'cached']
@@ -79,6 +80,20 @@ class CachedSingletonProperty(CachedPropertyBase):
             id = self.id = key_to_id(self.make_key(instance.__class__))
         CacheManager(instance.env).invalidate(id)
 
+    def update(self, instance, updater):
+        """Update the cached value in this process with `updater`,
+        and invalidate it in other processes.
+
+        See `CacheManager.update`.
+
+        :since: 1.3.3
+        """
+        try:
+            id = self.id
+        except AttributeError:
+            id = self.id = key_to_id(self.make_key(instance.__class__))
+        CacheManager(instance.env).update(id, updater)
+
 
 class CachedProperty(CachedPropertyBase):
     """Cached property descriptor for classes having potentially
@@ -187,7 +202,7 @@ class CacheManager(Component):
 
     def __init__(self):
         self._cache = {}
-        self._local = ThreadLocal(meta=None, cache=None)
+        self._local = ThreadLocal(meta=None, cache=None, pending=None)
         self._lock = threading.RLock()
 
     # Public interface
@@ -249,25 +264,96 @@ class CacheManager(Component):
         with self.env.db_transaction as db:
             with self._lock:
                 # Invalidate in other processes
+                self._increment_generation(db, id)
+
+                # Invalidate in this process and in this thread
+                self._discard(id)
+
+    def update(self, id, updater):
+        """Update cached data for the given id in this process, and
+        invalidate it in other processes.
+
+        The `updater` is called with the data cached in this process
+        and returns the updated data. It is only called when the
+        cached data is known to be current, i.e. when no other process
+        invalidated it in the meantime; otherwise the cached data is
+        simply invalidated. The `updater` must not modify the data in
+        place, as it may be in use by other threads.
 
-                # The row corresponding to the cache may not exist in the table
-                # yet.
-                #  - If the row exists, the UPDATE increments the generation,
-                #    the SELECT returns a row and we're done.
-                #  - If the row doesn't exist, the UPDATE does nothing, but
-                #    starts a transaction. The SELECT then returns nothing,
-                #    and we can safely INSERT a new row.
-                db("UPDATE cache SET generation=generation+1 WHERE id=%s",
-                   (id,))
-                if not db("SELECT generation FROM cache WHERE id=%s", (id,)):
-                    db("INSERT INTO cache VALUES (%s, %s, %s)",
-                       (id, 0, _id_to_key.get(id, '<unknown>')))
-
-                # Invalidate in this process
-                self._cache.pop(id, None)
-
-                # Invalidate in this thread
+        The updated data is only visible to the current thread until
+        the transaction is committed, and is dropped if the transaction
+        is rolled back.
+
+        :since: 1.3.3
+        """
+        with self.env.db_transaction as db:
+            with self._lock:
+                generation = self._increment_generation(db, id)
+                pending = self._local.pending
+                if pending is None:
+                    pending = self._local.pending = {}
+                first = id not in pending
                 try:
-                    del self._local.cache[id]
-                except (KeyError, TypeError):
-                    pass
+                    data, cached_generation = \
+                        self._cache[id] if first else pending[id]
+                except KeyError:
+                    cached_generation = None
+                if cached_generation is None or \
+                        generation != cached_generation + 1:
+                    self._discard(id)
+                    return
+                entry = pending[id] = updater(data), generation
+                if self._local.cache is not None:
+                    self._local.cache[id] = entry
+                    self._local.meta[id] = generation
+            if first:
+                DatabaseManager(self.env).add_transaction_callback(
+                    functools.partial(self._end_update, id))
+
+    # Internal methods
+
+    def _increment_generation(self, db, id):
+        # The row corresponding to the cache may not exist in the table
+        # yet.
+        #  - If the row exists, the UPDATE increments the generation,
+        #    the SELECT returns a row and we're done.
+        #  - If the row doesn't exist, the UPDATE does nothing, but
+        #    starts a transaction. The SELECT then returns nothing,
+        #    and we can safely INSERT a new row.
+        db("UPDATE cache SET generation=generation+1 WHERE id=%s", (id,))
+        for generation, in db("SELECT generation FROM cache WHERE id=%s",
+                              (id,)):
+            return generation
+        db("INSERT INTO cache VALUES (%s, %s, %s)",
+           (id, 0, _id_to_key.get(id, '<unknown>')))
+        return 0
+
+    def _discard(self, id):
+        self._cache.pop(id, None)
+        self._discard_local(id)
+
+    def _discard_local(self, id):
+        try:
+            del self._local.pending[id]
+        except (KeyError, TypeError):
+            pass
+        try:
+            del self._local.cache[id]
+        except (KeyError, TypeError):
+            pass
+
+    def _end_update(self, id, committed):
+        with self._lock:
+            if not committed:
+                # The process cache still holds the committed data
+                self._discard_local(id)
+                return
+            entry = self._local.pending.pop(id, None)
+            if entry is None:
+                return
+            try:
+                data, generation = self._cache[id]
+            except KeyError:
+                generation = None
+            if generation is None or generation < entry[1]:
+                self._cache[id] = entry
@@ -61,7 +61,9 @@ class TransactionContextManager(DbContextManager):
     `~trac.db.util.ConnectionWrapper`.
 
     The outermost such context manager will perform a commit upon
-    normal exit or a rollback after an exception.
+    normal exit or a rollback after an exception, and will then call
+    the callbacks registered with
+    `~trac.db.api.DatabaseManager.add_transaction_callback`.
     """
 
     def __enter__(self):
@@ -73,17 +75,26 @@ class TransactionContextManager(DbContextManager):
             else:
                 db = self.dbmgr.get_connection()
             self.dbmgr._transaction_local.wdb = self.db = db
+            self.dbmgr._transaction_local.callbacks = []
         return db
 
     def __exit__(self, et, ev, tb):
         if self.db:
             self.dbmgr._transaction_local.wdb = None
-            if et is None:
-                self.db.commit()
-            else:
-                self.db.rollback()
-            if not self.dbmgr._transaction_local.rdb:
-                self.db.close()
+            callbacks = self.dbmgr._transaction_local.callbacks
+            self.dbmgr._transaction_local.callbacks = None
+            committed = False
+            try:
+                if et is None:
+                    self.db.commit()
+                    committed = True
+                else:
+                    self.db.rollback()
+                if not self.dbmgr._transaction_local.rdb:
+                    self.db.close()
+            finally:
+                for callback in callbacks:
+                    callback(committed)
 
 
 class QueryContextManager(DbContextManager):
@@ -276,7 +287,8 @@ class DatabaseManager(Component):
 
     def __init__(self):
         self._cnx_pool = None
-        self._transaction_local = ThreadLocal(wdb=None, rdb=None)
+        self._transaction_local = ThreadLocal(wdb=None, rdb=None,
+                                              callbacks=None)
 
     def init_db(self):
         connector, args = self.get_connector()
@@ -417,6 +429,18 @@ class DatabaseManager(Component):
             db = ConnectionWrapper(db, readonly=True)
         return db
 
+    def add_transaction_callback(self, callback):
+        """Register a `callback` to be called once the current
+        transaction of this thread ends, with `True` if it has been
+        committed and `False` if it has been rolled back.
+
+        :since: 1.3.3
+        """
+        callbacks = self._transaction_local.callbacks
+        if callbacks is None:
+            raise TracError(_("No transaction in progress"))
+        callbacks.append(callback)
+
     def get_database_version(self, name='database_version'):
         """Returns the database version from the SYSTEM table as an int,
         or `False` if the entry is not found.
@@ -16,6 +16,7 @@ import os
 import unittest
 
 from trac.config import ConfigurationError
+from trac.core import TracError
 from trac.db.api import DatabaseManager, get_column_names, \
                         parse_connection_uri
 from trac.db_default import (schema as default_schema,
@@ -300,6 +301,26 @@ class ConnectionTestCase(unittest.TestCase):
                 """):
             self.fail("Transaction was not rolled back")
 
+    def test_transaction_callbacks(self):
+        """Callbacks are called once the outermost transaction ends."""
+        results = []
+        with self.env.db_transaction:
+            with self.env.db_transaction:
+                self.dbm.add_transaction_callback(results.append)
+            self.assertEqual([], results)
+        self.assertEqual([True], results)
+
+        try:
+            with self.env.db_transaction:
+                self.dbm.add_transaction_callback(results.append)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual([True, False], results)
+
+        self.assertRaises(TracError, self.dbm.add_transaction_callback,
+                          results.append)
+
     def test_get_last_id(self):
         q = "INSERT INTO report (author) VALUES ('anonymous')"
         with self.env.db_transaction as db:
@@ -17,7 +17,7 @@
 from trac.db.schema import Table, Column, Index
 
 # Database version identifier. Used for automatic upgrades.
-db_version = 45
+db_version = 51
 
 def __mkreports(reports):
     """Utility function used to create report data in same syntax as the
@@ -82,6 +82,11 @@ schema = [
         Column('comment'),
         Column('readonly', type='int'),
         Index(['time'])],
+    Table('wiki_latest', key='name')[
+        Column('name'),
+        Column('version', type='int'),
+        Column('time', type='int64'),
+        Index(['time'])],
 
     # Version control cache
     Table('repository', key=('id', 'name'))[
@@ -191,6 +196,51 @@ schema = [
         Column('target'),
         Index(['sid', 'authenticated', 'class']),
         Index(['class', 'realm', 'target'])],
+    Table('notify_spool', key='id')[
+        Column('id', auto_increment=True),
+        Column('time', type='int64'),
+        Column('next_attempt', type='int64'),
+        Column('attempts', type='int'),
+        Column('status'),
+        Column('realm'),
+        Column('category'),
+        Column('class'),
+        Column('data'),
+        Column('error'),
+        Index(['status', 'next_attempt'])],
+    Table('notify_digest', key='id')[
+        Column('id', auto_increment=True),
+        Column('time', type='int64'),
+        Column('sid'),
+        Column('authenticated', type='int'),
+        Column('address'),
+        Column('realm'),
+        Column('category'),
+        Column('subject'),
+        Column('body'),
+        Index(['sid', 'authenticated', 'address'])],
+    Table('timeline_event', key='id')[
+        Column('id', auto_increment=True),
+        Column('time', type='int64'),
+        Column('realm'),
+        Column('resource'),
+        Column('author'),
+        Column('kind'),
+        Column('filter'),
+        Index(['time']),
+        Index(['realm', 'resource'])],
+    Table('search_document', key='id')[
+        Column('id', auto_increment=True),
+        Column('realm'),
+        Column('resource'),
+        Index(['realm', 'resource'], unique=True)],
+    Table('wiki_links', key=('realm', 'id', 'target_realm', 'target_id'))[
+        Column('realm'),
+        Column('id'),
+        Column('version', type='int'),
+        Column('target_realm'),
+        Column('target_id'),
+        Index(['target_realm', 'target_id'])],
 ]
 
 
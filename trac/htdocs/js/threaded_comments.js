@@ -118,6 +118,32 @@ jQuery(function($){
     }
   };
 
+  // Fetch the older changes not rendered with the page and insert them
+  // before the ones already shown
+  $("#trac-older-changes a").click(function() {
+    var $older = $("#trac-older-changes");
+    var stop = $(this).data("stop");
+    $(".trac-loading", $older).show();
+    $.ajax({
+      url: $(this).attr("href"),
+      data: {action: 'changelog', stop: stop},
+      dataType: 'html',
+      success: function(html) {
+        unapplyOrder();
+        $("#changelog").prepend(html);
+        $("#propertyform input[name='changes_start']").val(0);
+        $older.remove();
+        if ($("a.follow-up").length)
+          $('#trac-threaded-toggle').show();
+        applyOrder(order);
+      },
+      error: function() {
+        $(".trac-loading", $older).hide();
+      }
+    });
+    return false;
+  });
+
   // Only propose "Threaded" if there are replies
   if ($("a.follow-up").length)
     $('#trac-threaded-toggle').show();
@@ -17,6 +17,7 @@
 # history and logs, available at http://trac.edgewall.org/log/.
 
 from collections import defaultdict
+from contextlib import contextmanager
 from operator import itemgetter
 
 from trac.config import (BoolOption, ConfigSection, ExtensionOption,
@@ -82,6 +83,20 @@ class INotificationSubscriber(Interface):
                  'always' or 'never'.
         """
 
+    def matches_events(events):
+        """Return a list of subscriptions that match any of the given
+        events.
+
+        This method is optional. When implemented, it is called instead
+        of `matches` and allows looking up the subscriptions of several
+        events at once, e.g. for the ticket change events of a batch
+        modification.
+
+        :param events: a list of `NotificationEvent`
+        :return: a list of tuples like `matches`
+        :since: 1.3.3
+        """
+
     def description():
         """Description of the subscription shown in the preferences UI."""
 
@@ -200,6 +215,10 @@ class NotificationEvent(object):
                      (e.g. 'created', 'changed' or 'deleted')
     :param target: the resource model (e.g. Ticket or WikiPage) or `None`
     :param time: the `datetime` when the event happened
+
+    The events can be spooled for a deferred delivery if their class
+    implements the serialization protocol described in
+    `trac.notification.spool.NotificationSpool`.
     """
 
     def __init__(self, realm, category, target, time, author=""):
@@ -311,6 +330,13 @@ class NotificationSystem(Component):
         """Hash algorithm to create unique Message-ID header.
         ''(since 1.0.13)''""")
 
+    use_spool = BoolOption('notification', 'use_spool', 'false',
+        """Store the notification events in the database instead of
+        delivering them while processing the request. The spooled events
+        are delivered by running `trac-admin $ENV notification process`,
+        for example from a cron job or as a long-running worker.
+        (''since 1.3.3'')""")
+
     notification_subscriber_section = ConfigSection('notification-subscriber',
         """The notifications subscriptions are controlled by plugins. All
         `INotificationSubscriber` components are in charge. These components
@@ -365,11 +391,35 @@ class NotificationSystem(Component):
         """Send message to recipients via e-mail."""
         self.email_sender.send(from_addr, recipients, message)
 
+    @contextmanager
+    def email_batch(self):
+        """Context manager for sending several e-mails at once.
+
+        When the `email_sender` supports it (e.g. `SmtpEmailSender`),
+        the messages sent within the context reuse the same connection.
+
+        :since: 1.3.3
+        """
+        batch = getattr(self.email_sender, 'batch', None)
+        if batch is None:
+            yield
+        else:
+            with batch():
+                yield
+
     def notify(self, event):
         """Distribute an event to all subscriptions.
 
+        When `use_spool` is enabled, events which can be serialized are
+        stored in the notification spool and delivered later by the
+        `trac-admin notification process` command.
+
         :param event: a `NotificationEvent`
         """
+        if self.use_spool:
+            from trac.notification.spool import NotificationSpool
+            if NotificationSpool(self.env).enqueue(event):
+                return
         self.distribute_event(event, self.subscriptions(event))
 
     def distribute_event(self, event, subscriptions):
@@ -401,13 +451,20 @@ class NotificationSystem(Component):
 
         :return: a list of (sid, authenticated, address, transport, format)
         """
+        if event.category == 'batchmodify':
+            # Build the ticket change events once for all the subscribers
+            events = list(event.get_ticket_change_events(self.env))
+        else:
+            events = [event]
         subscriptions = []
         for subscriber in self.subscribers:
-            if event.category == 'batchmodify':
-                for ticket_event in event.get_ticket_change_events(self.env):
-                    subscriptions.extend(x for x in subscriber.matches(ticket_event) if x)
+            if hasattr(subscriber, 'matches_events'):
+                matches = subscriber.matches_events(events)
+                subscriptions.extend(x for x in matches if x)
             else:
-                subscriptions.extend(x for x in subscriber.matches(event) if x)
+                for e in events:
+                    subscriptions.extend(x for x in subscriber.matches(e)
+                                           if x)
 
         # For each (transport, sid, authenticated) combination check the
         # subscription with the highest priority:
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from email.utils import formatdate
+
+from trac.core import Component
+from trac.notification.api import NotificationSystem
+from trac.notification.mail import create_charset, create_message_id, \
+                                   create_mime_text, get_default_headers, \
+                                   get_smtp_from, set_header
+from trac.util.datefmt import datetime_now, to_utimestamp, utc
+from trac.util.text import exception_to_unicode
+from trac.util.translation import _, N_
+
+__all__ = ['EmailDigest', 'digest_intervals']
+
+
+# Name, label and duration in seconds of the digest intervals
+digest_intervals = [
+    ('hourly', N_("Hourly digest"), 3600),
+    ('daily', N_("Daily digest"), 86400),
+]
+
+
+class EmailDigest(Component):
+    """Accumulate the email notifications of the users who chose to
+    receive them as a periodic digest.
+
+    The interval is selected in the notification preferences and stored
+    in the `notification.digest.email` session attribute. The digests
+    which are due are sent by `trac-admin $ENV notification process`.
+
+    :since: 1.3.3
+    """
+
+    def get_sessions(self):
+        """Return a `dict` mapping the `(sid, authenticated)` tuple of
+        the sessions receiving digests to the digest interval in
+        seconds.
+        """
+        durations = dict((name, duration)
+                         for name, label, duration in digest_intervals)
+        return dict(((sid, authenticated), durations[value])
+                    for sid, authenticated, value in self.env.db_query("""
+                        SELECT sid, authenticated, value
+                        FROM session_attribute WHERE name=%s
+                        """, ('notification.digest.email',))
+                    if value in durations)
+
+    def add(self, event, recipients, subject, body):
+        """Add a formatted notification event to the digest of the
+        recipients.
+
+        :param event: the `NotificationEvent`
+        :param recipients: a list of `(sid, authenticated, address)`
+                           tuples
+        :param subject: the subject of the notification
+        :param body: the `text/plain` formatted notification
+        """
+        now = to_utimestamp(datetime_now(utc))
+        with self.env.db_transaction as db:
+            db.executemany("""
+                INSERT INTO notify_digest (time, sid, authenticated, address,
+                                           realm, category, subject, body)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+                """, [(now, sid, 1 if authenticated else 0, address,
+                       event.realm, event.category, subject, body)
+                      for sid, authenticated, address in recipients])
+
+    def send(self):
+        """Send the digests which are due, i.e. when the oldest
+        notification of the digest is older than the interval chosen by
+        the recipient.
+
+        :return: the number of digests sent.
+        """
+        now = to_utimestamp(datetime_now(utc))
+        sessions = self.get_sessions()
+        due = []
+        for sid, authenticated, address, oldest in self.env.db_query("""
+                SELECT sid, authenticated, address, MIN(time)
+                FROM notify_digest GROUP BY sid, authenticated, address
+                """):
+            # The notifications are sent at once if the recipient no longer
+            # receives digests.
+            interval = sessions.get((sid, authenticated), 0)
+            if oldest + interval * 1000000 <= now:
+                due.append((sid, authenticated, address))
+
+        sent = 0
+        with NotificationSystem(self.env).email_batch():
+            for sid, authenticated, address in due:
+                entries = self.env.db_query("""
+                    SELECT id, subject, body FROM notify_digest
+                    WHERE sid=%s AND authenticated=%s AND address=%s
+                    ORDER BY id
+                    """, (sid, authenticated, address))
+                try:
+                    self._send_digest(address, entries)
+                except Exception as e:
+                    self.log.error("Failed to send the notification digest "
+                                   "to %s: %s", address,
+                                   exception_to_unicode(e))
+                    continue
+                self.env.db_transaction("""
+                    DELETE FROM notify_digest
+                    WHERE sid=%s AND authenticated=%s AND address=%s
+                    AND id<=%s
+                    """, (sid, authenticated, address, entries[-1][0]))
+                sent += 1
+        return sent
+
+    # Internal methods
+
+    def _send_digest(self, address, entries):
+        charset = create_charset(self.config.get('notification',
+                                                 'mime_encoding'))
+        message = create_mime_text(self._format_digest(entries), 'plain',
+                                   charset)
+        smtp_from, smtp_from_name, smtp_replyto = get_smtp_from(self.env)
+        headers = get_default_headers(self.env)
+        headers['Message-ID'] = create_message_id(self.env, 'digest',
+                                                  smtp_from,
+                                                  datetime_now(utc),
+                                                  more=address)
+        headers['Date'] = formatdate()
+        headers['From'] = (smtp_from_name, smtp_from) \
+                          if smtp_from_name else smtp_from
+        headers['To'] = address
+        headers['Reply-To'] = smtp_replyto
+        headers['Subject'] = _("[%(project)s] Digest of %(count)d "
+                               "notifications",
+                               project=self.env.project_name,
+                               count=len(entries))
+        for k, v in headers.iteritems():
+            set_header(message, k, v, charset)
+        NotificationSystem(self.env).send_email(smtp_from, [address],
+                                                message.as_string())
+
+    def _format_digest(self, entries):
+        lines = []
+        for id_, subject, body in entries:
+            lines.append(subject)
+            lines.append('=' * min(len(subject), 76))
+            lines.append('')
+            lines.append(body.rstrip())
+            lines.append('')
+            lines.append('')
+        lines.append('-- ')
+        lines.append(_("You receive this digest as chosen in your "
+                       "notification preferences:"))
+        lines.append(self.env.abs_href.prefs('notification'))
+        return '\n'.join(lines) + '\n'
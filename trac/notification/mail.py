@@ -20,8 +20,10 @@ import hashlib
 import os
 import re
 import smtplib
+import threading
+from contextlib import contextmanager
 from email.charset import BASE64, QP, SHORTEST, Charset
-from email.header import Header
+from email.header import Header, decode_header
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formatdate, parseaddr, getaddresses
@@ -48,7 +50,8 @@ __all__ = ['AlwaysEmailSubscriber', 'EMAIL_LOOKALIKE_PATTERN',
            'RecipientMatcher', 'SendmailEmailSender', 'SessionEmailResolver',
            'SmtpEmailSender', 'create_charset', 'create_header',
            'create_message_id', 'create_mime_multipart', 'create_mime_text',
-           'get_from_author', 'set_header']
+           'get_default_headers', 'get_from_author', 'get_smtp_from',
+           'set_header']
 
 
 MAXHEADERLEN = 76
@@ -166,6 +169,41 @@ def create_message_id(env, targetid, from_email, time, more=None):
     return '<%03d.%s@%s>' % (len(source), h.hexdigest(), host)
 
 
+def get_smtp_from(env):
+    """Return the `(address, name, reply_to)` tuple used as sender of
+    the notification emails.
+
+    :since: 1.3.3
+    """
+    notify_sys = NotificationSystem(env)
+    smtp_from = notify_sys.smtp_from
+    smtp_from_name = notify_sys.smtp_from_name or env.project_name
+    smtp_replyto = notify_sys.smtp_replyto
+    if not notify_sys.use_short_addr and notify_sys.smtp_default_domain:
+        if smtp_from and '@' not in smtp_from:
+            smtp_from = '%s@%s' % (smtp_from, notify_sys.smtp_default_domain)
+        if smtp_replyto and '@' not in smtp_replyto:
+            smtp_replyto = '%s@%s' % (smtp_replyto,
+                                      notify_sys.smtp_default_domain)
+    return smtp_from, smtp_from_name, smtp_replyto
+
+
+def get_default_headers(env):
+    """Return a `dict` with the headers common to all the notification
+    emails.
+
+    :since: 1.3.3
+    """
+    return {
+        'X-Mailer': 'Trac %s, by Edgewall Software' % env.trac_version,
+        'X-Trac-Version': env.trac_version,
+        'X-Trac-Project': env.project_name,
+        'X-URL': env.project_url,
+        'Precedence': 'bulk',
+        'Auto-Submitted': 'auto-generated',
+    }
+
+
 def get_from_author(env, event):
     if event.author and NotificationSystem(env).smtp_from_author:
         matcher = RecipientMatcher(env)
@@ -313,12 +351,18 @@ class EmailDistributor(Component):
                        "handling '%s' of '%s': %s", self.__class__.__name__,
                        transport, event.realm, ', '.join(formats))
 
+        from trac.notification.digest import EmailDigest
+        digest = EmailDigest(self.env)
+        digest_sessions = digest.get_sessions()
         matcher = RecipientMatcher(self.env)
         notify_sys = NotificationSystem(self.env)
         always_cc = set(notify_sys.smtp_always_cc_list)
         addresses = {}
+        digests = []
         for sid, auth, addr, fmt in recipients:
-            if fmt not in formats:
+            in_digest = 'text/plain' in formats and \
+                        (sid, 1 if auth else 0) in digest_sessions
+            if fmt not in formats and not in_digest:
                 self.log.debug("%s format %s not available for %s %s",
                                self.__class__.__name__, fmt, transport,
                                event.realm)
@@ -345,6 +389,9 @@ class EmailDistributor(Component):
             elif matcher.is_email(addr) or \
                     notify_sys.use_short_addr and \
                     matcher.nodomaddr_re.match(addr):
+                if in_digest:
+                    digests.append((sid, auth, addr, fmt))
+                    continue
                 addresses.setdefault(fmt, set()).add(addr)
                 if sid and auth and sid in always_cc:
                     always_cc.discard(sid)
@@ -358,8 +405,10 @@ class EmailDistributor(Component):
 
         outputs = {}
         failed = []
+        digest_formats = set(fmt for sid, auth, addr, fmt in digests)
         for fmt, formatter in formats.iteritems():
-            if fmt not in addresses and fmt != 'text/plain':
+            if fmt not in addresses and fmt not in digest_formats and \
+                    fmt != 'text/plain':
                 continue
             try:
                 outputs[fmt] = formatter.format(transport, fmt, event)
@@ -371,25 +420,48 @@ class EmailDistributor(Component):
                                  exception_to_unicode(e, traceback=True))
                 failed.append(fmt)
 
+        # Fallback to immediate delivery when digests cannot be formatted
+        if digests and 'text/plain' not in outputs:
+            self.log.warning("%s is sending event immediately to: %s, as "
+                             "it failed to add it to the digests",
+                             self.__class__.__name__,
+                             ', '.join(addr for sid, auth, addr, fmt
+                                            in digests))
+            for sid, auth, addr, fmt in digests:
+                addresses.setdefault(fmt, set()).add(addr)
+            digests = []
+
         # Fallback to text/plain when formatter is broken
         if failed and 'text/plain' in outputs:
             for fmt in failed:
                 addresses.setdefault('text/plain', set()) \
                          .update(addresses.pop(fmt, ()))
 
-        for fmt, addrs in addresses.iteritems():
-            self.log.debug("%s is sending event as '%s' to: %s",
-                           self.__class__.__name__, fmt, ', '.join(addrs))
-            message = self._create_message(fmt, outputs)
-            if message:
-                addrs = set(addrs)
-                cc_addrs = sorted(addrs & always_cc)
-                bcc_addrs = sorted(addrs - always_cc)
-                self._do_send(transport, event, message, cc_addrs, bcc_addrs)
-            else:
-                self.log.warning("%s cannot send event '%s' as '%s': %s",
-                                 self.__class__.__name__, event.realm, fmt,
-                                 ', '.join(addrs))
+        if digests:
+            self.log.debug("%s is adding event to the digests of: %s",
+                           self.__class__.__name__,
+                           ', '.join(addr for sid, auth, addr, fmt
+                                          in digests))
+            subject = self._get_subject(event, outputs)
+            digest.add(event, [(sid, auth, addr)
+                               for sid, auth, addr, fmt in digests],
+                       subject, outputs['text/plain'])
+
+        with notify_sys.email_batch():
+            for fmt, addrs in addresses.iteritems():
+                self.log.debug("%s is sending event as '%s' to: %s",
+                               self.__class__.__name__, fmt, ', '.join(addrs))
+                message = self._create_message(fmt, outputs)
+                if message:
+                    addrs = set(addrs)
+                    cc_addrs = sorted(addrs & always_cc)
+                    bcc_addrs = sorted(addrs - always_cc)
+                    self._do_send(transport, event, message, cc_addrs,
+                                  bcc_addrs)
+                else:
+                    self.log.warning("%s cannot send event '%s' as '%s': "
+                                     "%s", self.__class__.__name__,
+                                     event.realm, fmt, ', '.join(addrs))
 
     def _create_message(self, format, outputs):
         if format not in outputs:
@@ -406,28 +478,22 @@ class EmailDistributor(Component):
         message.attach(preferred)
         return message
 
+    def _get_subject(self, event, outputs):
+        message = self._create_message('text/plain', outputs)
+        for decorator in self.decorators:
+            decorator.decorate_message(event, message, self._charset)
+        subject = message['Subject']
+        if subject is None:
+            return u'%s %s' % (event.realm, event.category)
+        return u''.join(to_unicode(text, charset or 'ascii')
+                        for text, charset in decode_header(str(subject)))
+
     def _do_send(self, transport, event, message, cc_addrs, bcc_addrs):
         notify_sys = NotificationSystem(self.env)
-        smtp_from = notify_sys.smtp_from
-        smtp_from_name = notify_sys.smtp_from_name or self.env.project_name
-        smtp_replyto = notify_sys.smtp_replyto
-        if not notify_sys.use_short_addr and notify_sys.smtp_default_domain:
-            if smtp_from and '@' not in smtp_from:
-                smtp_from = '%s@%s' % (smtp_from,
-                                       notify_sys.smtp_default_domain)
-            if smtp_replyto and '@' not in smtp_replyto:
-                smtp_replyto = '%s@%s' % (smtp_replyto,
-                                          notify_sys.smtp_default_domain)
-
-        headers = {}
-        headers['X-Mailer'] = 'Trac %s, by Edgewall Software'\
-                              % self.env.trac_version
-        headers['X-Trac-Version'] = self.env.trac_version
-        headers['X-Trac-Project'] = self.env.project_name
-        headers['X-URL'] = self.env.project_url
+        smtp_from, smtp_from_name, smtp_replyto = get_smtp_from(self.env)
+
+        headers = get_default_headers(self.env)
         headers['X-Trac-Realm'] = event.realm
-        headers['Precedence'] = 'bulk'
-        headers['Auto-Submitted'] = 'auto-generated'
         if isinstance(event.target, (list, tuple)):
             targetid = ','.join(map(get_target_id, event.target))
         else:
@@ -487,13 +553,97 @@ class SmtpEmailSender(Component):
     use_tls = BoolOption('notification', 'use_tls', 'false',
         """Use SSL/TLS to send notifications over SMTP.""")
 
+    smtp_max_messages = IntOption('notification',
+                                  'smtp_max_messages_per_connection', 100,
+        """Maximum number of messages sent over a single SMTP connection
+        when several notification emails are sent at once, for example
+        for a batch modification or when processing the notification
+        spool. A new connection is opened once the limit is reached.
+        (''since 1.3.3'')""")
+
+    smtp_idle_timeout = IntOption('notification',
+                                  'smtp_connection_idle_timeout', 30,
+        """Number of seconds an SMTP connection can stay idle before a
+        new connection is opened for sending the next message, when
+        several notification emails are sent at once.
+        (''since 1.3.3'')""")
+
+    def __init__(self):
+        self._local = threading.local()
+
     def send(self, from_addr, recipients, message):
-        global local_hostname
         # Ensure the message complies with RFC2822: use CRLF line endings
         message = fix_eol(message, CRLF)
 
         self.log.info("Sending notification through SMTP at %s:%d to %s",
                       self.smtp_server, self.smtp_port, recipients)
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            server = self._connect()
+            self._sendmail(server, from_addr, recipients, message)
+            self._quit(server)
+            return
+
+        server = connection['server']
+        if server is not None and \
+                (connection['messages'] >= self.smtp_max_messages or
+                 time_now() - connection['last_used'] >
+                 self.smtp_idle_timeout):
+            self._close(server)
+            server = None
+        reused = server is not None
+        if not reused:
+            server = self._connect()
+            connection.update(server=server, messages=0)
+        try:
+            self._sendmail(server, from_addr, recipients, message)
+        except smtplib.SMTPServerDisconnected:
+            connection['server'] = None
+            server.close()
+            if not reused:
+                raise
+            # The server closed the idle connection, retry on a new one
+            server = self._connect()
+            connection.update(server=server, messages=0)
+            try:
+                self._sendmail(server, from_addr, recipients, message)
+            except Exception:
+                connection['server'] = None
+                self._close(server)
+                raise
+        except Exception:
+            connection['server'] = None
+            self._close(server)
+            raise
+        connection['messages'] += 1
+        connection['last_used'] = time_now()
+
+    @contextmanager
+    def batch(self):
+        """Context manager reusing an SMTP connection for the messages
+        sent from the current thread, until the outermost `batch` exits.
+
+        The connection is renewed after `smtp_max_messages_per_connection`
+        messages, or when it has been idle for more than
+        `smtp_connection_idle_timeout` seconds.
+
+        :since: 1.3.3
+        """
+        if getattr(self._local, 'connection', None) is not None:
+            yield
+            return
+        connection = self._local.connection = {'server': None,
+                                               'messages': 0,
+                                               'last_used': 0}
+        try:
+            yield
+        finally:
+            del self._local.connection
+            if connection['server'] is not None:
+                self._close(connection['server'])
+
+    def _connect(self):
+        global local_hostname
         try:
             server = smtplib.SMTP(self.smtp_server, self.smtp_port,
                                   local_hostname)
@@ -517,12 +667,17 @@ class SmtpEmailSender(Component):
         if self.smtp_user:
             server.login(self.smtp_user.encode('utf-8'),
                          self.smtp_password.encode('utf-8'))
+        return server
+
+    def _sendmail(self, server, from_addr, recipients, message):
         start = time_now()
         server.sendmail(from_addr, recipients, message)
         t = time_now() - start
         if t > 5:
             self.log.warning("Slow mail submission (%.2f s), "
                              "check your mail setup", t)
+
+    def _quit(self, server):
         if self.use_tls:
             # avoid false failure detection when the server closes
             # the SMTP connection with TLS enabled
@@ -534,6 +689,12 @@ class SmtpEmailSender(Component):
         else:
             server.quit()
 
+    def _close(self, server):
+        try:
+            self._quit(server)
+        except (smtplib.SMTPException, smtplib.socket.error):
+            server.close()
+
 
 class SendmailEmailSender(Component):
     """E-mail sender using a locally-installed sendmail program."""
@@ -575,6 +736,11 @@ class SessionEmailResolver(Component):
     implements(IEmailAddressResolver)
 
     def get_address_for_session(self, sid, authenticated):
+        if authenticated:
+            # Avoid a query per recipient, the known users are cached
+            user = self.env.get_known_users(as_dict=True).get(sid)
+            if user is not None:
+                return user[1]
         return get_session_attribute(self.env, sid, authenticated, 'email')
 
 
@@ -599,6 +765,10 @@ class AlwaysEmailSubscriber(Component):
                 yield (klass, 'email', sid, authenticated, address, format,
                        priority, 'always')
 
+    def matches_events(self, events):
+        # The addresses don't depend on the events
+        return self.matches(events[0]) if events else []
+
     def description(self):
         return None  # not configurable
 
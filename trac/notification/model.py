@@ -12,6 +12,7 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+from trac.util import chunked
 from trac.util.datefmt import datetime_now, utc, to_utimestamp
 
 __all__ = ['Subscription', 'Watch']
@@ -224,11 +225,31 @@ class Subscription(object):
     @classmethod
     def find_by_sids_and_class(cls, env, uids, class_):
         """uids should be a collection to tuples (sid, auth)"""
-        subs = []
+        positions = {}
         for sid, authenticated in uids:
-            subs.extend(cls._find(env, class_=class_, sid=sid,
-                                  authenticated=authenticated,
-                                  order='priority'))
+            positions.setdefault((sid, int(authenticated)), len(positions))
+        if not positions:
+            return []
+        sids = sorted(set(sid for sid, authenticated in positions))
+        subs = []
+        with env.db_query as db:
+            # Look up the subscriptions of all the sessions at once,
+            # limiting the number of parameters per query
+            for chunk in chunked(sids):
+                for row in db("""
+                        SELECT id, sid, authenticated, distributor, format,
+                               priority, adverb, class
+                        FROM notify_subscription
+                        WHERE class=%%s AND sid IN (%s)
+                        """ % ','.join(('%s',) * len(chunk)),
+                        [class_] + chunk):
+                    sub = Subscription(env)
+                    sub._from_database(*row)
+                    if (sub['sid'], sub['authenticated']) in positions:
+                        subs.append(sub)
+        subs.sort(key=lambda sub: (positions[sub['sid'],
+                                             sub['authenticated']],
+                                   sub['priority']))
         return subs
 
     @classmethod
@@ -315,7 +336,7 @@ class Watch(object):
             db("""
                 DELETE FROM notify_watch
                 WHERE class = %s AND realm = %s AND target = %s
-            """, (realm, class_, target))
+            """, (class_, realm, target))
 
     @classmethod
     def _find(cls, env, order=None, **kwargs):
@@ -362,6 +383,28 @@ class Watch(object):
     def find_by_class_realm_and_target(cls, env, class_, realm, target):
         return list(cls._find(env, class_=class_, realm=realm, target=target))
 
+    @classmethod
+    def find_by_class_realm_and_targets(cls, env, class_, realm, targets):
+        """Return the watches of several targets at once, using the
+        index on (class, realm, target).
+
+        :since: 1.3.3
+        """
+        targets = sorted(set(targets))
+        watches = []
+        with env.db_query as db:
+            for chunk in chunked(targets):
+                for row in db("""
+                        SELECT id, sid, authenticated, class, realm, target
+                        FROM notify_watch
+                        WHERE class=%%s AND realm=%%s AND target IN (%s)
+                        """ % ','.join(('%s',) * len(chunk)),
+                        [class_, realm] + chunk):
+                    watch = Watch(env)
+                    watch._from_database(*row)
+                    watches.append(watch)
+        return watches
+
     @classmethod
     def find_by_class_and_realm(cls, env, class_, realm):
         return list(cls._find(env, class_=class_, realm=realm))
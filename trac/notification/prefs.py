@@ -21,6 +21,7 @@ from trac.notification.api import (INotificationDistributor,
                                    INotificationFormatter,
                                    INotificationSubscriber,
                                    NotificationSystem)
+from trac.notification.digest import digest_intervals
 from trac.notification.model import Subscription
 from trac.prefs.api import IPreferencePanelProvider
 from trac.util import as_int
@@ -108,8 +109,17 @@ class NotificationPreferences(Component):
                 default_rules[dist].append({'adverb': adverb,
                                             'description': description})
 
+        digests = {}
+        selected_digest = {}
+        if 'email' in rules:
+            digests['email'] = [(name, _(label))
+                                for name, label, duration in digest_intervals]
+            selected_digest['email'] = \
+                req.session.get('notification.digest.email')
+
         data = {'rules': rules, 'subscribers': subscribers,
                 'formatters': formatters, 'selected_format': selected_format,
+                'digests': digests, 'selected_digest': selected_digest,
                 'default_rules': default_rules,
                 'adverbs': ('always', 'never'),
                 'adverb_labels': {'always': _("Notify"),
@@ -155,15 +165,26 @@ class NotificationPreferences(Component):
         format_ = req.args.getfirst('format-%s' % arg)
         format_ = self._normalize_format(format_, arg)
         req.session.set('notification.format.%s' % arg, format_, '')
+        self._set_digest(arg, req)
         Subscription.update_format_by_distributor_and_sid(
             self.env, arg, req.session.sid, req.session.authenticated, format_)
 
+    def _set_digest(self, transport, req):
+        if transport != 'email':
+            return
+        digest = req.args.getfirst('digest-%s' % transport)
+        if digest not in [name for name, label, duration
+                               in digest_intervals]:
+            digest = ''
+        req.session.set('notification.digest.%s' % transport, digest, '')
+
     def _replace_rules(self, arg, req):
         subscriptions = []
         for transport in self._iter_transports():
             format_ = req.args.getfirst('format-' + transport)
             format_ = self._normalize_format(format_, transport)
             req.session.set('notification.format.%s' % transport, format_, '')
+            self._set_digest(transport, req)
             adverbs = req.args.getlist('adverb-' + transport)
             classes = req.args.getlist('class-' + transport)
             for idx in xrange(min(len(adverbs), len(classes))):
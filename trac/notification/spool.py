@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import json
+import time
+
+from trac.admin import AdminCommandError, IAdminCommandProvider, \
+                       console_datetime_format
+from trac.config import IntOption
+from trac.core import Component, implements
+from trac.notification.api import NotificationSystem
+from trac.notification.digest import EmailDigest
+from trac.util import as_int, chunked
+from trac.util.datefmt import datetime_now, format_datetime, \
+                              from_utimestamp, to_utimestamp, utc
+from trac.util.text import exception_to_unicode, print_table, printout
+from trac.util.translation import _
+
+
+class NotificationSpool(Component):
+    """Store notification events in the database for a deferred delivery.
+
+    Events are spooled by `NotificationSystem.notify` when the
+    `[notification] use_spool` option is enabled, and delivered by the
+    `notification process` command of `trac-admin`. A failed delivery
+    is retried with an exponential backoff, and the event is kept with
+    the `failed` status once `spool_max_attempts` is reached.
+
+    An event can only be spooled if its class implements the optional
+    serialization protocol: a `serialize()` method returning a `dict`
+    of JSON-serializable values, or `None` if the event can't be
+    spooled, and a `deserialize(env, values)` class method rebuilding
+    the event from these values. The events of the other classes are
+    delivered synchronously.
+
+    The events are claimed by a worker before being delivered, by
+    setting their status to `processing`, so that concurrent workers
+    don't deliver the same events. The claim of a worker which didn't
+    complete expires after `claim_timeout` seconds, and counts as a
+    failed delivery attempt.
+    """
+
+    implements(IAdminCommandProvider)
+
+    max_attempts = IntOption('notification', 'spool_max_attempts', 5,
+        """Number of delivery attempts for a spooled notification event
+        before giving up. Events that can't be delivered are kept in the
+        spool with the `failed` status, see
+        `trac-admin $ENV notification list`. (''since 1.3.3'')""")
+
+    # Time in seconds after which the events claimed by a worker which
+    # didn't complete can be claimed again
+    claim_timeout = 3600
+
+    retry_delay = IntOption('notification', 'spool_retry_delay', 60,
+        """Delay in seconds before retrying to deliver a spooled
+        notification event after a failure. The delay is doubled after
+        each failed attempt. (''since 1.3.3'')""")
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('notification list', '',
+               """List the spooled notification events
+
+               Events with the `failed` status have reached the maximum
+               number of delivery attempts.""",
+               None, self._do_list)
+        yield ('notification process', '[interval]',
+               """Deliver the spooled notification events
+
+               The notification digests which are due are also sent.
+               When an interval in seconds is given, keep running and
+               process the spool at the given interval.""",
+               None, self._do_process)
+        yield ('notification retry', '[id]',
+               """Retry delivering failed notification events
+
+               All failed events are retried if no id is given.""",
+               self._complete_id, self._do_retry)
+        yield ('notification remove', '<id>',
+               "Remove a notification event from the spool",
+               self._complete_id, self._do_remove)
+
+    # Public methods
+
+    def enqueue(self, event):
+        """Store the event in the spool.
+
+        :param event: a `NotificationEvent`
+        :return: `True` if the event has been spooled, `False` if the
+                 event can't be serialized and must be delivered
+                 immediately.
+        """
+        cls = event.__class__
+        if not hasattr(cls, 'serialize') or \
+                not hasattr(cls, 'deserialize'):
+            return False  # Class not spoolable, deliver synchronously
+        values = event.serialize()
+        if values is None:
+            return False
+        now = to_utimestamp(datetime_now(utc))
+        self.env.db_transaction("""
+            INSERT INTO notify_spool (time, next_attempt, attempts, status,
+                                      realm, category, class, data, error)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
+            """, (now, now, 0, 'pending', event.realm, event.category,
+                  '%s.%s' % (cls.__module__, cls.__name__),
+                  json.dumps(values), None))
+        return True
+
+    def process(self, limit=None):
+        """Deliver the spooled events which are due.
+
+        :param limit: maximum number of events to process
+        :return: a tuple `(delivered, failed)` with the number of
+                 events delivered and the number of failed attempts.
+        """
+        rows = self._claim(limit)
+        notifier = NotificationSystem(self.env)
+        delivered = failed = 0
+        with notifier.email_batch():
+            for id_, attempts, class_, data in rows:
+                try:
+                    event = self._load_event(class_, data)
+                    notifier.distribute_event(event,
+                                              notifier.subscriptions(event))
+                except Exception as e:
+                    failed += 1
+                    self._attempt_failed(id_, attempts + 1,
+                                         exception_to_unicode(e))
+                else:
+                    delivered += 1
+                    self.env.db_transaction("""
+                        DELETE FROM notify_spool WHERE id=%s
+                        """, (id_,))
+        return delivered, failed
+
+    def retry(self, id_=None):
+        """Mark failed events as pending for a new round of delivery
+        attempts.
+
+        :param id_: the id of the event to retry, or `None` to retry
+                    all failed events.
+        """
+        now = to_utimestamp(datetime_now(utc))
+        query = """
+            UPDATE notify_spool SET status='pending', attempts=0,
+                                    next_attempt=%s, error=NULL
+            WHERE status='failed'"""
+        args = (now,)
+        if id_ is not None:
+            query += " AND id=%s"
+            args += (id_,)
+        self.env.db_transaction(query, args)
+
+    # Internal methods
+
+    def _claim(self, limit):
+        # The claimed events are marked with the expiration time of the
+        # claim, which is the time of the next attempt if the worker
+        # doesn't complete. The expired claims count as failed attempts,
+        # so that an event crashing the worker is eventually given up.
+        now = to_utimestamp(datetime_now(utc))
+        expires = now + self.claim_timeout * 1000000
+        query = """
+            SELECT id FROM notify_spool
+            WHERE status IN ('pending','processing') AND next_attempt<=%s
+            ORDER BY next_attempt, id"""
+        if limit is not None:
+            query += " LIMIT %d" % limit
+        with self.env.db_transaction as db:
+            for id_, attempts in db("""
+                    SELECT id, attempts FROM notify_spool
+                    WHERE status='processing' AND next_attempt<=%s
+                    AND attempts+1>=%s
+                    """, (now, self.max_attempts)):
+                self.log.error("Giving up delivering notification event "
+                               "%s after %d attempts: the delivery didn't "
+                               "complete", id_, attempts + 1)
+                db("""
+                    UPDATE notify_spool SET status='failed', attempts=%s,
+                                            error=%s
+                    WHERE id=%s
+                    """, (attempts + 1, "The delivery didn't complete",
+                          id_))
+            ids = [id_ for id_, in db(query, (now,))]
+            for chunk in chunked(ids):
+                db("""
+                    UPDATE notify_spool
+                    SET status='processing', next_attempt=%%s,
+                        attempts=CASE WHEN status='processing'
+                                      THEN attempts+1 ELSE attempts END
+                    WHERE id IN (%s) AND status IN ('pending','processing')
+                    AND next_attempt<=%%s
+                    """ % ','.join(['%s'] * len(chunk)),
+                   [expires] + chunk + [now])
+        return self.env.db_query("""
+            SELECT id, attempts, class, data FROM notify_spool
+            WHERE status='processing' AND next_attempt=%s ORDER BY id
+            """, (expires,))
+
+    def _load_event(self, class_, data):
+        module, name = class_.rsplit('.', 1)
+        cls = getattr(__import__(module, {}, {}, [name]), name)
+        return cls.deserialize(self.env, json.loads(data))
+
+    def _attempt_failed(self, id_, attempts, error):
+        if attempts >= self.max_attempts:
+            self.log.error("Giving up delivering notification event %s "
+                           "after %d attempts: %s", id_, attempts, error)
+            self.env.db_transaction("""
+                UPDATE notify_spool SET status='failed', attempts=%s,
+                                        error=%s
+                WHERE id=%s
+                """, (attempts, error, id_))
+        else:
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            self.log.warning("Failed to deliver notification event %s, "
+                             "retrying in %d seconds: %s",
+                             id_, delay, error)
+            next_attempt = to_utimestamp(datetime_now(utc)) + delay * 1000000
+            self.env.db_transaction("""
+                UPDATE notify_spool SET status='pending', attempts=%s,
+                                        next_attempt=%s, error=%s
+                WHERE id=%s
+                """, (attempts, next_attempt, error, id_))
+
+    def _complete_id(self, args):
+        if len(args) == 1:
+            return [unicode(id_) for id_, in self.env.db_query("""
+                SELECT id FROM notify_spool WHERE status='failed'
+                """)]
+
+    def _parse_id(self, id_):
+        value = as_int(id_, None)
+        if value is None:
+            raise AdminCommandError(_("Invalid event id '%(id)s'", id=id_))
+        return value
+
+    def _do_list(self):
+        print_table([(id_, format_datetime(from_utimestamp(ts),
+                                           console_datetime_format),
+                      '%s %s' % (realm, category), status, attempts,
+                      format_datetime(from_utimestamp(next_attempt),
+                                      console_datetime_format)
+                      if status == 'pending' else '',
+                      error or '')
+                     for id_, ts, realm, category, status, attempts,
+                         next_attempt, error in self.env.db_query("""
+                        SELECT id, time, realm, category, status, attempts,
+                               next_attempt, error
+                        FROM notify_spool ORDER BY id
+                        """)],
+                    [_("Id"), _("Time"), _("Event"), _("Status"),
+                     _("Attempts"), _("Next attempt"), _("Error")])
+
+    def _do_process(self, interval=None):
+        if interval is not None:
+            interval = self._parse_interval(interval)
+        while True:
+            delivered, failed = self.process()
+            if delivered or failed:
+                printout(_("%(delivered)d notification events delivered, "
+                           "%(failed)d failed",
+                           delivered=delivered, failed=failed))
+            digests = EmailDigest(self.env).send()
+            if digests:
+                printout(_("%(count)d notification digests sent",
+                           count=digests))
+            if interval is None:
+                break
+            try:
+                time.sleep(interval)
+            except KeyboardInterrupt:
+                break
+
+    def _parse_interval(self, interval):
+        value = as_int(interval, None)
+        if value is None or value < 1:
+            raise AdminCommandError(_("Invalid interval '%(interval)s'",
+                                      interval=interval))
+        return value
+
+    def _do_retry(self, id_=None):
+        self.retry(self._parse_id(id_) if id_ is not None else None)
+
+    def _do_remove(self, id_):
+        self.env.db_transaction("DELETE FROM notify_spool WHERE id=%s",
+                                (self._parse_id(id_),))
@@ -13,15 +13,17 @@
 
 import unittest
 
-from . import api, mail, model, prefs
+from . import api, digest, mail, model, prefs, spool
 
 
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(api.test_suite())
+    suite.addTest(digest.test_suite())
     suite.addTest(mail.test_suite())
     suite.addTest(model.test_suite())
     suite.addTest(prefs.test_suite())
+    suite.addTest(spool.test_suite())
     return suite
 
 
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.core import Component, implements
+from trac.notification.api import IEmailSender, NotificationSystem
+from trac.notification.digest import EmailDigest
+from trac.notification.model import Subscription
+from trac.notification.tests.mail import TestEmailSender, TestFormatter, \
+                                         TestModel, TestNotificationEvent, \
+                                         TestSubscriber
+from trac.test import EnvironmentStub
+from trac.util.datefmt import datetime_now, utc
+from trac.web.session import DetachedSession
+
+
+class FailingEmailSender(Component):
+
+    implements(IEmailSender)
+
+    def send(self, from_addr, recipients, message):
+        raise IOError('Connection refused')
+
+
+class EmailDigestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*', TestEmailSender,
+                                           TestFormatter, TestSubscriber,
+                                           FailingEmailSender])
+        config = self.env.config
+        config.set('notification', 'smtp_from', 'trac@example.org')
+        config.set('notification', 'smtp_enabled', 'enabled')
+        config.set('notification', 'email_sender', 'TestEmailSender')
+        self.sender = TestEmailSender(self.env)
+        self.digest = EmailDigest(self.env)
+        with self.env.db_transaction:
+            self._add_session('foo', email='foo@example.org',
+                              **{'notification.digest.email': 'hourly'})
+            self._add_session('bar', email='bar@example.org',
+                              **{'notification.digest.email': 'daily'})
+            self._add_session('baz', email='baz@example.org')
+            for sid in ('foo', 'bar', 'baz'):
+                Subscription.add(self.env, {
+                    'sid': sid, 'authenticated': 1, 'distributor': 'email',
+                    'format': 'text/html', 'adverb': 'always',
+                    'class': 'TestSubscriber'})
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _add_session(self, sid, **attrs):
+        session = DetachedSession(self.env, sid)
+        for name, value in attrs.iteritems():
+            session[name] = value
+        session.save()
+
+    def _notify_event(self, text):
+        event = TestNotificationEvent('test', 'created', TestModel(text),
+                                      datetime_now(utc))
+        NotificationSystem(self.env).notify(event)
+
+    def _age_digests(self, seconds):
+        self.env.db_transaction("""
+            UPDATE notify_digest SET time=time-%s
+            """, (seconds * 1000000,))
+
+    def _digests(self):
+        return self.env.db_query("""
+            SELECT address, subject, body FROM notify_digest ORDER BY id
+            """)
+
+    def test_digest_recipients_are_not_mailed(self):
+        self._notify_event('blah')
+
+        self.assertEqual(1, len(self.sender.history))
+        from_addr, recipients, message = self.sender.history[0]
+        self.assertEqual(['baz@example.org'], recipients)
+        self.assertEqual([('foo@example.org', 'test created', 'blah'),
+                          ('bar@example.org', 'test created', 'blah')],
+                         sorted(self._digests(), reverse=True))
+
+    def test_digest_recipients_are_mailed_when_text_plain_fails(self):
+        self._notify_event('raise-text-plain')
+
+        self.assertEqual(1, len(self.sender.history))
+        from_addr, recipients, message = self.sender.history[0]
+        self.assertEqual(['bar@example.org', 'baz@example.org',
+                          'foo@example.org'], sorted(recipients))
+        self.assertIn('<p>raise-text-plain</p>',
+                      message.get_payload(0).get_payload(decode=True))
+        self.assertEqual([], self._digests())
+        self.assertTrue(any(level == 'WARNING' and
+                            message.startswith('EmailDistributor is '
+                                               'sending event immediately')
+                            for level, message in self.env.log_messages))
+
+    def test_send_when_due(self):
+        self._notify_event('first')
+        self._notify_event('second')
+        del self.sender.history[:]
+
+        self.assertEqual(0, self.digest.send())
+        self._age_digests(3601)
+        self.assertEqual(1, self.digest.send())
+
+        self.assertEqual(1, len(self.sender.history))
+        from_addr, recipients, message = self.sender.history[0]
+        self.assertEqual('trac@example.org', from_addr)
+        self.assertEqual(['foo@example.org'], recipients)
+        self.assertEqual('foo@example.org', message['To'])
+        self.assertEqual('[My Project] Digest of 2 notifications',
+                         message['Subject'])
+        body = message.get_payload(decode=True)
+        self.assertIn('first', body)
+        self.assertIn('second', body)
+        self.assertLess(body.index('first'), body.index('second'))
+        self.assertEqual(['bar@example.org', 'bar@example.org'],
+                         [row[0] for row in self._digests()])
+
+        self._age_digests(86400)
+        self.assertEqual(1, self.digest.send())
+        self.assertEqual([], self._digests())
+
+    def test_send_when_digest_disabled(self):
+        self._notify_event('blah')
+        del self.sender.history[:]
+        self._add_session('foo', **{'notification.digest.email': ''})
+
+        self.assertEqual(1, self.digest.send())
+        from_addr, recipients, message = self.sender.history[0]
+        self.assertEqual(['foo@example.org'], recipients)
+
+    def test_failed_digest_is_kept(self):
+        self._notify_event('blah')
+        self._age_digests(86401)
+        self.env.config.set('notification', 'email_sender',
+                            'FailingEmailSender')
+
+        self.assertEqual(0, self.digest.send())
+        self.assertEqual(2, len(self._digests()))
+
+
+def test_suite():
+    return unittest.makeSuite(EmailDigestTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -14,7 +14,7 @@
 import unittest
 from datetime import datetime
 
-from trac.notification.model import Subscription
+from trac.notification.model import Subscription, Watch
 from trac.test import EnvironmentStub, MockRequest
 from trac.util.datefmt import to_utimestamp, utc
 
@@ -148,6 +148,17 @@ class SubscriptionTestCase(unittest.TestCase):
         self.assertEqual(['IrcSubscriber3', 'IrcSubscriber3'],
                          self._props(items, 'class'))
 
+    def test_find_by_sids_and_class_many_sids(self):
+        self._insert_rows()
+        sids = [('user%d' % idx, 1) for idx in xrange(1200)]
+        sids.insert(700, ('jim', 1))
+        sids.insert(0, ('jes', 0))
+        items = Subscription.find_by_sids_and_class(self.env, sids,
+                                                    'IrcSubscriber3')
+        self.assertEqual(['jim'], self._props(items, 'sid'))
+        self.assertEqual([], Subscription.find_by_sids_and_class(
+                                self.env, [], 'IrcSubscriber3'))
+
     def test_move(self):
         def query_subs():
             return self.env.db_query("""\
@@ -271,9 +282,47 @@ class SubscriptionTestCase(unittest.TestCase):
         self.assertEqual(expected, rows)
 
 
+class WatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        with self.env.db_transaction:
+            Watch.add(self.env, 'joe', 1, 'WatchSubscriber', 'ticket',
+                      ['1', '2', '3'])
+            Watch.add(self.env, 'jim', 1, 'WatchSubscriber', 'ticket',
+                      ['2'])
+            Watch.add(self.env, 'jim', 1, 'WatchSubscriber', 'wiki', ['2'])
+            Watch.add(self.env, 'jes', 1, 'OtherSubscriber', 'ticket', ['2'])
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _watches(self, watches):
+        return sorted((w['sid'], w['target']) for w in watches)
+
+    def test_find_by_class_realm_and_targets(self):
+        watches = Watch.find_by_class_realm_and_targets(
+            self.env, 'WatchSubscriber', 'ticket', ['2', '3', '4'])
+        self.assertEqual([('jim', '2'), ('joe', '2'), ('joe', '3')],
+                         self._watches(watches))
+        self.assertEqual([], Watch.find_by_class_realm_and_targets(
+                                self.env, 'WatchSubscriber', 'ticket', []))
+
+    def test_delete_by_class_realm_and_target(self):
+        Watch.delete_by_class_realm_and_target(self.env, 'WatchSubscriber',
+                                               'ticket', '2')
+        watches = Watch.find_by_class_realm_and_targets(
+            self.env, 'WatchSubscriber', 'ticket', ['1', '2', '3'])
+        self.assertEqual([('joe', '1'), ('joe', '3')],
+                         self._watches(watches))
+        self.assertEqual(1, len(Watch.find_by_class_realm_and_target(
+                                    self.env, 'WatchSubscriber', 'wiki', '2')))
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(SubscriptionTestCase))
+    suite.addTest(unittest.makeSuite(WatchTestCase))
     return suite
 
 
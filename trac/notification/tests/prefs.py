@@ -255,6 +255,19 @@ class NotificationPreferencesTestCase(unittest.TestCase):
         self.assertRaises(RequestDone, self._process, req)
         self.assertEqual([], self._get_rules('foo'))
 
+    def test_set_digest(self):
+        arg_list = [('action', 'replace_all'), ('format-email', ''),
+                    ('digest-email', 'daily')]
+        req = self._request(authname='foo', arg_list=arg_list)
+        self.assertRaises(RequestDone, self._process, req)
+        self.assertEqual('daily', req.session.get('notification.digest.email'))
+
+        arg_list = [('action', 'replace_all'), ('format-email', ''),
+                    ('digest-email', 'weekly')]
+        req = self._request(authname='foo', arg_list=arg_list)
+        self.assertRaises(RequestDone, self._process, req)
+        self.assertIsNone(req.session.get('notification.digest.email'))
+
 
 def test_suite():
     suite = unittest.TestSuite()
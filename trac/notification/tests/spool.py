@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import json
+import unittest
+from datetime import timedelta
+
+from trac.core import Component, implements
+from trac.notification.api import (IEmailSender, NotificationEvent,
+                                   NotificationSystem)
+from trac.notification.spool import NotificationSpool
+from trac.test import EnvironmentStub
+from trac.ticket.model import Ticket
+from trac.ticket.notification import (BatchTicketChangeEvent,
+                                      TicketChangeEvent)
+from trac.ticket.web_ui import TicketModule
+from trac.util.datefmt import datetime_now, from_utimestamp, utc
+
+
+class SpoolTestEmailSender(Component):
+
+    implements(IEmailSender)
+
+    def __init__(self):
+        self.history = []
+        self.error = None
+
+    def send(self, from_addr, recipients, message):
+        if self.error:
+            raise self.error
+        self.history.append((from_addr, recipients, message))
+
+
+class NotificationSpoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*', SpoolTestEmailSender,
+                                           TicketModule])
+        config = self.env.config
+        config.set('notification', 'smtp_enabled', 'enabled')
+        config.set('notification', 'smtp_from', 'trac@example.org')
+        config.set('notification', 'email_sender', 'SpoolTestEmailSender')
+        config.set('notification', 'use_spool', 'enabled')
+        config.set('notification', 'spool_max_attempts', '3')
+        config.set('notification-subscriber', 'always_notify_reporter',
+                   'TicketReporterSubscriber')
+        self.sender = SpoolTestEmailSender(self.env)
+        self.spool = NotificationSpool(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _insert_ticket(self, **props):
+        ticket = Ticket(self.env)
+        ticket['reporter'] = 'joe@example.org'
+        ticket['summary'] = 'The summary'
+        ticket['description'] = 'The description'
+        ticket.populate(props)
+        ticket.insert()
+        return ticket
+
+    def _spooled_events(self):
+        return self.env.db_query("""
+            SELECT status, attempts, next_attempt, error FROM notify_spool
+            ORDER BY id""")
+
+    def _make_due(self):
+        self.env.db_transaction("UPDATE notify_spool SET next_attempt=0")
+
+    def test_notify_enqueues_event(self):
+        ticket = self._insert_ticket()
+        event = TicketChangeEvent('created', ticket, ticket['time'],
+                                  ticket['reporter'])
+        NotificationSystem(self.env).notify(event)
+
+        self.assertEqual([], self.sender.history)
+        self.assertEqual(1, len(self._spooled_events()))
+        self.assertEqual((1, 0), self.spool.process())
+        self.assertEqual(1, len(self.sender.history))
+        self.assertEqual(['joe@example.org'], self.sender.history[0][1])
+        self.assertEqual([], self._spooled_events())
+
+    def test_notify_without_spool(self):
+        self.env.config.set('notification', 'use_spool', 'disabled')
+        ticket = self._insert_ticket()
+        event = TicketChangeEvent('created', ticket, ticket['time'],
+                                  ticket['reporter'])
+        NotificationSystem(self.env).notify(event)
+
+        self.assertEqual(1, len(self.sender.history))
+        self.assertEqual([], self._spooled_events())
+
+    def test_event_not_serializable_is_delivered(self):
+        event = NotificationEvent('test', 'created', None,
+                                  datetime_now(utc))
+        NotificationSystem(self.env).notify(event)
+
+        self.assertEqual([], self._spooled_events())
+
+    def test_ticket_change_event_uses_values_at_event_time(self):
+        ticket = self._insert_ticket()
+        ticket['summary'] = 'Changed summary'
+        now = datetime_now(utc)
+        ticket.save_changes('joe', 'The comment', when=now)
+        event = TicketChangeEvent('changed', ticket, now, 'joe',
+                                  'The comment')
+        self.spool.enqueue(event)
+        ticket['summary'] = 'Summary changed later'
+        ticket.save_changes('jim', when=now + timedelta(seconds=1))
+
+        data, = self.env.db_query("SELECT data FROM notify_spool")[0]
+        restored = TicketChangeEvent.deserialize(self.env, json.loads(data))
+        self.assertEqual('changed', restored.category)
+        self.assertEqual(ticket.id, restored.target.id)
+        self.assertEqual('Changed summary', restored.target['summary'])
+        self.assertEqual(ticket['time'], restored.target['time'])
+        self.assertEqual(now, restored.time)
+        self.assertEqual('The comment', restored.comment)
+        self.assertEqual(event.changes, restored.changes)
+
+    def test_batch_ticket_change_event(self):
+        ticket1 = self._insert_ticket()
+        ticket2 = self._insert_ticket()
+        event = BatchTicketChangeEvent([ticket1.id, ticket2.id], None, 'joe',
+                                       'The comment', {'milestone': 'm1'},
+                                       None)
+        self.spool.enqueue(event)
+
+        self.assertEqual((1, 0), self.spool.process())
+        self.assertEqual(1, len(self.sender.history))
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        ticket = self._insert_ticket()
+        event = TicketChangeEvent('created', ticket, ticket['time'],
+                                  ticket['reporter'])
+        self.spool.enqueue(event)
+        self.sender.error = IOError('Connection refused')
+
+        start = datetime_now(utc)
+        self.assertEqual((0, 1), self.spool.process())
+        (status, attempts, next_attempt, error), = self._spooled_events()
+        self.assertEqual(('pending', 1), (status, attempts))
+        self.assertIn('Connection refused', error)
+        delay = from_utimestamp(next_attempt) - start
+        self.assertTrue(timedelta(seconds=60) <= delay <
+                        timedelta(seconds=70), delay)
+        # Not due yet
+        self.assertEqual((0, 0), self.spool.process())
+
+        self._make_due()
+        start = datetime_now(utc)
+        self.assertEqual((0, 1), self.spool.process())
+        (status, attempts, next_attempt, error), = self._spooled_events()
+        self.assertEqual(('pending', 2), (status, attempts))
+        delay = from_utimestamp(next_attempt) - start
+        self.assertTrue(timedelta(seconds=120) <= delay <
+                        timedelta(seconds=130), delay)
+
+        self._make_due()
+        self.assertEqual((0, 1), self.spool.process())
+        (status, attempts, next_attempt, error), = self._spooled_events()
+        self.assertEqual(('failed', 3), (status, attempts))
+
+        self._make_due()
+        self.assertEqual((0, 0), self.spool.process())
+        self.assertEqual([], self.sender.history)
+
+    def test_retry_failed_events(self):
+        ticket = self._insert_ticket()
+        event = TicketChangeEvent('created', ticket, ticket['time'],
+                                  ticket['reporter'])
+        self.spool.enqueue(event)
+        self.env.db_transaction("""
+            UPDATE notify_spool SET status='failed', attempts=3,
+                                    error='Connection refused'""")
+
+        self.spool.retry()
+        (status, attempts, next_attempt, error), = self._spooled_events()
+        self.assertEqual(('pending', 0, None), (status, attempts, error))
+        self.assertEqual((1, 0), self.spool.process())
+        self.assertEqual(1, len(self.sender.history))
+
+    def _enqueue_events(self, count):
+        ticket = self._insert_ticket()
+        for idx in xrange(count):
+            self.spool.enqueue(TicketChangeEvent('created', ticket,
+                                                 ticket['time'],
+                                                 ticket['reporter']))
+
+    def test_process_limit(self):
+        self._enqueue_events(3)
+
+        self.assertEqual((2, 0), self.spool.process(limit=2))
+        self.assertEqual(1, len(self._spooled_events()))
+        self.assertEqual((1, 0), self.spool.process(limit=2))
+        self.assertEqual(3, len(self.sender.history))
+
+    def test_claimed_events_are_not_delivered_twice(self):
+        self._enqueue_events(2)
+        claimed = self.spool._claim(1)
+
+        self.assertEqual(1, len(claimed))
+        self.assertEqual('processing', self._spooled_events()[0][0])
+        self.assertEqual((1, 0), self.spool.process())
+        self.assertEqual((0, 0), self.spool.process())
+        self.assertEqual(1, len(self.sender.history))
+
+    def test_expired_claim_is_processed(self):
+        self._enqueue_events(1)
+        self.spool._claim(None)
+
+        self.assertEqual((0, 0), self.spool.process())
+        self._make_due()
+        self.assertEqual((1, 0), self.spool.process())
+        self.assertEqual([], self._spooled_events())
+
+    def test_expired_claims_count_as_attempts(self):
+        self._enqueue_events(1)
+        self.spool._claim(None)
+        self._make_due()
+        self.spool._claim(None)
+        (status, attempts, next_attempt, error), = self._spooled_events()
+        self.assertEqual(('processing', 1), (status, attempts))
+        self._make_due()
+        self.spool._claim(None)
+        self.assertEqual(2, self._spooled_events()[0][1])
+
+        self._make_due()
+        self.assertEqual((0, 0), self.spool.process())
+        (status, attempts, next_attempt, error), = self._spooled_events()
+        self.assertEqual(('failed', 3), (status, attempts))
+        self.assertEqual("The delivery didn't complete", error)
+        self.assertEqual([], self.sender.history)
+
+
+def test_suite():
+    return unittest.makeSuite(NotificationSpoolTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
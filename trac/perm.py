@@ -216,17 +216,34 @@ class DefaultPermissionStore(Component):
 
         Users are returned as a list of usernames.
         """
-        # get_user_permissions() takes care of the magic 'authenticated'
-        # group. The optimized loop we had before didn't. This is very
-        # inefficient, but it works.
-        result = set()
-        users = {u[0] for u in self.env.get_known_users()}
-        for user in users:
-            user_perms = self.get_user_permissions(user)
-            for group in permissions:
-                if group in user_perms:
-                    result.add(user)
-        return list(result)
+        # Determine the subjects (users and groups) having the permissions,
+        # then check for each known user whether the user or one of the
+        # groups given by the group providers, such as the magic
+        # 'authenticated' group, is among these subjects.
+        members = {}
+        subjects = set()
+        for user, action in self._all_permissions:
+            if action.isupper():
+                if action in permissions:
+                    subjects.add(user)
+            else:
+                # action is actually the name of the permission group here
+                members.setdefault(action, []).append(user)
+        pending = list(subjects)
+        while pending:
+            for member in members.get(pending.pop(), ()):
+                if member not in subjects:
+                    subjects.add(member)
+                    pending.append(member)
+
+        result = []
+        for user, name, email in self.env.get_known_users():
+            if user in subjects or \
+                    any(subjects.intersection(
+                            provider.get_permission_groups(user) or [])
+                        for provider in self.group_providers):
+                result.append(user)
+        return result
 
     def get_all_permissions(self):
         """Return all permissions for all users.
@@ -337,15 +354,6 @@ class PermissionSystem(Component):
         in which they will be applied. These components manage fine-grained
         access control to Trac resources.""")
 
-    # Number of seconds a cached user permission set is valid for.
-    CACHE_EXPIRY = 5
-    # How frequently to clear the entire permission cache
-    CACHE_REAP_TIME = 60
-
-    def __init__(self):
-        self.permission_cache = {}
-        self.last_reap = time_now()
-
     # Public API
 
     def grant_permission(self, username, action):
@@ -375,11 +383,13 @@ class PermissionSystem(Component):
                 raise PermissionExistsError(
                     _("The user %(user)s is already in the group %(group)s.",
                       user=username, group=action))
+        del self._users_with_permission
 
     def revoke_permission(self, username, action):
         """Revokes the permission of the specified user to perform an
         action."""
         self.store.revoke_permission(username, action)
+        del self._users_with_permission
 
     def get_actions_dict(self):
         """Get all actions from permission requestors as a `dict`.
@@ -503,14 +513,13 @@ class PermissionSystem(Component):
 
         Users are returned as a list of user names.
         """
-        now = time_now()
-        if now - self.last_reap > self.CACHE_REAP_TIME:
-            self.permission_cache = {}
-            self.last_reap = now
-        timestamp, permissions = self.permission_cache.get(permission,
-                                                           (0, None))
-        if now - timestamp <= self.CACHE_EXPIRY:
-            return permissions
+        # The users are also looked up among the known users, whose
+        # cache is renewed when they change
+        known_users = self.env.get_known_users(as_dict=True)
+        cache = self._users_with_permission
+        users_known, users = cache.get(permission, (None, None))
+        if users_known is known_users:
+            return users
 
         parent_map = {}
         for parent, children in self.get_actions_dict().iteritems():
@@ -526,9 +535,17 @@ class PermissionSystem(Component):
         append_with_parents(permission)
 
         perms = self.store.get_users_with_permissions(satisfying_perms) or []
-        self.permission_cache[permission] = (now, perms)
+        cache[permission] = (known_users, perms)
         return perms
 
+    @cached
+    def _users_with_permission(self):
+        """Cache of `get_users_with_permission`, by permission, which is
+        invalidated in all the processes when a permission is granted or
+        revoked, and per entry when the known users change.
+        """
+        return {}
+
     def expand_actions(self, actions):
         """Helper method for expanding all meta actions."""
         all_actions = self.get_actions_dict()
@@ -38,9 +38,107 @@ class ISearchSource(Interface):
 
         The events returned by this function must be tuples of the form
         `(href, title, date, author, excerpt).`
+
+        A relevance score can be added as a sixth element of the tuple,
+        in which case the results are ordered by decreasing score before
+        the date. The scores are those of the `SearchIndex`, so that
+        the results of the different sources can be compared.
+
+        :since 1.3.3: the results can have a relevance score.
+        """
+
+    def get_sorted_search_results(req, terms, filters, limit):
+        """Return the first `limit` search results matching each search
+        term in `terms`, in the order of the search results page, and
+        the total number of results.
+
+        The results are the tuples returned by `get_search_results`,
+        sorted with `search_result_key` in decreasing order. The total
+        number of results can be an estimate, e.g. when it includes
+        results which the user isn't allowed to see.
+
+        This method is optional. When it is implemented, it is called
+        instead of `get_search_results`, so that only the results of
+        the requested page and the previous ones are retrieved.
+
+        :return: a `(results, count)` tuple.
+        :since: 1.3.3
+        """
+
+
+class ISearchIndexer(Interface):
+    """Extension point interface for the full-text index backends of
+    the `SearchIndex`.
+
+    The backend indexes the text of documents identified by an integer
+    id, and returns the ids of the documents matching the search terms.
+
+    :since: 1.3.3
+    """
+
+    def reset():
+        """Create the index if it doesn't exist, and remove all the
+        documents from the index.
+        """
+
+    def add_documents(docs):
+        """Add documents to the index, replacing the existing documents
+        with the same ids.
+
+        :param docs: an iterable of `(docid, text)` tuples.
+        """
+
+    def delete_documents(docids):
+        """Remove the documents with the given ids from the index."""
+
+    def search(terms):
+        """Return the documents containing all the `terms`, each term
+        matching a word or the beginning of a word.
+
+        :return: an iterable of `(docid, score)` tuples, a higher score
+                 meaning a more relevant document.
         """
 
 
+def search_result_key(result):
+    """Key for sorting the search results in decreasing order: by
+    relevance score if the results have one, then by date.
+
+    :since: 1.3.3
+    """
+    return result[5:6], result[2]
+
+
+def sorted_search_results(fetch, make_result, limit):
+    """Return the first `limit` search results built from the rows
+    returned by `fetch`, sorted with `search_result_key`.
+
+    :param fetch: a function returning the `count` rows starting at
+                  `offset`, as `fetch(offset, count)`, in the order
+                  of the results, e.g. with an `ORDER BY` clause and
+                  `LIMIT` and `OFFSET`.
+    :param make_result: a function returning the search result for a
+                        row, or `None` if the row must be left out,
+                        e.g. for lack of permission. More rows are
+                        fetched for making up for the left out rows.
+
+    :since: 1.3.3
+    """
+    results = []
+    offset = 0
+    while len(results) < limit:
+        rows = fetch(offset, limit)
+        for row in rows:
+            result = make_result(row)
+            if result is not None:
+                results.append(result)
+        if len(rows) < limit:
+            break
+        offset += limit
+    results.sort(key=search_result_key, reverse=True)
+    return results[:limit]
+
+
 def search_to_sql(db, columns, terms):
     """Convert a search query into an SQL WHERE clause and corresponding
     parameters.
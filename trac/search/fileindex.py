@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import errno
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+from contextlib import contextmanager
+from itertools import groupby, islice, izip
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from trac.core import Component, TracError, implements
+from trac.search.api import ISearchIndexer
+from trac.util import AtomicFile
+from trac.util.translation import _
+
+__all__ = ['FileSearchIndexer', 'tokenize']
+
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Split a text in lowercased words."""
+    return _word_re.findall(text.lower())
+
+
+# A segment file contains the posting lists of its words, followed by
+# the words, the sorted ids and lengths of its documents, the offsets of
+# the words and of the posting lists, and a footer with the positions
+# of these parts. The numbers are stored in little-endian order.
+
+_footer = struct.Struct('<4sIIIIII')
+_magic = 'TSIX'
+_version = 1
+
+# A posting list starts with its number of documents and the typecodes
+# of the arrays of document id deltas and word counts which follow.
+_posting_header = struct.Struct('<Icc')
+
+
+def _typecode(values):
+    top = max(values) if values else 0
+    return 'B' if top < 1 << 8 else 'H' if top < 1 << 16 else 'I'
+
+
+def _to_bytes(typecode, values):
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tostring()
+
+
+def _from_bytes(typecode, data):
+    values = array(typecode)
+    values.fromstring(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _encode_postings(postings):
+    """Encode a list of `(docid, count)` tuples sorted by docid."""
+    docids = [docid for docid, count in postings]
+    deltas = docids[:1] + [b - a for a, b in izip(docids, docids[1:])]
+    counts = [count for docid, count in postings]
+    delta_code = _typecode(deltas)
+    count_code = _typecode(counts)
+    return _posting_header.pack(len(postings), delta_code, count_code) + \
+           _to_bytes(delta_code, deltas) + _to_bytes(count_code, counts)
+
+
+def _decode_postings(data):
+    """Decode a posting list as a list of `(docid, count)` tuples."""
+    size, delta_code, count_code = _posting_header.unpack_from(data)
+    start = _posting_header.size
+    end = start + size * array(delta_code).itemsize
+    docid = 0
+    docids = []
+    for delta in _from_bytes(delta_code, data[start:end]):
+        docid += delta
+        docids.append(docid)
+    return zip(docids, _from_bytes(count_code, data[end:]))
+
+
+class _SegmentWriter(object):
+    """Write a segment file, the words being added in sorted order."""
+
+    def __init__(self, path):
+        self._file = AtomicFile(path, 'wb')
+        self._words = []
+        self._offsets = [0]
+
+    def add(self, word, postings):
+        data = _encode_postings(postings)
+        self._file.write(data)
+        self._words.append(word.encode('utf-8'))
+        self._offsets.append(self._offsets[-1] + len(data))
+
+    def close(self, lengths):
+        """Write the document `lengths`, a list of `(docid, length)`
+        tuples sorted by docid, and commit the file."""
+        try:
+            words_pos = self._offsets[-1]
+            word_offsets = [0]
+            for word in self._words:
+                self._file.write(word)
+                word_offsets.append(word_offsets[-1] + len(word))
+            self._file.write(_to_bytes('I', [docid for docid, length
+                                                   in lengths]))
+            self._file.write(_to_bytes('I', [length for docid, length
+                                                    in lengths]))
+            self._file.write(_to_bytes('I', word_offsets))
+            self._file.write(_to_bytes('I', self._offsets))
+            docs_pos = words_pos + word_offsets[-1]
+            self._file.write(_footer.pack(_magic, _version, len(lengths),
+                                          len(self._words), words_pos,
+                                          docs_pos,
+                                          docs_pos + 8 * len(lengths)))
+        except Exception:
+            self._file.rollback()
+            raise
+        self._file.commit()
+
+
+class _Segment(object):
+    """Memory-mapped segment file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mm = mmap.mmap(f.fileno(), 0,
+                                        access=mmap.ACCESS_READ)
+        magic, version, ndocs, nwords, self._words_pos, docs_pos, \
+            offsets_pos = _footer.unpack_from(mm, len(mm) - _footer.size)
+        if magic != _magic or version != _version:
+            raise TracError(_("The search index file %(path)s is invalid, "
+                              "the index must be rebuilt.", path=path))
+        docids = _from_bytes('I', mm[docs_pos:docs_pos + 4 * ndocs])
+        lengths = _from_bytes('I', mm[docs_pos + 4 * ndocs:offsets_pos])
+        self.lengths = dict(izip(docids, lengths))
+        self.total_length = sum(lengths)
+        pos = offsets_pos + 4 * (nwords + 1)
+        self._word_offsets = _from_bytes('I', mm[offsets_pos:pos])
+        self._offsets = _from_bytes('I', mm[pos:pos + 4 * (nwords + 1)])
+        self.nwords = nwords
+
+    def word(self, idx):
+        start = self._words_pos + self._word_offsets[idx]
+        end = self._words_pos + self._word_offsets[idx + 1]
+        return self._mmap[start:end].decode('utf-8')
+
+    def postings(self, idx):
+        return _decode_postings(self._mmap[self._offsets[idx]:
+                                           self._offsets[idx + 1]])
+
+    def iter_words(self, prefix=u''):
+        """Yield the `(word, idx)` tuples of the words starting with
+        `prefix`, in sorted order."""
+        lo, hi = 0, self.nwords
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.word(mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        for idx in xrange(lo, self.nwords):
+            word = self.word(idx)
+            if not word.startswith(prefix):
+                break
+            yield word, idx
+
+
+class _Snapshot(object):
+    """The segments of a version of the index manifest."""
+
+    def __init__(self, key, segments):
+        self.key = key
+        self.segments = segments  # list of (segment, deleted) tuples
+        self.ndocs = 0
+        total = 0
+        for segment, deleted in segments:
+            self.ndocs += len(segment.lengths) - len(deleted)
+            total += segment.total_length - \
+                     sum(segment.lengths[docid] for docid in deleted)
+        self.avg_length = float(total) / self.ndocs if self.ndocs else 0
+
+
+class FileSearchIndexer(Component):
+    """Full-text index stored in the `files/search-index` directory of
+    the environment, for the databases without full-text search.
+
+    The index is made of immutable segment files holding the sorted
+    words of their documents and the posting lists of the words, which
+    are delta-encoded arrays of document ids and word counts. The
+    segments are memory-mapped for searching, and the documents are
+    ranked with the BM25 formula.
+
+    Adding documents writes a new segment, and the replaced or deleted
+    documents are recorded in the manifest of the index. The smallest
+    segments are merged when there are more than `merge_factor` of
+    them, which also drops the deleted documents.
+    """
+
+    implements(ISearchIndexer)
+
+    segment_size = 10000  # maximum number of documents of a new segment
+    merge_factor = 10
+
+    # BM25 parameters
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._segments = {}
+        self._snapshot = None
+
+    @property
+    def path(self):
+        return os.path.join(self.env.files_dir, 'search-index')
+
+    # ISearchIndexer methods
+
+    def reset(self):
+        with self._update() as manifest:
+            del manifest['segments'][:]
+
+    def add_documents(self, docs):
+        docs = iter(docs)
+        with self._update() as manifest:
+            while True:
+                batch = dict(islice(docs, self.segment_size))
+                if not batch:
+                    break
+                self._delete(manifest, batch)
+                self._write_segment(manifest, batch)
+                if len(manifest['segments']) > self.merge_factor:
+                    self._merge(manifest)
+
+    def delete_documents(self, docids):
+        with self._update() as manifest:
+            self._delete(manifest, set(docids))
+
+    def search(self, terms):
+        words = set(word for term in terms for word in tokenize(term))
+        snapshot = self._get_snapshot()
+        if not words or not snapshot.ndocs:
+            return []
+        scores = None
+        for word in words:
+            word_scores = self._score(snapshot, word)
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = dict((docid, score + word_scores[docid])
+                              for docid, score in scores.iteritems()
+                              if docid in word_scores)
+            if not scores:
+                break
+        return scores.items()
+
+    # Internal methods
+
+    def _score(self, snapshot, prefix):
+        """Return the BM25 scores of the documents containing a word
+        starting with `prefix`."""
+        postings = {}
+        for segment, deleted in snapshot.segments:
+            for word, idx in segment.iter_words(prefix):
+                postings.setdefault(word, []).extend(
+                    (docid, count, segment.lengths[docid])
+                    for docid, count in segment.postings(idx)
+                    if docid not in deleted)
+        scores = {}
+        for word, entries in postings.iteritems():
+            df = len(entries)
+            idf = math.log(1 + (snapshot.ndocs - df + 0.5) / (df + 0.5))
+            for docid, count, length in entries:
+                norm = 1 - self.b + self.b * length / snapshot.avg_length \
+                       if snapshot.avg_length else 1
+                scores[docid] = scores.get(docid, 0) + \
+                                idf * count * (self.k1 + 1) / \
+                                (count + self.k1 * norm)
+        return scores
+
+    @contextmanager
+    def _locked(self, exclusive):
+        """Serialize the modifications of the index between threads and
+        processes."""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with self._lock:
+            with open(os.path.join(self.path, 'lock'), 'a') as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX if exclusive
+                                   else fcntl.LOCK_SH)
+                yield
+
+    @contextmanager
+    def _update(self):
+        """Modify the manifest of the index, and remove the segments
+        which are no longer used."""
+        with self._locked(exclusive=True):
+            manifest = self._read_manifest()
+            yield manifest
+            with AtomicFile(os.path.join(self.path, 'manifest'), 'w') as f:
+                json.dump(manifest, f)
+            used = self._forget_unused(manifest)
+            for name in os.listdir(self.path):
+                if name.startswith('seg') and name not in used:
+                    try:
+                        os.unlink(os.path.join(self.path, name))
+                    except OSError:
+                        pass  # e.g. still mapped on Windows, retry later
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.path, 'manifest')) as f:
+                return json.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return {'next': 1, 'segments': []}
+
+    def _get_snapshot(self):
+        """Return the segments of the current version of the index."""
+        try:
+            st = os.stat(os.path.join(self.path, 'manifest'))
+        except OSError:
+            return _Snapshot(None, [])
+        key = (st.st_ino, st.st_mtime, st.st_size)
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.key != key:
+            with self._locked(exclusive=False):
+                manifest = self._read_manifest()
+                self._forget_unused(manifest)
+                segments = [(self._open(entry['name']),
+                             set(entry['deleted']))
+                            for entry in manifest['segments']]
+            self._snapshot = snapshot = _Snapshot(key, segments)
+        return snapshot
+
+    def _open(self, name):
+        """Return the segment `name`, which is only mapped once as the
+        segments are immutable."""
+        segment = self._segments.get(name)
+        if segment is None:
+            segment = _Segment(os.path.join(self.path, name))
+            self._segments[name] = segment
+        return segment
+
+    def _forget_unused(self, manifest):
+        """Forget the segments which are no longer in the `manifest`,
+        and return the names of the used segments."""
+        used = set(entry['name'] for entry in manifest['segments'])
+        for name in list(self._segments):
+            if name not in used:
+                del self._segments[name]
+        return used
+
+    def _delete(self, manifest, docids):
+        for entry in manifest['segments']:
+            segment = self._open(entry['name'])
+            deleted = set(entry['deleted'])
+            deleted.update(docid for docid in docids
+                           if docid in segment.lengths)
+            entry['deleted'] = sorted(deleted)
+
+    def _new_segment(self, manifest):
+        name = 'seg%06d' % manifest['next']
+        manifest['next'] += 1
+        manifest['segments'].append({'name': name, 'deleted': []})
+        return _SegmentWriter(os.path.join(self.path, name))
+
+    def _write_segment(self, manifest, docs):
+        postings = {}
+        lengths = []
+        for docid in sorted(docs):
+            words = tokenize(docs[docid])
+            lengths.append((docid, len(words)))
+            counts = {}
+            for word in words:
+                counts[word] = counts.get(word, 0) + 1
+            for word, count in counts.iteritems():
+                postings.setdefault(word, []).append((docid, count))
+        writer = self._new_segment(manifest)
+        for word in sorted(postings):
+            writer.add(word, postings[word])
+        writer.close(lengths)
+
+    def _merge(self, manifest):
+        """Merge the smallest segments, leaving out the deleted
+        documents."""
+        def live_size(entry):
+            return len(self._open(entry['name']).lengths) - \
+                   len(entry['deleted'])
+        entries = sorted(manifest['segments'],
+                         key=live_size)[:self.merge_factor]
+        segments = [(self._open(entry['name']), set(entry['deleted']))
+                    for entry in entries]
+        for entry in entries:
+            manifest['segments'].remove(entry)
+        lengths = sorted((docid, length) for segment, deleted in segments
+                         for docid, length in segment.lengths.iteritems()
+                         if docid not in deleted)
+        if not lengths:
+            return
+        words = heapq.merge(*[self._iter_words(n, segment)
+                              for n, (segment, deleted)
+                              in enumerate(segments)])
+        writer = self._new_segment(manifest)
+        for word, group in groupby(words, lambda item: item[0]):
+            postings = []
+            for word, n, idx in group:
+                segment, deleted = segments[n]
+                postings.extend((docid, count) for docid, count
+                                in segment.postings(idx)
+                                if docid not in deleted)
+            if postings:
+                postings.sort()
+                writer.add(word, postings)
+        writer.close(lengths)
+
+    def _iter_words(self, n, segment):
+        for word, idx in segment.iter_words():
+            yield word, n, idx
@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import re
+
+from trac.admin import IAdminCommandProvider
+from trac.attachment import IAttachmentChangeListener
+from trac.config import ExtensionOption
+from trac.core import Component, TracError, implements
+from trac.db.api import DatabaseManager, parse_connection_uri
+from trac.search.api import ISearchIndexer
+from trac.ticket.api import ITicketChangeListener
+from trac.util import chunked
+from trac.util.text import printout
+from trac.util.translation import _
+from trac.versioncontrol.api import IRepositoryChangeListener
+from trac.wiki.api import IWikiChangeListener
+
+__all__ = ['DatabaseSearchIndexer', 'SearchIndex', 'attachment_resource']
+
+
+def attachment_resource(parent_realm, parent_id, filename):
+    """Return the id of an attachment in the `SearchIndex`.
+
+    The filename can't contain a `/`, and the realm can't contain a `:`.
+    """
+    return u'%s:%s/%s' % (parent_realm, parent_id, filename)
+
+
+class SearchIndex(Component):
+    """Maintain a full-text index of the tickets, wiki pages, changesets
+    and attachments, used by their search sources instead of scanning
+    the database.
+
+    The indexed resources are stored in the `search_document` table,
+    which gives them the integer ids used by the `ISearchIndexer`
+    backend selected by the `[search] index_backend` option.
+    """
+
+    implements(IAdminCommandProvider, IAttachmentChangeListener,
+               IRepositoryChangeListener, ITicketChangeListener,
+               IWikiChangeListener)
+
+    indexer = ExtensionOption('search', 'index_backend', ISearchIndexer, '',
+        """Name of the component implementing `ISearchIndexer` which
+        maintains a full-text index of the tickets, wiki pages,
+        changesets and attachments. The search uses the index instead of
+        scanning the database, and orders the results by relevance.
+        `DatabaseSearchIndexer` uses the full-text search of the
+        database: FTS5 for SQLite, `tsvector` for PostgreSQL and
+        `FULLTEXT` indexes for MySQL. `FileSearchIndexer` stores the
+        index in the `files/search-index` directory of the environment
+        and works with any database. The index is only used once it has
+        been built by `trac-admin $ENV search reindex`. Leave empty to
+        disable the index. (''since 1.3.3'')""")
+
+    # Public methods
+
+    def search(self, realm, terms):
+        """Return the resources of `realm` matching all the `terms`.
+
+        :return: a dictionary of the ids of the matching resources and
+                 their relevance score, or `None` if the index isn't
+                 used, in which case the search source must scan the
+                 database.
+        """
+        indexer = self._get_indexer()
+        if indexer is None:
+            return None
+        scores = dict(indexer.search(terms))
+        matches = {}
+        with self.env.db_query as db:
+            for docids in chunked(list(scores)):
+                for docid, resource in db("""
+                        SELECT id, resource FROM search_document
+                        WHERE realm=%%s AND id IN (%s)
+                        """ % ','.join(['%s'] * len(docids)),
+                        [realm] + docids):
+                    matches[resource] = scores[docid]
+        return matches
+
+    def reindex(self):
+        """Rebuild the index from the tickets, wiki pages, attachments
+        and cached repositories.
+
+        :return: the number of indexed documents.
+        """
+        indexer = self.indexer
+        count = 0
+        with self.env.db_transaction as db:
+            db("DELETE FROM search_document")
+            db("DELETE FROM system WHERE name='search_index'")
+            indexer.reset()
+            for realm, get_documents in (
+                    ('ticket', self._get_ticket_documents),
+                    ('wiki', self._get_wiki_documents),
+                    ('attachment', self._get_attachment_documents),
+                    ('changeset', self._get_changeset_documents)):
+                docs = list(get_documents(db))
+                db.executemany("""
+                    INSERT INTO search_document (realm, resource)
+                    VALUES (%s,%s)
+                    """, [(realm, resource) for resource, text in docs])
+                docids = dict((resource, docid) for docid, resource in db("""
+                    SELECT id, resource FROM search_document WHERE realm=%s
+                    """, (realm,)))
+                indexer.add_documents((docids[resource], text)
+                                      for resource, text in docs)
+                count += len(docs)
+            db("INSERT INTO system (name, value) VALUES ('search_index',%s)",
+               (indexer.__class__.__name__,))
+        return count
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('search reindex', '',
+               """Rebuild the full-text index of the search
+
+               The index is used when [search] index_backend is set.""",
+               None, self._do_reindex)
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self._update_ticket(ticket.id)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self._update_ticket(ticket.id)
+
+    def ticket_deleted(self, ticket):
+        self._update('ticket', unicode(ticket.id), None)
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        self._update_ticket(ticket.id)
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        self._update_ticket(ticket.id)
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self._update_wiki_page(page.name)
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        self._update_wiki_page(page.name)
+
+    def wiki_page_deleted(self, page):
+        self._update('wiki', page.name, None)
+
+    def wiki_page_version_deleted(self, page):
+        self._update_wiki_page(page.name)
+
+    def wiki_page_renamed(self, page, old_name):
+        self._update('wiki', old_name, None)
+        self._update_wiki_page(page.name)
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        self._update_attachment(attachment.parent_realm, attachment.parent_id,
+                                attachment.filename)
+
+    def attachment_deleted(self, attachment):
+        self._update('attachment',
+                     attachment_resource(attachment.parent_realm,
+                                         attachment.parent_id,
+                                         attachment.filename), None)
+
+    def attachment_moved(self, attachment, old_parent_realm, old_parent_id,
+                         old_filename):
+        self._update('attachment',
+                     attachment_resource(old_parent_realm, old_parent_id,
+                                         old_filename), None)
+        self._update_attachment(attachment.parent_realm, attachment.parent_id,
+                                attachment.filename)
+
+    # IRepositoryChangeListener methods
+
+    def changeset_added(self, repos, changeset):
+        self._update_changeset(repos, changeset.rev)
+
+    def changeset_modified(self, repos, changeset, old_changeset):
+        self._update_changeset(repos, changeset.rev)
+
+    # Internal methods
+
+    def _get_indexer(self):
+        """Return the indexer if the index is enabled and has been built
+        with this indexer."""
+        name = self.config.get('search', 'index_backend')
+        if name:
+            for value, in self.env.db_query("""
+                    SELECT value FROM system WHERE name='search_index'
+                    """):
+                if value == name:
+                    return self.indexer
+        return None
+
+    def _update(self, realm, resource, text):
+        """Index the `text` of a resource, or remove the resource from
+        the index if `text` is `None`."""
+        indexer = self._get_indexer()
+        if indexer is None:
+            return
+        with self.env.db_transaction as db:
+            for docid, in db("""
+                    SELECT id FROM search_document
+                    WHERE realm=%s AND resource=%s
+                    """, (realm, resource)):
+                break
+            else:
+                docid = None
+            if text is None:
+                if docid is not None:
+                    db("DELETE FROM search_document WHERE id=%s", (docid,))
+                    indexer.delete_documents([docid])
+                return
+            if docid is None:
+                cursor = db.cursor()
+                cursor.execute("""
+                    INSERT INTO search_document (realm, resource)
+                    VALUES (%s,%s)
+                    """, (realm, resource))
+                docid = db.get_last_id(cursor, 'search_document')
+            indexer.add_documents([(docid, text)])
+
+    def _update_ticket(self, id_):
+        with self.env.db_query as db:
+            docs = list(self._get_ticket_documents(db, id_))
+        self._update('ticket', unicode(id_), docs[0][1] if docs else None)
+
+    def _update_wiki_page(self, name):
+        with self.env.db_query as db:
+            docs = list(self._get_wiki_documents(db, name))
+        self._update('wiki', name, docs[0][1] if docs else None)
+
+    def _update_attachment(self, parent_realm, parent_id, filename):
+        with self.env.db_query as db:
+            docs = list(self._get_attachment_documents(
+                db, (parent_realm, unicode(parent_id), filename)))
+        self._update('attachment',
+                     attachment_resource(parent_realm, parent_id, filename),
+                     docs[0][1] if docs else None)
+
+    def _update_changeset(self, repos, rev):
+        if hasattr(repos, 'db_rev'):  # only the cached revisions are indexed
+            rev = repos.db_rev(rev)
+            with self.env.db_query as db:
+                docs = list(self._get_changeset_documents(db, (repos.id,
+                                                               rev)))
+            self._update('changeset', u'%s:%s' % (repos.id, rev),
+                         docs[0][1] if docs else None)
+
+    # The documents are generated as `(resource, text)` tuples, for all
+    # the resources of a realm or for the resource given by `key`.
+
+    def _get_ticket_documents(self, db, key=None):
+        cond, args = ('=%s', (key,)) if key is not None \
+                     else (' IS NOT NULL', ())
+        texts = {}
+        for row in db("""
+                SELECT id, summary, keywords, description, reporter, cc
+                FROM ticket WHERE id""" + cond, args):
+            texts[row[0]] = [unicode(row[0])] + [v for v in row[1:] if v]
+        for id_, value in db("""
+                SELECT ticket, value FROM ticket_custom
+                WHERE ticket""" + cond, args):
+            if id_ in texts and value:
+                texts[id_].append(value)
+        for id_, value in db("""
+                SELECT ticket, newvalue FROM ticket_change
+                WHERE field='comment' AND ticket""" + cond, args):
+            if id_ in texts and value:
+                texts[id_].append(value)
+        for id_, parts in texts.iteritems():
+            yield unicode(id_), u'\n'.join(parts)
+
+    def _get_wiki_documents(self, db, key=None):
+        cond, args = ('=%s', (key,)) if key is not None \
+                     else (' IS NOT NULL', ())
+        for name, author, text in db("""
+                SELECT w1.name, w1.author, w1.text
+                FROM wiki_latest w2
+                INNER JOIN wiki w1
+                  ON (w1.name=w2.name AND w1.version=w2.version)
+                WHERE w2.name%s
+                """ % cond, args):
+            yield name, u'\n'.join(v for v in (name, author, text) if v)
+
+    def _get_attachment_documents(self, db, key=None):
+        where, args = (' WHERE type=%s AND id=%s AND filename=%s', key) \
+                      if key is not None else ('', ())
+        for type_, id_, filename, description, author in db("""
+                SELECT type, id, filename, description, author
+                FROM attachment""" + where, args):
+            yield (attachment_resource(type_, id_, filename),
+                   u'\n'.join(v for v in (filename, description, author)
+                              if v))
+
+    def _get_changeset_documents(self, db, key=None):
+        where, args = (' WHERE repos=%s AND rev=%s', key) \
+                      if key is not None else ('', ())
+        for repos, rev, author, message in db("""
+                SELECT repos, rev, author, message FROM revision
+                """ + where, args):
+            yield (u'%s:%s' % (repos, rev),
+                   u'\n'.join(v for v in (rev, author, message) if v))
+
+    def _do_reindex(self):
+        count = self.reindex()
+        printout(_("%(count)d documents indexed", count=count))
+
+
+class DatabaseSearchIndexer(Component):
+    """Full-text index using the full-text search of the database.
+
+    The index is an FTS5 virtual table for SQLite, which requires an
+    SQLite library built with the FTS5 extension, a `tsvector` column
+    with a GIN index for PostgreSQL and a `FULLTEXT` index for MySQL.
+    """
+
+    implements(ISearchIndexer)
+
+    table = 'search_index'
+
+    # ISearchIndexer methods
+
+    def reset(self):
+        scheme = self._get_scheme()
+        with self.env.db_transaction as db:
+            db.drop_table(self.table)
+            if scheme == 'sqlite':
+                try:
+                    db("CREATE VIRTUAL TABLE %s USING fts5(content)"
+                       % self.table)
+                except self.env.db_exc.OperationalError:
+                    raise TracError(_("The SQLite library doesn't support "
+                                      "the FTS5 full-text search "
+                                      "extension."))
+            elif scheme == 'postgres':
+                db("""CREATE TABLE %s (docid integer PRIMARY KEY,
+                                       content tsvector)""" % self.table)
+                db("CREATE INDEX %s_content_idx ON %s USING gin(content)"
+                   % (self.table, self.table))
+            elif scheme == 'mysql':
+                db("""CREATE TABLE %s (docid integer PRIMARY KEY,
+                                       content longtext,
+                                       FULLTEXT INDEX (content))
+                      ENGINE=InnoDB""" % self.table)
+            else:
+                raise TracError(_("The full-text search isn't supported for "
+                                  "the %(scheme)s database.", scheme=scheme))
+
+    def add_documents(self, docs):
+        docs = list(docs)
+        if self._get_scheme() == 'sqlite':
+            key, value = 'rowid', '%s'
+        elif self._get_scheme() == 'postgres':
+            key, value = 'docid', "to_tsvector('simple',%s)"
+        else:
+            key, value = 'docid', '%s'
+        with self.env.db_transaction as db:
+            for chunk in chunked(docs):
+                db("DELETE FROM %s WHERE %s IN (%s)"
+                   % (self.table, key, ','.join(['%s'] * len(chunk))),
+                   [docid for docid, text in chunk])
+            db.executemany("INSERT INTO %s (%s, content) VALUES (%%s,%s)"
+                           % (self.table, key, value), docs)
+
+    def delete_documents(self, docids):
+        key = 'rowid' if self._get_scheme() == 'sqlite' else 'docid'
+        with self.env.db_transaction as db:
+            for chunk in chunked(list(docids)):
+                db("DELETE FROM %s WHERE %s IN (%s)"
+                   % (self.table, key, ','.join(['%s'] * len(chunk))),
+                   chunk)
+
+    def search(self, terms):
+        scheme = self._get_scheme()
+        if scheme == 'sqlite':
+            # Quoted strings, matching the phrases starting with the term
+            query = ' AND '.join('"%s"*' % term.replace('"', '""')
+                                 for term in terms)
+            sql = """
+                SELECT rowid, -bm25(%(table)s) FROM %(table)s
+                WHERE %(table)s MATCH %%s"""
+        else:
+            words = [word for term in terms
+                          for word in re.findall(r'\w+', term, re.UNICODE)]
+            if not words:
+                return []
+            if scheme == 'postgres':
+                query = ' & '.join("'%s':*" % word for word in words)
+                sql = """
+                    SELECT docid, ts_rank(content, query)
+                    FROM %(table)s, to_tsquery('simple', %%s) query
+                    WHERE content @@ query"""
+            else:
+                query = ' '.join('+%s*' % word for word in words)
+                sql = """
+                    SELECT docid, MATCH (content) AGAINST (%%s IN BOOLEAN MODE)
+                    FROM %(table)s
+                    WHERE MATCH (content) AGAINST (%%s IN BOOLEAN MODE)"""
+        args = (query, query) if scheme == 'mysql' else (query,)
+        return self.env.db_query(sql % {'table': self.table}, args)
+
+    # Internal methods
+
+    def _get_scheme(self):
+        dburi = DatabaseManager(self.env).connection_uri
+        return parse_connection_uri(dburi)[0]
@@ -13,12 +13,14 @@
 
 import unittest
 
-from trac.search.tests import web_ui
+from trac.search.tests import fileindex, index, web_ui
 from trac.search.tests.functional import functionalSuite
 
 
 def test_suite():
     suite = unittest.TestSuite()
+    suite.addTest(fileindex.test_suite())
+    suite.addTest(index.test_suite())
     suite.addTest(web_ui.test_suite())
     return suite
 
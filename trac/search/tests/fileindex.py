@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import os
+import unittest
+
+from trac.search.fileindex import FileSearchIndexer, _decode_postings, \
+                                  _encode_postings, tokenize
+from trac.search.index import SearchIndex
+from trac.search.web_ui import SearchModule
+from trac.test import EnvironmentStub, MockRequest, mkdtemp
+from trac.ticket.test import insert_ticket
+from trac.ticket.web_ui import TicketModule
+
+
+class PostingsTestCase(unittest.TestCase):
+
+    def test_tokenize(self):
+        self.assertEqual([u'crash', u'in', u'trac', u'wiki', u'1', u'été'],
+                         tokenize(u'Crash in trac.wiki (#1): été'))
+
+    def test_encode_decode(self):
+        for postings in ([(1, 1)], [(3, 2), (250, 1), (300, 700)],
+                         [(1, 1), (70000, 3), (70001, 100000)]):
+            self.assertEqual(postings,
+                             _decode_postings(_encode_postings(postings)))
+
+    def test_small_values_are_compact(self):
+        small = _encode_postings([(idx, 1) for idx in xrange(100, 200)])
+        large = _encode_postings([(idx * 1000, 1) for idx in xrange(100)])
+        self.assertLess(len(small), len(large))
+
+
+class FileSearchIndexerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(path=mkdtemp())
+        self.indexer = FileSearchIndexer(self.env)
+        self.indexer.reset()
+
+    def tearDown(self):
+        self.env.reset_db_and_disk()
+
+    def _search(self, *terms):
+        return sorted(docid for docid, score in self.indexer.search(terms))
+
+    def _segments(self):
+        return [name for name in os.listdir(self.indexer.path)
+                if name.startswith('seg')]
+
+    def test_search(self):
+        self.indexer.add_documents([(1, u'The wiki crashes'),
+                                    (2, u'Crash in the ticket module'),
+                                    (3, u'Wiki formatting')])
+
+        self.assertEqual([1, 2], self._search(u'crash'))
+        self.assertEqual([1, 3], self._search(u'WIKI'))
+        self.assertEqual([1], self._search(u'wiki', u'crash'))
+        self.assertEqual([2], self._search(u'ticket module'))
+        self.assertEqual([], self._search(u'other'))
+        self.assertEqual([], self._search(u'!!'))
+
+    def test_ranking(self):
+        self.indexer.add_documents([(1, u'crash and other words'),
+                                    (2, u'crash crash')])
+
+        scores = dict(self.indexer.search([u'crash']))
+        self.assertGreater(scores[2], scores[1])
+
+    def test_replace_and_delete(self):
+        self.indexer.add_documents([(1, u'First text'), (2, u'Other')])
+        self.indexer.add_documents([(1, u'Second text')])
+        self.assertEqual([], self._search(u'first'))
+        self.assertEqual([1], self._search(u'second'))
+
+        self.indexer.delete_documents([1])
+        self.assertEqual([], self._search(u'text'))
+        self.assertEqual([2], self._search(u'other'))
+
+    def test_merge_segments(self):
+        for docid in xrange(1, 31):
+            self.indexer.add_documents([(docid, u'Document %d' % docid)])
+        self.indexer.delete_documents(xrange(1, 11))
+
+        self.assertLessEqual(len(self._segments()),
+                             self.indexer.merge_factor)
+        self.assertEqual(range(11, 31), self._search(u'document'))
+        self.assertEqual([25], self._search(u'25'))
+
+    def test_batches_of_documents(self):
+        self.indexer.segment_size = 3
+        self.indexer.add_documents((docid, u'Document')
+                                   for docid in xrange(1, 11))
+
+        self.assertEqual(4, len(self._segments()))
+        self.assertEqual(range(1, 11), self._search(u'doc'))
+
+    def test_reset(self):
+        self.indexer.add_documents([(1, u'Text')])
+        self.indexer.reset()
+
+        self.assertEqual([], self._segments())
+        self.assertEqual([], self._search(u'text'))
+
+
+class SearchIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True,
+                                   enable=['trac.*', TicketModule],
+                                   path=mkdtemp())
+        self.env.config.set('search', 'index_backend', 'FileSearchIndexer')
+        SearchIndex(self.env).reindex()
+
+    def tearDown(self):
+        self.env.reset_db_and_disk()
+
+    def test_search_tickets(self):
+        insert_ticket(self.env, summary='Crash', description='Crash twice')
+        insert_ticket(self.env, summary='Crash')
+        insert_ticket(self.env, summary='Other')
+
+        req = MockRequest(self.env, args={'q': 'cras', 'ticket': 'on'})
+        data = SearchModule(self.env).process_request(req)[1]
+        self.assertEqual(['/trac.cgi/ticket/1', '/trac.cgi/ticket/2'],
+                         [result['href'] for result in data['results']])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(PostingsTestCase))
+    suite.addTest(unittest.makeSuite(FileSearchIndexerTestCase))
+    suite.addTest(unittest.makeSuite(SearchIndexTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
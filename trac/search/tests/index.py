@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import io
+import unittest
+
+from trac.attachment import Attachment
+from trac.core import TracError
+from trac.search.index import SearchIndex
+from trac.search.web_ui import SearchModule
+from trac.test import EnvironmentStub, MockRequest, mkdtemp
+from trac.ticket.test import insert_ticket
+from trac.ticket.web_ui import TicketModule
+from trac.wiki.model import WikiPage
+from trac.wiki.web_ui import WikiModule
+
+
+class DatabaseSearchIndexerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True,
+                                   enable=['trac.*', TicketModule,
+                                           WikiModule],
+                                   path=mkdtemp())
+        self.env.config.set('search', 'index_backend',
+                            'DatabaseSearchIndexer')
+        self.index = SearchIndex(self.env)
+        try:
+            self.index.reindex()
+        except TracError as e:
+            self.tearDown()
+            raise unittest.SkipTest(unicode(e))
+
+    def tearDown(self):
+        with self.env.db_transaction as db:
+            db.drop_table('search_index')
+        self.env.reset_db_and_disk()
+
+    def _insert_page(self, name, text):
+        page = WikiPage(self.env, name)
+        page.text = text
+        page.save('joe', 'Comment')
+        return page
+
+    def test_ticket_is_indexed(self):
+        ticket = insert_ticket(self.env, summary='Crash on startup',
+                               description='The application crashes')
+        ticket.save_changes('jane', 'Happens with the plugins')
+
+        self.assertEqual(['1'], list(self.index.search('ticket', ['crash'])))
+        self.assertEqual(['1'], list(self.index.search('ticket',
+                                                       ['plugin', 'app'])))
+        self.assertEqual({}, self.index.search('ticket', ['other']))
+        self.assertEqual({}, self.index.search('wiki', ['crash']))
+
+        ticket.delete()
+        self.assertEqual({}, self.index.search('ticket', ['crash']))
+
+    def test_wiki_page_is_indexed(self):
+        page = self._insert_page('OldName', 'First version')
+        page.text = 'Second version'
+        page.save('joe', 'Comment')
+        page.rename('NewName')
+
+        self.assertEqual(['NewName'],
+                         list(self.index.search('wiki', ['second'])))
+        self.assertEqual({}, self.index.search('wiki', ['first']))
+
+        page.delete()
+        self.assertEqual({}, self.index.search('wiki', ['second']))
+
+    def test_attachment_is_indexed(self):
+        self._insert_page('SomePage', 'Text')
+        attachment = Attachment(self.env, 'wiki', 'SomePage')
+        attachment.description = 'Screenshot of the crash'
+        attachment.insert('screen.png', io.BytesIO(), 0)
+
+        self.assertEqual(['wiki:SomePage/screen.png'],
+                         list(self.index.search('attachment', ['crash'])))
+        req = MockRequest(self.env)
+        results = list(WikiModule(self.env).get_search_results(
+            req, ['crash'], ['wiki']))
+        self.assertEqual(1, len(results))
+        self.assertEqual('/trac.cgi/attachment/wiki/SomePage/screen.png',
+                         results[0][0])
+
+    def test_reindex(self):
+        insert_ticket(self.env, summary='Crash')
+        self._insert_page('SomePage', 'Crash')
+        self.env.config.set('search', 'index_backend', '')
+        insert_ticket(self.env, summary='Another crash')
+
+        self.assertIsNone(self.index.search('ticket', ['crash']))
+        self.env.config.set('search', 'index_backend',
+                            'DatabaseSearchIndexer')
+        self.assertEqual(['1'], list(self.index.search('ticket', ['crash'])))
+        self.assertEqual(3, self.index.reindex())
+        self.assertEqual(['1', '2'],
+                         sorted(self.index.search('ticket', ['crash'])))
+
+    def test_results_are_ranked(self):
+        insert_ticket(self.env, summary='Crash',
+                      description='Crash after crash')
+        insert_ticket(self.env, summary='Crash')
+        self._insert_page('SomePage', 'Unrelated')
+
+        req = MockRequest(self.env, args={'q': 'crash', 'ticket': 'on',
+                                          'wiki': 'on'})
+        data = SearchModule(self.env).process_request(req)[1]
+        self.assertEqual(['/trac.cgi/ticket/1', '/trac.cgi/ticket/2'],
+                         [result['href'] for result in data['results']])
+
+
+def test_suite():
+    return unittest.makeSuite(DatabaseSearchIndexerTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -11,15 +11,21 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+from datetime import datetime, timedelta
 import os
 import pkg_resources
+import threading
 import unittest
 
+from trac.core import Component, ComponentMeta, implements
+from trac.search.api import ISearchSource
 from trac.search.web_ui import SearchModule
 from trac.test import EnvironmentStub, MockRequest
 from trac.ticket.model import Ticket
 from trac.ticket.test import insert_ticket
 from trac.ticket.web_ui import TicketModule
+from trac.util import translation
+from trac.util.datefmt import utc
 from trac.wiki.admin import WikiAdmin
 from trac.wiki.web_ui import WikiModule
 from trac.web.api import RequestDone
@@ -66,6 +72,25 @@ class SearchModuleTestCase(unittest.TestCase):
         self.assertIn("Page 3 is out of range.", req.chrome['warnings'])
         self.assertEqual(0, data['results'].page)
 
+    def test_process_request_sorted_ticket_results(self):
+        """The ticket source retrieves only the results up to the
+        requested page, newest first, and counts all the results."""
+        for idx in xrange(25):
+            self._insert_ticket(summary="Trac",
+                                when=datetime(2018, 1, 1, tzinfo=utc) +
+                                     timedelta(days=idx))
+        req = MockRequest(self.env,
+                          args={'page': '2', 'q': 'Trac', 'ticket': 'on'})
+
+        data = self.search_module.process_request(req)[1]
+
+        results = data['results']
+        self.assertEqual(25, results.num_items)
+        self.assertEqual(3, results.num_pages)
+        self.assertEqual(['/trac.cgi/ticket/%d' % id_
+                          for id_ in xrange(15, 5, -1)],
+                         [result['href'] for result in results])
+
     def test_camelcase_quickjump(self):
         """CamelCase word does quick-jump."""
         req = MockRequest(self.env, args={'q': 'WikiStart'})
@@ -94,9 +119,129 @@ class SearchModuleTestCase(unittest.TestCase):
         self.assertEqual([], req.chrome['notices'])
 
 
+class SearchConcurrentSourcesTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        class SlowSource(Component):
+            implements(ISearchSource)
+            done = threading.Event()
+            def get_search_filters(self, req):
+                yield 'slow', 'Slow'
+            def get_search_results(self, req, terms, filters):
+                self.done.wait(5)
+                return []
+
+        class LocaleSource(Component):
+            implements(ISearchSource)
+            def get_search_filters(self, req):
+                yield 'locale', 'Locale'
+            def get_search_results(self, req, terms, filters):
+                translation.translations.isactive
+                return []
+
+        cls.components = [SlowSource, LocaleSource]
+
+    @classmethod
+    def tearDownClass(cls):
+        for component in cls.components:
+            ComponentMeta.deregister(component)
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*'] + self.components)
+        self.env.config.set('search', 'source_threads', 2)
+        self.env.config.set('search', 'source_timeout', 1)
+        self.search_module = SearchModule(self.env)
+        self.components[0].done.clear()
+
+    def tearDown(self):
+        self.components[0].done.set()
+        self.env.reset_db()
+
+    def test_results_of_concurrent_sources(self):
+        insert_ticket(self.env, summary='Trac')
+        req = MockRequest(self.env, args={'q': 'Trac', 'ticket': 'on',
+                                          'slow': 'on'})
+
+        data = self.search_module.process_request(req)[1]
+
+        results = list(data['results'])
+        self.assertEqual(1, len(results))
+        self.assertEqual('/trac.cgi/ticket/1', results[0]['href'])
+        warnings = req.chrome['warnings']
+        self.assertEqual(1, len(warnings))
+        self.assertIn("SlowSource didn't complete in time",
+                      unicode(warnings[0]))
+
+    def test_locale_is_activated_in_sources(self):
+        if not translation.has_babel:
+            self.skipTest("Babel not installed")
+        activated = []
+        proxy = translation.translations
+        proxy.activate = lambda locale, env_path=None: \
+                         activated.append((locale, env_path))
+        req = MockRequest(self.env, locale='fr',
+                          args={'q': 'Trac', 'locale': 'on'})
+        try:
+            self.search_module.process_request(req)
+        finally:
+            del proxy.activate
+
+        self.assertEqual([('fr', self.env.path)], activated)
+
+
+class SearchSortedSourcesTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        class SortedSource(Component):
+            implements(ISearchSource)
+            limits = []
+            def get_search_filters(self, req):
+                yield 'sorted', 'Sorted'
+            def get_search_results(self, req, terms, filters):
+                raise AssertionError("get_sorted_search_results not used")
+            def get_sorted_search_results(self, req, terms, filters, limit):
+                self.limits.append(limit)
+                when = datetime(2018, 1, 1, tzinfo=utc)
+                return [('/sorted/%d' % idx, 'Result %d' % idx,
+                         when - timedelta(days=idx), 'joe', '')
+                        for idx in xrange(limit)], 1000
+
+        cls.components = [SortedSource]
+
+    @classmethod
+    def tearDownClass(cls):
+        for component in cls.components:
+            ComponentMeta.deregister(component)
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*'] + self.components)
+        self.search_module = SearchModule(self.env)
+        self.components[0].limits[:] = []
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_limit_and_count(self):
+        req = MockRequest(self.env, args={'q': 'Trac', 'sorted': 'on',
+                                          'page': '3'})
+
+        data = self.search_module.process_request(req)[1]
+
+        results = data['results']
+        self.assertEqual([30], self.components[0].limits)
+        self.assertEqual(1000, results.num_items)
+        self.assertEqual(100, results.num_pages)
+        self.assertEqual(['/sorted/%d' % idx for idx in xrange(20, 30)],
+                         [result['href'] for result in results])
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(SearchModuleTestCase))
+    suite.addTest(unittest.makeSuite(SearchConcurrentSourcesTestCase))
+    suite.addTest(unittest.makeSuite(SearchSortedSourcesTestCase))
     return suite
 
 
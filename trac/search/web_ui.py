@@ -16,11 +16,14 @@
 
 import pkg_resources
 import re
+import time
+from functools import partial
 
 from trac.config import IntOption, ListOption
 from trac.core import *
 from trac.perm import IPermissionRequestor
-from trac.search.api import ISearchSource
+from trac.search.api import ISearchSource, search_result_key
+from trac.util.concurrency import call_concurrently
 from trac.util.datefmt import format_datetime, user_time
 from trac.util.html import Markup, escape, find_element, tag
 from trac.util.presentation import Paginator
@@ -61,6 +64,19 @@ class SearchModule(Component):
                be manually enabled by the user on the search page.
                """)
 
+    source_threads = IntOption('search', 'source_threads', 0,
+        """Number of threads used to retrieve the results of the search
+        sources concurrently. When set to `0`, the sources are called
+        one after the other. (''since 1.3.3'')
+        """)
+
+    source_timeout = IntOption('search', 'source_timeout', 30,
+        """Maximum time in seconds to wait for the results of the search
+        sources, when `source_threads` is not `0`. The results of a
+        source which takes longer are left out and a warning is shown.
+        (''since 1.3.3'')
+        """)
+
     # INavigationContributor methods
 
     def get_active_navigation_item(self, req):
@@ -106,9 +122,12 @@ class SearchModule(Component):
 
             terms = self._parse_query(req, query)
             if terms:
-                results = self._do_search(req, terms, filters)
+                page = req.args.getint('page', 1, min=1)
+                results, count = self._do_search(
+                    req, terms, filters, page * self.RESULTS_PER_PAGE)
                 if results:
-                    data.update(self._prepare_results(req, filters, results))
+                    data.update(self._prepare_results(req, filters, results,
+                                                      count))
             if noquickjump and filters:
                 req.session['search.filters'] = ','.join(filters)
 
@@ -229,21 +248,76 @@ class SearchModule(Component):
                            'Query must be at least %(num)s characters long.',
                            num=self.min_query_length))
 
-    def _do_search(self, req, terms, filters):
-        results = []
-        for source in self.search_sources:
-            results.extend(source.get_search_results(req, terms, filters)
-                           or [])
-        return sorted(results, key=lambda x: x[2], reverse=True)
+    def _do_search(self, req, terms, filters, limit=None):
+        """Return the sorted search results and their total number.
 
-    def _prepare_results(self, req, filters, results):
+        When a `limit` is given, only the first `limit` results are
+        retrieved from the sources implementing the optional
+        `get_sorted_search_results` method.
+        """
+        results = []
+        counts = []
+        if self.source_threads > 0:
+            self._search_concurrently(req, terms, filters, limit, results,
+                                      counts)
+        else:
+            for source in self.search_sources:
+                t = time.time()
+                source_results, count = self._get_source_results(
+                    source, req, terms, filters, limit)
+                results.extend(source_results)
+                counts.append(count)
+                self.log.debug("Search source %s took %.3f s",
+                               source.__class__.__name__, time.time() - t)
+        # The results of the sources are sorted runs, which are merged
+        # by the sort. The results ranked by the search index come
+        # first, by decreasing relevance, then by decreasing date.
+        results.sort(key=search_result_key, reverse=True)
+        return results, sum(counts)
+
+    def _get_source_results(self, source, req, terms, filters, limit):
+        if limit is not None and \
+                hasattr(source, 'get_sorted_search_results'):
+            return source.get_sorted_search_results(req, terms, filters,
+                                                    limit)
+        results = list(source.get_search_results(req, terms, filters) or [])
+        return results, len(results)
+
+    def _search_concurrently(self, req, terms, filters, limit, results,
+                             counts):
+        def get_results(source):
+            return self._get_source_results(source, req, terms, filters,
+                                            limit)
+        sources = list(self.search_sources)
+        outcomes = call_concurrently((partial(get_results, source)
+                                      for source in sources),
+                                     self.source_threads, self.source_timeout,
+                                     req.locale, self.env.path)
+        for source, (outcome, exc_info, elapsed) in zip(sources, outcomes):
+            name = source.__class__.__name__
+            if elapsed is None:
+                self.log.warning("Search source %s didn't complete within "
+                                 "%d s", name, self.source_timeout)
+                add_warning(req, _("%(component)s didn't complete in time, "
+                                   "its results are not shown.",
+                                   component=name))
+                continue
+            self.log.debug("Search source %s took %.3f s", name, elapsed)
+            if exc_info:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            source_results, count = outcome
+            results.extend(source_results)
+            counts.append(count)
+
+    def _prepare_results(self, req, filters, results, count):
         page = req.args.getint('page', 1, min=1)
-        try:
-            results = Paginator(results, page - 1, self.RESULTS_PER_PAGE)
-        except TracError:
+        offset = (page - 1) * self.RESULTS_PER_PAGE
+        if offset >= len(results):
             add_warning(req, _("Page %(page)s is out of range.", page=page))
             page = 1
-            results = Paginator(results, page - 1, self.RESULTS_PER_PAGE)
+            offset = 0
+        results = Paginator(results[offset:offset + self.RESULTS_PER_PAGE],
+                            page - 1, self.RESULTS_PER_PAGE, count)
 
         for idx, result in enumerate(results):
             results[idx] = {'href': result[0], 'title': result[1],
@@ -24,13 +24,15 @@ import os
 import quopri
 import re
 import socket
+import smtplib
 import string
 import threading
 import unittest
 from contextlib import closing
 
 from trac.config import ConfigurationError
-from trac.notification import SendmailEmailSender, SmtpEmailSender
+from trac.notification import (NotificationSystem, SendmailEmailSender,
+                               SmtpEmailSender)
 from trac.test import EnvironmentStub
 
 LF = '\n'
@@ -233,6 +235,7 @@ class SMTPServer(object):
         self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self._socket.bind((host, port))
         self._socket_service = None
+        self.connections = 0
 
     def serve(self, impl):
         while self._resume:
@@ -241,6 +244,7 @@ class SMTPServer(object):
             except socket.error:
                 return
             self._socket_service = nsd[0]
+            self.connections += 1
             engine = SMTPServerEngine(self._socket_service, impl)
             engine.chug()
             self._socket_service = None
@@ -280,6 +284,9 @@ class SMTPServerStore(SMTPServerInterface):
         self.reset(None)
 
     def mail_from(self, args):
+        # A new mail transaction starts, maybe over the same connection
+        self.recipients = []
+        self.message = None
         if args.lower().startswith('from:'):
             self.sender = strip_address(args[5:].replace('\r\n', '').strip())
 
@@ -345,6 +352,9 @@ class SMTPThreadedServer(threading.Thread):
     def get_message(self):
         return self.store.message
 
+    def get_connections(self):
+        return self.server.connections
+
     def cleanup(self):
         self.store.reset(None)
 
@@ -468,10 +478,114 @@ class SmtpEmailSenderTestCase(unittest.TestCase):
                           'admin@domain.com', ['foo@domain.com'], "")
 
 
+class SmtpEmailSenderConnectionTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.smtpd = SMTPThreadedServer(SMTP_TEST_PORT)
+        cls.smtpd.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.smtpd.stop()
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.config.set('notification', 'smtp_server', self.smtpd.host)
+        self.env.config.set('notification', 'smtp_port', self.smtpd.port)
+        self.sender = SmtpEmailSender(self.env)
+        self.connections = self.smtpd.get_connections()
+
+    def tearDown(self):
+        self.smtpd.cleanup()
+
+    def _send(self, count):
+        for idx in xrange(count):
+            self.sender.send('admin@example.org',
+                             ['user%d@example.org' % idx],
+                             'Subject: Message %d\n\nBody\n' % idx)
+
+    def _assert_connections(self, expected):
+        self.assertEqual(expected,
+                         self.smtpd.get_connections() - self.connections)
+
+    def test_connection_per_message(self):
+        self._send(3)
+        self._assert_connections(3)
+        self.assertEqual(['user2@example.org'], self.smtpd.get_recipients())
+
+    def test_batch_reuses_connection(self):
+        with self.sender.batch():
+            with self.sender.batch():
+                self._send(2)
+            self._send(1)
+        self._assert_connections(1)
+        self.assertEqual(['user0@example.org'], self.smtpd.get_recipients())
+        self.assertIn('Subject: Message 0', self.smtpd.get_message())
+
+    def test_batch_max_messages_per_connection(self):
+        self.env.config.set('notification',
+                            'smtp_max_messages_per_connection', 2)
+        with self.sender.batch():
+            self._send(5)
+        self._assert_connections(3)
+
+    def test_batch_idle_timeout(self):
+        self.env.config.set('notification', 'smtp_connection_idle_timeout',
+                            -1)
+        with self.sender.batch():
+            self._send(2)
+        self._assert_connections(2)
+
+    def test_batch_resend_failure(self):
+        servers = []
+
+        class Server(object):
+            closed = sent = False
+
+            def close(self):
+                self.closed = True
+
+            def quit(self):
+                raise smtplib.SMTPServerDisconnected()
+
+        def connect():
+            servers.append(Server())
+            return servers[-1]
+
+        def sendmail(server, from_addr, recipients, message):
+            # Only the first message goes through
+            if server is not servers[0] or server.sent:
+                raise smtplib.SMTPServerDisconnected()
+            server.sent = True
+
+        self.sender._connect = connect
+        self.sender._sendmail = sendmail
+        with self.sender.batch():
+            self._send(1)
+            self.assertRaises(smtplib.SMTPServerDisconnected, self._send, 1)
+            self.assertEqual(2, len(servers))
+            self.assertTrue(all(server.closed for server in servers))
+            self.assertIsNone(self.sender._local.connection['server'])
+            self.assertRaises(smtplib.SMTPServerDisconnected, self._send, 1)
+            self.assertEqual(3, len(servers))
+        self.assertTrue(all(server.closed for server in servers))
+
+    def test_email_batch(self):
+        notify_sys = NotificationSystem(self.env)
+        with notify_sys.email_batch():
+            for idx in xrange(3):
+                notify_sys.send_email('admin@example.org',
+                                      ['user@example.org'],
+                                      'Subject: Message\n\nBody\n')
+        self._assert_connections(1)
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(SendmailEmailSenderTestCase))
     suite.addTest(unittest.makeSuite(SmtpEmailSenderTestCase))
+    suite.addTest(unittest.makeSuite(SmtpEmailSenderConnectionTestCase))
     return suite
 
 
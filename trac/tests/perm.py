@@ -16,6 +16,7 @@ import unittest
 from trac import perm
 from trac.admin.console import TracAdmin
 from trac.admin.test import TracAdminTestCaseBase
+from trac.cache import CacheManager, key_to_id
 from trac.core import Component, ComponentMeta, TracError, implements
 from trac.resource import Resource
 from trac.test import EnvironmentStub
@@ -112,6 +113,38 @@ class DefaultPermissionStoreTestCase(unittest.TestCase):
         for res in self.store.get_all_permissions():
             self.assertIn(res, expected)
 
+    def test_get_users_with_permissions(self):
+        self.env.insert_users([('john', None, None), ('kate', None, None),
+                               ('mike', None, None), ('anna', None, None)])
+        self.env.db_transaction.executemany(
+            "INSERT INTO permission VALUES (%s,%s)",
+            [('dev', 'WIKI_MODIFY'),
+             ('admin', 'dev'),
+             ('john', 'admin'),
+             ('kate', 'dev'),
+             ('kate', 'REPORT_ADMIN'),
+             ('mike', 'TICKET_CREATE'),
+             ('unknown', 'WIKI_MODIFY')])
+        self.assertEqual(['john', 'kate'], sorted(
+            self.store.get_users_with_permissions(['WIKI_MODIFY'])))
+        self.assertEqual(['kate', 'mike'], sorted(
+            self.store.get_users_with_permissions(['REPORT_ADMIN',
+                                                   'TICKET_CREATE'])))
+        self.assertEqual([], self.store.get_users_with_permissions(
+            ['TICKET_ADMIN']))
+
+    def test_get_users_with_permissions_builtin_groups(self):
+        self.env.insert_users([('john', None, None), ('kate', None, None)])
+        self.env.db_transaction.executemany(
+            "INSERT INTO permission VALUES (%s,%s)",
+            [('authenticated', 'dev'),
+             ('dev', 'WIKI_MODIFY'),
+             ('anonymous', 'TICKET_CREATE')])
+        self.assertEqual(['john', 'kate'], sorted(
+            self.store.get_users_with_permissions(['WIKI_MODIFY'])))
+        self.assertEqual(['john', 'kate'], sorted(
+            self.store.get_users_with_permissions(['TICKET_CREATE'])))
+
 
 class BaseTestCase(unittest.TestCase):
 
@@ -236,6 +269,56 @@ class PermissionSystemTestCase(BaseTestCase):
         self.assertEqual({}, self.perm.get_user_permissions('bob'))
         self.assertEqual({}, self.perm.get_user_permissions('jane'))
 
+    def test_get_users_with_permission_after_grant_and_revoke(self):
+        """The cached users with a permission are updated when granting
+        or revoking a permission.
+        """
+        self.env.insert_users([('bob', None, None), ('jane', None, None)])
+        self.perm.grant_permission('bob', 'TEST_MODIFY')
+        self.assertEqual(['bob'],
+                         self.perm.get_users_with_permission('TEST_MODIFY'))
+
+        self.perm.grant_permission('jane', 'TEST_ADMIN')
+        self.assertEqual(['bob', 'jane'], sorted(
+            self.perm.get_users_with_permission('TEST_MODIFY')))
+
+        self.perm.revoke_permission('bob', 'TEST_MODIFY')
+        self.assertEqual(['jane'],
+                         self.perm.get_users_with_permission('TEST_MODIFY'))
+
+    def test_get_users_with_permission_after_grant_in_other_process(self):
+        """The cached users with a permission are updated when another
+        process grants a permission.
+        """
+        self.env.insert_users([('bob', None, None), ('jane', None, None)])
+        self.perm.grant_permission('bob', 'TEST_MODIFY')
+        self.assertEqual(['bob'],
+                         self.perm.get_users_with_permission('TEST_MODIFY'))
+
+        # Simulate the invalidation of the cache by another process
+        self.perm.store.grant_permission('jane', 'TEST_MODIFY')
+        self.env.db_transaction("""
+            UPDATE cache SET generation=generation+1 WHERE id=%s
+            """, (key_to_id('trac.perm.PermissionSystem.'
+                            '_users_with_permission'),))
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(['bob', 'jane'], sorted(
+            self.perm.get_users_with_permission('TEST_MODIFY')))
+
+    def test_get_users_with_permission_after_new_known_user(self):
+        """The cached users with a permission are updated when the known
+        users change.
+        """
+        self.env.insert_users([('bob', None, None)])
+        self.perm.grant_permission('authenticated', 'TEST_MODIFY')
+        self.assertEqual(['bob'],
+                         self.perm.get_users_with_permission('TEST_MODIFY'))
+
+        self.env.insert_users([('jane', None, None)])
+        self.env.invalidate_known_users_cache()
+        self.assertEqual(['bob', 'jane'], sorted(
+            self.perm.get_users_with_permission('TEST_MODIFY')))
+
     def test_grant_permission_differs_from_action_by_casing(self):
         """`TracError` is raised when granting a permission that differs
         from an action by casing.
@@ -26,8 +26,8 @@ from trac.config import (
 from trac.core import *
 from trac.perm import IPermissionRequestor, PermissionCache, PermissionSystem
 from trac.resource import IResourceManager
-from trac.util import Ranges, as_bool, as_int
-from trac.util.datefmt import parse_date, user_time
+from trac.util import Ranges, as_bool, as_int, chunked
+from trac.util.datefmt import from_utimestamp, parse_date, user_time
 from trac.util.html import tag
 from trac.util.text import shorten_line, to_unicode
 from trac.util.translation import _, N_, deactivate, gettext, reactivate
@@ -231,6 +231,14 @@ class TicketSystem(Component):
         e-mail addresses must remain protected.
         """)
 
+    restrict_owner_limit = IntOption('ticket', 'restrict_owner_limit', 0,
+        """Maximum number of users in the drop-down menu of the owner
+        field when `restrict_owner` is enabled. When more users are
+        allowed to own tickets, the owner is entered in a text field
+        which auto-completes user names. When set to 0, there is no
+        limit. (''since 1.3.3'')
+        """)
+
     default_version = Option('ticket', 'default_version', '',
         """Default version for newly created tickets.""")
 
@@ -284,6 +292,7 @@ class TicketSystem(Component):
         """Maximum allowed summary size in characters. (//since 1.0.2//)""")
 
     def __init__(self):
+        self._localized_fields_cache = (None, {})
         self.log.debug('action controllers for ticket workflow: %r',
                        [c.__class__.__name__ for c in self.action_controllers])
 
@@ -314,7 +323,7 @@ class TicketSystem(Component):
 
     def get_ticket_field_labels(self):
         """Produce a (name,label) mapping from `get_ticket_fields`."""
-        labels = {f['name']: f['label'] for f in self.get_ticket_fields()}
+        labels = {f['name']: f['label'] for f in self._localized_fields()}
         labels['attachment'] = _("Attachment")
         return labels
 
@@ -325,17 +334,37 @@ class TicketSystem(Component):
         and 'type' keys.
         It may in addition contain the 'custom' key, the 'optional' and the
         'options' keys. When present 'custom' and 'optional' are always `True`.
+
+        The returned list can be modified by the caller: the field dicts
+        and their list values are copies of the shared localized fields.
         """
-        fields = copy.deepcopy(self.fields)
-        label = 'label' # workaround gettext extraction bug
-        for f in fields:
-            f[label] = gettext(f[label])
-        return fields
+        return TicketFieldList(_copy_field(f)
+                               for f in self._localized_fields())
 
     def reset_ticket_fields(self):
         """Invalidate ticket field cache."""
         del self.fields
 
+    def _localized_fields(self):
+        """Return the shared list of fields with labels translated in the
+        active locale. The list must not be modified.
+
+        A list is kept per set of translated labels, i.e. per locale, for
+        as long as the `fields` cache is valid.
+        """
+        fields = self.fields
+        label = 'label' # workaround gettext extraction bug
+        labels = tuple(gettext(f[label]) for f in fields)
+        snapshot = self._localized_fields_cache
+        if snapshot[0] is not fields:
+            snapshot = self._localized_fields_cache = (fields, {})
+        localized = snapshot[1].get(labels)
+        if localized is None:
+            localized = TicketFieldList(dict(f, label=l)
+                                        for f, l in zip(fields, labels))
+            snapshot[1][labels] = localized
+        return localized
+
     @cached
     def fields(self):
         """Return the list of fields available for tickets."""
@@ -464,6 +493,17 @@ class TicketSystem(Component):
         # i18n TODO - translated keys
         return {'created': 'time', 'modified': 'changetime'}
 
+    def get_tickets_last_modified(self):
+        """Return the time of the last modification of a ticket and the
+        number of tickets, which change when a ticket is created,
+        modified or deleted.
+
+        :since: 1.3.3
+        """
+        for changetime, count in self.env.db_query("""
+                SELECT MAX(changetime), COUNT(*) FROM ticket"""):
+            return from_utimestamp(changetime), count
+
     def eventually_restrict_owner(self, field, ticket=None):
         """Restrict given owner field to be a list of users having
         the TICKET_MODIFY permission (for the given ticket)
@@ -494,6 +534,47 @@ class TicketSystem(Component):
             allowed_owners.sort()
             return allowed_owners
 
+    def find_allowed_owners(self, term, ticket=None, limit=None):
+        """Returns a sorted list of permitted ticket owners whose
+        username or full name contains `term`, ignoring case.
+
+        The fine-grained permission checks for `ticket` are only done
+        for the matching users, and at most `limit` users are returned.
+
+        :since: 1.3.3
+        """
+        term = term.lower()
+        users = self.env.get_known_users(as_dict=True)
+        owners = []
+        for user in sorted(PermissionSystem(self.env)
+                           .get_users_with_permission('TICKET_MODIFY')):
+            name = users.get(user, (None, None))[0]
+            if term not in user.lower() and \
+                    (not name or term not in name.lower()):
+                continue
+            if ticket and \
+                    'TICKET_MODIFY' not in PermissionCache(self.env, user,
+                                                           ticket.resource):
+                continue
+            owners.append(user)
+            if limit and len(owners) >= limit:
+                break
+        return owners
+
+    def autocomplete_owner(self):
+        """Returns `True` if there are more permitted ticket owners than
+        the `restrict_owner_limit`, in which case the owner should be
+        entered in an auto-completed text field rather than selected in
+        a drop-down menu.
+
+        :since: 1.3.3
+        """
+        if self.restrict_owner and self.restrict_owner_limit > 0:
+            users = PermissionSystem(self.env) \
+                    .get_users_with_permission('TICKET_MODIFY')
+            return len(users) > self.restrict_owner_limit
+        return False
+
     # ITicketManipulator methods
 
     def prepare_ticket(self, req, ticket, fields, actions):
@@ -591,6 +672,35 @@ class TicketSystem(Component):
                                       Ranges.RE_STR),
             lambda x, y, z: self._format_link(x, 'ticket', y[1:], y, z))
 
+    def prefetch_links(self, formatter, links, matches):
+        from trac.ticket.model import Ticket
+        targets = set()
+        for ns in ('bug', 'issue', 'ticket'):
+            targets.update(links.get(ns, ()))
+        for fullmatch in matches:
+            if not fullmatch.group('it_ticket'):  # not an InterTrac link
+                targets.add(fullmatch.group(0)[1:])
+        ids = set()
+        for target in targets:
+            try:
+                r = Ranges(formatter.split_link(target)[0])
+            except ValueError:
+                continue
+            if len(r) == 1 and Ticket.id_is_valid(r.a) and \
+                    (self.realm, r.a) not in formatter.link_cache:
+                ids.add(r.a)
+        if not ids:
+            return
+        for id_ in ids:
+            formatter.link_cache[(self.realm, id_)] = None
+        with self.env.db_query as db:
+            for chunk in chunked(sorted(ids)):
+                for row in db("""
+                        SELECT id, type, summary, status, resolution
+                        FROM ticket WHERE id IN (%s)
+                        """ % ','.join(['%s'] * len(chunk)), chunk):
+                    formatter.link_cache[(self.realm, row[0])] = row[1:]
+
     def _format_link(self, formatter, ns, target, label, fullmatch=None):
         intertrac = formatter.shorthand_intertrac_helper(ns, target, label,
                                                          fullmatch)
@@ -603,15 +713,20 @@ class TicketSystem(Component):
                 num = r.a
                 ticket = formatter.resource(self.realm, num)
                 from trac.ticket.model import Ticket
+                if Ticket.id_is_valid(num):
+                    formatter.add_link_target(self.realm, num)
                 if Ticket.id_is_valid(num) and \
                         'TICKET_VIEW' in formatter.perm(ticket):
-                    # TODO: attempt to retrieve ticket view directly,
-                    #       something like: t = Ticket.view(num)
-                    for type, summary, status, resolution in \
-                            self.env.db_query("""
+                    key = (self.realm, num)
+                    if key in formatter.link_cache:
+                        rows = filter(None, [formatter.link_cache[key]])
+                    else:
+                        # Not prefetched by `prefetch_links`
+                        rows = self.env.db_query("""
                             SELECT type, summary, status, resolution
                             FROM ticket WHERE id=%s
-                            """, (str(num),)):
+                            """, (str(num),))
+                    for type, summary, status, resolution in rows:
                         description = self.format_summary(summary, status,
                                                           resolution, type)
                         title = '#%s: %s' % (num, description)
@@ -649,6 +764,7 @@ class TicketSystem(Component):
 
         if resource and resource.id and resource.realm == self.realm and \
                 cnum and (cnum.isdigit() or cnum == 'description'):
+            formatter.add_link_target(self.realm, resource.id)
             href = title = class_ = None
             if self.resource_exists(resource):
                 from trac.ticket.model import Ticket
@@ -745,6 +861,12 @@ class TicketSystem(Component):
             return False
 
 
+def _copy_field(field):
+    """Copy a field dict, along with its list values (e.g. `options`)."""
+    return {name: list(value) if isinstance(value, list) else value
+            for name, value in field.iteritems()}
+
+
 @contextlib.contextmanager
 def translation_deactivated(ticket=None):
     t = deactivate()
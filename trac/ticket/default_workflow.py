@@ -244,7 +244,12 @@ class ConfigurableTicketWorkflow(Component):
         if 'del_owner' in operations:
             hints.append(_("The ticket will be disowned"))
         if 'set_owner' in operations or 'may_set_owner' in operations:
-            owners = self.get_allowed_owners(req, ticket, this_action)
+            autocomplete = 'set_owner' not in this_action and \
+                           ticket_system.autocomplete_owner()
+            if autocomplete:
+                owners = None
+            else:
+                owners = self.get_allowed_owners(req, ticket, this_action)
 
             if 'set_owner' in operations:
                 default_owner = author
@@ -267,7 +272,9 @@ class ConfigurableTicketWorkflow(Component):
                 control.append(
                     tag_("to %(owner)s",
                          owner=tag.input(type='text', id=id, name=id,
-                                         value=owner)))
+                                         value=owner,
+                                         class_='trac-autocomplete-owner'
+                                                if autocomplete else None)))
                 if not exists or ticket_owner is None:
                     hints.append(_("The owner will be the specified user"))
                 else:
@@ -19,7 +19,7 @@
 import re
 
 from trac.api import IEnvironmentSetupParticipant
-from trac.attachment import IAttachmentChangeListener
+from trac.attachment import Attachment, IAttachmentChangeListener
 from trac.core import *
 from trac.config import *
 from trac.notification.api import (IEmailDecorator, INotificationFormatter,
@@ -30,8 +30,9 @@ from trac.notification.mail import (RecipientMatcher, create_message_id,
 from trac.notification.model import Subscription
 from trac.ticket.api import translation_deactivated
 from trac.ticket.model import Ticket, sort_tickets_by_priority
-from trac.util import lazy
-from trac.util.datefmt import format_date_or_datetime, get_timezone
+from trac.util import chunked, lazy
+from trac.util.datefmt import (format_date_or_datetime, from_utimestamp,
+                                get_timezone, to_utimestamp)
 from trac.util.text import (CRLF, exception_to_unicode, jinja2template,
                             shorten_line, text_width, wrap)
 from trac.util.translation import _
@@ -60,6 +61,14 @@ class TicketNotificationSystem(Component):
         pass
 
 
+def _to_utimestamp(dt):
+    return to_utimestamp(dt) if dt else None
+
+
+def _from_utimestamp(ts):
+    return from_utimestamp(ts) if ts is not None else None
+
+
 class TicketChangeEvent(NotificationEvent):
     """Represent a ticket change `NotificationEvent`."""
 
@@ -73,6 +82,46 @@ class TicketChangeEvent(NotificationEvent):
         self.changes = changes or {}
         self.attachment = attachment
 
+    def serialize(self):
+        ticket = self.target
+        values = dict((name, _to_utimestamp(value)
+                             if name in ticket.time_fields else value)
+                      for name, value in ticket.values.iteritems())
+        changes = None
+        if self.changes:
+            changes = dict(self.changes)
+            changes['date'] = _to_utimestamp(changes['date'])
+        attachment = None
+        if self.attachment:
+            attachment = {'filename': self.attachment.filename,
+                          'description': self.attachment.description,
+                          'author': self.attachment.author}
+        return {'category': self.category, 'id': ticket.id,
+                'values': values, 'time': _to_utimestamp(self.time),
+                'author': self.author, 'comment': self.comment,
+                'changes': changes, 'attachment': attachment}
+
+    @classmethod
+    def deserialize(cls, env, values):
+        ticket = Ticket(env, values['id'])
+        # Restore the values at the time of the event, the ticket may
+        # have been modified since then
+        for name, value in values['values'].iteritems():
+            if name in ticket.time_fields:
+                value = _from_utimestamp(value)
+            ticket.values[name] = value
+        changes = values['changes']
+        if changes:
+            changes['date'] = _from_utimestamp(changes['date'])
+        attachment = None
+        if values['attachment']:
+            attachment = Attachment(env, 'ticket', ticket.id)
+            for name, value in values['attachment'].iteritems():
+                setattr(attachment, name, value)
+        return cls(values['category'], ticket,
+                   _from_utimestamp(values['time']), values['author'],
+                   values['comment'], changes or {}, attachment)
+
 
 class BatchTicketChangeEvent(NotificationEvent):
     """Represent a ticket batch modify `NotificationEvent`."""
@@ -90,6 +139,18 @@ class BatchTicketChangeEvent(NotificationEvent):
             yield TicketChangeEvent('changed', model, self.time, self.author,
                                     self.comment)
 
+    def serialize(self):
+        return {'targets': list(self.target),
+                'time': _to_utimestamp(self.time), 'author': self.author,
+                'comment': self.comment, 'new_values': self.new_values,
+                'action': self.action}
+
+    @classmethod
+    def deserialize(cls, env, values):
+        return cls(values['targets'], _from_utimestamp(values['time']),
+                   values['author'], values['comment'],
+                   values['new_values'], values['action'])
+
 
 class TicketFormatter(Component):
     """Format `TicketChangeEvent` notifications."""
@@ -123,6 +184,9 @@ class TicketFormatter(Component):
         [TracNotification#Customizingthee-mailsubject TracNotification] page.
         """)
 
+    def __init__(self):
+        self._subject_templates = {}
+
     @lazy
     def ambiwidth(self):
         return 2 if self.ambiguous_char_width == 'double' else 1
@@ -339,7 +403,7 @@ class TicketFormatter(Component):
             'env': self.env,
         }
 
-        template = jinja2template(self.ticket_subject_template, text=True)
+        template = self._get_subject_template(self.ticket_subject_template)
         subj = template.render(**data).strip()
         if not is_newticket:
             subj = "Re: " + subj
@@ -348,7 +412,7 @@ class TicketFormatter(Component):
     def _format_subj_batchmodify(self, tickets):
         tickets_descr = ', '.join('#%s' % t for t in tickets)
 
-        template = jinja2template(self.batch_subject_template, text=True)
+        template = self._get_subject_template(self.batch_subject_template)
 
         prefix = self.config.get('notification', 'smtp_subject_prefix')
         if prefix == '__default__':
@@ -362,6 +426,15 @@ class TicketFormatter(Component):
         subj = template.render(**data).strip()
         return shorten_line(subj)
 
+    def _get_subject_template(self, source):
+        # Compiling the template is much slower than rendering it, and
+        # the subject is rendered for each message
+        template = self._subject_templates.get(source)
+        if template is None:
+            template = jinja2template(source, text=True)
+            self._subject_templates[source] = template
+        return template
+
     def _format_hdr(self, ticket):
         return '#%s: %s' % (ticket.id, wrap(ticket['summary'], self.COLS,
                                             linesep='\n',
@@ -531,22 +604,26 @@ class TicketFormatter(Component):
         set_header(message, 'Message-ID', msgid, charset)
 
 
-class TicketOwnerSubscriber(Component):
-    """Allows ticket owners to subscribe to their tickets."""
+class TicketChangeSubscriberBase(Component):
+    """Base class for the subscribers to ticket change events, matching
+    the users and addresses returned by `get_candidates`.
+
+    :since: 1.3.3
+    """
+
+    abstract = True
 
     implements(INotificationSubscriber)
 
     def matches(self, event):
-        owners = None
-        if _is_ticket_change_event(event):
-            owners = [event.target['owner']]
-            # Harvest previous owner
-            if 'fields' in event.changes and 'owner' in event.changes['fields']:
-                owners.append(event.changes['fields']['owner']['old'])
-        return _ticket_change_subscribers(self, owners)
+        return self.matches_events([event])
 
-    def description(self):
-        return _("Ticket that I own is created or modified")
+    def matches_events(self, events):
+        events = [event for event in events
+                  if _is_ticket_change_event(event)]
+        if not events:
+            return []
+        return _ticket_change_subscribers(self, self.get_candidates(events))
 
     def default_subscriptions(self):
         klass = self.__class__.__name__
@@ -555,104 +632,85 @@ class TicketOwnerSubscriber(Component):
     def requires_authentication(self):
         return True
 
+    def get_candidates(self, events):
+        """Return the users or addresses to notify for the given ticket
+        change events.
+        """
 
-class TicketUpdaterSubscriber(Component):
-    """Allows updaters to subscribe to their own updates."""
-
-    implements(INotificationSubscriber)
 
-    def matches(self, event):
-        updater = None
-        if _is_ticket_change_event(event):
-            updater = event.author
-        return _ticket_change_subscribers(self, updater)
+class TicketOwnerSubscriber(TicketChangeSubscriberBase):
+    """Allows ticket owners to subscribe to their tickets."""
 
     def description(self):
-        return _("I update a ticket")
+        return _("Ticket that I own is created or modified")
 
-    def default_subscriptions(self):
-        klass = self.__class__.__name__
-        return NotificationSystem(self.env).default_subscriptions(klass)
+    def get_candidates(self, events):
+        owners = set()
+        for event in events:
+            owners.add(event.target['owner'])
+            # Harvest previous owner
+            if 'fields' in event.changes and 'owner' in event.changes['fields']:
+                owners.add(event.changes['fields']['owner']['old'])
+        return owners
 
-    def requires_authentication(self):
-        return True
 
+class TicketUpdaterSubscriber(TicketChangeSubscriberBase):
+    """Allows updaters to subscribe to their own updates."""
 
-class TicketPreviousUpdatersSubscriber(Component):
-    """Allows subscribing to future changes simply by updating a ticket."""
+    def description(self):
+        return _("I update a ticket")
 
-    implements(INotificationSubscriber)
+    def get_candidates(self, events):
+        return set(event.author for event in events)
 
-    def matches(self, event):
-        updaters = None
-        if _is_ticket_change_event(event):
-            updaters = [author for author, in self.env.db_query("""
-                SELECT DISTINCT author FROM ticket_change
-                WHERE ticket=%s
-                """, (event.target.id,))
-                        if author != event.author]
-        return _ticket_change_subscribers(self, updaters)
+
+class TicketPreviousUpdatersSubscriber(TicketChangeSubscriberBase):
+    """Allows subscribing to future changes simply by updating a ticket."""
 
     def description(self):
         return _("Ticket that I previously updated is modified")
 
-    def default_subscriptions(self):
-        klass = self.__class__.__name__
-        return NotificationSystem(self.env).default_subscriptions(klass)
-
-    def requires_authentication(self):
-        return True
-
-
-class TicketReporterSubscriber(Component):
+    def get_candidates(self, events):
+        authors = dict((event.target.id, event.author) for event in events)
+        ids = sorted(authors)
+        updaters = set()
+        with self.env.db_query as db:
+            for chunk in chunked(ids):
+                updaters.update(author for id_, author in db("""
+                    SELECT DISTINCT ticket, author FROM ticket_change
+                    WHERE ticket IN (%s)
+                    """ % ','.join(('%s',) * len(chunk)), chunk)
+                    if author != authors[id_])
+        return updaters
+
+
+class TicketReporterSubscriber(TicketChangeSubscriberBase):
     """Allows the users to subscribe to tickets that they report."""
 
-    implements(INotificationSubscriber)
-
-    def matches(self, event):
-        reporter = None
-        if _is_ticket_change_event(event):
-            reporter = event.target['reporter']
-        return _ticket_change_subscribers(self, reporter)
-
     def description(self):
         return _("Ticket that I reported is modified")
 
-    def default_subscriptions(self):
-        klass = self.__class__.__name__
-        return NotificationSystem(self.env).default_subscriptions(klass)
-
-    def requires_authentication(self):
-        return True
+    def get_candidates(self, events):
+        return set(event.target['reporter'] for event in events)
 
 
-class CarbonCopySubscriber(Component):
+class CarbonCopySubscriber(TicketChangeSubscriberBase):
     """Carbon copy subscriber for cc ticket field."""
 
-    implements(INotificationSubscriber)
-
-    def matches(self, event):
-        cc_users = None
-        if _is_ticket_change_event(event):
-            # CC field is stored as comma-separated string. Parse to set.
-            chrome = Chrome(self.env)
-            to_set = lambda cc: set(chrome.cc_list(cc))
-            cc_users = to_set(event.target['cc'] or '')
-
-            # Harvest previous CC field
-            if 'fields' in event.changes and 'cc' in event.changes['fields']:
-                cc_users.update(to_set(event.changes['fields']['cc']['old']))
-        return _ticket_change_subscribers(self, cc_users)
-
     def description(self):
         return _("Ticket that I'm listed in the CC field is modified")
 
-    def default_subscriptions(self):
-        klass = self.__class__.__name__
-        return NotificationSystem(self.env).default_subscriptions(klass)
-
-    def requires_authentication(self):
-        return True
+    def get_candidates(self, events):
+        # CC field is stored as comma-separated string. Parse to set.
+        chrome = Chrome(self.env)
+        cc_users = set()
+        for event in events:
+            cc_users.update(chrome.cc_list(event.target['cc'] or ''))
+            # Harvest previous CC field
+            if 'fields' in event.changes and 'cc' in event.changes['fields']:
+                cc_users.update(
+                    chrome.cc_list(event.changes['fields']['cc']['old']))
+        return cc_users
 
 
 class TicketAttachmentNotifier(Component):
@@ -45,7 +45,8 @@ from trac.web.chrome import (INavigationContributor, Chrome,
                              add_ctxtnav, add_link, add_script,
                              add_script_data, add_stylesheet, add_warning,
                              web_context)
-from trac.wiki.api import IWikiSyntaxProvider
+from trac.web.feed import FeedCache
+from trac.wiki.api import IWikiSyntaxProvider, MacroCachePolicy
 from trac.wiki.formatter import MacroError
 from trac.wiki.macros import WikiMacroBase
 
@@ -984,6 +985,8 @@ class QueryModule(Component):
                      query.get_href(req.href, format=conversion.key),
                      conversion.name, conversion.out_mimetype, conversion.key)
 
+        if format == 'rss':
+            self._check_rss_modified(req, query)
         if format:
             filename = 'query' if format != 'rss' else None
             Mimeview(self.env).send_converted(req, 'trac.ticket.Query', query,
@@ -1194,21 +1197,37 @@ class QueryModule(Component):
         return iterate(), '%s;charset=utf-8' % mimetype
 
     def _export_rss(self, req, query):
+        data = self._get_rss_data(req, query)
+        output = Chrome(self.env).render_template(req, 'query.rss', data,
+                                                  {'content_type':
+                                                   'application/rss+xml',
+                                                   'iterable': True})
+        return output, 'application/rss+xml'
+
+    def _get_rss_data(self, req, query):
         context = web_context(req, 'query', absurls=True)
         query_href = query.get_href(context.href)
         if 'description' not in query.rows:
             query.rows.append('description')
         results = query.execute(req)
-        data = {
+        return {
             'context': context,
             'results': results,
             'query_href': query_href
         }
-        output = Chrome(self.env).render_template(req, 'query.rss', data,
-                                                  {'content_type':
-                                                   'application/rss+xml',
-                                                   'iterable': True})
-        return output, 'application/rss+xml'
+
+    def _check_rss_modified(self, req, query):
+        """Answer the conditional requests for the feed of the query, or
+        send the cached feed, before executing the query.
+        """
+        last_modified, count = \
+            TicketSystem(self.env).get_tickets_last_modified()
+        # The current hour accounts for the relative time constraints
+        hour = datetime_now(utc).replace(minute=0, second=0, microsecond=0)
+        feed = FeedCache(self.env)
+        key = feed.check(req, last_modified, [count, hour, query.to_string()])
+        if key:
+            feed.send(req, key, 'query.rss', self._get_rss_data(req, query))
 
     # IWikiSyntaxProvider methods
 
@@ -1302,6 +1321,16 @@ class TicketQueryMacro(WikiMacroBase):
 
     realm = TicketSystem.realm
 
+    def get_macro_cache_policy(self, name, content):
+        content = content or ''
+        if any(substitution in content
+               for substitution in Query.substitutions):
+            return None
+        # The relative dates of the time constraints follow the clock,
+        # and the ticket enums can change without ticket events.
+        ttl = 60 if 'time' in content else 3600
+        return MacroCachePolicy([self.realm, 'milestone'], ttl=ttl)
+
     @staticmethod
     def parse_args(content):
         """Parse macro arguments and translate them to a query string."""
@@ -28,7 +28,8 @@ from trac.resource import Resource, ResourceNotFound
 from trac.ticket.api import TicketSystem
 from trac.ticket.model import Report
 from trac.util import as_int, content_disposition
-from trac.util.datefmt import format_datetime, format_time, from_utimestamp
+from trac.util.datefmt import datetime_now, format_datetime, format_time, \
+                              from_utimestamp, utc
 from trac.util.html import tag
 from trac.util.presentation import Paginator
 from trac.util.text import (exception_to_unicode, quote_query_string,
@@ -39,6 +40,7 @@ from trac.web.chrome import (Chrome, INavigationContributor, add_ctxtnav,
                              add_link, add_notice, add_script_data,
                              add_stylesheet, add_warning, auth_link,
                              web_context)
+from trac.web.feed import FeedCache
 from trac.wiki import IWikiSyntaxProvider, WikiParser
 
 
@@ -89,6 +91,35 @@ def sql_skeleton(sql):
 
 _order_by_re = re.compile(r'ORDER\s+BY', re.MULTILINE)
 
+_from_clause_re = re.compile(r"""
+    \bFROM\b(.*?)
+    (?=\b(?:WHERE|GROUP|ORDER|HAVING|LIMIT|UNION|EXCEPT|INTERSECT)\b
+       |[();]|$)
+""", re.IGNORECASE | re.DOTALL | re.VERBOSE)
+
+_from_item_re = re.compile(r',|\bJOIN\b', re.IGNORECASE)
+
+
+def reads_only_ticket(sql):
+    """Return whether the tables read by an SQL query are all the
+    `ticket` table, which is erring on the side of `False`.
+
+    >>> reads_only_ticket('SELECT id FROM ticket t WHERE t.id IN '
+    ...                   '(SELECT id FROM "ticket")')
+    True
+    >>> reads_only_ticket('SELECT id FROM ticket t '
+    ...                   'LEFT JOIN enum p ON p.name = t.priority')
+    False
+    >>> reads_only_ticket('SELECT id FROM ticket, milestone')
+    False
+    """
+    for clause in _from_clause_re.findall(sql):
+        for item in _from_item_re.split(clause):
+            words = item.split(None, 1)
+            if not words or words[0].strip('"`').lower() != 'ticket':
+                return False
+    return True
+
 
 def split_sql(sql, clause_re, skel=None):
     """Split an SQL query according to a toplevel clause regexp.
@@ -425,6 +456,11 @@ class ReportModule(Component):
         data.update({'args': args, 'title': sub_vars(title, args),
                      'description': sub_vars(description or '', args)})
 
+        feed_key = None
+        if format == 'rss':
+            feed_key = self._check_rss_modified(req, title, description,
+                                                sql, args)
+
         try:
             res = self.execute_paginated_report(req, id, sql, args, limit,
                                                 offset)
@@ -610,6 +646,8 @@ class ReportModule(Component):
         if format == 'rss':
             data['context'] = web_context(req, report_resource,
                                           absurls=True)
+            if feed_key:
+                FeedCache(self.env).send(req, feed_key, 'report.rss', data)
             return 'report.rss', data, 'application/rss+xml'
         elif format == 'csv':
             filename = 'report_%s.csv' % id if id else 'report.csv'
@@ -927,6 +965,26 @@ class ReportModule(Component):
         req.write(data)
         raise RequestDone
 
+    def _check_rss_modified(self, req, title, description, sql, args):
+        """Answer the conditional requests for the feed of the report, or
+        send the cached feed, before executing the report.
+
+        The feed is only validated when the report only reads the
+        `ticket` table, whose changes are tracked by the last ticket
+        change time.
+
+        :return: the key for caching the feed, or `None`.
+        """
+        if not reads_only_ticket(sql):
+            return None
+        last_modified, count = \
+            TicketSystem(self.env).get_tickets_last_modified()
+        # The current hour accounts for the time-dependent SQL expressions
+        hour = datetime_now(utc).replace(minute=0, second=0, microsecond=0)
+        return FeedCache(self.env).check(req, last_modified,
+                                         [count, hour, title, description,
+                                          sql, sorted(args.iteritems())])
+
     def _send_sql(self, req, id, title, description, sql):
         req.perm(self.realm, id).require('REPORT_SQL_VIEW')
 
@@ -40,6 +40,7 @@ from trac.ticket.api import TicketSystem
 from trac.ticket.notification import BatchTicketChangeEvent
 from trac.ticket.model import Milestone, MilestoneCache, Ticket
 from trac.timeline.api import ITimelineEventProvider
+from trac.timeline.index import TimelineChangeTracker
 from trac.web.api import HTTPBadRequest, IRequestHandler, RequestDone
 from trac.web.chrome import (Chrome, INavigationContributor, accesskey,
                              add_link, add_notice, add_stylesheet, add_warning,
@@ -715,6 +716,15 @@ class MilestoneModule(Component):
                     req, milestone_realm, start, stop):
                 yield event
 
+    def get_timeline_last_modified(self, req, filters):
+        milestones = MilestoneCache(self.env).milestones.itervalues()
+        return max([completed for name, due, completed, description
+                    in milestones if completed] +
+                   [AttachmentModule(self.env).get_timeline_last_modified(
+                       req, Resource(self.realm)),
+                    TimelineChangeTracker(self.env)
+                    .get_last_changed(self.realm)])
+
     def render_timeline_event(self, context, field, event):
         milestone, description = event[3]
         if field == 'url':
@@ -1068,6 +1078,8 @@ class MilestoneModule(Component):
 
     def _format_link(self, formatter, ns, name, label):
         name, query, fragment = formatter.split_link(name)
+        if name:
+            formatter.add_link_target(self.realm, name)
         return self._render_link(formatter.context, name, label,
                                  query + fragment)
 
@@ -12,6 +12,7 @@
 # history and logs, available at http://trac.edgewall.org/log/.
 
 from datetime import timedelta
+import io
 
 from trac.perm import PermissionCache, PermissionSystem
 from trac.resource import Resource
@@ -20,6 +21,8 @@ from trac.ticket.api import TicketSystem
 from trac.ticket.model import Milestone, Ticket, Version
 from trac.ticket.test import insert_ticket
 from trac.util.datefmt import datetime_now, utc
+from trac.web.chrome import web_context
+from trac.wiki.formatter import Formatter
 
 import unittest
 
@@ -292,6 +295,39 @@ class TicketSystemTestCase(unittest.TestCase):
                           'milestone3', 'milestone4'],
                          updated_milestone_field['options'])
 
+    def test_get_ticket_fields_returns_copies(self):
+        """Modifying the returned fields doesn't alter the cached fields.
+        """
+        fields = self.ticket_system.get_ticket_fields()
+        milestone_field = fields.by_name('milestone')
+        milestone_field['label'] = 'Modified'
+        milestone_field['options'].append('milestone5')
+        fields.by_name('summary')['skip'] = True
+
+        updated_fields = self.ticket_system.get_ticket_fields()
+        updated_milestone_field = updated_fields.by_name('milestone')
+
+        self.assertEqual('Milestone', updated_milestone_field['label'])
+        self.assertEqual(['milestone1', 'milestone2',
+                          'milestone3', 'milestone4'],
+                         updated_milestone_field['options'])
+        self.assertNotIn('skip', updated_fields.by_name('summary'))
+        self.assertIsNot(fields, updated_fields)
+
+    def test_get_ticket_fields_reset(self):
+        """Localized fields are rebuilt when the cache is invalidated."""
+        fields = self.ticket_system.get_ticket_fields()
+        milestone = Milestone(self.env)
+        milestone.name = 'milestone5'
+        milestone.insert()
+
+        updated_fields = self.ticket_system.get_ticket_fields()
+
+        self.assertNotIn('milestone5',
+                         fields.by_name('milestone')['options'])
+        self.assertIn('milestone5',
+                      updated_fields.by_name('milestone')['options'])
+
     def test_resource_exists_valid_resource_id(self):
         insert_ticket(self.env)
         r1 = Resource('ticket', 1)
@@ -312,6 +348,30 @@ class TicketSystemTestCase(unittest.TestCase):
         self.assertFalse(self.ticket_system.resource_exists(r3))
         self.assertFalse(self.ticket_system.resource_exists(r4))
 
+    def test_prefetch_links(self):
+        """The tickets of the links are retrieved before formatting."""
+        insert_ticket(self.env, summary='The first', status='new')
+        insert_ticket(self.env, summary='The second', status='closed',
+                      resolution='fixed')
+        insert_ticket(self.env, summary='In code block')
+        formatter = Formatter(self.env, web_context(self.req))
+        out = io.StringIO()
+
+        formatter.format(u"#1, ticket:2#comment:1, [bug:5 five], !#2, "
+                         u"#1-2\n{{{\n#3\n}}}\n", out)
+
+        self.assertEqual({('ticket', 1): ('defect', 'The first', 'new',
+                                          None),
+                          ('ticket', 2): ('defect', 'The second', 'closed',
+                                          'fixed'),
+                          ('ticket', 5): None},
+                         formatter.link_cache)
+        html = out.getvalue()
+        self.assertIn('title="#1: defect: The first (new)"', html)
+        self.assertIn('title="#2: defect: The second (closed: fixed)"',
+                      html)
+        self.assertIn('<a class="missing ticket">five</a>', html)
+
 
 def test_suite():
     return unittest.makeSuite(TicketSystemTestCase)
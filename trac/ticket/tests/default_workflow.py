@@ -616,6 +616,49 @@ to <select id="action_reassign_reassign_owner"\
 <option value="user3">User D</option></select>\
 """, str(ctrl[1]))
 
+    def test_set_owner_autocomplete(self):
+        """Text field with auto-completion when there are more owners
+        than [ticket] restrict_owner_limit.
+        """
+        self.env.config.set('ticket', 'restrict_owner_limit', 2)
+
+        ctrl = self.ctlr.render_ticket_action_control(self.req1, self.ticket,
+                                                      'reassign')
+
+        self.assertEqual('reassign', ctrl[0])
+        self.assertNotIn('<select', str(ctrl[1]))
+        self.assertIn('<input class="trac-autocomplete-owner"', str(ctrl[1]))
+
+    def test_set_owner_below_limit(self):
+        """Drop-down menu when there are no more owners than
+        [ticket] restrict_owner_limit.
+        """
+        self.env.config.set('ticket', 'restrict_owner_limit', 3)
+
+        ctrl = self.ctlr.render_ticket_action_control(self.req1, self.ticket,
+                                                      'reassign')
+
+        self.assertEqual('reassign', ctrl[0])
+        self.assertIn('<select', str(ctrl[1]))
+
+    def test_find_allowed_owners(self):
+        """Allowed owners are matched on username and full name, with
+        fine-grained permission checks.
+        """
+        create_file(self.authz_file, """\
+[ticket:1]
+user4 = !TICKET_MODIFY
+""")
+        ts = TicketSystem(self.env)
+
+        self.assertEqual(['user1', 'user3', 'user4'],
+                         ts.find_allowed_owners('USER'))
+        self.assertEqual(['user1', 'user3'],
+                         ts.find_allowed_owners('user', self.ticket))
+        self.assertEqual(['user4'], ts.find_allowed_owners('b'))
+        self.assertEqual(['user1'], ts.find_allowed_owners('user', limit=1))
+        self.assertEqual([], ts.find_allowed_owners('user2'))
+
 
 class SetResolutionAttributeTestCase(unittest.TestCase):
 
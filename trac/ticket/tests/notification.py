@@ -25,6 +25,7 @@ from datetime import datetime, timedelta
 
 from trac.attachment import Attachment
 from trac.notification.api import NotificationSystem
+from trac.notification.model import Subscription
 from trac.test import EnvironmentStub, MockRequest, mkdtemp
 from trac.tests.notification import SMTP_TEST_PORT, SMTPThreadedServer, \
                                     parse_smtp_message
@@ -34,6 +35,7 @@ from trac.ticket.notification import (
 from trac.ticket.test import insert_ticket
 from trac.ticket.web_ui import TicketModule
 from trac.util.datefmt import datetime_now, utc
+from trac.web.session import DetachedSession
 
 MAXBODYWIDTH = 76
 smtpd = None
@@ -1523,6 +1525,20 @@ ${prefix} (${
         self.assertEqual('[TracTest] (new) #1: The summary',
                          headers['Subject'])
 
+    def test_format_subject_template_changed(self):
+        """The subject template can be changed once it has been used."""
+        ticket = self._insert_ticket()
+        notify_ticket_created(self.env, ticket)
+        self.env.config.set('notification', 'ticket_subject_template',
+                            self.custom_template)
+
+        notify_ticket_created(self.env, ticket)
+        message = smtpd.get_message()
+        headers, body = parse_smtp_message(message)
+
+        self.assertEqual('[TracTest] (new) #1: The summary',
+                         headers['Subject'])
+
     def test_format_subject_custom_template_changed_ticket(self):
         """Format subject with a custom template for a ticket with
         a changed property.
@@ -1738,6 +1754,38 @@ class BatchTicketNotificationTestCase(unittest.TestCase):
                       '%2C10%2C4%2C11%2C5%2C12%2C6%2C13%2C7%2C14%2C1%2C2%2C8'
                       '%2C9>', body)
 
+    def test_batchmod_notify_previous_updaters(self):
+        """The previous updaters of all the tickets and their subscription
+        rules are taken into account."""
+        for sid in ('joe', 'jim'):
+            session = DetachedSession(self.env, sid)
+            session['email'] = '%s@example.net' % sid
+            session.save()
+        Subscription.add(self.env, {
+            'sid': 'joe', 'authenticated': 1, 'distributor': 'email',
+            'format': None, 'adverb': 'never',
+            'class': 'TicketPreviousUpdatersSubscriber'})
+        when = datetime(2016, 8, 20, 12, 34, 56, 987654, utc)
+        for tktid, author in ((self.tktids[0], 'prev1@example.org'),
+                              (self.tktids[7], 'prev2@example.org'),
+                              (self.tktids[7], 'joe'),
+                              (self.tktids[9], 'jim')):
+            t = Ticket(self.env, tktid)
+            t.save_changes(author, 'comment', when=when)
+            when += timedelta(seconds=1)
+
+        event = BatchTicketChangeEvent(self.tktids, when,
+                                       'author@example.org', 'batch-modify',
+                                       {'milestone': 'milestone1'}, 'leave')
+        smtpd.cleanup()
+        NotificationSystem(self.env).notify(event)
+
+        self.assertEqual(['author@example.org', 'cc1@example.org',
+                          'cc2@example.org', 'jim@example.net',
+                          'prev1@example.org', 'prev2@example.org',
+                          'reporter@example.org'],
+                         sorted(smtpd.get_recipients()))
+
 
 def test_suite():
     suite = unittest.TestSuite()
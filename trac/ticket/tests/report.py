@@ -344,6 +344,42 @@ class ReportModuleTestCase(unittest.TestCase):
         self.assertIsNone(data['message'])
         self.assertEqual(1, data['numrows'])
 
+    def test_rss_feed_not_modified(self):
+        id_ = self._insert_report('Tickets', """
+            SELECT id AS ticket, summary FROM ticket ORDER BY id""", '')
+        insert_ticket(self.env, status='new', summary='Test 1')
+        def request_feed(**headers):
+            req = MockRequest(self.env, path_info='/report/%d' % id_,
+                              args={'format': 'rss'})
+            req.environ.update(headers)
+            self.assertTrue(self.report_module.match_request(req))
+            self.assertRaises(RequestDone,
+                              self.report_module.process_request, req)
+            return req
+
+        req = request_feed()
+        etag = req.headers_sent['ETag']
+        self.assertIn('Test 1', req.response_sent.getvalue())
+
+        req = request_feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual('304 Not Modified', req.status_sent[0])
+
+        insert_ticket(self.env, status='new', summary='Test 2')
+        req = request_feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertNotEqual(etag, req.headers_sent['ETag'])
+        self.assertIn('Test 2', req.response_sent.getvalue())
+
+    def test_rss_feed_reading_other_tables_is_not_validated(self):
+        insert_ticket(self.env, status='new', summary='Test 1')
+        req = MockRequest(self.env, path_info='/report/1',
+                          args={'format': 'rss'})
+        self.assertTrue(self.report_module.match_request(req))
+        template, data, metadata = self.report_module.process_request(req)
+
+        self.assertEqual('report.rss', template)
+        self.assertNotIn('ETag', req.headers_sent)
+        self.assertNotIn('Last-Modified', req.headers_sent)
+
 
 class ExecuteReportTestCase(unittest.TestCase):
 
@@ -16,7 +16,7 @@ import io
 import unittest
 
 from trac.core import Component, TracError, implements
-from trac.perm import PermissionCache, PermissionSystem
+from trac.perm import PermissionCache, PermissionError, PermissionSystem
 from trac.resource import Resource, ResourceNotFound
 from trac.test import EnvironmentStub, MockRequest
 from trac.ticket.api import ITicketActionController, TicketSystem
@@ -832,6 +832,147 @@ class TicketModuleTestCase(unittest.TestCase):
         self.assertIn(('DEBUG', "Side effect for MockTicketOperation"),
                       self.env.log_messages)
 
+    def test_allowed_owners_autocompletion(self):
+        self.env.config.set('ticket', 'restrict_owner', True)
+        self.env.insert_users([('user1', 'User One', ''),
+                               ('user2', 'User Two', ''),
+                               ('other', 'Someone', '')])
+        ps = PermissionSystem(self.env)
+        for user in ('user1', 'user2', 'other'):
+            ps.grant_permission(user, 'TICKET_MODIFY')
+        self._insert_ticket(summary='the summary', status='new')
+        req = self._create_owner_request('user1', 'reassign', 'user')
+
+        self.assertTrue(self.ticket_module.match_request(req))
+        with self.assertRaises(RequestDone):
+            self.ticket_module.process_request(req)
+
+        self.assertTrue(req.headers_sent['Content-Type']
+                        .startswith('application/json'))
+        self.assertEqual('[{"label":"User One","value":"user1"},'
+                         '{"label":"User Two","value":"user2"}]',
+                         req.response_sent.getvalue())
+
+    def test_allowed_owners_autocompletion_obfuscates_label(self):
+        self.env.config.set('ticket', 'restrict_owner', True)
+        self.env.config.set('trac', 'show_email_addresses', False)
+        self.env.insert_users([('user1', 'User One', ''),
+                               ('user2@example.org', '', '')])
+        ps = PermissionSystem(self.env)
+        for user in ('user1', 'user2@example.org'):
+            ps.grant_permission(user, 'TICKET_MODIFY')
+        self._insert_ticket(summary='the summary', status='new')
+        req = self._create_owner_request('user1', 'reassign', 'user2')
+
+        self.assertTrue(self.ticket_module.match_request(req))
+        with self.assertRaises(RequestDone):
+            self.ticket_module.process_request(req)
+
+        self.assertEqual('[{"label":"user2@\\u2026",'
+                         '"value":"user2@example.org"}]',
+                         req.response_sent.getvalue())
+
+    def test_allowed_owners_autocompletion_requires_action(self):
+        self.env.config.set('ticket', 'restrict_owner', True)
+        self.env.insert_users([('user1', 'User One', ''),
+                               ('user2', 'User Two', '')])
+        ps = PermissionSystem(self.env)
+        for user in ('user1', 'user2'):
+            ps.grant_permission(user, 'TICKET_MODIFY')
+        self._insert_ticket(summary='the summary', status='new')
+
+        for authname, action in (('anonymous', 'reassign'),
+                                 ('user2', 'resolve'),
+                                 ('user2', None)):
+            req = self._create_owner_request(authname, action, 'user')
+            self.assertTrue(self.ticket_module.match_request(req))
+            self.assertRaises(PermissionError,
+                              self.ticket_module.process_request, req)
+
+    def _create_owner_request(self, authname, action, term):
+        args = {'owner_term': term}
+        if action:
+            args['owner_action'] = action
+        req = MockRequest(self.env, authname=authname, method='GET',
+                          path_info='/ticket/1', args=args)
+        req.environ['HTTP_X_REQUESTED_WITH'] = 'XMLHttpRequest'
+        return req
+
+    def _insert_ticket_with_comments(self, count):
+        ticket = self._insert_ticket(summary='the summary')
+        when = ticket['time']
+        for idx in range(count):
+            when += timedelta(seconds=1)
+            ticket.save_changes('user', 'Comment %d' % (idx + 1), when)
+        return ticket
+
+    def _render_ticket_page(self, **args):
+        args['id'] = '1'
+        req = MockRequest(self.env, method='GET', path_info='/ticket/1',
+                          args=args)
+        self.assertTrue(self.ticket_module.match_request(req))
+        template, data = self.ticket_module.process_request(req)
+        content = Chrome(self.env).render_fragment(req, template, data)
+        return data, content
+
+    def test_changelog_page_size_disabled(self):
+        self._insert_ticket_with_comments(5)
+
+        data, content = self._render_ticket_page()
+
+        self.assertEqual(5, len(data['changes']))
+        self.assertEqual(0, data['changes_start'])
+        self.assertIn('id="comment:1"', content)
+        self.assertNotIn('trac-older-changes', content)
+
+    def test_changelog_page_size_renders_recent_changes(self):
+        self.env.config.set('ticket', 'changelog_page_size', 2)
+        self._insert_ticket_with_comments(5)
+
+        data, content = self._render_ticket_page()
+
+        self.assertEqual(5, len(data['changes']))
+        self.assertEqual(3, data['changes_start'])
+        self.assertIn('id="trac-older-changes"', content)
+        self.assertIn('data-stop="3"', content)
+        self.assertNotIn('id="comment:3"', content)
+        self.assertIn('id="comment:4"', content)
+        self.assertIn('id="comment:5"', content)
+
+    def test_changelog_page_size_includes_replied_comment(self):
+        self.env.config.set('ticket', 'changelog_page_size', 2)
+        self._insert_ticket_with_comments(5)
+
+        data, content = self._render_ticket_page(replyto='2')
+
+        self.assertEqual(1, data['changes_start'])
+        self.assertNotIn('id="comment:1"', content)
+        self.assertIn('id="comment:2"', content)
+
+    def test_changelog_page_size_changes_start_argument(self):
+        self.env.config.set('ticket', 'changelog_page_size', 2)
+        self._insert_ticket_with_comments(5)
+
+        data, content = self._render_ticket_page(changes_start='0')
+
+        self.assertEqual(0, data['changes_start'])
+        self.assertIn('id="comment:1"', content)
+        self.assertNotIn('trac-older-changes', content)
+
+    def test_changelog_action_renders_range(self):
+        self.env.config.set('ticket', 'changelog_page_size', 2)
+        self._insert_ticket_with_comments(5)
+
+        data, content = self._render_ticket_page(action='changelog',
+                                                 start='1', stop='3')
+
+        self.assertEqual(1, data['changes_start'])
+        self.assertEqual(3, data['changes_stop'])
+        self.assertNotIn('id="comment:1"', content)
+        self.assertIn('id="comment:2"', content)
+        self.assertIn('id="comment:3"', content)
+        self.assertNotIn('id="comment:4"', content)
+
 
 class CustomFieldMaxSizeTestCase(unittest.TestCase):
     """Tests for [ticket-custom] max_size attribute."""
@@ -16,27 +16,32 @@
 
 import csv
 from datetime import datetime
+from functools import partial
 import io
 import pkg_resources
 import re
 
 from trac.attachment import AttachmentModule
-from trac.config import BoolOption, Option
+from trac.config import BoolOption, IntOption, Option
 from trac.core import *
 from trac.mimeview.api import Mimeview, IContentConverter
 from trac.notification.api import NotificationSystem
-from trac.perm import IPermissionPolicy
+from trac.perm import IPermissionPolicy, PermissionError
 from trac.resource import (
     Resource, ResourceNotFound, get_resource_url, render_resource_link,
     get_resource_shortname
 )
-from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search import ISearchSource, search_result_key, search_to_sql, \
+                        shorten_result, sorted_search_results
+from trac.search.index import SearchIndex
 from trac.ticket import model
 from trac.ticket.api import TicketSystem, ITicketManipulator
+from trac.ticket.default_workflow import ConfigurableTicketWorkflow
 from trac.ticket.notification import TicketChangeEvent
 from trac.ticket.roadmap import group_milestones
 from trac.timeline.api import ITimelineEventProvider
-from trac.util import as_bool, as_int, get_reporter_id, lazy
+from trac.timeline.index import TimelineChangeTracker
+from trac.util import as_bool, as_int, chunked, get_reporter_id, lazy
 from trac.util.datefmt import (
     datetime_now, format_datetime, format_date_or_datetime, from_utimestamp,
     get_date_format_hint, get_datetime_format_hint, parse_date, to_utimestamp,
@@ -46,7 +51,7 @@ from trac.util.html import Markup, tag, to_fragment
 from trac.util.text import (
     exception_to_unicode, empty, is_obfuscated, shorten_line
 )
-from trac.util.presentation import separated
+from trac.util.presentation import separated, to_json
 from trac.util.translation import _, tag_, tagn_, N_, ngettext
 from trac.versioncontrol.diff import get_diff_options, diff_blocks
 from trac.web.api import IRequestHandler, arg_list_to_args, parse_arg_list
@@ -107,6 +112,12 @@ class TicketModule(Component):
             [TracQuery#UsingTracLinks Trac links].
             """)
 
+    changelog_page_size = IntOption('ticket', 'changelog_page_size', 0,
+        """Number of most recent changes rendered with the ticket page.
+        Older changes are fetched on demand, which reduces the rendering
+        time for tickets with a long change history. When set to 0, all
+        the changes are rendered. (''since 1.3.3'')""")
+
     ticket_path_re = re.compile(r'/ticket/([0-9]+)$')
 
     def __init__(self):
@@ -200,44 +211,59 @@ class TicketModule(Component):
         if 'ticket' not in filters:
             return
         ticket_realm = Resource(self.realm)
+        matches = SearchIndex(self.env).search(self.realm, terms)
         with self.env.db_query as db:
-            sql, args = search_to_sql(db, ['summary', 'keywords',
-                                           'description', 'reporter', 'cc',
-                                           db.cast('id', 'text')], terms)
-            sql2, args2 = search_to_sql(db, ['newvalue'], terms)
-            sql3, args3 = search_to_sql(db, ['value'], terms)
-            ticketsystem = TicketSystem(self.env)
-            for summary, desc, author, type, tid, ts, status, resolution in \
-                    db("""SELECT summary, description, reporter, type, id,
-                                 time, status, resolution
-                          FROM ticket
-                          WHERE id IN (
-                              SELECT id FROM ticket WHERE %s
-                            UNION
-                              SELECT ticket FROM ticket_change
-                              WHERE field='comment' AND %s
-                            UNION
-                              SELECT ticket FROM ticket_custom WHERE %s
-                          )
-                          """ % (sql, sql2, sql3),
-                          args + args2 + args3):
-                t = ticket_realm(id=tid)
-                if 'TICKET_VIEW' in req.perm(t):
-                    yield (req.href.ticket(tid),
-                           tag_("%(title)s: %(message)s",
-                                title=tag.span(
-                                    get_resource_shortname(self.env, t),
-                                    class_=status),
-                                message=ticketsystem.format_summary(
-                                    summary, status, resolution, type)),
-                           from_utimestamp(ts), author,
-                           shorten_result(desc, terms))
+            if matches is None:
+                where, args = self._get_search_condition(db, terms)
+                rows = db(self._search_query % where, args)
+            else:
+                rows = []
+                for ids in chunked([int(id_) for id_ in matches]):
+                    rows.extend(db(self._search_query % 'id IN (%s)'
+                                   % ','.join(['%s'] * len(ids)), ids))
+            for row in rows:
+                result = self._make_search_result(req, terms, matches, row)
+                if result is not None:
+                    yield result
 
         # Attachments
         for result in AttachmentModule(self.env).get_search_results(
             req, ticket_realm, terms):
             yield result
 
+    def get_sorted_search_results(self, req, terms, filters, limit):
+        if 'ticket' not in filters:
+            return [], 0
+        matches = SearchIndex(self.env).search(self.realm, terms)
+        with self.env.db_query as db:
+            if matches is None:
+                where, args = self._get_search_condition(db, terms)
+                count = db("SELECT COUNT(*) FROM ticket WHERE " + where,
+                           args)[0][0]
+                def fetch(offset, size):
+                    return db(self._search_query % where +
+                              " ORDER BY time DESC LIMIT %d OFFSET %d"
+                              % (size, offset), args)
+            else:
+                ids = sorted(matches, key=matches.get, reverse=True)
+                count = len(ids)
+                def fetch(offset, size):
+                    chunk = [int(id_) for id_ in ids[offset:offset + size]]
+                    return db(self._search_query % 'id IN (%s)'
+                              % ','.join(['%s'] * len(chunk)),
+                              chunk) if chunk else []
+            results = sorted_search_results(
+                fetch, partial(self._make_search_result, req, terms, matches),
+                limit)
+
+        # Attachments
+        attachments, attachments_count = \
+            AttachmentModule(self.env).get_sorted_search_results(
+                req, Resource(self.realm), terms, limit)
+        results.extend(attachments)
+        results.sort(key=search_result_key, reverse=True)
+        return results[:limit], count + attachments_count
+
     # ITimelineEventProvider methods
 
     def get_timeline_filters(self, req):
@@ -379,6 +405,17 @@ class TicketModule(Component):
                     req, ticket_realm, start, stop):
                     yield event
 
+    def get_timeline_last_modified(self, req, filters):
+        for ts, in self.env.db_query("SELECT MAX(changetime) FROM ticket"):
+            last_modified = max(from_utimestamp(ts),
+                                TimelineChangeTracker(self.env)
+                                .get_last_changed(self.realm))
+        if 'ticket_details' in filters:
+            last_modified = max(last_modified, AttachmentModule(self.env)
+                                .get_timeline_last_modified(
+                                    req, Resource(self.realm)))
+        return last_modified
+
     def render_timeline_event(self, context, field, event):
         kind = event[0]
         if kind == 'batchmodify':
@@ -440,6 +477,40 @@ class TicketModule(Component):
 
     # Internal methods
 
+    _search_query = """
+        SELECT summary, description, reporter, type, id, time, status,
+               resolution
+        FROM ticket WHERE %s"""
+
+    def _get_search_condition(self, db, terms):
+        sql, args = search_to_sql(db, ['summary', 'keywords', 'description',
+                                       'reporter', 'cc',
+                                       db.cast('id', 'text')], terms)
+        sql2, args2 = search_to_sql(db, ['newvalue'], terms)
+        sql3, args3 = search_to_sql(db, ['value'], terms)
+        return """id IN (
+                      SELECT id FROM ticket WHERE %s
+                    UNION
+                      SELECT ticket FROM ticket_change
+                      WHERE field='comment' AND %s
+                    UNION
+                      SELECT ticket FROM ticket_custom WHERE %s
+                  )""" % (sql, sql2, sql3), args + args2 + args3
+
+    def _make_search_result(self, req, terms, matches, row):
+        summary, desc, author, type, tid, ts, status, resolution = row
+        t = Resource(self.realm, tid)
+        if 'TICKET_VIEW' in req.perm(t):
+            score = () if matches is None else (matches[unicode(tid)],)
+            return (req.href.ticket(tid),
+                    tag_("%(title)s: %(message)s",
+                         title=tag.span(get_resource_shortname(self.env, t),
+                                        class_=status),
+                         message=TicketSystem(self.env).format_summary(
+                             summary, status, resolution, type)),
+                    from_utimestamp(ts), author,
+                    shorten_result(desc, terms)) + score
+
     def _get_action_controls(self, req, ticket):
         # action_controls is an ordered list of "renders" tuples, where
         # renders is a list of (action_key, label, widgets, hints)
@@ -484,6 +555,9 @@ class TicketModule(Component):
         req.perm(self.realm).require('TICKET_CREATE')
         ticket = model.Ticket(self.env)
 
+        if req.is_xhr and 'owner_term' in req.args:
+            self._send_allowed_owners(req, ticket)
+
         plain_fields = True  # support for /newticket?version=0.11 GETs
         field_reporter = 'reporter'
 
@@ -585,6 +659,10 @@ class TicketModule(Component):
 
         req.perm(self.realm, id, version).require('TICKET_VIEW')
         ticket = model.Ticket(self.env, id, version=version)
+
+        if req.is_xhr and 'owner_term' in req.args:
+            self._send_allowed_owners(req, ticket)
+
         action = req.args.get('action', ('history' in req.args and 'history' or
                                          'view'))
 
@@ -609,6 +687,8 @@ class TicketModule(Component):
             req.args.require('cnum')
             cnum = req.args.getint('cnum')
             return self._render_comment_diff(req, ticket, data, cnum)
+        elif action == 'changelog':
+            return self._render_changelog(req, ticket, data)
         elif 'preview_comment' in req.args:
             field_changes = {}
             data.update({'action': None,
@@ -796,6 +876,66 @@ class TicketModule(Component):
 
         return 'ticket.html', data
 
+    def _render_changelog(self, req, ticket, data):
+        """Render the range of changes given by the `start` and `stop`
+        request arguments, as a fragment of the change history.
+        """
+        data.update({'action': None,
+                     'reassign_owner': req.authname,
+                     'resolve_resolution': None,
+                     'start_time': ticket['changetime'],
+                     'cnum_edit': None, 'cnum_hist': None, 'cversion': None})
+        self._insert_ticket_data(req, ticket, data,
+                                 get_reporter_id(req, 'author'), {})
+        data.update({'changes_start': req.args.getint('start', 0, min=0),
+                     'changes_stop': req.args.getint('stop', None, min=0)})
+        return 'ticket_changelog.html', data
+
+    def _get_changes_start(self, req, changes):
+        """Return the index of the first change rendered with the page.
+
+        Only the `[ticket] changelog_page_size` most recent changes are
+        rendered, unless the change being replied to, edited or whose
+        history is shown is older.
+        """
+        page_size = self.changelog_page_size
+        if page_size <= 0:
+            return 0
+        start = req.args.as_int('changes_start',
+                                max(0, len(changes) - page_size),
+                                min=0, max=len(changes))
+        cnums = {req.args.get(name)
+                 for name in ('replyto', 'cnum_edit', 'cnum_hist')}
+        for idx, change in enumerate(changes[:start]):
+            if 'cnum' in change and str(change['cnum']) in cnums:
+                return idx
+        return start
+
+    def _send_allowed_owners(self, req, ticket):
+        """Send the permitted owners matching the `owner_term` request
+        argument, for the auto-completion of the owner field of the
+        `owner_action` workflow action.
+        """
+        action = req.args.get('owner_action')
+        ticket_system = TicketSystem(self.env)
+        workflow = self.env[ConfigurableTicketWorkflow]
+        operations = workflow.actions.get(action, {}).get('operations', ()) \
+                     if workflow else ()
+        if 'set_owner' not in operations and \
+                'may_set_owner' not in operations or \
+                action not in ticket_system.get_available_actions(req,
+                                                                  ticket):
+            raise PermissionError(msg=_('The action "%(name)s" is not '
+                                        'available.', name=action))
+        chrome = Chrome(self.env)
+        owners = ticket_system.find_allowed_owners(
+            req.args.get('owner_term', ''), ticket, limit=20)
+        content = to_json([{'label': chrome.format_author(req, owner,
+                                                          ticket.resource),
+                            'value': owner}
+                           for owner in owners])
+        req.send(content, 'application/json', 200)
+
     def _get_prefs(self, req):
         return {'comments_order': req.session.get('ticket_comments_order',
                                                   'oldest'),
@@ -1731,6 +1871,7 @@ class TicketModule(Component):
             'context': context, 'conflicts': conflicts,
             'fields': fields, 'fields_map': fields_map,
             'changes': changes, 'replies': replies,
+            'changes_start': self._get_changes_start(req, changes),
             'attachments': AttachmentModule(self.env).attachment_data(context),
             'action_controls': action_controls, 'action': selected_action,
             'change_preview': change_preview, 'closetime': closetime,
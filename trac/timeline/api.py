@@ -54,6 +54,18 @@ class ITimelineEventProvider(Interface):
         of the following form: `(kind, date, author, data, provider)`.
         """
 
+    def get_timeline_last_modified(req, filters):
+        """Return the time of the last change of the events provided for
+        the enabled `filters`, or `None` if there are no events.
+
+        This method is optional. The timeline feed is only validated by
+        the time of the last change, for answering the conditional
+        requests of the feed readers, if all the providers of the
+        enabled filters implement it.
+
+        :since: 1.3.3
+        """
+
     def render_timeline_event(context, field, event):
         """Display the title of the event in the given context.
 
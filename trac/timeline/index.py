@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.admin import IAdminCommandProvider
+from trac.attachment import IAttachmentChangeListener
+from trac.config import BoolOption
+from trac.core import Component, implements
+from trac.ticket.api import IMilestoneChangeListener, ITicketChangeListener
+from trac.util.datefmt import datetime_now, from_utimestamp, to_utimestamp, \
+                              utc
+from trac.util.text import printout
+from trac.util.translation import _
+from trac.versioncontrol.api import IRepositoryChangeListener, \
+                                    RepositoryManager
+from trac.wiki.api import IWikiChangeListener
+
+__all__ = ['TimelineChangeTracker', 'TimelineEventIndex']
+
+
+# Timeline filters of the attachments, by realm of the parent resource
+_attachment_filters = {'ticket': 'ticket_details', 'wiki': 'wiki',
+                       'milestone': 'milestone'}
+
+
+def _attachment_id(realm, id_, filename):
+    return u'%s:%s:%s' % (realm, id_, filename)
+
+
+class TimelineEventIndex(Component):
+    """Maintain the `timeline_event` table, an index of the time, author
+    and timeline filter of the ticket, wiki, milestone, attachment and
+    changeset events.
+
+    The index is used by the timeline for narrowing the period of time
+    for which the event providers are queried, when a maximum number
+    of events is requested, e.g. for the RSS feed. The providers still
+    produce the events, so an event missing from the index only makes
+    the period wider than needed. The index however also holds the
+    events which the providers don't show to the user, e.g. for lack
+    of permission, so the timeline gathers again the whole period of
+    time when the narrowed one holds less events than requested.
+    """
+
+    implements(IAdminCommandProvider, IAttachmentChangeListener,
+               IMilestoneChangeListener, IRepositoryChangeListener,
+               ITicketChangeListener, IWikiChangeListener)
+
+    enabled = BoolOption('timeline', 'use_event_index', 'false',
+        """Maintain an index of the timeline events in the database, and
+        use it for retrieving a limited number of events, as done for
+        the RSS feed, without querying the whole period of time. The
+        index of the existing events is built by
+        `trac-admin $ENV timeline reindex`. (''since 1.3.3'')""")
+
+    # Public methods
+
+    def get_start(self, start, stop, filters, limit, include=None,
+                  exclude=None):
+        """Return the time of the `limit`-th newest event in the given
+        period of time, or `start` if there are less events.
+
+        :param filters: the enabled timeline filters.
+        :param include: lowercased authors to include, if not empty.
+        :param exclude: lowercased authors to exclude.
+        """
+        if not self.enabled or not limit or not filters:
+            return start
+        with self.env.db_query as db:
+            filters = list(filters)
+            filter_cond = ['filter IN (%s)' % ','.join(['%s'] * len(filters))]
+            args = [to_utimestamp(start), to_utimestamp(stop)] + filters
+            # The changesets are only indexed by `repo-<reponame>`: the
+            # `changeset` filter stands for all the repositories when
+            # none of them is selected individually.
+            if 'changeset' in filters and \
+                    not any(f.startswith('repo-') for f in filters):
+                filter_cond.append('filter %s' % db.like())
+                args.append(db.like_escape('repo-') + '%')
+            author_cond = ''
+            if include:
+                author_cond += ' AND LOWER(author) IN (%s)' \
+                               % ','.join(['%s'] * len(include))
+                args.extend(include)
+            if exclude:
+                author_cond += ' AND LOWER(author) NOT IN (%s)' \
+                               % ','.join(['%s'] * len(exclude))
+                args.extend(exclude)
+            for ts, in db("""
+                    SELECT time FROM timeline_event
+                    WHERE time>=%%s AND time<=%%s AND (%s)%s
+                    ORDER BY time DESC LIMIT 1 OFFSET %d
+                    """ % (' OR '.join(filter_cond), author_cond,
+                           limit - 1), args):
+                return from_utimestamp(ts)
+        return start
+
+    def reindex(self):
+        """Rebuild the index from the tickets, wiki pages, milestones,
+        attachments and cached repositories.
+
+        :return: the number of indexed events.
+        """
+        rows = []
+        with self.env.db_transaction as db:
+            db("DELETE FROM timeline_event")
+            for id_, ts, reporter in db("""
+                    SELECT id, time, reporter FROM ticket"""):
+                rows.append((ts, 'ticket', unicode(id_), reporter,
+                             'newticket', 'ticket'))
+            rows.extend(self._get_ticket_changes(db))
+            for name, ts, author in db("""
+                    SELECT name, time, author FROM wiki"""):
+                rows.append((ts, 'wiki', name, author, 'wiki', 'wiki'))
+            for name, completed in db("""
+                    SELECT name, completed FROM milestone
+                    WHERE completed IS NOT NULL AND completed>0"""):
+                rows.append((completed, 'milestone', name, '', 'milestone',
+                             'milestone'))
+            for type_, id_, filename, ts, author in db("""
+                    SELECT type, id, filename, time, author
+                    FROM attachment"""):
+                rows.append((ts, 'attachment',
+                             _attachment_id(type_, id_, filename), author,
+                             'attachment',
+                             _attachment_filters.get(type_, type_)))
+            reponames = dict((info['id'], reponame) for reponame, info
+                             in RepositoryManager(self.env)
+                                .get_all_repositories().iteritems())
+            for repos, rev, ts, author in db("""
+                    SELECT repos, rev, time, author FROM revision"""):
+                if repos in reponames:
+                    rows.append((ts, 'changeset', rev, author, 'changeset',
+                                 'repo-' + reponames[repos]))
+            self._insert(db, rows)
+        return len(rows)
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('timeline reindex', '',
+               """Rebuild the index of the timeline events
+
+               The index is used when [timeline] use_event_index is
+               enabled.""",
+               None, self._do_reindex)
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        if self.enabled:
+            with self.env.db_transaction as db:
+                self._insert(db, [(to_utimestamp(ticket['time']), 'ticket',
+                                   unicode(ticket.id), ticket['reporter'],
+                                   'newticket', 'ticket')])
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        if self.enabled:
+            if 'status' in old_values and \
+                    ticket['status'] in ('closed', 'reopened'):
+                kind = ticket['status'] + 'ticket'
+                filter_ = 'ticket'
+            else:
+                kind = 'editedticket'
+                filter_ = 'ticket_details'
+            with self.env.db_transaction as db:
+                self._insert(db, [(to_utimestamp(ticket['changetime']),
+                                   'ticket', unicode(ticket.id), author,
+                                   kind, filter_)])
+
+    def ticket_deleted(self, ticket):
+        if self.enabled:
+            self.env.db_transaction("""
+                DELETE FROM timeline_event
+                WHERE realm='ticket' AND resource=%s
+                """, (unicode(ticket.id),))
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        pass
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        if self.enabled:
+            self.env.db_transaction("""
+                DELETE FROM timeline_event
+                WHERE realm='ticket' AND resource=%s AND time=%s
+                """, (unicode(ticket.id), to_utimestamp(cdate)))
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        self._update_milestone(milestone, milestone.name)
+
+    def milestone_changed(self, milestone, old_values):
+        self._update_milestone(milestone,
+                               old_values.get('name', milestone.name))
+
+    def milestone_deleted(self, milestone):
+        self._update_milestone(None, milestone.name)
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self._update_wiki_page(page.name)
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        self._update_wiki_page(page.name)
+
+    def wiki_page_deleted(self, page):
+        self._update_wiki_page(page.name)
+
+    def wiki_page_version_deleted(self, page):
+        self._update_wiki_page(page.name)
+
+    def wiki_page_renamed(self, page, old_name):
+        if self.enabled:
+            self.env.db_transaction("""
+                UPDATE timeline_event SET resource=%s
+                WHERE realm='wiki' AND resource=%s
+                """, (page.name, old_name))
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        if self.enabled:
+            with self.env.db_transaction as db:
+                self._insert(db, [(to_utimestamp(attachment.date),
+                                   'attachment',
+                                   _attachment_id(attachment.parent_realm,
+                                                  attachment.parent_id,
+                                                  attachment.filename),
+                                   attachment.author, 'attachment',
+                                   _attachment_filters.get(
+                                       attachment.parent_realm,
+                                       attachment.parent_realm))])
+
+    def attachment_deleted(self, attachment):
+        if self.enabled:
+            self.env.db_transaction("""
+                DELETE FROM timeline_event
+                WHERE realm='attachment' AND resource=%s
+                """, (_attachment_id(attachment.parent_realm,
+                                     attachment.parent_id,
+                                     attachment.filename),))
+
+    def attachment_moved(self, attachment, old_parent_realm, old_parent_id,
+                         old_filename):
+        if self.enabled:
+            self.env.db_transaction("""
+                UPDATE timeline_event SET resource=%s, filter=%s
+                WHERE realm='attachment' AND resource=%s
+                """, (_attachment_id(attachment.parent_realm,
+                                     attachment.parent_id,
+                                     attachment.filename),
+                      _attachment_filters.get(attachment.parent_realm,
+                                              attachment.parent_realm),
+                      _attachment_id(old_parent_realm, old_parent_id,
+                                     old_filename)))
+
+    # IRepositoryChangeListener methods
+
+    def changeset_added(self, repos, changeset):
+        if self.enabled:
+            with self.env.db_transaction as db:
+                self._insert(db, [(to_utimestamp(changeset.date),
+                                   'changeset', unicode(changeset.rev),
+                                   changeset.author, 'changeset',
+                                   'repo-' + repos.reponame)])
+
+    def changeset_modified(self, repos, changeset, old_changeset):
+        if self.enabled:
+            self.env.db_transaction("""
+                UPDATE timeline_event SET time=%s, author=%s
+                WHERE realm='changeset' AND resource=%s AND filter=%s
+                """, (to_utimestamp(changeset.date), changeset.author,
+                      unicode(changeset.rev), 'repo-' + repos.reponame))
+
+    # Internal methods
+
+    def _insert(self, db, rows):
+        db.executemany("""
+            INSERT INTO timeline_event (time, realm, resource, author, kind,
+                                        filter)
+            VALUES (%s,%s,%s,%s,%s,%s)
+            """, rows)
+
+    def _get_ticket_changes(self, db):
+        # One event per ticket change, which is a closing or reopening
+        # if the status changed to closed or reopened.
+        changes = {}
+        for id_, ts, author, field, newvalue in db("""
+                SELECT ticket, time, author, field, newvalue
+                FROM ticket_change"""):
+            key = (id_, ts)
+            if key not in changes:
+                changes[key] = [author, 'editedticket', 'ticket_details']
+            change = changes[key]
+            if field == 'comment':
+                change[0] = author
+            elif field == 'status' and newvalue in ('closed', 'reopened'):
+                change[1:] = [newvalue + 'ticket', 'ticket']
+        return [(ts, 'ticket', unicode(id_), author, kind, filter_)
+                for (id_, ts), (author, kind, filter_)
+                in changes.iteritems()]
+
+    def _update_milestone(self, milestone, old_name):
+        if self.enabled:
+            with self.env.db_transaction as db:
+                db("""
+                    DELETE FROM timeline_event
+                    WHERE realm='milestone' AND resource=%s
+                    """, (old_name,))
+                if milestone is not None and milestone.completed:
+                    self._insert(db, [(to_utimestamp(milestone.completed),
+                                       'milestone', milestone.name, '',
+                                       'milestone', 'milestone')])
+
+    def _update_wiki_page(self, name):
+        if self.enabled:
+            with self.env.db_transaction as db:
+                db("""
+                    DELETE FROM timeline_event
+                    WHERE realm='wiki' AND resource=%s
+                    """, (name,))
+                self._insert(db, [(ts, 'wiki', name, author, 'wiki', 'wiki')
+                                  for ts, author in db("""
+                                    SELECT time, author FROM wiki
+                                    WHERE name=%s""", (name,))])
+
+    def _do_reindex(self):
+        count = self.reindex()
+        printout(_("%(count)d timeline events indexed", count=count))
+
+
+class TimelineChangeTracker(Component):
+    """Keep the time of the last changes of the wiki pages, tickets,
+    milestones and their attachments which aren't told by the time of
+    the newest events, e.g. deletions, renames and comment edits.
+
+    The event providers use it for validating the timeline feed in
+    `ITimelineEventProvider.get_timeline_last_modified`.
+
+    :since: 1.3.3
+    """
+
+    implements(IAttachmentChangeListener, IMilestoneChangeListener,
+               ITicketChangeListener, IWikiChangeListener)
+
+    # Public methods
+
+    def get_last_changed(self, realm):
+        """Return the time of the last change of the events of the
+        resources of `realm` and of their attachments which isn't told
+        by the time of the events.
+        """
+        for value, in self.env.db_query("""
+                SELECT value FROM system WHERE name=%s
+                """, (self._key(realm),)):
+            return from_utimestamp(int(value))
+        return from_utimestamp(0)
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        pass
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        pass
+
+    def ticket_deleted(self, ticket):
+        self._changed('ticket')
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        self._changed('ticket')
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        self._changed('ticket')
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        self._changed('milestone')
+
+    def milestone_changed(self, milestone, old_values):
+        self._changed('milestone')
+
+    def milestone_deleted(self, milestone):
+        self._changed('milestone')
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        pass
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        pass
+
+    def wiki_page_deleted(self, page):
+        self._changed('wiki')
+
+    def wiki_page_version_deleted(self, page):
+        self._changed('wiki')
+
+    def wiki_page_renamed(self, page, old_name):
+        self._changed('wiki')
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        self._changed('wiki')
+
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        pass
+
+    def attachment_deleted(self, attachment):
+        self._changed(attachment.parent_realm)
+
+    def attachment_moved(self, attachment, old_parent_realm, old_parent_id,
+                         old_filename):
+        self._changed(old_parent_realm)
+        self._changed(attachment.parent_realm)
+
+    # Internal methods
+
+    def _key(self, realm):
+        return 'timeline_changed:' + realm
+
+    def _changed(self, realm):
+        key = self._key(realm)
+        value = str(to_utimestamp(datetime_now(utc)))
+        with self.env.db_transaction as db:
+            db("UPDATE system SET value=%s WHERE name=%s", (value, key))
+            if not db("SELECT value FROM system WHERE name=%s", (key,)):
+                db("INSERT INTO system (name, value) VALUES (%s,%s)",
+                   (key, value))
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import io
+import unittest
+from datetime import datetime, timedelta
+
+from trac.attachment import Attachment
+from trac.core import Component, implements
+from trac.perm import IPermissionPolicy
+from trac.test import EnvironmentStub, MockRequest, mkdtemp
+from trac.ticket.model import Milestone, Ticket
+from trac.ticket.roadmap import MilestoneModule
+from trac.ticket.web_ui import TicketModule
+from trac.timeline.index import TimelineEventIndex
+from trac.timeline.web_ui import TimelineModule
+from trac.util.datefmt import datetime_now, to_utimestamp, utc
+from trac.wiki.model import WikiPage
+from trac.wiki.web_ui import WikiModule
+
+
+class NewestTicketDenyingPolicy(Component):
+
+    implements(IPermissionPolicy)
+
+    def check_permission(self, action, username, resource, perm):
+        if resource and resource.realm == 'ticket' and resource.id == 3:
+            return False
+
+
+class TimelineEventIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True,
+                                   enable=['trac.*', TicketModule],
+                                   path=mkdtemp())
+        self.env.config.set('timeline', 'use_event_index', 'enabled')
+        self.index = TimelineEventIndex(self.env)
+        self.now = datetime_now(utc).replace(microsecond=0)
+
+    def tearDown(self):
+        self.env.reset_db_and_disk()
+
+    def _events(self):
+        return sorted(self.env.db_query("""
+            SELECT time, realm, resource, author, kind, filter
+            FROM timeline_event"""))
+
+    def _insert_ticket(self, when, reporter='joe', summary='Summary'):
+        ticket = Ticket(self.env)
+        ticket['reporter'] = reporter
+        ticket['summary'] = summary
+        ticket.insert(when)
+        return ticket
+
+    def test_ticket_events(self):
+        t1 = self.now - timedelta(hours=3)
+        ticket = self._insert_ticket(t1)
+        ticket['summary'] = 'Changed'
+        ticket.save_changes('jane', 'Comment', t1 + timedelta(hours=1))
+        ticket['status'] = 'closed'
+        ticket['resolution'] = 'fixed'
+        ticket.save_changes('jim', None, t1 + timedelta(hours=2))
+
+        ts = to_utimestamp(t1)
+        hour = 3600 * 1000000
+        self.assertEqual([
+            (ts, 'ticket', '1', 'joe', 'newticket', 'ticket'),
+            (ts + hour, 'ticket', '1', 'jane', 'editedticket',
+             'ticket_details'),
+            (ts + 2 * hour, 'ticket', '1', 'jim', 'closedticket', 'ticket'),
+        ], self._events())
+
+        ticket.delete()
+        self.assertEqual([], self._events())
+
+    def test_wiki_and_attachment_events(self):
+        page = WikiPage(self.env, 'OldName')
+        page.text = 'Text'
+        page.save('joe', 'Comment', self.now)
+        attachment = Attachment(self.env, 'wiki', 'OldName')
+        attachment.insert('file.txt', io.BytesIO(), 0,
+                          self.now + timedelta(seconds=1))
+        page.rename('NewName')
+
+        ts = to_utimestamp(self.now)
+        self.assertEqual([
+            (ts, 'wiki', 'NewName', 'joe', 'wiki', 'wiki'),
+            (ts + 1000000, 'attachment', 'wiki:NewName:file.txt', None,
+             'attachment', 'wiki'),
+        ], self._events())
+
+        page.delete()
+        self.assertEqual([], self._events())
+
+    def test_milestone_events(self):
+        milestone = Milestone(self.env, 'milestone1')
+        milestone.completed = self.now
+        milestone.update()
+        milestone.name = 'renamed'
+        milestone.update()
+
+        self.assertEqual([(to_utimestamp(self.now), 'milestone', 'renamed',
+                           '', 'milestone', 'milestone')], self._events())
+
+        milestone.delete()
+        self.assertEqual([], self._events())
+
+    def test_disabled_index_is_not_maintained(self):
+        self.env.config.set('timeline', 'use_event_index', 'disabled')
+        self._insert_ticket(self.now)
+
+        self.assertEqual([], self._events())
+
+    def test_reindex(self):
+        ticket = self._insert_ticket(self.now - timedelta(hours=2))
+        ticket['status'] = 'closed'
+        ticket.save_changes('jim', 'Fixed', self.now - timedelta(hours=1))
+        page = WikiPage(self.env, 'SomePage')
+        page.text = 'Text'
+        page.save('joe', 'Comment', self.now)
+        milestone = Milestone(self.env, 'milestone1')
+        milestone.completed = self.now
+        milestone.update()
+        events = self._events()
+        self.env.db_transaction("DELETE FROM timeline_event")
+
+        self.assertEqual(len(events), self.index.reindex())
+        self.assertEqual(events, self._events())
+
+    def test_get_start(self):
+        for idx in xrange(5):
+            self._insert_ticket(self.now - timedelta(days=idx),
+                                reporter='joe' if idx % 2 else 'jane')
+        start = self.now - timedelta(days=30)
+
+        self.assertEqual(self.now - timedelta(days=2),
+                         self.index.get_start(start, self.now, ['ticket'], 3))
+        self.assertEqual(self.now - timedelta(days=3),
+                         self.index.get_start(start, self.now, ['ticket'], 2,
+                                              include=set(['joe'])))
+        self.assertEqual(start,
+                         self.index.get_start(start, self.now, ['ticket'], 6))
+        self.assertEqual(start,
+                         self.index.get_start(start, self.now, ['wiki'], 1))
+
+    def test_get_start_deselected_repository(self):
+        for idx in xrange(4):
+            self.env.db_transaction("""
+                INSERT INTO timeline_event (time, realm, resource, author,
+                                            kind, filter)
+                VALUES (%s,'changeset',%s,'joe','changeset',%s)
+                """, (to_utimestamp(self.now - timedelta(days=idx)),
+                      str(idx), 'repo-a' if idx % 2 else 'repo-b'))
+        start = self.now - timedelta(days=30)
+
+        self.assertEqual(self.now - timedelta(days=1),
+                         self.index.get_start(start, self.now,
+                                              ['changeset'], 2))
+        self.assertEqual(self.now - timedelta(days=3),
+                         self.index.get_start(start, self.now,
+                                              ['changeset', 'repo-a'], 2))
+        self.assertEqual(self.now - timedelta(days=3),
+                         self.index.get_start(start, self.now,
+                                              ['repo-a'], 2))
+
+    def test_events_hidden_by_permission(self):
+        self.env.enable_component(NewestTicketDenyingPolicy)
+        self.env.config.set('trac', 'permission_policies',
+                            'NewestTicketDenyingPolicy, '
+                            'DefaultPermissionPolicy, LegacyAttachmentPolicy')
+        for idx in xrange(3):
+            self._insert_ticket(self.now - timedelta(days=2 - idx),
+                                summary='Ticket %d' % idx)
+
+        req = MockRequest(self.env, authname='anonymous',
+                          args={'max': '2', 'ticket': 'on'})
+        template, data = TimelineModule(self.env).process_request(req)
+        self.assertEqual(['Ticket 1', 'Ticket 0'],
+                         [e['data'][3] for e in data['events']])
+
+    def test_load_more_events(self):
+        for idx in xrange(5):
+            self._insert_ticket(self.now - timedelta(days=idx),
+                                summary='Ticket %d' % idx)
+
+        req = MockRequest(self.env, args={'max': '2', 'ticket': 'on'})
+        template, data = TimelineModule(self.env).process_request(req)
+        self.assertEqual(['Ticket 0', 'Ticket 1'],
+                         [e['data'][3] for e in data['events']])
+        self.assertIsNotNone(data['more_href'])
+
+        before = to_utimestamp(self.now - timedelta(days=1))
+        req = MockRequest(self.env, args={'max': '2', 'ticket': 'on',
+                                          'before': str(before)})
+        template, data = TimelineModule(self.env).process_request(req)
+        self.assertEqual(['Ticket 2', 'Ticket 3'],
+                         [e['data'][3] for e in data['events']])
+
+
+class TimelineChangeTrackerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True,
+                                   enable=['trac.*', TicketModule],
+                                   path=mkdtemp())
+        self.past = datetime(2018, 1, 2, 3, 4, 5, tzinfo=utc)
+        self.req = MockRequest(self.env)
+
+    def tearDown(self):
+        self.env.reset_db_and_disk()
+
+    def _last_modified(self, provider, filters):
+        return provider(self.env).get_timeline_last_modified(self.req,
+                                                             filters)
+
+    def _assert_changed(self, provider, filters, change):
+        self.env.db_transaction("""
+            DELETE FROM system WHERE name LIKE 'timeline_changed:%'""")
+        last_modified = self._last_modified(provider, filters)
+        change()
+        self.assertLess(last_modified,
+                        self._last_modified(provider, filters))
+
+    def test_wiki_changes(self):
+        page = WikiPage(self.env, 'WikiPage')
+        for idx in xrange(3):
+            page.text = 'Text %d' % idx
+            page.save('joe', 'Comment %d' % idx,
+                      self.past + timedelta(hours=idx))
+        attachment = Attachment(self.env, 'wiki', 'WikiPage')
+        attachment.insert('file.txt', io.BytesIO(), 0, self.past)
+
+        self._assert_changed(WikiModule, ['wiki'], lambda:
+            WikiPage(self.env, 'WikiPage', 1).delete(version=1))
+        self._assert_changed(WikiModule, ['wiki'], lambda:
+            WikiPage(self.env, 'WikiPage', 2).edit_comment('Edited'))
+        self._assert_changed(WikiModule, ['wiki'], lambda:
+            WikiPage(self.env, 'WikiPage').rename('Renamed'))
+        self._assert_changed(WikiModule, ['wiki'], lambda:
+            Attachment(self.env, 'wiki', 'Renamed', 'file.txt').delete())
+
+    def test_ticket_changes(self):
+        tickets = []
+        for idx in xrange(2):
+            ticket = Ticket(self.env)
+            ticket['reporter'] = 'joe'
+            ticket['summary'] = 'Summary %d' % idx
+            ticket.insert(self.past)
+            ticket.save_changes('jane', 'Comment',
+                                self.past + timedelta(hours=1))
+            tickets.append(ticket)
+        tickets[1].save_changes('jane', 'Comment',
+                                self.past + timedelta(hours=2))
+
+        self._assert_changed(TicketModule, ['ticket'], lambda:
+            tickets[0].modify_comment(self.past + timedelta(hours=1),
+                                      'jane', 'Edited'))
+        self._assert_changed(TicketModule, ['ticket'], lambda:
+            tickets[1].delete_change(cdate=self.past + timedelta(hours=2)))
+        self._assert_changed(TicketModule, ['ticket'], tickets[0].delete)
+
+    def test_milestone_changes(self):
+        milestone = Milestone(self.env)
+        milestone.name = 'Milestone'
+        milestone.completed = self.past
+        milestone.insert()
+
+        self._assert_changed(MilestoneModule, ['milestone'],
+                             milestone.delete)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TimelineEventIndexTestCase))
+    suite.addTest(unittest.makeSuite(TimelineChangeTrackerTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
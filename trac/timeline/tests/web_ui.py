@@ -11,17 +11,21 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+import threading
 import unittest
 from datetime import datetime, timedelta
 
+from trac.core import Component, ComponentMeta, implements
 from trac.perm import PermissionError, PermissionSystem
 from trac.test import EnvironmentStub, MockRequest, locale_en
+from trac.timeline.api import ITimelineEventProvider
 from trac.timeline.web_ui import TimelineModule
 from trac.util.datefmt import (
     datetime_now, format_date, format_datetime, format_time,
     get_date_format_hint, pretty_timedelta, utc,
 )
 from trac.util.html import plaintext
+from trac.web.api import RequestDone
 from trac.web.chrome import Chrome
 from trac.web.tests.api import RequestHandlerPermissionsTestCaseBase
 
@@ -205,11 +209,165 @@ class TimelineModuleTestCase(unittest.TestCase):
         self.assertEqual(90, data['daysback'])
 
 
+class TimelineConcurrentProvidersTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        class EventsProvider(Component):
+            implements(ITimelineEventProvider)
+            def get_timeline_filters(self, req):
+                yield 'events', 'Events'
+            def get_timeline_events(self, req, start, stop, filters):
+                for idx in xrange(3):
+                    yield ('event', stop - timedelta(hours=idx), 'joe',
+                           idx)
+            def render_timeline_event(self, context, field, event):
+                return 'Event %d' % event[3]
+
+        class FailingProvider(Component):
+            implements(ITimelineEventProvider)
+            def get_timeline_filters(self, req):
+                yield 'failing', 'Failing'
+            def get_timeline_events(self, req, start, stop, filters):
+                raise ValueError('Failing provider')
+
+        class SlowProvider(Component):
+            implements(ITimelineEventProvider)
+            done = threading.Event()
+            def get_timeline_filters(self, req):
+                yield 'slow', 'Slow'
+            def get_timeline_events(self, req, start, stop, filters):
+                self.done.wait(5)
+                return []
+
+        cls.components = [EventsProvider, FailingProvider, SlowProvider]
+
+    @classmethod
+    def tearDownClass(cls):
+        for component in cls.components:
+            ComponentMeta.deregister(component)
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[TimelineModule] + self.components)
+        self.env.config.set('timeline', 'provider_threads', 3)
+        self.env.config.set('timeline', 'provider_timeout', 1)
+
+    def tearDown(self):
+        self.components[2].done.set()
+        self.env.reset_db()
+
+    def test_events_of_concurrent_providers(self):
+        req = MockRequest(self.env)
+
+        data = TimelineModule(self.env).process_request(req)[1]
+
+        self.assertEqual([0, 1, 2], [event['data']
+                                     for event in data['events']])
+        warnings = req.chrome['warnings']
+        self.assertEqual(2, len(warnings))
+        self.assertIn('FailingProvider failed with ValueError',
+                      unicode(warnings[0]))
+        self.assertIn("SlowProvider didn't complete in time",
+                      unicode(warnings[1]))
+
+
+class TimelineFeedTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        class ValidatedProvider(Component):
+            implements(ITimelineEventProvider)
+            calls = 0
+            last_modified = datetime(2018, 1, 2, 3, 4, 5, tzinfo=utc)
+            def get_timeline_filters(self, req):
+                yield 'validated', 'Validated'
+            def get_timeline_events(self, req, start, stop, filters):
+                self.calls += 1
+                yield 'event', stop - timedelta(hours=1), 'joe', None
+            def get_timeline_last_modified(self, req, filters):
+                return self.last_modified
+            def render_timeline_event(self, context, field, event):
+                return 'Event'
+
+        class OtherProvider(Component):
+            implements(ITimelineEventProvider)
+            def get_timeline_filters(self, req):
+                yield 'other', 'Other'
+            def get_timeline_events(self, req, start, stop, filters):
+                return []
+
+        cls.components = [ValidatedProvider, OtherProvider]
+
+    @classmethod
+    def tearDownClass(cls):
+        for component in cls.components:
+            ComponentMeta.deregister(component)
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.perm.*', 'trac.web.*',
+                                           TimelineModule] + self.components)
+        self.provider = self.components[0](self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _request_feed(self, filters=('validated',), **headers):
+        args = dict((f, 'on') for f in filters)
+        args['format'] = 'rss'
+        req = MockRequest(self.env, args=args)
+        req.environ.update(headers)
+        try:
+            TimelineModule(self.env).process_request(req)
+        except RequestDone:
+            return req
+        self.fail("The feed isn't sent")
+
+    def test_not_modified(self):
+        req = self._request_feed()
+        etag = req.headers_sent['ETag']
+        self.assertEqual('Tue, 02 Jan 2018 03:04:05 GMT',
+                         req.headers_sent['Last-Modified'])
+        self.assertIn('Event', req.response_sent.getvalue())
+
+        req = self._request_feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual('304 Not Modified', req.status_sent[0])
+        self.assertEqual(1, self.provider.calls)
+
+        self.provider.last_modified += timedelta(seconds=1)
+        req = self._request_feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual('200 Ok', req.status_sent[0])
+        self.assertEqual(2, self.provider.calls)
+
+    def test_cached_feed(self):
+        content = self._request_feed().response_sent.getvalue()
+        req = self._request_feed()
+        self.assertEqual(content, req.response_sent.getvalue())
+        self.assertEqual(1, self.provider.calls)
+
+        self.env.config.set('trac', 'feed_cache_ttl', 0)
+        req = MockRequest(self.env, args={'format': 'rss',
+                                          'validated': 'on'})
+        TimelineModule(self.env).process_request(req)
+        self.assertEqual(2, self.provider.calls)
+
+    def test_not_validated_without_last_modified(self):
+        req = MockRequest(self.env, args={'format': 'rss', 'validated': 'on',
+                                          'other': 'on'})
+
+        template, data, metadata = \
+            TimelineModule(self.env).process_request(req)
+
+        self.assertEqual('timeline.rss', template)
+        self.assertNotIn('ETag', dict(req._outheaders))
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(PrettyDateinfoTestCase))
     suite.addTest(unittest.makeSuite(TimelinePermissionsTestCase))
     suite.addTest(unittest.makeSuite(TimelineModuleTestCase))
+    suite.addTest(unittest.makeSuite(TimelineConcurrentProvidersTestCase))
+    suite.addTest(unittest.makeSuite(TimelineFeedTestCase))
     return suite
 
 if __name__ == '__main__':
@@ -19,24 +19,30 @@
 
 import pkg_resources
 import re
+import time
 from datetime import datetime, timedelta
+from functools import partial
 
 from trac.config import IntOption, BoolOption
 from trac.core import *
 from trac.perm import IPermissionRequestor
+from trac.timeline.index import TimelineEventIndex
 from trac.timeline.api import ITimelineEventProvider
+from trac.util.concurrency import call_concurrently
 from trac.util.datefmt import (datetime_now, format_date, format_datetime,
-                               format_time, localtz, parse_date,
-                               pretty_timedelta, to_datetime, to_utimestamp,
+                               format_time, from_utimestamp, localtz,
+                               parse_date, pretty_timedelta, to_datetime,
+                               to_utimestamp,
                                truncate_datetime, user_time, utc)
 from trac.util.html import tag
-from trac.util.text import to_unicode
+from trac.util.text import exception_to_unicode, to_unicode
 from trac.util.translation import _
 from trac.web import IRequestHandler, IRequestFilter
 from trac.web.chrome import (Chrome, INavigationContributor, ITemplateProvider,
                              accesskey, add_link, add_stylesheet, add_warning,
                              auth_link, component_guard, prevnext_nav,
                              web_context)
+from trac.web.feed import FeedCache
 from trac.wiki.api import IWikiSyntaxProvider
 from trac.wiki.formatter import concat_path_query_fragment, \
                                 split_url_into_path_query_fragment
@@ -66,6 +72,20 @@ class TimelineModule(Component):
         specific event providers, see their own documentation.
         """)
 
+    provider_threads = IntOption('timeline', 'provider_threads', 0,
+        """Number of threads used to retrieve the events of the timeline
+        event providers concurrently, as well as the changesets of the
+        repositories. When set to `0`, the providers are called one
+        after the other. (''since 1.3.3'')
+        """)
+
+    provider_timeout = IntOption('timeline', 'provider_timeout', 30,
+        """Maximum time in seconds to wait for the events of the timeline
+        event providers and of the repositories, when `provider_threads`
+        is not `0`. The events of a provider which takes longer are
+        left out and a warning is shown. (''since 1.3.3'')
+        """)
+
     _authors_pattern = re.compile(r'(-)?(?:"([^"]*)"|\'([^\']*)\'|([^\s]+))')
 
     # INavigationContributor methods
@@ -98,7 +118,8 @@ class TimelineModule(Component):
 
         # indication of new events is unchanged when form is updated by user
         revisit = any(a in req.args
-                      for a in ['update', 'from', 'daysback', 'author'])
+                      for a in ['update', 'from', 'daysback', 'author',
+                                'before'])
         if revisit:
             lastvisit = req.session.as_int('timeline.nextlastvisit',
                                            lastvisit)
@@ -146,14 +167,16 @@ class TimelineModule(Component):
         data = {'fromdate': fromdate, 'daysback': daysback,
                 'authors': authors, 'today': today, 'yesterday': yesterday,
                 'precisedate': precisedate, 'precision': precision,
-                'events': [], 'filters': [],
+                'events': [], 'filters': [], 'more_href': None,
                 'abbreviated_messages': self.abbreviated_messages}
 
         available_filters = []
+        provider_filters = []
         for event_provider in self.event_providers:
             with component_guard(self.env, req, event_provider):
-                available_filters += (event_provider.get_timeline_filters(req)
-                                      or [])
+                provider_filters.append((event_provider, list(
+                    event_provider.get_timeline_filters(req) or [])))
+                available_filters += provider_filters[-1][1]
 
         # check the request or session for enabled filters, or use default
         filters = [f[0] for f in available_filters if f[0] in req.args]
@@ -172,7 +195,13 @@ class TimelineModule(Component):
                 elif key in req.session:
                     del req.session[key]
 
-        stop = fromdate
+        # `before` is the timestamp of the oldest event of the previous
+        # page, when loading more events
+        before = req.args.getint('before')
+        if before:
+            stop = from_utimestamp(before - 1).astimezone(req.tz)
+        else:
+            stop = fromdate
         start = to_datetime(stop.replace(tzinfo=None) -
                             timedelta(days=daysback + 1), req.tz)
 
@@ -186,17 +215,36 @@ class TimelineModule(Component):
             else:
                 include.add(name)
 
+        # narrow the period of time to the one holding the `maxrows`
+        # newest events, if the timeline events are indexed
+        event_index = self.env[TimelineEventIndex]
+        if maxrows and event_index and event_index.enabled:
+            indexed_start = event_index.get_start(start, stop, filters,
+                                                  maxrows, include, exclude)
+        else:
+            event_index = None
+            indexed_start = start
+
+        # answer the conditional requests of the feed readers before
+        # gathering the events
+        feed_key = None
+        if format == 'rss':
+            last_modified = self._get_last_modified(req, filters,
+                                                    provider_filters)
+            if last_modified is not None:
+                feed_key = FeedCache(self.env).check(
+                    req, last_modified, [fromdate, daysback, before,
+                                         maxrows, filters, authors])
+
         # gather all events for the given period of time
-        events = []
-        for provider in self.event_providers:
-            with component_guard(self.env, req, provider):
-                for event in provider.get_timeline_events(req, start, stop,
-                                                          filters) or []:
-                    author = (event[2] or '').lower()
-                    if ((not include or author in include) and
-                        author not in exclude):
-                        events.append(
-                            self._event_data(req, provider, event, lastvisit))
+        events = self._gather_events(req, indexed_start, stop, filters,
+                                     include, exclude, lastvisit)
+        # the index also counts the events which the providers don't
+        # show to the user, so gather again the whole period of time
+        # when the narrowed period holds less than `maxrows` events
+        if indexed_start != start and len(events) < maxrows:
+            events = self._gather_events(req, start, stop, filters,
+                                         include, exclude, lastvisit)
 
         # prepare sorted global list
         events = sorted(events, key=lambda e: e['datetime'], reverse=True)
@@ -204,11 +252,18 @@ class TimelineModule(Component):
             events = events[:maxrows]
 
         data['events'] = events
+        if event_index and len(events) == maxrows:
+            data['more_href'] = req.href.timeline(
+                [(f, 'on') for f in filters], authors=authors,
+                daysback=daysback, max=maxrows,
+                before=to_utimestamp(events[-1]['datetime']))
 
         if format == 'rss':
             rss_context = web_context(req, absurls=True)
             rss_context.set_hints(wiki_flavor='html', shorten_lines=False)
             data['context'] = rss_context
+            if feed_key:
+                FeedCache(self.env).send(req, feed_key, 'timeline.rss', data)
             return 'timeline.rss', data, {'content_type': 'application/rss+xml'}
         else:
             req.session.set('timeline.daysback', daysback,
@@ -362,6 +417,96 @@ class TimelineModule(Component):
 
     # Internal methods
 
+    def call_concurrently(self, req, funcs):
+        """Call the functions from at most `provider_threads` threads,
+        waiting at most `provider_timeout` seconds, with the
+        translations of the request locale.
+
+        The calls which don't complete in time keep running with the
+        request after the response has been sent, so they shouldn't
+        modify the request.
+
+        :return: see `trac.util.concurrency.call_concurrently`.
+        :since: 1.3.3
+        """
+        return call_concurrently(funcs, self.provider_threads,
+                                 self.provider_timeout, req.locale,
+                                 self.env.path)
+
+    def _gather_events(self, req, start, stop, filters, include, exclude,
+                       lastvisit):
+        events = []
+        def add_events(provider, provider_events):
+            for event in provider_events:
+                author = (event[2] or '').lower()
+                if ((not include or author in include) and
+                    author not in exclude):
+                    events.append(
+                        self._event_data(req, provider, event, lastvisit))
+
+        if self.provider_threads > 0:
+            self._add_events_concurrently(req, start, stop, filters,
+                                          add_events)
+        else:
+            for provider in self.event_providers:
+                with component_guard(self.env, req, provider):
+                    t = time.time()
+                    add_events(provider,
+                               provider.get_timeline_events(req, start, stop,
+                                                            filters) or [])
+                    self.log.debug("Timeline event provider %s took %.3f s",
+                                   provider.__class__.__name__,
+                                   time.time() - t)
+        return events
+
+    def _add_events_concurrently(self, req, start, stop, filters,
+                                 add_events):
+        def get_events(provider):
+            return list(provider.get_timeline_events(req, start, stop,
+                                                     filters) or [])
+        providers = list(self.event_providers)
+        results = self.call_concurrently(req, (partial(get_events, provider)
+                                               for provider in providers))
+        for provider, (provider_events, exc_info, elapsed) \
+                in zip(providers, results):
+            name = provider.__class__.__name__
+            if elapsed is None:
+                self.log.warning("Timeline event provider %s didn't "
+                                 "complete within %d s", name,
+                                 self.provider_timeout)
+                add_warning(req, _("%(component)s didn't complete in time, "
+                                   "its events are not shown.",
+                                   component=name))
+                continue
+            self.log.debug("Timeline event provider %s took %.3f s",
+                           name, elapsed)
+            with component_guard(self.env, req, provider):
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                add_events(provider, provider_events)
+
+    def _get_last_modified(self, req, filters, provider_filters):
+        """Return the time of the last change of the events, or `None`
+        if a provider of the enabled filters can't tell it.
+        """
+        last_modified = datetime(1970, 1, 1, tzinfo=utc)
+        for provider, provided in provider_filters:
+            if not any(f[0] in filters for f in provided):
+                continue
+            if not hasattr(provider, 'get_timeline_last_modified'):
+                return None
+            try:
+                t = provider.get_timeline_last_modified(req, filters)
+            except Exception as e:
+                self.log.warning("Timeline event provider %s failed to "
+                                 "tell the time of the last change: %s",
+                                 provider.__class__.__name__,
+                                 exception_to_unicode(e))
+                return None
+            if t and t > last_modified:
+                last_modified = t
+        return last_modified
+
     def _event_data(self, req, provider, event, lastvisit):
         """Compose the timeline event date from the event tuple and prepared
         provider methods"""
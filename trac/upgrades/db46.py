@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.db import Table, Column, Index, DatabaseManager
+
+
+def do_upgrade(env, version, cursor):
+    """Add the notify_spool table."""
+    table = Table('notify_spool', key='id')[
+                Column('id', auto_increment=True),
+                Column('time', type='int64'),
+                Column('next_attempt', type='int64'),
+                Column('attempts', type='int'),
+                Column('status'),
+                Column('realm'),
+                Column('category'),
+                Column('class'),
+                Column('data'),
+                Column('error'),
+                Index(['status', 'next_attempt'])]
+
+    DatabaseManager(env).create_tables([table])
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.db import Table, Column, Index, DatabaseManager
+
+
+def do_upgrade(env, version, cursor):
+    """Add the notify_digest table."""
+    table = Table('notify_digest', key='id')[
+                Column('id', auto_increment=True),
+                Column('time', type='int64'),
+                Column('sid'),
+                Column('authenticated', type='int'),
+                Column('address'),
+                Column('realm'),
+                Column('category'),
+                Column('subject'),
+                Column('body'),
+                Index(['sid', 'authenticated', 'address'])]
+
+    DatabaseManager(env).create_tables([table])
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.db import Table, Column, Index, DatabaseManager
+from trac.wiki.links import WikiLinkIndex
+
+
+def do_upgrade(env, version, cursor):
+    """Add the wiki_links table, and fill it with the links of the
+    latest version of the wiki pages."""
+    table = Table('wiki_links', key=('realm', 'id', 'target_realm',
+                                     'target_id'))[
+                Column('realm'),
+                Column('id'),
+                Column('version', type='int'),
+                Column('target_realm'),
+                Column('target_id'),
+                Index(['target_realm', 'target_id'])]
+
+    with env.db_transaction:
+        DatabaseManager(env).create_tables([table])
+        WikiLinkIndex(env).rebuild()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.db import Table, Column, Index, DatabaseManager
+
+
+def do_upgrade(env, version, cursor):
+    """Add the wiki_latest table, holding the latest version of each
+    wiki page."""
+    table = Table('wiki_latest', key='name')[
+                Column('name'),
+                Column('version', type='int'),
+                Column('time', type='int64'),
+                Index(['time'])]
+
+    with env.db_transaction as db:
+        DatabaseManager(env).create_tables([table])
+        db("""INSERT INTO wiki_latest (name, version, time)
+              SELECT w1.name, w1.version, w1.time
+              FROM wiki w1, (SELECT name, max(version) AS ver
+                             FROM wiki GROUP BY name) w2
+              WHERE w1.version=w2.ver AND w1.name=w2.name""")
@@ -13,7 +13,9 @@
 
 import unittest
 
-from trac.upgrades.tests import db31, db32, db39, db41, db42, db44, db45
+from trac.upgrades.tests import db31, db32, db39, db41, db42, db44, db45, \
+                                db46, db47, db48, db49, db50, \
+                                db51
 
 
 def test_suite():
@@ -25,6 +27,12 @@ def test_suite():
     suite.addTest(db42.test_suite())
     suite.addTest(db44.test_suite())
     suite.addTest(db45.test_suite())
+    suite.addTest(db46.test_suite())
+    suite.addTest(db47.test_suite())
+    suite.addTest(db48.test_suite())
+    suite.addTest(db49.test_suite())
+    suite.addTest(db50.test_suite())
+    suite.addTest(db51.test_suite())
     return suite
 
 
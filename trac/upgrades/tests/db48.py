@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.db.api import DatabaseManager
+from trac.test import EnvironmentStub
+from trac.upgrades import db48
+
+VERSION = 48
+
+
+class UpgradeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.dbm = DatabaseManager(self.env)
+        self.dbm.drop_tables(('timeline_event',))
+        self.dbm.set_database_version(VERSION - 1)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_add_timeline_event_table(self):
+        self.assertNotIn('timeline_event', self.dbm.get_table_names())
+
+        with self.env.db_transaction as db:
+            db48.do_upgrade(self.env, VERSION, None)
+
+        self.assertIn('timeline_event', self.dbm.get_table_names())
+        columns = self.dbm.get_column_names('timeline_event')
+        self.assertEqual(['id', 'time', 'realm', 'resource', 'author',
+                          'kind', 'filter'], columns)
+
+
+def test_suite():
+    return unittest.makeSuite(UpgradeTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.db.api import DatabaseManager
+from trac.test import EnvironmentStub
+from trac.upgrades import db50
+
+VERSION = 50
+
+
+class UpgradeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.dbm = DatabaseManager(self.env)
+        self.dbm.drop_tables(('wiki_links',))
+        self.dbm.set_database_version(VERSION - 1)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_add_wiki_links_table(self):
+        self.assertNotIn('wiki_links', self.dbm.get_table_names())
+        self.env.db_transaction.executemany("""
+            INSERT INTO wiki (name, version, time, author, text)
+            VALUES (%s,%s,0,'joe',%s)
+            """, [('WikiStart', 1, 'See SandBox'),
+                  ('WikiStart', 2, 'See SandBox and #1'),
+                  ('SandBox', 1, 'No links')])
+
+        with self.env.db_transaction as db:
+            db50.do_upgrade(self.env, VERSION, None)
+
+        self.assertIn('wiki_links', self.dbm.get_table_names())
+        columns = self.dbm.get_column_names('wiki_links')
+        self.assertEqual(['realm', 'id', 'version', 'target_realm',
+                          'target_id'], columns)
+        self.assertEqual([('wiki', 'WikiStart', 2, 'ticket', '1'),
+                          ('wiki', 'WikiStart', 2, 'wiki', 'SandBox')],
+                         self.env.db_query("""
+                            SELECT * FROM wiki_links
+                            ORDER BY realm, id, target_realm, target_id
+                            """))
+
+
+def test_suite():
+    return unittest.makeSuite(UpgradeTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
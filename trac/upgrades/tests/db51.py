@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.db.api import DatabaseManager
+from trac.test import EnvironmentStub
+from trac.upgrades import db51
+
+VERSION = 51
+
+
+class UpgradeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.dbm = DatabaseManager(self.env)
+        self.dbm.drop_tables(('wiki_latest',))
+        self.dbm.set_database_version(VERSION - 1)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_add_wiki_latest_table(self):
+        self.assertNotIn('wiki_latest', self.dbm.get_table_names())
+        self.env.db_transaction.executemany("""
+            INSERT INTO wiki (name, version, time, author, text)
+            VALUES (%s,%s,%s,'joe','Text')
+            """, [('WikiStart', 1, 10), ('WikiStart', 2, 20),
+                  ('SandBox', 1, 30)])
+
+        with self.env.db_transaction as db:
+            db51.do_upgrade(self.env, VERSION, None)
+
+        self.assertIn('wiki_latest', self.dbm.get_table_names())
+        columns = self.dbm.get_column_names('wiki_latest')
+        self.assertEqual(['name', 'version', 'time'], columns)
+        self.assertEqual([('SandBox', 1, 30), ('WikiStart', 2, 20)],
+                         self.env.db_query("""
+                            SELECT name, version, time FROM wiki_latest
+                            ORDER BY name"""))
+
+
+def test_suite():
+    return unittest.makeSuite(UpgradeTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
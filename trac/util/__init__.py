@@ -1311,6 +1311,19 @@ def partition(iterable, order=None):
     return [result[key] for key in order]
 
 
+def chunked(items, size=500):
+    """Split a list in lists of at most `size` items, e.g. for
+    bounding the number of parameters of an `IN (...)` condition.
+
+    >>> list(chunked([1, 2, 3, 4, 5], 2))
+    [[1, 2], [3, 4], [5]]
+
+    :since: 1.3.3
+    """
+    for idx in xrange(0, len(items), size):
+        yield items[idx:idx + size]
+
+
 def as_int(s, default, min=None, max=None):
     """Convert s to an int and limit it to the given range, or return default
     if unsuccessful."""
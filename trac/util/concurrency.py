@@ -11,6 +11,10 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+import Queue
+import sys
+import time
+
 try:
     import threading
 except ImportError:
@@ -32,3 +36,96 @@ except AttributeError:
     get_thread_id = threading._get_ident
 else:
     get_thread_id = threading.get_ident
+
+
+# Deadline of the call of `call_concurrently` from which the current
+# thread calls its functions
+_call_deadline = ThreadLocal(deadline=None)
+
+
+def call_concurrently(funcs, max_threads, timeout=None, locale=None,
+                      env_path=None):
+    """Call the functions without arguments from at most `max_threads`
+    threads, and wait until all the calls complete or `timeout` seconds
+    elapse.
+
+    When called from one of the functions of another call, the timeout
+    is at most half of the time remaining before the timeout of that
+    call, which is left to the function for processing the results.
+
+    The translations being thread-local, the translations of `locale`
+    are activated in the threads while calling the functions, if
+    `locale` is given.
+
+    The calls which don't complete before the timeout are not
+    interrupted: they keep running in the background, possibly after
+    the caller returned, so the functions shouldn't depend on objects
+    whose state changes once the caller is done with them.
+
+    :return: a list with a `(result, exc_info, elapsed)` tuple for each
+             function, in the order of `funcs`. `exc_info` is the
+             `sys.exc_info()` tuple of the exception raised by the
+             function, or `None`. `elapsed` is the duration of the call
+             in seconds, or `None` if the call didn't complete before
+             the timeout. The functions which didn't start before the
+             timeout are not called.
+
+    :since: 1.3.3
+    """
+    funcs = list(funcs)
+    results = [None] * len(funcs)
+    tasks = Queue.Queue()
+    for idx, func in enumerate(funcs):
+        tasks.put((idx, func))
+    cond = threading.Condition()
+
+    now = time.time()
+    deadline = now + timeout if timeout else None
+    if _call_deadline.deadline is not None:
+        outer_deadline = now + max(_call_deadline.deadline - now, 0) / 2.0
+        deadline = min(deadline or outer_deadline, outer_deadline)
+
+    def worker():
+        from trac.util import translation
+        _call_deadline.deadline = deadline
+        if locale is not None:
+            translation.make_activable(lambda: locale, env_path)
+        try:
+            while True:
+                try:
+                    idx, func = tasks.get_nowait()
+                except Queue.Empty:
+                    return
+                start = time.time()
+                try:
+                    result = (func(), None)
+                except Exception:
+                    result = (None, sys.exc_info())
+                with cond:
+                    results[idx] = result + (time.time() - start,)
+                    cond.notify()
+        finally:
+            if locale is not None:
+                translation.deactivate()
+
+    for idx in xrange(min(max(max_threads, 1), len(funcs))):
+        thread = threading.Thread(target=worker,
+                                  name='call_concurrently-%d' % idx)
+        thread.daemon = True
+        thread.start()
+
+    with cond:
+        while None in results:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+            cond.wait(remaining)
+        # Don't start the calls which are still pending
+        while True:
+            try:
+                tasks.get_nowait()
+            except Queue.Empty:
+                break
+        return [result or (None, None, None) for result in results]
@@ -12,9 +12,11 @@
 # history and logs, available at http://trac.edgewall.org/log/.
 
 import threading
+import time
 import unittest
 
-from trac.util.concurrency import ThreadLocal
+from trac.util import translation
+from trac.util.concurrency import ThreadLocal, call_concurrently
 
 
 class ThreadLocalTestCase(unittest.TestCase):
@@ -35,9 +37,76 @@ class ThreadLocalTestCase(unittest.TestCase):
         self.assertEqual(dict(a=1, b=5, d=6), local_dict[1])
 
 
+class CallConcurrentlyTestCase(unittest.TestCase):
+
+    def test_results(self):
+        def fail():
+            raise ValueError('failure')
+        results = call_concurrently([lambda: 1, fail, lambda: 3], 2)
+
+        self.assertEqual(3, len(results))
+        self.assertEqual((1, None), results[0][:2])
+        self.assertIsNone(results[1][0])
+        self.assertEqual(ValueError, results[1][1][0])
+        self.assertEqual((3, None), results[2][:2])
+        for result, exc_info, elapsed in results:
+            self.assertGreaterEqual(elapsed, 0)
+
+    def test_calls_from_several_threads(self):
+        barrier = threading.Event()
+        def wait():
+            return barrier.wait(5)
+        results = call_concurrently([wait, wait, barrier.set], 3)
+
+        self.assertEqual([True, True, None],
+                         [result for result, exc_info, elapsed in results])
+
+    def test_timeout(self):
+        event = threading.Event()
+        done = threading.Event()
+        called = []
+        def slow():
+            event.wait(5)
+            done.set()
+        results = call_concurrently([slow, lambda: called.append(1)], 1, 0.1)
+        event.set()
+        done.wait(5)
+
+        self.assertEqual([(None, None, None), (None, None, None)], results)
+        self.assertEqual([], called)
+
+    def test_nested_call_timeout(self):
+        event = threading.Event()
+        def nested():
+            start = time.time()
+            call_concurrently([lambda: event.wait(5)], 1, 5)
+            return time.time() - start
+        results = call_concurrently([nested], 1, 0.4)
+        event.set()
+
+        self.assertIsNotNone(results[0][2])
+        self.assertLess(results[0][0], 0.4)
+
+    def test_locale_is_activated_in_threads(self):
+        if not translation.has_babel:
+            self.skipTest("Babel not installed")
+        activated = []
+        proxy = translation.translations
+        proxy.activate = lambda locale, env_path=None: \
+                         activated.append((locale, env_path))
+        try:
+            call_concurrently([lambda: proxy.isactive] * 2, 2,
+                              locale='fr', env_path='/path/to/env')
+        finally:
+            del proxy.activate
+
+        self.assertEqual(set([('fr', '/path/to/env')]), set(activated))
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(ThreadLocalTestCase))
+    suite.addTest(unittest.makeSuite(CallConcurrentlyTestCase))
     return suite
 
 if __name__ == '__main__':
@@ -18,6 +18,7 @@ import os
 
 from trac.cache import cached
 from trac.core import TracError
+from trac.util import chunked
 from trac.util.datefmt import from_utimestamp, to_utimestamp
 from trac.util.translation import _
 from trac.versioncontrol import Changeset, Node, Repository, NoSuchChangeset
@@ -67,6 +68,35 @@ class CachedRepository(Repository):
     def get_changeset(self, rev):
         return CachedChangeset(self, self.normalize_rev(rev), self.env)
 
+    def get_changesets_by_rev(self, revs):
+        """Return a dict of the changesets of the revisions `revs`
+        which exist, retrieved from the cache in batches.
+
+        :since: 1.3.3
+        """
+        normalized = {}
+        for rev in revs:
+            try:
+                nrev = self.normalize_rev(rev)
+            except NoSuchChangeset:
+                continue
+            normalized.setdefault(self.db_rev(nrev), (nrev, []))[1] \
+                      .append(rev)
+        changesets = {}
+        with self.env.db_query as db:
+            for chunk in chunked(list(normalized)):
+                for drev, time, author, message in db("""
+                        SELECT rev, time, author, message FROM revision
+                        WHERE repos=%%s AND rev IN (%s)
+                        """ % ','.join(['%s'] * len(chunk)),
+                        [self.id] + chunk):
+                    nrev, aliases = normalized[drev]
+                    changeset = CachedChangeset(self, nrev, self.env,
+                                                (time, author, message))
+                    for rev in aliases:
+                        changesets[rev] = changeset
+        return changesets
+
     def get_changeset_uid(self, rev):
         return self.repos.get_changeset_uid(rev)
 
@@ -475,13 +505,18 @@ class CachedRepository(Repository):
 
 class CachedChangeset(Changeset):
 
-    def __init__(self, repos, rev, env):
+    def __init__(self, repos, rev, env, row=None):
+        """The `row` of the revision can be given as a
+        `(time, author, message)` tuple, when it has already been
+        retrieved from the cache.
+        """
         self.env = env
         drev = repos.db_rev(rev)
-        for _date, author, message in self.env.db_query("""
+        rows = [row] if row else self.env.db_query("""
                 SELECT time, author, message FROM revision
                 WHERE repos=%s AND rev=%s
-                """, (repos.id, drev)):
+                """, (repos.id, drev))
+        for _date, author, message in rows:
             date = from_utimestamp(_date)
             Changeset.__init__(self, repos, repos.rev_db(rev), message, author,
                                date)
@@ -343,6 +343,26 @@ class CacheTestCase(unittest.TestCase):
                          next(changes))
         self.assertRaises(StopIteration, next, changes)
 
+    def test_get_changesets_by_rev(self):
+        t1 = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+        t2 = datetime(2002, 1, 1, 1, 1, 1, 0, utc)
+        self.preset_cache(
+            (('0', to_utimestamp(t1), '', ''), []),
+            (('1', to_utimestamp(t2), 'joe', 'Import'),
+             [('trunk', 'D', 'A', None, None)]),
+            )
+        repos = self.get_repos()
+        cache = CachedRepository(self.env, repos, self.log)
+        changesets = cache.get_changesets_by_rev(['1', 1, '0', '5', 'x'])
+        self.assertEqual({'0', '1', 1}, set(changesets))
+        self.assertIs(changesets['1'], changesets[1])
+        changeset = changesets['1']
+        self.assertEqual(1, changeset.rev)
+        self.assertEqual('joe', changeset.author)
+        self.assertEqual('Import', changeset.message)
+        self.assertEqual(t2, changeset.date)
+        self.assertEqual(t1, changesets['0'].date)
+
 
 def test_suite():
     return unittest.makeSuite(CacheTestCase)
@@ -29,9 +29,13 @@ from trac.core import *
 from trac.mimeview.api import Mimeview
 from trac.perm import IPermissionRequestor
 from trac.resource import ResourceNotFound
-from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search import ISearchSource, search_to_sql, shorten_result, \
+                        sorted_search_results
+from trac.search.index import SearchIndex
 from trac.timeline.api import ITimelineEventProvider
-from trac.util import as_bool, content_disposition, embedded_numbers, pathjoin
+from trac.timeline.web_ui import TimelineModule
+from trac.util import as_bool, chunked, content_disposition, \
+                      embedded_numbers, pathjoin
 from trac.util.datefmt import from_utimestamp, pretty_timedelta
 from trac.util.html import tag
 from trac.util.presentation import to_json
@@ -40,6 +44,7 @@ from trac.util.text import CRLF, exception_to_unicode, shorten_line, \
 from trac.util.translation import _, ngettext, tag_
 from trac.versioncontrol.api import Changeset, NoSuchChangeset, Node, \
                                     RepositoryManager
+from trac.versioncontrol.cache import CachedRepository
 from trac.versioncontrol.diff import diff_blocks, get_diff_options, \
                                      unified_diff
 from trac.versioncontrol.web_ui.browser import BrowserModule
@@ -884,23 +889,32 @@ class ChangesetModule(Component):
             else:
                 collapse_changesets = lambda c: c.rev
 
-            uids_seen = {}
-            def generate_changesets(repos):
+            def get_changesets(repos):
+                # Viewable changesets and their uid, grouped by event
+                groups = []
                 for _, changesets in groupby(repos.get_changesets(start, stop),
                                              key=collapse_changesets):
+                    group = [(cset, repos.get_changeset_uid(cset.rev))
+                             for cset in changesets
+                             if cset.is_viewable(req.perm)]
+                    if group:
+                        groups.append(group)
+                return groups
+
+            uids_seen = {}
+            def generate_changesets(repos, groups):
+                for group in groups:
                     viewable_changesets = []
-                    for cset in changesets:
-                        if cset.is_viewable(req.perm):
-                            repos_for_uid = [repos.reponame]
-                            uid = repos.get_changeset_uid(cset.rev)
-                            if uid:
-                                # uid can be seen in multiple repositories
-                                if uid in uids_seen:
-                                    uids_seen[uid].append(repos.reponame)
-                                    continue  # already viewable, just append
-                                uids_seen[uid] = repos_for_uid
-                            viewable_changesets.append((cset, cset.resource,
-                                                        repos_for_uid))
+                    for cset, uid in group:
+                        repos_for_uid = [repos.reponame]
+                        if uid:
+                            # uid can be seen in multiple repositories
+                            if uid in uids_seen:
+                                uids_seen[uid].append(repos.reponame)
+                                continue  # already viewable, just append
+                            uids_seen[uid] = repos_for_uid
+                        viewable_changesets.append((cset, cset.resource,
+                                                    repos_for_uid))
                     if viewable_changesets:
                         cset = viewable_changesets[-1][0]
                         yield ('changeset', cset.date, cset.author,
@@ -908,16 +922,55 @@ class ChangesetModule(Component):
                                 show_location, show_files))
 
             rm = RepositoryManager(self.env)
-            for repos in sorted(rm.get_real_repositories(),
-                                key=lambda repos: repos.reponame):
-                if all_repos or ('repo-' + repos.reponame) in repo_filters:
-                    try:
-                        for event in generate_changesets(repos):
-                            yield event
-                    except TracError as e:
-                        self.log.error("Timeline event provider for repository"
-                                       " '%s' failed: %r",
-                                       repos.reponame, exception_to_unicode(e))
+            repositories = [repos for repos
+                                  in sorted(rm.get_real_repositories(),
+                                            key=lambda repos: repos.reponame)
+                                  if all_repos or 'repo-' + repos.reponame
+                                                  in repo_filters]
+            timeline = TimelineModule(self.env)
+            if timeline.provider_threads > 0 and len(repositories) > 1:
+                # When this provider is itself called concurrently, the
+                # repositories get half of its remaining time
+                results = timeline.call_concurrently(req, [
+                    partial(get_changesets, repos) for repos in repositories])
+            else:
+                results = None
+            for idx, repos in enumerate(repositories):
+                try:
+                    if results is None:
+                        groups = get_changesets(repos)
+                    else:
+                        groups, exc_info, elapsed = results[idx]
+                        if elapsed is None:
+                            self.log.warning("Timeline event provider for "
+                                             "repository '%s' didn't "
+                                             "complete in time",
+                                             repos.reponame)
+                            continue
+                        self.log.debug("Timeline event provider for "
+                                       "repository '%s' took %.3f s",
+                                       repos.reponame, elapsed)
+                        if exc_info:
+                            raise exc_info[0], exc_info[1], exc_info[2]
+                    for event in generate_changesets(repos, groups):
+                        yield event
+                except TracError as e:
+                    self.log.error("Timeline event provider for repository"
+                                   " '%s' failed: %r",
+                                   repos.reponame, exception_to_unicode(e))
+
+    def get_timeline_last_modified(self, req, filters):
+        all_repos = 'changeset' in filters
+        last_modified = None
+        for repos in RepositoryManager(self.env).get_real_repositories():
+            if not all_repos and 'repo-' + repos.reponame not in filters:
+                continue
+            youngest_rev = repos.youngest_rev
+            if youngest_rev is not None:
+                date = repos.get_changeset(youngest_rev).date
+                if last_modified is None or date > last_modified:
+                    last_modified = date
+        return last_modified
 
     def render_timeline_event(self, context, field, event):
         changesets, show_location, show_files = event[3]
@@ -1045,6 +1098,28 @@ class ChangesetModule(Component):
         yield ('changeset', self._format_changeset_link)
         yield ('diff', self._format_diff_link)
 
+    def prefetch_links(self, formatter, links, matches):
+        targets = set(links.get('changeset', ()))
+        for fullmatch in matches:
+            if not fullmatch.group('it_changeset'):  # not an InterTrac link
+                match = fullmatch.group(0)
+                targets.add(match[1:] if match[0] == 'r' else match[1:-1])
+        revs = {}
+        for target in targets:
+            try:
+                rev, reponame, repos, path = \
+                    self._get_changeset_link_repository(
+                        formatter, formatter.split_link(target)[0])
+            except TracError:
+                continue
+            if isinstance(repos, CachedRepository):
+                revs.setdefault(repos, set()).add(rev)
+        for repos, repos_revs in revs.iteritems():
+            for rev, changeset in \
+                    repos.get_changesets_by_rev(repos_revs).iteritems():
+                formatter.link_cache[(self.realm, repos.reponame, rev)] = \
+                    changeset
+
     def _format_changeset_link(self, formatter, ns, chgset, label,
                                fullmatch=None):
         intertrac = formatter.shorthand_intertrac_helper(ns, chgset, label,
@@ -1052,26 +1127,16 @@ class ChangesetModule(Component):
         if intertrac:
             return intertrac
 
-        # identifying repository
-        rm = RepositoryManager(self.env)
         chgset, params, fragment = formatter.split_link(chgset)
-        sep = chgset.find('/')
-        if sep > 0:
-            rev, path = chgset[:sep], chgset[sep:]
-        else:
-            rev, path = chgset, '/'
         try:
-            reponame, repos, path = rm.get_repository_by_path(path)
-            if not reponame:
-                reponame = rm.get_default_repository(formatter.context)
-                if reponame is not None:
-                    repos = rm.get_repository(reponame)
-            if path == '/':
-                path = None
+            rev, reponame, repos, path = \
+                self._get_changeset_link_repository(formatter, chgset)
 
             # rendering changeset link
             if repos:
-                changeset = repos.get_changeset(rev)
+                changeset = formatter.link_cache.get(
+                                (self.realm, repos.reponame, rev)) or \
+                            repos.get_changeset(rev)
                 if changeset.is_viewable(formatter.perm):
                     href = formatter.href.changeset(rev,
                                                     repos.reponame or None,
@@ -1090,6 +1155,25 @@ class ChangesetModule(Component):
             errmsg = to_unicode(e)
         return tag.a(label, class_="missing changeset", title=errmsg)
 
+    def _get_changeset_link_repository(self, formatter, chgset):
+        """Return the revision, the repository name, the repository and
+        the path of the target of a changeset link.
+        """
+        rm = RepositoryManager(self.env)
+        sep = chgset.find('/')
+        if sep > 0:
+            rev, path = chgset[:sep], chgset[sep:]
+        else:
+            rev, path = chgset, '/'
+        reponame, repos, path = rm.get_repository_by_path(path)
+        if not reponame:
+            reponame = rm.get_default_repository(formatter.context)
+            if reponame is not None:
+                repos = rm.get_repository(reponame)
+        if path == '/':
+            path = None
+        return rev, reponame, repos, path
+
     def _format_diff_link(self, formatter, ns, target, label):
         params, query, fragment = formatter.split_link(target)
         def pathrev(path):
@@ -1131,33 +1215,95 @@ class ChangesetModule(Component):
     def get_search_results(self, req, terms, filters):
         if not 'changeset' in filters:
             return
-        rm = RepositoryManager(self.env)
-        repositories = {repos.params['id']: repos
-                        for repos in rm.get_real_repositories()}
+        repositories = self._get_search_repositories()
         uids_seen = set()
+        matches = SearchIndex(self.env).search(self.realm, terms)
         with self.env.db_query as db:
-            sql, args = search_to_sql(db, ['rev', 'message', 'author'], terms)
-            for id, rev, ts, author, log in db("""
-                    SELECT repos, rev, time, author, message
-                    FROM revision WHERE """ + sql, args):
-                repos = repositories.get(id)
-                if not repos:
-                    continue  # revisions for a no longer active repository
-                try:
-                    rev = repos.normalize_rev(rev)
-                    drev = repos.display_rev(rev)
-                except NoSuchChangeset:
-                    continue
-                uid = repos.get_changeset_uid(rev)
-                if uid in uids_seen:
-                    continue
-                cset = repos.resource.child(self.realm, rev)
-                if 'CHANGESET_VIEW' in req.perm(cset):
-                    uids_seen.add(uid)
-                    yield (req.href.changeset(rev, repos.reponame or None),
-                           '[%s]: %s' % (drev, shorten_line(log)),
-                           from_utimestamp(ts), author,
-                           shorten_result(log, terms))
+            if matches is None:
+                sql, args = search_to_sql(db, ['rev', 'message', 'author'],
+                                          terms)
+                rows = db(self._search_query + sql, args)
+            else:
+                rows = self._get_search_rows(db, matches)
+            for row in rows:
+                result = self._make_search_result(req, terms, matches,
+                                                  repositories, uids_seen,
+                                                  row)
+                if result is not None:
+                    yield result
+
+    def get_sorted_search_results(self, req, terms, filters, limit):
+        if not 'changeset' in filters:
+            return [], 0
+        repositories = self._get_search_repositories()
+        matches = SearchIndex(self.env).search(self.realm, terms)
+        with self.env.db_query as db:
+            if matches is None:
+                sql, args = search_to_sql(db, ['rev', 'message', 'author'],
+                                          terms)
+                count = db("SELECT COUNT(*) FROM revision WHERE " + sql,
+                           args)[0][0]
+                def fetch(offset, size):
+                    return db(self._search_query + sql +
+                              " ORDER BY time DESC LIMIT %d OFFSET %d"
+                              % (size, offset), args)
+            else:
+                resources = sorted(matches, key=matches.get, reverse=True)
+                count = len(resources)
+                def fetch(offset, size):
+                    return self._get_search_rows(
+                        db, resources[offset:offset + size])
+            return sorted_search_results(
+                fetch, partial(self._make_search_result, req, terms, matches,
+                               repositories, set()),
+                limit), count
+
+    _search_query = """SELECT repos, rev, time, author, message
+                       FROM revision WHERE """
+
+    def _get_search_repositories(self):
+        rm = RepositoryManager(self.env)
+        return {repos.params['id']: repos
+                for repos in rm.get_real_repositories()}
+
+    def _get_search_rows(self, db, resources):
+        """Return the revisions of the `'repos_id:db_rev'` resources."""
+        revs = {}
+        for resource in resources:
+            id, rev = resource.split(':', 1)
+            revs.setdefault(int(id), []).append(rev)
+        rows = []
+        for id, id_revs in revs.iteritems():
+            for chunk in chunked(id_revs):
+                rows.extend(db(self._search_query +
+                               "repos=%%s AND rev IN (%s)"
+                               % ','.join(['%s'] * len(chunk)),
+                               [id] + chunk))
+        return rows
+
+    def _make_search_result(self, req, terms, matches, repositories,
+                            uids_seen, row):
+        id, db_rev, ts, author, log = row
+        repos = repositories.get(id)
+        if not repos:
+            return  # revisions for a no longer active repository
+        try:
+            rev = repos.normalize_rev(db_rev)
+            drev = repos.display_rev(rev)
+        except NoSuchChangeset:
+            return
+        uid = repos.get_changeset_uid(rev)
+        if uid in uids_seen:
+            return
+        cset = repos.resource.child(self.realm, rev)
+        if 'CHANGESET_VIEW' in req.perm(cset):
+            uids_seen.add(uid)
+            score = () if matches is None \
+                    else (matches[u'%s:%s' % (id, db_rev)],)
+            return (req.href.changeset(rev, repos.reponame or None),
+                    '[%s]: %s' % (drev, shorten_line(log)),
+                    from_utimestamp(ts), author,
+                    shorten_result(log, terms)) + score
 
 
 class AnyDiffModule(Component):
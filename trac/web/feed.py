@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import threading
+import time
+from hashlib import md5
+
+from trac.config import IntOption
+from trac.core import Component
+from trac.perm import PermissionSystem
+from trac.util.datefmt import http_date
+from trac.web.chrome import Chrome
+
+__all__ = ['FeedCache']
+
+
+class FeedCache(Component):
+    """Answer the conditional requests of the feed readers and share the
+    rendered feeds between the anonymous users.
+
+    The feeds are validated by their last modification time and by
+    `extra` data identifying the variant of the feed, which always
+    include the permissions of the user.
+
+    :since: 1.3.3
+    """
+
+    cache_ttl = IntOption('trac', 'feed_cache_ttl', 60,
+        """Number of seconds the RSS feeds rendered for anonymous users
+        are cached and served to the other anonymous users, as long as
+        the feed is not modified. Set to 0 to disable the cache.
+        (''since 1.3.3'')""")
+
+    max_entries = 100
+
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def check(self, req, last_modified, extra):
+        """Send a "304 Not Modified" response if the client has a
+        current copy of the feed, or the cached feed if it is still
+        valid.
+
+        :param last_modified: the `datetime` of the last modification
+                              of the feed.
+        :param extra: a list of the other data the feed depends on.
+        :return: the key for caching the rendered feed with `send`, or
+                 `None` if the feed isn't to be cached.
+        """
+        extra = list(extra) + \
+                sorted(PermissionSystem(self.env)
+                       .get_user_permissions(req.authname))
+        req.send_header('Last-Modified', http_date(last_modified))
+        req.check_modified(last_modified, extra)
+
+        if self.cache_ttl <= 0 or req.authname != 'anonymous':
+            return None
+        digest = md5()
+        for elt in [req.abs_href(), req.path_info, req.query_string,
+                    unicode(req.locale), unicode(req.tz), req.lc_time,
+                    last_modified] + extra:
+            digest.update(repr(elt))
+        key = digest.hexdigest()
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry and entry[0] > time.time():
+            req.send(entry[1], entry[2])
+        return key
+
+    def send(self, req, key, template, data,
+             content_type='application/rss+xml'):
+        """Render the feed, cache it with the `key` returned by `check`
+        and send it.
+        """
+        content = Chrome(self.env).render_template(
+            req, template, data, {'content_type': content_type})
+        now = time.time()
+        with self._lock:
+            for k, entry in self._cache.items():
+                if entry[0] <= now:
+                    del self._cache[k]
+            if len(self._cache) < self.max_entries:
+                self._cache[key] = (now + self.cache_ttl, content,
+                                    content_type)
+        req.send(content, content_type)
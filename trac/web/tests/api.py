@@ -15,12 +15,13 @@ import io
 import os.path
 import sys
 import unittest
+from datetime import datetime
 
 from trac import perm
 from trac.core import TracError
 from trac.test import EnvironmentStub, Mock, MockPerm, mkdtemp, rmtree
 from trac.util import create_file
-from trac.util.datefmt import utc
+from trac.util.datefmt import http_date, utc
 from trac.util.html import tag
 from trac.util.text import shorten_line
 from trac.web.api import HTTPBadRequest, HTTPInternalServerError, Request, \
@@ -435,6 +436,29 @@ new\r\n\
         self.assertEqual(msie303, location(
             'Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.1; SV1)'))
 
+    def _check_modified(self, last_modified, extra='extra', **headers):
+        status_sent = []
+        def start_response(status, headers):
+            status_sent.append(status)
+        environ = _make_environ(**headers)
+        req = _make_req(environ, start_response, authname='anonymous')
+        try:
+            req.check_modified(last_modified, extra)
+        except RequestDone:
+            return status_sent[0]
+
+    def test_check_modified(self):
+        t = datetime(2018, 1, 2, 3, 4, 5, tzinfo=utc)
+        etag = 'W/"anonymous/%s/extra"' % http_date(t)
+
+        self.assertIsNone(self._check_modified(t))
+        self.assertEqual('304 Not Modified',
+                         self._check_modified(t, HTTP_IF_NONE_MATCH=etag))
+        self.assertIsNone(self._check_modified(t, HTTP_IF_NONE_MATCH='W/"x"'))
+        self.assertIsNone(self._check_modified(
+            t, HTTP_IF_NONE_MATCH='W/"x"',
+            HTTP_IF_MODIFIED_SINCE=http_date(t)))
+
     def test_write_iterable(self):
         buf = io.BytesIO()
         def write(data):
@@ -20,6 +20,7 @@ from trac.api import IEnvironmentSetupParticipant
 from trac.core import *
 from trac.wiki import model
 from trac.wiki.api import WikiSystem, validate_page_name
+from trac.wiki.links import WikiLinkIndex
 from trac.util import read_file
 from trac.util.datefmt import datetime_now, format_datetime, from_utimestamp, \
                               to_utimestamp, utc
@@ -85,6 +86,13 @@ class WikiAdmin(Component):
         yield ('wiki upgrade', '',
                'Upgrade default wiki pages to current version',
                None, self._do_upgrade)
+        yield ('wiki latest rebuild', '',
+               """Collect again the latest version of all the wiki pages
+
+               The latest versions are kept up to date by Trac, but need
+               to be collected again after the wiki table of the database
+               has been modified directly.""",
+               None, self._do_latest_rebuild)
 
     def get_wiki_list(self):
         return list(WikiSystem(self.env).get_pages())
@@ -145,8 +153,12 @@ class WikiAdmin(Component):
                       FROM wiki WHERE name=%s
                       """, (title, to_utimestamp(datetime_now(utc)), data,
                             title))
+            model.update_latest_version(db, title)
             if not old:
-                del WikiSystem(self.env).pages
+                WikiSystem(self.env)._update_pages(added=[title])
+            links = self.env[WikiLinkIndex]
+            if links:
+                links.update_page(title)
         return True
 
     def load_pages(self, dir, ignore=[], create_only=[], replace=False):
@@ -187,8 +199,8 @@ class WikiAdmin(Component):
             [(title, int(edits), format_datetime(from_utimestamp(modified),
                                                  console_datetime_format))
              for title, edits, modified in self.env.db_query("""
-                    SELECT name, max(version), max(time)
-                    FROM wiki GROUP BY name ORDER BY name""")
+                    SELECT name, version, time
+                    FROM wiki_latest ORDER BY name""")
              ], [_("Title"), _("Edits"), _("Modified")])
 
     def _do_rename(self, name, new_name):
@@ -266,6 +278,12 @@ class WikiAdmin(Component):
                         ignore=['WikiStart', 'SandBox'],
                         create_only=['InterMapTxt'])
 
+    def _do_latest_rebuild(self):
+        with self.env.db_transaction as db:
+            count = model.rebuild_latest_versions(db)
+        printout(_("Latest version of %(count)d pages collected",
+                   count=count))
+
     # IEnvironmentSetupParticipant methods
 
     def environment_created(self):
@@ -17,6 +17,7 @@
 #         Christopher Lenz <cmlenz@gmx.de>
 
 import re
+from bisect import bisect_left
 
 from trac.cache import cached
 from trac.config import BoolOption, ListOption
@@ -111,6 +112,20 @@ class IWikiMacroProvider(Interface):
         .. versionadded :: 1.0
         """
 
+    def get_macro_cache_policy(name, content):
+        """Tell whether the output of the macro can be cached.
+
+        Return `None` if the output can change at any time, which is
+        also assumed when the method is not implemented. Otherwise,
+        return a `MacroCachePolicy` telling what the output depends
+        on, besides the arguments of the macro, the wiki text and
+        resource being formatted and the permissions of the user.
+
+        This method is optional.
+
+        :since: 1.3.3
+        """
+
     def expand_macro(formatter, name, content, args=None):
         """Called by the formatter when rendering the parsed wiki text.
 
@@ -170,6 +185,38 @@ class IWikiMacroProvider(Interface):
         """
 
 
+class MacroCachePolicy(object):
+    """Cache policy of the output of a wiki macro, as returned by
+    `IWikiMacroProvider.get_macro_cache_policy`.
+
+    Without arguments, the output is static: it only depends on the
+    call of the macro.
+
+    :param realms: the realms whose changes can alter the output,
+                   e.g. `['ticket']`.
+    :param resources: the `Resource`s whose changes can alter the
+                      output.
+    :param ttl: the number of seconds after which the output expires,
+                or `None` if it doesn't expire.
+
+    Only changes to the `wiki`, `ticket`, `milestone` and `attachment`
+    realms are tracked, the output of a macro depending on another
+    realm is not cached.
+
+    :since: 1.3.3
+    """
+
+    def __init__(self, realms=(), resources=(), ttl=None):
+        self.realms = frozenset(realms)
+        self.resources = tuple(resources)
+        self.ttl = ttl
+
+    def __repr__(self):
+        return '<%s realms=%r resources=%r ttl=%r>' % \
+               (self.__class__.__name__, sorted(self.realms),
+                list(self.resources), self.ttl)
+
+
 class IWikiSyntaxProvider(Interface):
     """Enrich the Wiki syntax with new markup."""
 
@@ -196,6 +243,22 @@ class IWikiSyntaxProvider(Interface):
         for the link.
         """
 
+    def prefetch_links(formatter, links, matches):
+        """Retrieve in batches what is needed for formatting the links
+        found in a wiki text, before the text is formatted.
+
+        `links` is a dict of the targets of the TracLinks of the text
+        keyed by namespace, and `matches` is the list of the regexp
+        match objects for the syntax of this provider. The retrieved
+        data can be stored in `formatter.link_cache`, a dict whose
+        keys are chosen by the provider, and used by the link
+        resolvers and syntax callbacks.
+
+        This method is optional.
+
+        :since: 1.3.3
+        """
+
 def parse_args(args, strict=True):
     """Utility for parsing macro "content" and splitting them into arguments.
 
@@ -245,6 +308,66 @@ def validate_page_name(pagename):
            all(part not in ('', '.', '..') for part in pagename.split('/'))
 
 
+class WikiPageNames(object):
+    """Immutable collection of wiki page names, iterated in sorted
+    order and searchable by prefix.
+
+    Membership tests use a set, prefix searches use a bisection of the
+    sorted names. Updates return a new collection, so that the
+    collection can be shared between threads.
+
+    :since: 1.3.3
+    """
+
+    __slots__ = ('_names', '_sorted')
+
+    def __init__(self, names=()):
+        self._names = frozenset(names)
+        self._sorted = sorted(self._names)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __iter__(self):
+        return iter(self._sorted)
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def __repr__(self):
+        return '<%s %d pages>' % (self.__class__.__name__, len(self))
+
+    def startswith(self, prefix):
+        """Iterate in sorted order over the names starting with
+        `prefix`.
+        """
+        names = self._sorted
+        for idx in xrange(bisect_left(names, prefix), len(names)):
+            name = names[idx]
+            if not name.startswith(prefix):
+                break
+            yield name
+
+    def updated(self, added=(), removed=()):
+        """Return a new collection with the names in `added` and
+        without the names in `removed`.
+        """
+        added = set(added) - self._names
+        removed = self._names.intersection(removed)
+        if not added and not removed:
+            return self
+        names = WikiPageNames.__new__(WikiPageNames)
+        names._names = (self._names - removed) | added
+        if removed:
+            names._sorted = [name for name in self._sorted
+                             if name not in removed]
+        else:
+            names._sorted = list(self._sorted)
+        for name in added:
+            names._sorted.insert(bisect_left(names._sorted, name), name)
+        return names
+
+
 class WikiSystem(Component):
     """Wiki system manager."""
 
@@ -292,21 +415,33 @@ class WikiSystem(Component):
 
     @cached
     def pages(self):
-        """Return the names of all existing wiki pages."""
-        return {name for name,
-                     in self.env.db_query("SELECT DISTINCT name FROM wiki")}
+        """Return the names of all existing wiki pages, as a
+        `WikiPageNames` collection (''since 1.3.3'').
+        """
+        return WikiPageNames(name for name,
+                             in self.env.db_query("SELECT DISTINCT name "
+                                                  "FROM wiki"))
+
+    def _update_pages(self, added=(), removed=()):
+        """Update the page name cache of this process in place, instead
+        of reading all the page names again, and invalidate it in
+        other processes.
+        """
+        WikiSystem.pages.update(self, lambda pages: pages.updated(added,
+                                                                  removed))
 
     # Public API
 
     def get_pages(self, prefix=None):
-        """Iterate over the names of existing Wiki pages.
+        """Iterate over the names of existing Wiki pages, in sorted
+        order (''since 1.3.3'').
 
         :param prefix: if given, only names that start with that
           prefix are included.
         """
-        for page in self.pages:
-            if not prefix or page.startswith(prefix):
-                yield page
+        if prefix:
+            return self.pages.startswith(prefix)
+        return iter(self.pages)
 
     def has_page(self, pagename):
         """Whether a page with the specified name exists."""
@@ -426,6 +561,8 @@ class WikiSystem(Component):
             pagename = self._resolve_relative_name(pagename, referrer)
         else:
             pagename = self._resolve_scoped_name(pagename, referrer)
+        if not ignore_missing or self.has_page(pagename):
+            formatter.add_link_target(self.realm, pagename)
         label = unquote_label(label)
         if 'WIKI_VIEW' in formatter.perm(self.realm, pagename, version):
             href = formatter.href.wiki(pagename, version=version) + query \
@@ -463,12 +600,13 @@ class WikiSystem(Component):
         referrer = referrer.split('/')
         if len(referrer) == 1:           # Non-hierarchical referrer
             return pagename
+        pages = self.pages
         # Test for pages with same name, higher in the hierarchy
         for i in xrange(len(referrer) - 1, 0, -1):
             name = '/'.join(referrer[:i]) + '/' + pagename
-            if self.has_page(name):
+            if name.rstrip('/') in pages:
                 return name
-        if self.has_page(pagename):
+        if pagename.rstrip('/') in pages:
             return pagename
         # If we are on First/Second/Third, and pagename is Second/Other,
         # resolve to First/Second/Other instead of First/Second/Second/Other
@@ -37,12 +37,13 @@ from trac.util.html import (
 )
 from trac.util.translation import _, tag_
 from trac.wiki.api import WikiSystem, parse_args
-from trac.wiki.parser import WikiParser, parse_processor_args
+from trac.wiki.parser import WikiDocument, WikiParser, parse_processor_args
 
 __all__ = ['Formatter', 'MacroError', 'ProcessorError',
            'concat_path_query_fragment', 'extract_link', 'format_to',
            'format_to_html', 'format_to_oneliner',
-           'split_url_into_path_query_fragment', 'wiki_to_outline']
+           'split_url_into_path_query_fragment', 'wiki_to_outline',
+           'write_outline']
 
 
 def _markup_to_unicode(markup):
@@ -354,6 +355,17 @@ class WikiProcessor(object):
     def _macro_processor(self, text):
         self.env.log.debug('Executing Wiki macro %s by provider %s',
                            self.name, self.macro_provider)
+        self.formatter._add_dependency('macro', self.macro_provider,
+                                       self.name, text)
+        from trac.wiki.htmlcache import WikiHtmlCache
+        cache = self.env[WikiHtmlCache]
+        if cache is None:
+            return self._expand_macro(text)
+        return cache.expand_macro(self.formatter, self.macro_provider,
+                                  self.name, text, self.args,
+                                  lambda: self._expand_macro(text))
+
+    def _expand_macro(self, text):
         if arity(self.macro_provider.expand_macro) == 4:
             return self.macro_provider.expand_macro(self.formatter, self.name,
                                                     text, self.args)
@@ -450,6 +462,7 @@ class Formatter(object):
         self._safe_schemes = None
         if not self.wiki.render_unsafe_content:
             self._safe_schemes = set(self.wiki.safe_schemes)
+        self.link_cache = {}
 
 
     def split_link(self, target):
@@ -679,6 +692,7 @@ class Formatter(object):
         # first check for an alias defined in trac.ini
         ns = self.env.config['intertrac'].get(ns, ns)
         if ns in self.wikiparser.link_resolvers:
+            self._add_dependency('link', ns)
             resolver = self.wikiparser.link_resolvers[ns]
             if arity(resolver) == 5:
                 return resolver(self, ns, target, escape(label, False),
@@ -703,6 +717,7 @@ class Formatter(object):
             else:
                 return escape(match)
         else:
+            self._add_dependency('resource', 'wiki', 'InterMapTxt')
             return self._make_intertrac_link(ns, target, label) or \
                    self._make_interwiki_link(ns, target, label) or \
                    escape(match)
@@ -824,15 +839,19 @@ class Formatter(object):
 
     # Headings
 
+    def _get_heading_text(self, fullmatch):
+        hdepth = fullmatch.group('hdepth')
+        htext = fullmatch.group('htext').strip()
+        if htext.endswith(hdepth):
+            htext = htext[:-len(hdepth)]
+        return htext
+
     def _parse_heading(self, match, fullmatch, shorten):
         match = match.strip()
 
-        hdepth = fullmatch.group('hdepth')
-        depth = len(hdepth)
+        depth = len(fullmatch.group('hdepth'))
         anchor = fullmatch.group('hanchor') or ''
-        htext = fullmatch.group('htext').strip()
-        if htext.endswith(hdepth):
-            htext = htext[:-depth]
+        htext = self._get_heading_text(fullmatch)
         heading = format_to_oneliner(self.env, self.context, htext, False)
         if anchor:
             anchor = anchor[1:]
@@ -854,9 +873,61 @@ class Formatter(object):
         self.close_list()
         self.close_def_list()
         depth, heading, anchor = self._parse_heading(match, fullmatch, False)
+        self.headings.append((depth, anchor, heading,
+                              self._get_heading_text(fullmatch)))
         self.out.write(u'<h%d class="section" id="%s">%s</h%d>' %
                        (depth, anchor, heading, depth))
 
+    # Outline
+
+    _outline_re = re.compile(r'<!--outline ([1-6]) ([1-6]) ([01])-->')
+
+    def outline_placeholder(self, max_depth=6, min_depth=1, shorten=True):
+        """Return a placeholder for the outline of the headings of the
+        formatted text, from `min_depth` to `max_depth`.
+
+        The placeholder is replaced by the outline once the whole text
+        has been formatted, using the `headings` recorded meanwhile, so
+        that the text isn't formatted again for its outline.
+
+        :since: 1.3.3
+        """
+        if min_depth > max_depth:
+            min_depth, max_depth = max_depth, min_depth
+        max_depth = max(1, min(6, max_depth))
+        min_depth = max(1, min(6, min_depth))
+        return Markup(u'<!--outline %d %d %d-->'
+                      % (max_depth, min_depth, bool(shorten)))
+
+    def fill_outlines(self, html, headings=None):
+        """Replace the outline placeholders in the formatted `html`.
+
+        :param headings: the `(depth, anchor, heading, text)` of the
+                         headings of the text, defaults to the
+                         `headings` recorded by the formatter.
+
+        :since: 1.3.3
+        """
+        if '<!--outline ' not in html:
+            return html
+        if headings is None:
+            headings = self.headings
+        def replace(match):
+            max_depth, min_depth, shorten = [int(group)
+                                             for group in match.groups()]
+            outline = [(depth, anchor,
+                        self._get_outline_heading(heading, text, shorten))
+                       for depth, anchor, heading, text in headings]
+            out = io.StringIO()
+            write_outline(out, outline, max_depth, min_depth)
+            return out.getvalue()
+        return self._outline_re.sub(replace, html)
+
+    def _get_outline_heading(self, heading, text, shorten):
+        if shorten and shorten_line(text) != text:
+            heading = format_to_oneliner(self.env, self.context, text, True)
+        return re.sub(r'</?a(?: .*?)?>', '', heading) # Strip out link tags
+
     # Generic indentation (as defined by lists and quotes)
 
     def _set_tab(self, depth):
@@ -1252,15 +1323,41 @@ class Formatter(object):
     def handle_match(self, fullmatch):
         for itype, match in fullmatch.groupdict().items():
             if match and not itype in self.wikiparser.helper_patterns:
-                # Check for preceding escape character '!'
-                if match[0] == '!':
-                    return escape(match[1:])
-                if itype in self.wikiparser.external_handlers:
-                    external_handler = self.wikiparser.external_handlers[itype]
-                    return external_handler(self, match, fullmatch)
-                else:
-                    internal_handler = getattr(self, '_%s_formatter' % itype)
-                    return internal_handler(match, fullmatch)
+                return self._handle_markup(itype, match, fullmatch)
+
+    def _handle_markup(self, itype, match, fullmatch):
+        # Check for preceding escape character '!'
+        if match[0] == '!':
+            return escape(match[1:])
+        if itype in self.wikiparser.external_handlers:
+            self._add_dependency('syntax',
+                                 self.wikiparser.external_providers[itype])
+            external_handler = self.wikiparser.external_handlers[itype]
+            return external_handler(self, match, fullmatch)
+        else:
+            internal_handler = getattr(self, '_%s_formatter' % itype)
+            return internal_handler(match, fullmatch)
+
+    def _add_dependency(self, *dependency):
+        # Tell the `WikiHtmlCache` what the formatted text depends on
+        dependencies = self.context.get_hint('wiki_dependencies')
+        if dependencies is not None:
+            dependencies.add(dependency)
+
+    def add_link_target(self, realm, id):
+        """Record that the text links to the resource identified by
+        `realm` and `id`, when the links are collected for the
+        `WikiLinkIndex`, and that the formatted text depends on that
+        resource for the `WikiHtmlCache`.
+
+        Called by the link resolvers of the `IWikiSyntaxProvider`s.
+
+        :since: 1.3.3
+        """
+        links = self.context.get_hint('wiki_links')
+        if links is not None:
+            links.add((realm, unicode(id)))
+        self._add_dependency('resource', realm, id)
 
     def replace(self, fullmatch):
         """Replace one match with its corresponding expansion"""
@@ -1268,16 +1365,38 @@ class Formatter(object):
         if replacement:
             return _markup_to_unicode(replacement)
 
+    def format_tokens(self, tokens):
+        """Replace the markup of the `tokens` of a line, as returned by
+        `WikiDocument.tokenize`, with its expansion.
+
+        :since: 1.3.3
+        """
+        result = []
+        for token in tokens:
+            if isinstance(token, basestring):
+                result.append(token)
+            else:
+                replacement = self._handle_markup(*token)
+                if replacement:
+                    result.append(_markup_to_unicode(replacement))
+        return u''.join(result)
+
     _normalize_re = re.compile(r'[\v\f]', re.UNICODE)
 
     def reset(self, source, out=None):
-        if isinstance(source, basestring):
-            source = re.sub(self._normalize_re, ' ', source)
+        if isinstance(source, WikiDocument):
+            self.document = source
+            source = source.text
+        else:
+            self.document = None
+            if isinstance(source, basestring):
+                source = re.sub(self._normalize_re, ' ', source)
         self.source = source
         class NullOut(object):
             def write(self, data):
                 pass
         self.out = out or NullOut()
+        self.headings = []
         self._open_tags = []
         self._list_stack = []
         self._quote_stack = []
@@ -1294,14 +1413,76 @@ class Formatter(object):
         self.paragraph_open = 0
         return source
 
+    def prefetch_links(self, document, lines=None):
+        """Let the `IWikiSyntaxProvider`s implementing `prefetch_links`
+        retrieve in batches what is needed for formatting the links
+        found in the `WikiDocument`, outside of the code blocks.
+
+        If `lines` is given, only the links found in these lines of the
+        document are considered.
+
+        :since: 1.3.3
+        """
+        providers = [provider for provider in self.wiki.syntax_providers
+                     if hasattr(provider, 'prefetch_links')]
+        if not providers:
+            return
+        intertrac = self.env.config['intertrac']
+        external_providers = self.wikiparser.external_providers
+        links = {}
+        matches = {}
+        in_code_block = 0
+        for line in document.lines if lines is None else lines:
+            if WikiParser.ENDBLOCK not in line and \
+                    WikiParser._startblock_re.match(line):
+                in_code_block += 1
+            elif line.strip() == WikiParser.ENDBLOCK:
+                if in_code_block:
+                    in_code_block -= 1
+            elif not in_code_block:
+                line = line.replace('\t', ' ' * 8)
+                for token in document.tokenize(line):
+                    if isinstance(token, basestring):
+                        continue
+                    itype, match, fullmatch = token
+                    if match[0] == '!':
+                        continue
+                    if itype in external_providers:
+                        matches.setdefault(external_providers[itype],
+                                           []).append(fullmatch)
+                        continue
+                    if itype in ('shref', 'shrefbr'):
+                        suffix = itype[5:]
+                        ns = fullmatch.group('sns' + suffix)
+                        target = fullmatch.group('stgt' + suffix)
+                    elif itype == 'lhref' and not fullmatch.group('rel'):
+                        ns = fullmatch.group('lns') or 'wiki'
+                        target = fullmatch.group('ltgt') or ''
+                    else:
+                        continue
+                    links.setdefault(intertrac.get(ns, ns), set()) \
+                         .add(unquote_label(target))
+        for provider in providers:
+            provider.prefetch_links(self, links, matches.get(provider, []))
+
     def format(self, text, out=None, escape_newlines=False):
-        text = self.reset(text, out)
-        if isinstance(text, basestring):
-            text = text.splitlines()
+        buf = io.StringIO() if out is not None else None
+        self.reset(self.wikiparser.parse(text, cache=True), buf)
+        self.prefetch_links(self.document)
+        self.format_lines(self.document.lines, escape_newlines)
+        if out is not None:
+            out.write(self.fill_outlines(buf.getvalue()))
+
+    def format_lines(self, lines, escape_newlines=False):
+        """Format `lines` of wiki text, after the formatter has been
+        `reset` with the `WikiDocument` containing these lines, which
+        is then the `document` attribute of the formatter.
+
+        The blocks opened by the lines are closed at the end.
 
-        for line in text:
-            if isinstance(line, str):
-                line = line.decode('utf-8')
+        :since: 1.3.3
+        """
+        for line in lines:
             # Detect start of code block (new block or embedded block)
             block_start_match = None
             if WikiParser.ENDBLOCK not in line:
@@ -1351,7 +1532,7 @@ class Formatter(object):
             self.in_quote = False
             # Throw a bunch of regexps on the problem
             self.line = line
-            result = re.sub(self.wikiparser.rules, self.replace, line)
+            result = self.format_tokens(self.document.tokenize(line))
 
             if not self.in_list_item:
                 self.close_list()
@@ -1425,15 +1606,13 @@ class OneLinerFormatter(Formatter):
     def format(self, text, out, shorten=False):
         if not text:
             return
-        text = self.reset(text, out)
+        text = self.reset(self.wikiparser.parse(text), out)
 
         # Simplify code blocks
         in_code_block = 0
         processor = None
         buf = io.StringIO()
         for line in text.strip().splitlines():
-            if isinstance(line, str):
-                line = line.decode('utf-8')
             if WikiParser.ENDBLOCK not in line and \
                    WikiParser._startblock_re.match(line):
                 in_code_block += 1
@@ -1455,7 +1634,7 @@ class OneLinerFormatter(Formatter):
         if shorten:
             result = shorten_line(result)
 
-        result = re.sub(self.wikiparser.rules, self.replace, result)
+        result = self.format_tokens(self.document.tokenize(result))
         result = result.replace('[...]', u'[\u2026]')
         if result.endswith('...'):
             result = result[:-3] + u'\u2026'
@@ -1491,40 +1670,23 @@ class OutlineFormatter(Formatter):
 
     def format(self, text, out, max_depth=6, min_depth=1, shorten=True):
         self.shorten = shorten
-        whitespace_indent = '  '
         self.outline = []
-        Formatter.format(self, text)
+        self._headings_only = True
+        try:
+            Formatter.format(self, text)
+        finally:
+            self._headings_only = False
 
         if min_depth > max_depth:
             min_depth, max_depth = max_depth, min_depth
-        max_depth = min(6, max_depth)
-        min_depth = max(1, min_depth)
+        write_outline(out, self.outline, min(6, max_depth), max(1, min_depth))
 
-        curr_depth = min_depth - 1
-        out.write(u'\n')
-        for depth, anchor, text in self.outline:
-            if depth < min_depth or depth > max_depth:
-                continue
-            if depth > curr_depth: # Deeper indent
-                for i in xrange(curr_depth, depth):
-                    out.write(whitespace_indent * (2*i) + u'<ol>\n' +
-                              whitespace_indent * (2*i+1) + u'<li>\n')
-            elif depth < curr_depth: # Shallower indent
-                for i in xrange(curr_depth-1, depth-1, -1):
-                    out.write(whitespace_indent * (2*i+1) + u'</li>\n' +
-                              whitespace_indent * (2*i) + u'</ol>\n')
-                out.write(whitespace_indent * (2*depth-1) + u'</li>\n' +
-                          whitespace_indent * (2*depth-1) + u'<li>\n')
-            else: # Same indent
-                out.write( whitespace_indent * (2*depth-1) + u'</li>\n' +
-                           whitespace_indent * (2*depth-1) + u'<li>\n')
-            curr_depth = depth
-            out.write(whitespace_indent * (2*depth) +
-                      u'<a href="#%s">%s</a>\n' % (anchor, text))
-        # Close out all indentation
-        for i in xrange(curr_depth-1, min_depth-2, -1):
-            out.write(whitespace_indent * (2*i+1) + u'</li>\n' +
-                      whitespace_indent * (2*i) + u'</ol>\n')
+    _headings_only = False
+
+    def _handle_markup(self, itype, match, fullmatch):
+        # The output is discarded, only the headings are needed
+        if itype == 'heading' or not self._headings_only:
+            return Formatter._handle_markup(self, itype, match, fullmatch)
 
     def _heading_formatter(self, match, fullmatch):
         depth, heading, anchor = self._parse_heading(match, fullmatch,
@@ -1549,6 +1711,41 @@ class LinkFormatter(OutlineFormatter):
             return self.handle_match(match)
 
 
+def write_outline(out, outline, max_depth=6, min_depth=1):
+    """Write the HTML of the nested lists of the `outline` to `out`.
+
+    :param outline: the `(depth, anchor, heading)` of the headings.
+
+    :since: 1.3.3
+    """
+    whitespace_indent = '  '
+    curr_depth = min_depth - 1
+    out.write(u'\n')
+    for depth, anchor, text in outline:
+        if depth < min_depth or depth > max_depth:
+            continue
+        if depth > curr_depth: # Deeper indent
+            for i in xrange(curr_depth, depth):
+                out.write(whitespace_indent * (2*i) + u'<ol>\n' +
+                          whitespace_indent * (2*i+1) + u'<li>\n')
+        elif depth < curr_depth: # Shallower indent
+            for i in xrange(curr_depth-1, depth-1, -1):
+                out.write(whitespace_indent * (2*i+1) + u'</li>\n' +
+                          whitespace_indent * (2*i) + u'</ol>\n')
+            out.write(whitespace_indent * (2*depth-1) + u'</li>\n' +
+                      whitespace_indent * (2*depth-1) + u'<li>\n')
+        else: # Same indent
+            out.write( whitespace_indent * (2*depth-1) + u'</li>\n' +
+                       whitespace_indent * (2*depth-1) + u'<li>\n')
+        curr_depth = depth
+        out.write(whitespace_indent * (2*depth) +
+                  u'<a href="#%s">%s</a>\n' % (anchor, text))
+    # Close out all indentation
+    for i in xrange(curr_depth-1, min_depth-2, -1):
+        out.write(whitespace_indent * (2*i+1) + u'</li>\n' +
+                  whitespace_indent * (2*i) + u'</ol>\n')
+
+
 # Pure Wiki Formatter
 
 class HtmlFormatter(object):
@@ -1560,7 +1757,7 @@ class HtmlFormatter(object):
         self.env = env
         self.context = context
         if isinstance(wikidom, basestring):
-            wikidom = WikiParser(env).parse(wikidom)
+            wikidom = WikiParser(env).parse(wikidom, cache=True)
         self.wikidom = wikidom
 
     def generate(self, escape_newlines=False):
@@ -1642,5 +1839,6 @@ def wiki_to_outline(wikitext, env, db=None,
     from trac.web.chrome import web_context
     context = web_context(req, absurls=absurls)
     out = io.StringIO()
-    OutlineFormatter(env, context).format(wikitext, out, max_depth, min_depth)
+    OutlineFormatter(env, context).format(wikitext, out, max_depth or 6,
+                                          min_depth or 1)
     return Markup(out.getvalue())
@@ -0,0 +1,676 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from collections import OrderedDict
+from hashlib import sha1
+import io
+import re
+import threading
+import time
+import zlib
+
+from trac.attachment import IAttachmentChangeListener
+from trac.cache import CacheManager, key_to_id
+from trac.config import IntOption
+from trac.core import *
+from trac.perm import PermissionSystem
+from trac.ticket.api import IMilestoneChangeListener, ITicketChangeListener
+from trac.util.html import Fragment, Markup
+from trac.wiki.api import IWikiChangeListener
+from trac.wiki.formatter import Formatter, format_to_html
+from trac.wiki.parser import WikiParser
+
+
+class _RecordingAnchors(dict):
+    """The anchors used by a `Formatter`, recording whether the anchors
+    looked up were already used before.
+    """
+
+    def __init__(self, anchors):
+        dict.__init__(self, anchors)
+        self.lookups = {}
+
+    def __contains__(self, anchor):
+        used = dict.__contains__(self, anchor)
+        self.lookups.setdefault(anchor, used)
+        return used
+
+
+class WikiHtmlCache(Component):
+    """Keep the HTML of the rendered wiki pages and of the expanded
+    wiki macros in memory.
+
+    The rendered pages are keyed on the page version and text, and on
+    what affects the rendering for the user: the permissions, the
+    locale and the timezone. While formatting a page, the `Formatter`
+    records the TracLinks namespaces, the resources they link to, the
+    syntax providers and the macros used by the text, and the page is
+    only cached if the realms they depend on are known. A change to a
+    linked resource, e.g. a ticket, invalidates the pages linking to
+    it, in all the processes, and adding, deleting or renaming a wiki
+    page invalidates the pages linking to wiki pages.
+
+    The output of the macros returning a `MacroCachePolicy` is also
+    kept, so that it is reused when the page can't be cached as a
+    whole.
+
+    The sections of the wiki text previewed while a page is edited are
+    kept as well, so that only the changed sections are formatted
+    again.
+    """
+
+    implements(IAttachmentChangeListener, IMilestoneChangeListener,
+               ITicketChangeListener, IWikiChangeListener)
+
+    html_cache_size = IntOption('wiki', 'html_cache_size', 100,
+        """Number of rendered wiki pages kept in memory, so that a page
+        viewed again is not formatted again unless something it links
+        to has changed. Set to 0 for disabling the cache.
+        (''since 1.3.3'')
+        """)
+
+    macro_cache_size = IntOption('wiki', 'macro_cache_size', 500,
+        """Number of wiki macro outputs kept in memory, for the macros
+        declaring a cache policy. Set to 0 for disabling the cache.
+        (''since 1.3.3'')
+        """)
+
+    section_cache_size = IntOption('wiki', 'section_cache_size', 1000,
+        """Number of formatted sections of wiki text kept in memory, so
+        that the preview of a page being edited only formats again the
+        sections which changed. Set to 0 for disabling the cache.
+        (''since 1.3.3'')
+        """)
+
+    #: The realm of the resources checked by the link resolvers, or
+    #: `None` for the namespaces of links only depending on the target.
+    link_realms = {
+        'attachment': 'attachment', 'raw-attachment': 'attachment',
+        'bug': 'ticket', 'comment': 'ticket', 'issue': 'ticket',
+        'ticket': 'ticket', 'milestone': 'milestone', 'wiki': 'wiki',
+        'htdocs': None, 'query': None, 'search': None,
+    }
+
+    #: The link namespaces whose resolvers report the resources the
+    #: links depend on with `Formatter.add_link_target`.
+    resource_link_namespaces = frozenset(('bug', 'comment', 'issue',
+                                          'milestone', 'ticket', 'wiki'))
+
+    #: The policies which only check global permissions for viewing
+    #: the resources.
+    default_policies = frozenset(('DefaultWikiPolicy', 'DefaultTicketPolicy',
+                                  'DefaultPermissionPolicy',
+                                  'LegacyAttachmentPolicy'))
+
+    #: The context hints which can change the output of a macro.
+    macro_hints = ('disable_warnings', 'preserve_newlines', 'shorten_lines',
+                   'wiki_flavor')
+
+    #: Number of tokens shared by the resources of a realm.
+    resource_tokens = 64
+
+    def __init__(self):
+        self._pages = OrderedDict()
+        self._macros = OrderedDict()
+        self._sections = OrderedDict()
+        self._token_ids = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.uncacheable = 0
+        self.section_hits = self.section_misses = 0
+        # The number of expansions, of cache hits and the time spent
+        # expanding, for each macro name
+        self.macro_statistics = {}
+
+    # Public API
+
+    def render(self, context, page, text):
+        """Return the HTML of the wiki `text` of `page`, from the cache
+        if possible.
+
+        `text` is the text of the page as transformed by the
+        `IWikiPageManipulator`s. The links, scripts and script data
+        added to the request while the page was formatted are added
+        again when it's taken from the cache.
+        """
+        if self.html_cache_size <= 0 or not page.exists:
+            return format_to_html(self.env, context, text)
+        req = context.req
+        key = (page.name, page.version, self._hash(text)) + \
+              self._get_rendering_key(req)
+        entry = self._lookup(self._pages, key)
+        if entry is not None:
+            html, tokens, expires, changes = entry
+            if self._is_valid(tokens, expires):
+                self._replay_chrome_changes(req, changes)
+                self._count('hits', "hit", page)
+                return html
+
+        realm_tokens = self._get_realm_tokens()
+        dependencies = set()
+        context = context.child()
+        context.set_hints(wiki_dependencies=dependencies)
+        before = self._get_chrome_state(req)
+        html = format_to_html(self.env, context, text)
+        changes = self._get_chrome_changes(req, before)
+        tokens = self._get_tokens(dependencies, realm_tokens)
+        if tokens is None or changes is None:
+            self._count('uncacheable', "not cacheable", page)
+            return html
+        tokens, expires = tokens
+        self._store(self._pages, key, (html, tokens, expires, changes),
+                    self.html_cache_size)
+        self._count('misses', "miss", page)
+        return html
+
+    def render_sections(self, context, text):
+        """Return the HTML of the wiki `text`, only formatting the
+        sections of the text not found in the cache.
+
+        The text is split before the top-level headings following an
+        empty line outside of the code blocks, where the formatter
+        starts afresh. A formatted section is reused when the anchors
+        it generated are still unique in the text, and when it calls
+        macros, only for the same text, as the output of a macro can
+        depend on the whole text. The outlines are filled in with the
+        headings of all the sections.
+
+        :since: 1.3.3
+        """
+        req = context.req
+        if self.section_cache_size <= 0 or req is None:
+            return format_to_html(self.env, context, text)
+        document = WikiParser(self.env).parse(text, cache=True)
+        if not document:
+            return Markup()
+        text_hash = self._hash(document.text)
+        rendering_key = (repr(context.resource),
+                         tuple(context.get_hint(hint)
+                               for hint in self.macro_hints)) + \
+                        self._get_rendering_key(req)
+        realm_tokens = self._get_realm_tokens()
+        anchors = {}
+        headings = []
+        html = []
+        formatted = 0
+        for lines in self._split_sections(document.lines):
+            key = (self._hash(u'\n'.join(lines)),) + rendering_key
+            entry = self._lookup(self._sections, key)
+            if entry is not None:
+                (section_html, section_headings, lookups, added,
+                 source_hash, tokens, expires, changes) = entry
+                if source_hash in (None, text_hash) and \
+                        all((anchor in anchors) == used
+                            for anchor, used in lookups.iteritems()) and \
+                        self._is_valid(tokens, expires):
+                    anchors.update(added)
+                    self._replay_chrome_changes(req, changes)
+                    headings.extend(section_headings)
+                    html.append(section_html)
+                    continue
+
+            dependencies = set()
+            section_context = context.child()
+            section_context.set_hints(wiki_dependencies=dependencies)
+            recorder = _RecordingAnchors(anchors)
+            before = self._get_chrome_state(req)
+            section_html, section_headings = \
+                self._format_section(section_context, document, lines,
+                                     recorder)
+            headings.extend(section_headings)
+            html.append(section_html)
+            formatted += 1
+            added = {anchor: True for anchor in recorder
+                     if anchor not in anchors}
+            anchors.update(added)
+            changes = self._get_chrome_changes(req, before)
+            tokens = self._get_tokens(dependencies, realm_tokens)
+            if tokens is None or changes is None:
+                continue
+            tokens, expires = tokens
+            source_hash = None
+            if any(dependency[0] == 'macro' for dependency in dependencies):
+                source_hash = text_hash
+            self._store(self._sections, key,
+                        (section_html, section_headings, recorder.lookups,
+                         added, source_hash, tokens, expires, changes),
+                        self.section_cache_size)
+        with self._lock:
+            self.section_hits += len(html) - formatted
+            self.section_misses += formatted
+        self.log.debug("Wiki HTML cache formatted %d of %d sections for "
+                       "%s", formatted, len(html), context.resource)
+        html = Formatter(self.env, context).fill_outlines(u''.join(html),
+                                                          headings)
+        return Markup(html)
+
+    def expand_macro(self, formatter, provider, name, content, args,
+                     expand):
+        """Return the output of the macro `name` of `provider`, as
+        returned by `expand()`, from the cache if possible.
+
+        The output is kept when the provider returns a
+        `MacroCachePolicy`, and reused for the same call of the macro
+        in the same wiki text and resource, rendered with the same
+        context hints for the same permissions, locale and timezone.
+        """
+        req = formatter.req
+        policy = self._get_macro_policy(provider, name, content)
+        if policy is None or req is None:
+            return self._expand(name, expand)
+        keys, ttl = policy
+        context = formatter.context
+        dependencies = context.get_hint('wiki_dependencies')
+        key = None
+        if self.macro_cache_size > 0:
+            key = self._get_macro_key(formatter, provider, name, content,
+                                      args)
+            entry = self._lookup(self._macros, key)
+            if entry is not None:
+                output, tokens, expires, nested, changes = entry
+                if self._is_valid(tokens, expires):
+                    if dependencies is not None:
+                        dependencies.add(('tokens', tokens, expires))
+                        dependencies.update(nested)
+                    self._replay_chrome_changes(req, changes)
+                    self._add_macro_statistics(name, True, 0)
+                    return output
+
+        realm_tokens = self._get_realm_tokens()
+        tokens = tuple((token_key, self._get_token(*token_key))
+                       for token_key in keys)
+        expires = time.time() + ttl if ttl is not None else None
+        if dependencies is not None:
+            dependencies.add(('tokens', tokens, expires))
+        if key is None:
+            return self._expand(name, expand)
+        nested = set()
+        context.set_hints(wiki_dependencies=nested)
+        before = self._get_chrome_state(req)
+        try:
+            output = self._expand(name, expand)
+        finally:
+            context.set_hints(wiki_dependencies=dependencies)
+        if dependencies is not None:
+            dependencies.update(nested)
+        changes = self._get_chrome_changes(req, before)
+        nested_tokens = self._get_tokens(nested, realm_tokens)
+        if nested_tokens is not None and changes is not None and \
+                isinstance(output, (basestring, Fragment)):
+            nested_tokens, nested_expires = nested_tokens
+            if nested_expires is not None:
+                expires = min(expires or nested_expires, nested_expires)
+            self._store(self._macros, key,
+                        (output, tokens + nested_tokens, expires, nested,
+                         changes),
+                        self.macro_cache_size)
+        return output
+
+    @property
+    def hit_rate(self):
+        """Fraction of the rendered pages taken from the cache."""
+        total = self.hits + self.misses + self.uncacheable
+        return float(self.hits) / total if total else 0.0
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self._invalidate('wiki', page.name)
+        self._invalidate_pages()
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        self._invalidate('wiki', page.name)
+
+    def wiki_page_deleted(self, page):
+        self._invalidate('wiki', page.name)
+        self._invalidate_pages()
+
+    def wiki_page_version_deleted(self, page):
+        self._invalidate('wiki', page.name)
+
+    def wiki_page_renamed(self, page, old_name):
+        self._invalidate('wiki', page.name, old_name)
+        self._invalidate_pages()
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self._invalidate('ticket', ticket.id)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self._invalidate('ticket', ticket.id)
+
+    def ticket_deleted(self, ticket):
+        self._invalidate('ticket', ticket.id)
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        self._invalidate('ticket', ticket.id)
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        self._invalidate('ticket', ticket.id)
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        self._invalidate('milestone', milestone.name)
+
+    def milestone_changed(self, milestone, old_values):
+        self._invalidate('milestone', milestone.name,
+                         old_values.get('name'))
+
+    def milestone_deleted(self, milestone):
+        self._invalidate('milestone', milestone.name)
+
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        self._invalidate('attachment',
+                         self._get_resource_id(attachment.resource))
+
+    def attachment_deleted(self, attachment):
+        self._invalidate('attachment',
+                         self._get_resource_id(attachment.resource))
+
+    def attachment_moved(self, attachment, old_parent_realm, old_parent_id,
+                         old_filename):
+        self._invalidate('attachment',
+                         self._get_resource_id(attachment.resource),
+                         '%s:%s:%s' % (old_parent_realm, old_parent_id,
+                                       old_filename))
+
+    # Internal methods
+
+    # A token is an object replaced when a resource of a realm changes,
+    # kept by the `CacheManager` for invalidating the cached outputs in
+    # all the processes. Each realm has a token, and the resources of a
+    # realm share `resource_tokens` other tokens. As the target of a
+    # wiki link depends on the pages which exist, another token is
+    # replaced when a wiki page is added, deleted or renamed.
+
+    _tracked_realms = ('attachment', 'milestone', 'ticket', 'wiki')
+
+    _pages_key = ('wiki-pages', None)
+
+    def _get_token_id(self, realm, id=None):
+        if id is not None:
+            crc = zlib.crc32(unicode(id).encode('utf-8')) & 0xffffffff
+            id = crc % self.resource_tokens
+        try:
+            return self._token_ids[(realm, id)]
+        except KeyError:
+            key = '%s.%s.%s' % (self.__module__, self.__class__.__name__,
+                                realm)
+            if id is not None:
+                key += '.%d' % id
+            token_id = self._token_ids[(realm, id)] = key_to_id(key)
+            return token_id
+
+    def _get_token(self, realm, id=None):
+        return CacheManager(self.env).get(self._get_token_id(realm, id),
+                                          lambda instance: object(), self)
+
+    def _get_realm_tokens(self):
+        keys = [(realm, None) for realm in self._tracked_realms]
+        keys.append(self._pages_key)
+        return {key: self._get_token(*key) for key in keys}
+
+    def _invalidate(self, realm, *ids):
+        cache = CacheManager(self.env)
+        cache.invalidate(self._get_token_id(realm))
+        for id in ids:
+            if id is not None:
+                cache.invalidate(self._get_token_id(realm, id))
+
+    def _invalidate_pages(self):
+        CacheManager(self.env).invalidate(self._get_token_id(
+            *self._pages_key))
+
+    _section_re = re.compile(r'=\s')
+
+    def _split_sections(self, lines):
+        """Split the `lines` of a wiki text before the top-level
+        headings following an empty line outside of the code blocks.
+        """
+        start = 0
+        in_code_block = 0
+        for idx, line in enumerate(lines):
+            if WikiParser.ENDBLOCK not in line and \
+                    WikiParser._startblock_re.match(line):
+                in_code_block += 1
+            elif line.strip() == WikiParser.ENDBLOCK:
+                if in_code_block:
+                    in_code_block -= 1
+            elif not in_code_block and idx > start and \
+                    lines[idx - 1] == '' and self._section_re.match(line):
+                yield lines[start:idx]
+                start = idx
+        yield lines[start:]
+
+    def _format_section(self, context, document, lines, anchors):
+        out = io.StringIO()
+        formatter = Formatter(self.env, context)
+        formatter._anchors = anchors
+        formatter.reset(document, out)
+        formatter.prefetch_links(document, lines)
+        formatter.format_lines(lines)
+        return out.getvalue(), formatter.headings
+
+    def _get_resource_id(self, resource):
+        if resource.realm == 'attachment' and resource.parent:
+            return '%s:%s:%s' % (resource.parent.realm, resource.parent.id,
+                                 resource.id)
+        return resource.id
+
+    def _is_valid(self, tokens, expires):
+        return (expires is None or time.time() < expires) and \
+               all(self._get_token(*key) is token for key, token in tokens)
+
+    def _get_tokens(self, dependencies, realm_tokens):
+        """Return the tokens and the expiration time of a text
+        formatted with the given dependencies, or `None` if the
+        formatted text can't be cached.
+        """
+        keys = set()
+        tokens = {}
+        expires = None
+        for dependency in dependencies:
+            kind = dependency[0]
+            if kind == 'realm':
+                keys.add((dependency[1], None))
+            elif kind == 'resource':
+                keys.add(dependency[1:])
+            elif kind == 'link':
+                if dependency[1] not in self.link_realms:
+                    return None
+                keys.update(self._get_link_keys(dependency[1]))
+            elif kind == 'syntax':
+                provider = dependency[1]
+                namespaces = [ns for ns, resolver
+                              in provider.get_link_resolvers() or ()]
+                if not namespaces or \
+                        any(ns not in self.link_realms for ns in namespaces):
+                    return None
+                for ns in namespaces:
+                    keys.update(self._get_link_keys(ns))
+            elif kind == 'macro':
+                if self._get_macro_policy(*dependency[1:]) is None:
+                    return None
+            elif kind == 'tokens':
+                # Tokens taken when the macros were expanded
+                for key, token in dependency[1]:
+                    if tokens.setdefault(key, token) is not token:
+                        return None
+                if dependency[2] is not None:
+                    expires = min(expires or dependency[2], dependency[2])
+            else:
+                return None
+        for key in keys:
+            realm, id = key
+            if id is None:
+                if key not in realm_tokens:
+                    return None
+                token = realm_tokens[key]
+            else:
+                if realm not in self._tracked_realms:
+                    return None
+                # The token of the resource is only taken now, which is
+                # right if nothing in its realm changed while formatting
+                if self._get_token(realm) is not realm_tokens[(realm, None)]:
+                    return None
+                token = self._get_token(realm, id)
+            if tokens.setdefault(key, token) is not token:
+                return None
+        return tuple(tokens.iteritems()), expires
+
+    def _get_link_keys(self, ns):
+        """Return the keys of the tokens of the links of namespace `ns`,
+        besides the keys of the resources they report.
+        """
+        realm = self.link_realms[ns]
+        if realm is None:
+            return []
+        if ns not in self.resource_link_namespaces:
+            return [(realm, None)]
+        if realm == 'wiki':
+            return [self._pages_key]
+        return []
+
+    def _get_macro_policy(self, provider, name, content):
+        """Return the token keys and the time-to-live of the output of
+        the macro, or `None` if it can't be cached.
+        """
+        if not hasattr(provider, 'get_macro_cache_policy'):
+            return None
+        policy = provider.get_macro_cache_policy(name, content)
+        if policy is None:
+            return None
+        keys = {(realm, None) for realm in policy.realms}
+        keys.update((resource.realm, self._get_resource_id(resource))
+                    for resource in policy.resources)
+        if any(realm not in self._tracked_realms for realm, id in keys):
+            return None
+        return keys, policy.ttl
+
+    def _hash(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return sha1(text).hexdigest()
+
+    def _get_rendering_key(self, req):
+        policies = PermissionSystem(self.env).policies
+        if all(policy.__class__.__name__ in self.default_policies
+               for policy in policies):
+            perms = PermissionSystem(self.env) \
+                    .get_user_permissions(req.authname)
+            user = tuple(sorted(action for action, granted
+                                in perms.iteritems() if granted))
+        else:
+            user = ('user', req.authname)
+        return (user, str(req.locale), str(req.tz), req.lc_time, req.href())
+
+    def _get_macro_key(self, formatter, provider, name, content, args):
+        context = formatter.context
+        return (provider.__class__.__module__, provider.__class__.__name__,
+                name, content,
+                tuple(sorted(args.iteritems())) if args is not None else None,
+                formatter.__class__.__name__, repr(formatter.resource),
+                self._hash(formatter.source or ''),
+                tuple(context.get_hint(hint) for hint in self.macro_hints)) + \
+               self._get_rendering_key(formatter.req)
+
+    def _lookup(self, cache, key):
+        with self._lock:
+            entry = cache.pop(key, None)
+            if entry is not None:
+                cache[key] = entry
+        return entry
+
+    def _store(self, cache, key, entry, size):
+        with self._lock:
+            cache[key] = entry
+            while len(cache) > size:
+                cache.popitem(last=False)
+
+    def _get_chrome_state(self, req):
+        chrome = req.chrome
+        return ({rel: len(links)
+                 for rel, links in chrome.get('links', {}).iteritems()},
+                len(chrome.get('scripts', ())),
+                set(chrome.get('scriptset', ())),
+                dict(chrome.get('script_data', {})),
+                [len(chrome.get(name, ()))
+                 for name in ('ctxtnav', 'notices', 'warnings')])
+
+    def _get_chrome_changes(self, req, before):
+        """Return the links, scripts and script data added while the
+        page was formatted, or `None` if other changes were made.
+        """
+        links_count, scripts_count, scriptset, script_data, counts = before
+        after = self._get_chrome_state(req)
+        if after[4] != counts:
+            return None
+        chrome = req.chrome
+        links = [(rel, link)
+                 for rel, rel_links in chrome.get('links', {}).iteritems()
+                 for link in rel_links[links_count.get(rel, 0):]]
+        scripts = chrome.get('scripts', [])[scripts_count:]
+        filenames = after[2] - scriptset
+        data = {name: value
+                for name, value in after[3].iteritems()
+                if name not in script_data or script_data[name] != value}
+        return links, scripts, filenames, data
+
+    def _replay_chrome_changes(self, req, changes):
+        links, scripts, filenames, data = changes
+        chrome = req.chrome
+        linkset = chrome.setdefault('linkset', set())
+        for rel, link in links:
+            linkid = '%s:%s' % (rel, link['href'])
+            if linkid not in linkset:
+                chrome.setdefault('links', {}).setdefault(rel, []) \
+                      .append(link)
+                linkset.add(linkid)
+        hrefs = {script['href'] for script in chrome.get('scripts', ())}
+        chrome.setdefault('scripts', []) \
+              .extend(script for script in scripts
+                      if script['href'] not in hrefs)
+        chrome.setdefault('scriptset', set()).update(filenames)
+        chrome.setdefault('script_data', {}).update(data)
+
+    def _expand(self, name, expand):
+        start = time.time()
+        output = expand()
+        self._add_macro_statistics(name, False, time.time() - start)
+        return output
+
+    def _add_macro_statistics(self, name, hit, elapsed):
+        with self._lock:
+            stats = self.macro_statistics.setdefault(name, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += hit
+            stats[2] += elapsed
+        if hit:
+            self.log.debug("Wiki macro %s taken from the cache", name)
+        else:
+            self.log.debug("Wiki macro %s expanded in %.3f s", name, elapsed)
+
+    def _count(self, counter, outcome, page):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        self.log.debug("Wiki HTML cache %s for %s, hit rate %.1f%% "
+                       "(%d hits, %d misses, %d not cacheable)",
+                       outcome, page.name, self.hit_rate * 100, self.hits,
+                       self.misses, self.uncacheable)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.admin import IAdminCommandProvider
+from trac.core import Component, implements
+from trac.mimeview.api import RenderingContext
+from trac.perm import PermissionCache
+from trac.resource import Resource
+from trac.util.text import exception_to_unicode, printout
+from trac.util.translation import _
+from trac.wiki.api import IWikiChangeListener, WikiSystem
+from trac.wiki.formatter import Formatter, OutlineFormatter
+
+__all__ = ['WikiLinkIndex']
+
+
+class LinkCollector(OutlineFormatter):
+    """Special formatter that only resolves the TracLinks of a wiki
+    text, without expanding the macros and processors.
+
+    :since: 1.3.3
+    """
+    flavor = 'link'
+
+    def _handle_markup(self, itype, match, fullmatch):
+        # Some link resolvers need a request, which isn't available here
+        try:
+            return OutlineFormatter._handle_markup(self, itype, match,
+                                                   fullmatch)
+        except Exception as e:
+            self.env.log.debug("Failed to resolve %s in %s: %s", match,
+                               self.resource, exception_to_unicode(e))
+            return ''
+
+    def _macro_formatter(self, match, fullmatch, macro, only_inline=False):
+        return ''
+
+    def _heading_formatter(self, match, fullmatch):
+        # Resolve the links of the heading
+        self._parse_heading(match, fullmatch, False)
+        return ''
+
+    def collect(self, text):
+        """Return the `(realm, id)` of the resources the `text` links
+        to, as reported by `Formatter.add_link_target`.
+        """
+        links = set()
+        self.context.set_hints(wiki_links=links)
+        Formatter.format(self, text)
+        return links
+
+
+class WikiLinkIndex(Component):
+    """Maintain the `wiki_links` table of the TracLinks found in the
+    latest version of the wiki pages, so that the pages linking to a
+    resource are found without scanning the wiki text.
+
+    Only the links to wiki pages, tickets and milestones are recorded,
+    and the links in macro calls and processor blocks are ignored. As
+    the target of a link to a wiki page can depend on the pages that
+    exist, e.g. for `Sub` linked from `Parent/Page`, the index is only
+    exact after a `trac-admin $ENV wiki links rebuild`.
+    """
+
+    implements(IAdminCommandProvider, IWikiChangeListener)
+
+    realm = WikiSystem.realm
+
+    # Public methods
+
+    def get_backlinks(self, realm, id):
+        """Return the `(realm, id, version)` of the resources linking to
+        the resource identified by `realm` and `id`, sorted by realm
+        and id.
+        """
+        return self.env.db_query("""
+            SELECT realm, id, version FROM wiki_links
+            WHERE target_realm=%s AND target_id=%s
+            ORDER BY realm, id
+            """, (realm, unicode(id)))
+
+    def get_links(self, realm, id):
+        """Return the `(realm, id)` of the resources the resource
+        identified by `realm` and `id` links to, sorted by realm and id.
+        """
+        return self.env.db_query("""
+            SELECT target_realm, target_id FROM wiki_links
+            WHERE realm=%s AND id=%s
+            ORDER BY target_realm, target_id
+            """, (realm, unicode(id)))
+
+    def get_orphaned_pages(self):
+        """Return the sorted names of the wiki pages to which no other
+        wiki page links.
+        """
+        linked = set(name for name, in self.env.db_query("""
+            SELECT DISTINCT target_id FROM wiki_links
+            WHERE target_realm=%s AND realm=%s AND id!=target_id
+            """, (self.realm, self.realm)))
+        return [name for name in WikiSystem(self.env).pages
+                if name not in linked]
+
+    def update_page(self, name):
+        """Collect again the links of the latest version of the wiki
+        page `name`, when it has been modified without notifying the
+        `IWikiChangeListener`s.
+        """
+        for version, text in self.env.db_query("""
+                SELECT version, text FROM wiki WHERE name=%s
+                ORDER BY version DESC LIMIT 1
+                """, (name,)):
+            self._update_page(name, version, text)
+            break
+        else:
+            self._update_page(name)
+
+    def rebuild(self):
+        """Collect again the links of the latest version of all the
+        wiki pages.
+
+        :return: the number of links.
+        """
+        perm = PermissionCache(self.env)
+        count = 0
+        with self.env.db_transaction as db:
+            db("DELETE FROM wiki_links")
+            for name, version, text in db("""
+                    SELECT w1.name, w1.version, w1.text
+                    FROM wiki w1, (SELECT name, max(version) AS ver
+                                   FROM wiki GROUP BY name) w2
+                    WHERE w1.version=w2.ver AND w1.name=w2.name
+                    """):
+                count += self._insert_links(db, name, version, text, perm)
+        return count
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('wiki links rebuild', '',
+               """Collect again the links of all the wiki pages""",
+               None, self._do_rebuild)
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self._update_page(page.name, page.version, page.text)
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        self._update_page(page.name, page.version, page.text)
+
+    def wiki_page_deleted(self, page):
+        self._update_page(page.name)
+
+    def wiki_page_version_deleted(self, page):
+        self._update_page(page.name, page.version, page.text)
+
+    def wiki_page_renamed(self, page, old_name):
+        self._update_page(old_name)
+        self._update_page(page.name, page.version, page.text)
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # Internal methods
+
+    def _update_page(self, name, version=None, text=None):
+        """Replace the links of the page `name` by those of its `text`,
+        or remove them if `version` is `None`.
+        """
+        with self.env.db_transaction as db:
+            db("DELETE FROM wiki_links WHERE realm=%s AND id=%s",
+               (self.realm, name))
+            if version is not None:
+                self._insert_links(db, name, version, text)
+
+    def _insert_links(self, db, name, version, text, perm=None):
+        links = self._collect_links(name, text, perm)
+        db.executemany("""
+            INSERT INTO wiki_links (realm, id, version, target_realm,
+                                    target_id)
+            VALUES (%s,%s,%s,%s,%s)
+            """, [(self.realm, name, version, target_realm, target_id)
+                  for target_realm, target_id in sorted(links)])
+        return len(links)
+
+    def _collect_links(self, name, text, perm=None):
+        resource = Resource(self.realm, name)
+        context = RenderingContext(resource, href=self.env.href,
+                                   perm=perm or PermissionCache(self.env))
+        context.req = None
+        try:
+            links = LinkCollector(self.env, context).collect(text)
+        except Exception as e:
+            self.log.error("Failed to collect the links of wiki page %s: %s",
+                           name, exception_to_unicode(e, traceback=True))
+            return set()
+        links.discard((self.realm, name))
+        return links
+
+    def _do_rebuild(self):
+        count = self.rebuild()
+        printout(_("%(count)d links collected", count=count))
@@ -18,7 +18,6 @@ from fnmatch import fnmatchcase
 from itertools import groupby
 import fnmatch
 import inspect
-import io
 import os
 import re
 
@@ -29,14 +28,16 @@ from trac.resource import (
 )
 from trac.util import as_int
 from trac.util.datefmt import format_date, from_utimestamp, user_time
-from trac.util.html import Markup, escape, find_element, tag
+from trac.util.html import escape, find_element, tag
 from trac.util.presentation import separated
 from trac.util.text import unicode_quote, to_unicode, stripws
 from trac.util.translation import _, dgettext, cleandoc_, tag_
 from trac.web.chrome import chrome_resource_path
-from trac.wiki.api import IWikiMacroProvider, WikiSystem, parse_args
+from trac.wiki.api import (
+    IWikiMacroProvider, MacroCachePolicy, WikiSystem, parse_args
+)
 from trac.wiki.formatter import (
-    MacroError, OutlineFormatter, ProcessorError, extract_link, format_to_html,
+    MacroError, ProcessorError, extract_link, format_to_html,
     format_to_oneliner, system_message
 )  # ProcessorError unused, but imported for plugin use.
 from trac.wiki.interwiki import InterWikiMap
@@ -125,6 +126,9 @@ class TitleIndexMacro(WikiMacroBase):
     SPLIT_RE = re.compile(r"(/| )")
     NUM_SPLIT_RE = re.compile(r"([0-9.]+)")
 
+    def get_macro_cache_policy(self, name, content):
+        return MacroCachePolicy(['wiki'])
+
     def expand_macro(self, formatter, name, content):
         args, kw = parse_args(content)
         prefix = args[0].strip() if args else None
@@ -153,11 +157,13 @@ class TitleIndexMacro(WikiMacroBase):
         else:
             omitprefix = lambda page: page
 
-        pages = sorted(page for page in wiki.get_pages(prefix)
-                       if (depth < 0 or depth >= page.count('/') - start)
-                       and 'WIKI_VIEW' in formatter.perm('wiki', page)
-                       and any(fnmatchcase(page, inc) for inc in includes)
-                       and not any(fnmatchcase(page, exc) for exc in excludes))
+        # The pages are already sorted, and the permission check comes
+        # last as it is the most expensive filter
+        pages = [page for page in wiki.get_pages(prefix)
+                 if (depth < 0 or depth >= page.count('/') - start)
+                 and any(fnmatchcase(page, inc) for inc in includes)
+                 and not any(fnmatchcase(page, exc) for exc in excludes)
+                 and 'WIKI_VIEW' in formatter.perm('wiki', page)]
 
         if format == 'compact':
             return tag(
@@ -337,20 +343,22 @@ class RecentChangesMacro(WikiMacroBase):
     e.g. `[[RecentChanges(,10,group=none)]]`.
     """)
 
+    def get_macro_cache_policy(self, name, content):
+        return MacroCachePolicy(['wiki'])
+
     def expand_macro(self, formatter, name, content):
         args, kw = parse_args(content)
         prefix = args[0].strip() if args else None
         limit = _arg_as_int(args[1].strip(), min=1) if len(args) > 1 else None
         group = kw.get('group', 'date')
 
-        sql = """SELECT name, max(version) AS max_version,
-                        max(time) AS max_time FROM wiki"""
+        sql = "SELECT name, version, time FROM wiki_latest"
         args = []
         if prefix:
             with self.env.db_query as db:
                 sql += " WHERE name %s" % db.prefix_match()
                 args.append(db.prefix_match_value(prefix))
-        sql += " GROUP BY name ORDER BY max_time DESC"
+        sql += " ORDER BY time DESC"
         if limit:
             sql += " LIMIT %s"
             args.append(limit)
@@ -416,6 +424,9 @@ class PageOutlineMacro(WikiMacroBase):
        default). This parameter only has an effect in `inline` style.
     """)
 
+    def get_macro_cache_policy(self, name, content):
+        return MacroCachePolicy()
+
     def expand_macro(self, formatter, name, content):
         min_depth, max_depth = 1, 6
         title = None
@@ -441,13 +452,9 @@ class PageOutlineMacro(WikiMacroBase):
                         elif arg == 'unnumbered':
                             numbered = False
 
-        # TODO: - integrate the rest of the OutlineFormatter directly here
-        #       - use formatter.wikidom instead of formatter.source
-        out = io.StringIO()
-        oformatter = OutlineFormatter(self.env, formatter.context)
-        oformatter.format(formatter.source, out, max_depth, min_depth,
-                          shorten=not inline)
-        outline = Markup(out.getvalue())
+        # Filled with the headings once the whole text is formatted
+        outline = formatter.outline_placeholder(max_depth, min_depth,
+                                                shorten=not inline)
 
         if title:
             outline = tag.h4(title, class_='section') + outline
@@ -543,6 +550,10 @@ class ImageMacro(WikiMacroBase):
                           '|title|longdesc|class|id|usemap)=(.+)')
     _quoted_re = re.compile("(?:[\"'])(.*)(?:[\"'])$")
 
+    def get_macro_cache_policy(self, name, content):
+        return MacroCachePolicy(['attachment'],
+                                [Resource('wiki', 'InterMapTxt')])
+
     def expand_macro(self, formatter, name, content):
         args = None
         if content:
@@ -730,6 +741,9 @@ class MacroListMacro(WikiMacroBase):
     macros if the `PythonOptimize` option is enabled for mod_python!
     """)
 
+    def get_macro_cache_policy(self, name, content):
+        return MacroCachePolicy()
+
     def expand_macro(self, formatter, name, content):
         from trac.wiki.formatter import system_message
 
@@ -797,6 +811,9 @@ class TracIniMacro(WikiMacroBase):
      option  :: a glob-style filtering on the option names
     """)
 
+    def get_macro_cache_policy(self, name, content):
+        return MacroCachePolicy()
+
     def expand_macro(self, formatter, name, content):
         from trac.config import ConfigSection, Option
 
@@ -874,6 +891,9 @@ class KnownMimeTypesMacro(WikiMacroBase):
     Can be given an optional argument which is interpreted as mime-type filter.
     """)
 
+    def get_macro_cache_policy(self, name, content):
+        return MacroCachePolicy()
+
     def expand_macro(self, formatter, name, content):
         from trac.mimeview.api import Mimeview
         mime_map = Mimeview(self.env).mime_map
@@ -941,6 +961,9 @@ class TracGuideTocMacro(WikiMacroBase):
            ('TracNotification',             'Notification'),
           ]
 
+    def get_macro_cache_policy(self, name, content):
+        return MacroCachePolicy(['wiki'])
+
     def expand_macro(self, formatter, name, content):
         curpage = formatter.resource.id
 
@@ -127,10 +127,11 @@ class WikiPage(object):
 
             if version is None or version == self.version:
                 self._fetch(self.name, None)
+                update_latest_version(db, self.name)
 
             if not self.exists:
-                # Invalidate page name cache
-                del WikiSystem(self.env).pages
+                # Update page name cache
+                WikiSystem(self.env)._update_pages(removed=[self.name])
                 # Delete orphaned attachments
                 from trac.attachment import Attachment
                 Attachment.delete_all(self.env, self.realm, self.name)
@@ -163,12 +164,13 @@ class WikiPage(object):
                       """, (self.name, self.version + 1, to_utimestamp(t),
                             author, self.text, comment, self.readonly))
                 self.version += 1
+                update_latest_version(db, self.name)
             else:
                 db("UPDATE wiki SET readonly=%s WHERE name=%s",
                    (self.readonly, self.name))
             if self.version == 1:
-                # Invalidate page name cache
-                del WikiSystem(self.env).pages
+                # Update page name cache
+                WikiSystem(self.env)._update_pages(added=[self.name])
 
         self.author = author
         self.comment = comment
@@ -205,8 +207,11 @@ class WikiPage(object):
                                   name=new_name))
 
             db("UPDATE wiki SET name=%s WHERE name=%s", (new_name, old_name))
-            # Invalidate page name cache
-            del WikiSystem(self.env).pages
+            update_latest_version(db, old_name)
+            update_latest_version(db, new_name)
+            # Update page name cache
+            WikiSystem(self.env)._update_pages(added=[new_name],
+                                               removed=[old_name])
             # Reparent attachments
             from trac.attachment import Attachment
             Attachment.reparent_all(self.env, self.realm, old_name,
@@ -249,3 +254,38 @@ class WikiPage(object):
                 WHERE name=%s AND version<=%s ORDER BY version DESC
                 """, (self.name, self.version)):
             yield version, from_utimestamp(ts), author, comment
+
+
+def update_latest_version(db, name):
+    """Update the row of the page `name` in the `wiki_latest` table,
+    which holds the latest version of each wiki page, after the
+    versions of the page have been changed in the `wiki` table.
+
+    To be called within a transaction by the code writing directly in
+    the `wiki` table.
+
+    :since: 1.3.3
+    """
+    db("DELETE FROM wiki_latest WHERE name=%s", (name,))
+    db("""INSERT INTO wiki_latest (name, version, time)
+          SELECT name, version, time FROM wiki WHERE name=%s
+          ORDER BY version DESC LIMIT 1
+          """, (name,))
+
+
+def rebuild_latest_versions(db):
+    """Fill again the `wiki_latest` table from the `wiki` table, when
+    the latter has been modified without `update_latest_version`.
+
+    To be called within a transaction.
+
+    :return: the number of wiki pages.
+    :since: 1.3.3
+    """
+    db("DELETE FROM wiki_latest")
+    db("""INSERT INTO wiki_latest (name, version, time)
+          SELECT w1.name, w1.version, w1.time
+          FROM wiki w1, (SELECT name, max(version) AS ver
+                         FROM wiki GROUP BY name) w2
+          WHERE w1.version=w2.ver AND w1.name=w2.name""")
+    return db("SELECT count(*) FROM wiki_latest")[0][0]
@@ -18,8 +18,11 @@
 #         Christopher Lenz <cmlenz@gmx.de>
 #         Christian Boos <cboos@edgewall.org>
 
+from collections import OrderedDict
 import re
+import threading
 
+from trac.config import IntOption
 from trac.core import *
 from trac.notification import EMAIL_LOOKALIKE_PATTERN
 
@@ -27,6 +30,16 @@ from trac.notification import EMAIL_LOOKALIKE_PATTERN
 class WikiParser(Component):
     """Wiki text parser."""
 
+    parse_cache_size = IntOption('wiki', 'parse_cache_size', 1048576,
+        """Maximum total size, in characters, of the parsed wiki texts
+        kept in memory, so that a text which is formatted again, like
+        a wiki page or the description of a ticket, is not parsed
+        again. (''since 1.3.3'')
+        """)
+
+    # Texts shorter than this are parsed again rather than cached
+    min_cached_length = 256
+
     # Some constants used for clarifying the Wiki regexps:
 
     BOLDITALIC_TOKEN = "'''''"
@@ -144,6 +157,8 @@ class WikiParser(Component):
     _processor_param_re = re.compile(PROCESSOR_PARAM)
     _anchor_re = re.compile(r'[^\w:.-]+', re.UNICODE)
 
+    _normalize_re = re.compile(r'[\v\f]', re.UNICODE)
+
     _macro_re = re.compile(r'''
         (?P<macroname> [\w/+-]+ \?? | \? )     # macro, macro? or ?
           (?: \( (?P<macroargs> .*? ) \) )? $  # optional arguments within ()
@@ -172,6 +187,10 @@ class WikiParser(Component):
         self._link_resolvers = None
         self._helper_patterns = None
         self._external_handlers = None
+        self._external_providers = None
+        self._documents = OrderedDict()
+        self._documents_size = 0
+        self._documents_lock = threading.Lock()
 
     @property
     def rules(self):
@@ -188,16 +207,27 @@ class WikiParser(Component):
         self._prepare_rules()
         return self._external_handlers
 
+    @property
+    def external_providers(self):
+        """The `IWikiSyntaxProvider` of each rule of `external_handlers`.
+
+        :since: 1.3.3
+        """
+        self._prepare_rules()
+        return self._external_providers
+
     def _prepare_rules(self):
         from trac.wiki.api import WikiSystem
         if not self._compiled_rules:
             helpers = []
             handlers = {}
+            providers = {}
             syntax = self._pre_rules[:]
             i = 0
             for resolver in WikiSystem(self.env).syntax_providers:
                 for regexp, handler in resolver.get_wiki_syntax() or []:
                     handlers['i' + str(i)] = handler
+                    providers['i' + str(i)] = resolver
                     syntax.append('(?P<i%d>%s)' % (i, regexp))
                     i += 1
             syntax += self._post_rules[:]
@@ -206,6 +236,7 @@ class WikiParser(Component):
                 helpers += helper_re.findall(rule)[1:]
             rules = re.compile('(?:' + '|'.join(syntax) + ')', re.UNICODE)
             self._external_handlers = handlers
+            self._external_providers = providers
             self._helper_patterns = helpers
             self._compiled_rules = rules
 
@@ -220,10 +251,107 @@ class WikiParser(Component):
             self._link_resolvers = resolvers
         return self._link_resolvers
 
-    def parse(self, wikitext):
-        """Parse `wikitext` and produce a WikiDOM tree."""
-        # obviously still some work to do here ;)
-        return wikitext
+    def parse(self, wikitext, cache=False):
+        """Parse `wikitext` and produce a WikiDOM tree.
+
+        The tree is a `WikiDocument`. The `wikitext` can also be a
+        list of lines, or a `WikiDocument`, which is returned as is.
+
+        If `cache` is `True`, the document is kept in memory and
+        returned again for the same text, with its tokens, as long as
+        the `[wiki] parse_cache_size` allows. Texts shorter than
+        `min_cached_length` are not cached.
+        """
+        if isinstance(wikitext, WikiDocument):
+            return wikitext
+        if not isinstance(wikitext, basestring):
+            return WikiDocument(wikitext, self.tokenize)
+        wikitext = self._normalize_re.sub(' ', wikitext)
+        max_size = self.parse_cache_size
+        if not cache or len(wikitext) < self.min_cached_length or \
+                len(wikitext) > max_size:
+            return WikiDocument(wikitext, self.tokenize)
+        with self._documents_lock:
+            document = self._documents.pop(wikitext, None)
+            if document is None:
+                document = WikiDocument(wikitext, self.tokenize)
+                self._documents_size += len(wikitext)
+            self._documents[wikitext] = document
+            while self._documents_size > max_size:
+                text = self._documents.popitem(last=False)[0]
+                self._documents_size -= len(text)
+        return document
+
+    def tokenize(self, line):
+        """Split a line of wiki text in tokens: the strings of text
+        between the markup, and the `(itype, match, fullmatch)` tuples
+        of the markup, where `itype` is the name of the matching rule,
+        `match` the matched text and `fullmatch` the match object.
+
+        :since: 1.3.3
+        """
+        helper_patterns = self.helper_patterns
+        tokens = []
+        end = [0]
+        def add_token(fullmatch):
+            start = fullmatch.start()
+            if start > end[0]:
+                tokens.append(line[end[0]:start])
+            for itype, match in fullmatch.groupdict().iteritems():
+                if match and itype not in helper_patterns:
+                    tokens.append((itype, match, fullmatch))
+                    break
+            end[0] = fullmatch.end()
+            return ''
+        # Use `sub` for finding the same matches as when replacing them
+        self.rules.sub(add_token, line)
+        if end[0] < len(line):
+            tokens.append(line[end[0]:])
+        return tokens
+
+
+class WikiDocument(object):
+    """Parsed wiki text, as returned by `WikiParser.parse`.
+
+    The document is made of the `lines` of the text. The inline markup
+    of each line (font styles, links, macro calls...) is tokenized the
+    first time the line is formatted, and the tokens are kept with the
+    document. The block structure (paragraphs, lists, tables, code
+    blocks and processors) is found by the formatters, while going
+    through the lines.
+
+    The tokens only depend on the text: everything depending on the
+    rendering context, like the permissions, the existence of the link
+    targets and the output of the macros, is evaluated by the
+    formatters, so a document can be formatted many times.
+
+    :since: 1.3.3
+    """
+
+    def __init__(self, wikitext, tokenize):
+        if isinstance(wikitext, basestring):
+            if isinstance(wikitext, str):
+                wikitext = wikitext.decode('utf-8')
+            self.text = wikitext
+            self.lines = wikitext.splitlines()
+        else:
+            self.lines = [line.decode('utf-8') if isinstance(line, str)
+                          else line for line in wikitext]
+            self.text = u'\n'.join(self.lines)
+        self._tokenize = tokenize
+        self._tokens = {}
+
+    def __nonzero__(self):
+        return bool(self.text)
+
+    def tokenize(self, line):
+        """Return the tokens of `line`, as returned by
+        `WikiParser.tokenize`.
+        """
+        tokens = self._tokens.get(line)
+        if tokens is None:
+            tokens = self._tokens[line] = self._tokenize(line)
+        return tokens
 
 
 _processor_pname_re = re.compile(r'[-\w]+$')
@@ -18,15 +18,20 @@ import trac.wiki.api
 import trac.wiki.formatter
 import trac.wiki.parser
 from trac.wiki.tests import (
-    formatter, macros, model, web_api, web_ui, wikisyntax)
+    api, formatter, htmlcache, links, macros, model, parser, web_api,
+    web_ui, wikisyntax)
 from trac.wiki.tests.functional import functionalSuite
 
 def test_suite():
 
     suite = unittest.TestSuite()
+    suite.addTest(api.test_suite())
     suite.addTest(formatter.test_suite())
+    suite.addTest(htmlcache.test_suite())
+    suite.addTest(links.test_suite())
     suite.addTest(macros.test_suite())
     suite.addTest(model.test_suite())
+    suite.addTest(parser.test_suite())
     suite.addTest(web_api.test_suite())
     suite.addTest(web_ui.test_suite())
     suite.addTest(wikisyntax.test_suite())
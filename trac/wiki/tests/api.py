@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.cache import CacheManager
+from trac.test import EnvironmentStub
+from trac.wiki.api import WikiPageNames, WikiSystem
+from trac.wiki.model import WikiPage
+
+
+class WikiPageNamesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.names = WikiPageNames(['WikiStart', 'Sandbox/Page',
+                                    'Sandbox', 'SandboxPage', 'Other'])
+
+    def test_sorted(self):
+        self.assertEqual(['Other', 'Sandbox', 'Sandbox/Page', 'SandboxPage',
+                          'WikiStart'], list(self.names))
+        self.assertEqual(5, len(self.names))
+
+    def test_contains(self):
+        self.assertIn('Sandbox/Page', self.names)
+        self.assertNotIn('Sandbox/', self.names)
+        self.assertNotIn('Missing', self.names)
+
+    def test_startswith(self):
+        self.assertEqual(['Sandbox', 'Sandbox/Page', 'SandboxPage'],
+                         list(self.names.startswith('Sandbox')))
+        self.assertEqual(['Sandbox/Page'],
+                         list(self.names.startswith('Sandbox/')))
+        self.assertEqual([], list(self.names.startswith('Z')))
+        self.assertEqual([], list(self.names.startswith('A')))
+
+    def test_updated(self):
+        names = self.names.updated(added=['Sandbox/Other', 'Zzz', 'Other'],
+                                   removed=['SandboxPage', 'Missing'])
+        self.assertEqual(['Other', 'Sandbox', 'Sandbox/Other',
+                          'Sandbox/Page', 'WikiStart', 'Zzz'], list(names))
+        self.assertIn('Zzz', names)
+        self.assertNotIn('SandboxPage', names)
+        self.assertIn('SandboxPage', self.names)
+        self.assertEqual(5, len(self.names))
+
+    def test_updated_unchanged(self):
+        self.assertIs(self.names, self.names.updated(added=['Other'],
+                                                     removed=['Missing']))
+
+
+class WikiSystemPagesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.wiki = WikiSystem(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _insert_page(self, name):
+        page = WikiPage(self.env, name)
+        page.text = 'Text'
+        page.save('joe', 'Comment')
+        return page
+
+    def _insert_page_row(self, name):
+        self.env.db_transaction("""
+            INSERT INTO wiki (name, version, time, author, text)
+            VALUES (%s,1,0,'joe','Text')""", (name,))
+
+    def test_get_pages(self):
+        for name in ('Sandbox/Page', 'WikiStart', 'Sandbox'):
+            self._insert_page(name)
+        self.assertEqual(['Sandbox', 'Sandbox/Page', 'WikiStart'],
+                         list(self.wiki.get_pages()))
+        self.assertEqual(['Sandbox/Page'],
+                         list(self.wiki.get_pages('Sandbox/')))
+
+    def test_updated_in_place(self):
+        self._insert_page('WikiStart')
+        self.assertEqual(['WikiStart'], list(self.wiki.pages))
+        # Not seen, as the page names aren't read again
+        self._insert_page_row('Hidden')
+
+        self._insert_page('Sandbox')
+        self.assertEqual(['Sandbox', 'WikiStart'], list(self.wiki.pages))
+        page = self._insert_page('Other')
+        page.rename('Renamed')
+        self.assertEqual(['Renamed', 'Sandbox', 'WikiStart'],
+                         list(self.wiki.pages))
+        WikiPage(self.env, 'Sandbox').delete()
+        self.assertEqual(['Renamed', 'WikiStart'], list(self.wiki.pages))
+
+        del self.wiki.pages
+        self.assertEqual(['Hidden', 'Renamed', 'WikiStart'],
+                         list(self.wiki.pages))
+
+    def test_changed_in_other_process(self):
+        self._insert_page('WikiStart')
+        self.assertEqual(['WikiStart'], list(self.wiki.pages))
+        # Page created by another process
+        self._insert_page_row('Hidden')
+        self.env.db_transaction("""
+            UPDATE cache SET generation=generation+1 WHERE id=%s
+            """, (WikiSystem.pages.id,))
+        CacheManager(self.env).reset_metadata()
+
+        self._insert_page('Sandbox')
+        self.assertEqual(['Hidden', 'Sandbox', 'WikiStart'],
+                         list(self.wiki.pages))
+
+    def test_rolled_back_update(self):
+        self._insert_page('WikiStart')
+        self.assertEqual(['WikiStart'], list(self.wiki.pages))
+        try:
+            with self.env.db_transaction:
+                self._insert_page('Sandbox')
+                self.assertEqual(['Sandbox', 'WikiStart'],
+                                 list(self.wiki.pages))
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(['WikiStart'], list(self.wiki.pages))
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(['WikiStart'], list(self.wiki.pages))
+
+        # Page created by another process, reusing the generation of
+        # the rolled back update
+        self._insert_page_row('Hidden')
+        self.env.db_transaction("""
+            UPDATE cache SET generation=generation+1 WHERE id=%s
+            """, (WikiSystem.pages.id,))
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(['Hidden', 'WikiStart'], list(self.wiki.pages))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(WikiPageNamesTestCase))
+    suite.addTest(unittest.makeSuite(WikiSystemPagesTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.core import Component, ComponentMeta, implements
+from trac.resource import Resource
+from trac.test import EnvironmentStub, MockRequest
+from trac.ticket.test import insert_ticket
+from trac.web.chrome import add_stylesheet, web_context
+from trac.wiki.api import IWikiMacroProvider, MacroCachePolicy
+from trac.wiki.formatter import format_to_html
+from trac.wiki.htmlcache import WikiHtmlCache
+from trac.wiki.model import WikiPage
+
+
+class WikiHtmlCacheTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        class StyledMacro(Component):
+            implements(IWikiMacroProvider)
+            def get_macros(self):
+                yield 'Styled'
+            def get_macro_description(self, name):
+                return ''
+            def get_macro_cache_policy(self, name, content):
+                return MacroCachePolicy()
+            def expand_macro(self, formatter, name, content):
+                add_stylesheet(formatter.req, 'common/css/styled.css')
+                return 'Styled'
+
+        class CountingMacro(Component):
+            implements(IWikiMacroProvider)
+            policy = MacroCachePolicy()
+            expansions = 0
+            def get_macros(self):
+                yield 'Counting'
+            def get_macro_description(self, name):
+                return ''
+            def get_macro_cache_policy(self, name, content):
+                return self.policy
+            def expand_macro(self, formatter, name, content):
+                self.expansions += 1
+                return 'Expansion %d' % self.expansions
+
+        cls.counting_macro = CountingMacro
+        cls.components = [StyledMacro, CountingMacro]
+
+    @classmethod
+    def tearDownClass(cls):
+        for component in cls.components:
+            ComponentMeta.deregister(component)
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True,
+                                   enable=['trac.*'] + self.components)
+        self.cache = WikiHtmlCache(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _insert_page(self, name, text):
+        page = WikiPage(self.env, name)
+        page.text = text
+        page.save('joe', 'Comment')
+        return page
+
+    def _render(self, page, authname='anonymous'):
+        req = MockRequest(self.env, authname=authname)
+        context = web_context(req, page.resource)
+        return unicode(self.cache.render(context, page, page.text))
+
+    def _counts(self):
+        return self.cache.hits, self.cache.misses, self.cache.uncacheable
+
+    def test_hit(self):
+        page = self._insert_page('SomePage', 'See WikiStart')
+        html = self._render(page)
+        self.assertEqual(html, self._render(page))
+        self.assertEqual((1, 1, 0), self._counts())
+        self.assertEqual(0.5, self.cache.hit_rate)
+
+    def test_new_version(self):
+        page = self._insert_page('SomePage', 'First version')
+        self.assertIn('First version', self._render(page))
+        page.text = 'Second version'
+        page.save('joe', 'Comment')
+        self.assertIn('Second version', self._render(page))
+        self.assertEqual((0, 2, 0), self._counts())
+
+    def test_linked_page_created(self):
+        page = self._insert_page('SomePage', 'See OtherPage')
+        self.assertIn('class="missing wiki"', self._render(page))
+        self._insert_page('OtherPage', 'Text')
+        self.assertNotIn('class="missing wiki"', self._render(page))
+        self.assertEqual((0, 2, 0), self._counts())
+
+    def test_linked_ticket_changed(self):
+        ticket = insert_ticket(self.env, summary='Old summary', status='new')
+        page = self._insert_page('SomePage', 'See #1')
+        self.assertIn('Old summary', self._render(page))
+        ticket['summary'] = 'New summary'
+        ticket.save_changes('joe')
+        self.assertIn('New summary', self._render(page))
+        self.assertIn('New summary', self._render(page))
+        self.assertEqual((1, 2, 0), self._counts())
+
+    def test_unrelated_change(self):
+        page = self._insert_page('SomePage', "'''No links'''")
+        self._render(page)
+        insert_ticket(self.env, summary='Summary')
+        self._insert_page('OtherPage', 'Text')
+        self._render(page)
+        self.assertEqual((1, 1, 0), self._counts())
+
+    def test_other_ticket_changed(self):
+        insert_ticket(self.env, summary='Summary')
+        ticket = insert_ticket(self.env, summary='Old summary')
+        page = self._insert_page('SomePage', 'See #1 and ticket:1')
+        self._render(page)
+        ticket['summary'] = 'New summary'
+        ticket.save_changes('joe')
+        self._render(page)
+        self.assertEqual((1, 1, 0), self._counts())
+
+    def test_linked_ticket_commented(self):
+        ticket = insert_ticket(self.env, summary='Summary')
+        page = self._insert_page('SomePage', 'See comment:1:ticket:1')
+        self.assertIn('comment does not exist', self._render(page))
+        ticket.save_changes('joe', 'Comment')
+        self.assertNotIn('comment does not exist', self._render(page))
+        self.assertEqual((0, 2, 0), self._counts())
+
+    def test_other_page_edited(self):
+        self._insert_page('OtherPage', 'Text')
+        third_page = self._insert_page('ThirdPage', 'Text')
+        page = self._insert_page('SomePage', 'See OtherPage')
+        self._render(page)
+        third_page.text = 'New text'
+        third_page.save('joe', 'Comment')
+        self._render(page)
+        self.assertEqual((1, 1, 0), self._counts())
+        self._insert_page('FourthPage', 'Text')
+        self._render(page)
+        self.assertEqual((1, 2, 0), self._counts())
+
+    def test_macro_cacheable(self):
+        page = self._insert_page('SomePage', '= Title =\n[[PageOutline]]')
+        self._render(page)
+        self._render(page)
+        self.assertEqual((1, 1, 0), self._counts())
+
+    def test_changeset_link_not_cacheable(self):
+        page = self._insert_page('SomePage', 'See changeset:1')
+        self._render(page)
+        self.assertEqual((0, 0, 1), self._counts())
+
+    def test_user_permissions(self):
+        page = self._insert_page('SomePage', 'See WikiStart')
+        self._render(page, 'anonymous')
+        self._render(page, 'admin')
+        self._render(page, 'anonymous')
+        self.assertEqual((1, 2, 0), self._counts())
+
+    def test_chrome_changes_replayed(self):
+        page = self._insert_page('SomePage', '[[Styled]]')
+        self._render(page)
+        req = MockRequest(self.env)
+        context = web_context(req, page.resource)
+        self.cache.render(context, page, page.text)
+        self.assertEqual((1, 1, 0), self._counts())
+        self.assertEqual(['/trac.cgi/chrome/common/css/styled.css'],
+                         [link['href'] for link
+                          in req.chrome['links']['stylesheet']
+                          if 'styled' in link['href']])
+
+    def test_macro_memoized(self):
+        page = self._insert_page('SomePage', '[[TitleIndex]] changeset:1')
+        self._render(page)
+        self._render(page)
+        self.assertEqual((0, 0, 2), self._counts())
+        self.assertEqual([2, 1],
+                         self.cache.macro_statistics['TitleIndex'][:2])
+
+        self._insert_page('OtherPage', 'Text')
+        self.assertIn('OtherPage', self._render(page))
+        self.assertEqual([3, 1],
+                         self.cache.macro_statistics['TitleIndex'][:2])
+
+    def test_macro_resource_dependency(self):
+        macro = self.counting_macro(self.env)
+        macro.policy = MacroCachePolicy(resources=[Resource('wiki',
+                                                            'Dependency')])
+        page = self._insert_page('SomePage', '[[Counting]]')
+        self.assertIn('Expansion 1', self._render(page))
+        self._insert_page('OtherPage', 'Text')
+        self.assertIn('Expansion 1', self._render(page))
+        self._insert_page('Dependency', 'Text')
+        self.assertIn('Expansion 2', self._render(page))
+        self.assertEqual((1, 2, 0), self._counts())
+
+    def test_macro_ttl(self):
+        macro = self.counting_macro(self.env)
+        macro.policy = MacroCachePolicy(ttl=0)
+        page = self._insert_page('SomePage', '[[Counting]]')
+        self.assertIn('Expansion 1', self._render(page))
+        self.assertIn('Expansion 2', self._render(page))
+        self.assertEqual((0, 2, 0), self._counts())
+
+    def test_macro_not_cacheable(self):
+        macro = self.counting_macro(self.env)
+        macro.policy = None
+        page = self._insert_page('SomePage', '[[Counting]] [[Counting]]')
+        self.assertIn('Expansion 2', self._render(page))
+        self.assertIn('Expansion 4', self._render(page))
+        self.assertEqual((0, 0, 2), self._counts())
+        self.assertEqual([4, 0], self.cache.macro_statistics['Counting'][:2])
+
+    def test_disabled(self):
+        self.env.config.set('wiki', 'html_cache_size', 0)
+        page = self._insert_page('SomePage', 'See WikiStart')
+        self._render(page)
+        self._render(page)
+        self.assertEqual((0, 0, 0), self._counts())
+
+    def _render_sections(self, text):
+        """Return the HTML of `text` rendered by sections, and the HTML
+        of `text` rendered as a whole.
+        """
+        req = MockRequest(self.env)
+        context = web_context(req, Resource('wiki', 'SomePage'))
+        return (unicode(self.cache.render_sections(context, text)),
+                unicode(format_to_html(self.env, context, text)))
+
+    def _section_counts(self):
+        counts = self.cache.section_hits, self.cache.section_misses
+        self.cache.section_hits = self.cache.section_misses = 0
+        return counts
+
+    sections_text = """\
+= Introduction =
+ * See WikiStart and #1
+ * Item
+
+= Code =
+{{{
+
+= Not a section =
+}}}
+||= Cell =||
+= Not a section =
+> Quote
+
+ Indented
+
+= Last =
+Text
+"""
+
+    def test_sections(self):
+        html, expected = self._render_sections(self.sections_text)
+        self.assertEqual(expected, html)
+        self.assertEqual((0, 3), self._section_counts())
+        html, expected = self._render_sections(self.sections_text)
+        self.assertEqual(expected, html)
+        self.assertEqual((3, 0), self._section_counts())
+
+    def test_sections_changed(self):
+        self._render_sections(self.sections_text)
+        self._section_counts()
+        text = self.sections_text.replace('Indented', 'Changed')
+        html, expected = self._render_sections(text)
+        self.assertEqual(expected, html)
+        self.assertIn('Changed', html)
+        self.assertEqual((2, 1), self._section_counts())
+
+    def test_sections_linked_ticket_created(self):
+        self._render_sections(self.sections_text)
+        self._section_counts()
+        insert_ticket(self.env, summary='Summary')
+        html, expected = self._render_sections(self.sections_text)
+        self.assertEqual(expected, html)
+        self.assertEqual((2, 1), self._section_counts())
+
+    def test_sections_unique_anchors(self):
+        text = "= A =\n== Sub ==\n\n= B =\n== Sub ==\n\n= C =\nText\n"
+        html, expected = self._render_sections(text)
+        self.assertIn('id="Sub"', html)
+        self.assertIn('id="Sub1"', html)
+        self._section_counts()
+        # The second heading no longer needs a numbered anchor
+        text = text.replace('== Sub ==', '== Other ==', 1)
+        html, expected = self._render_sections(text)
+        self.assertEqual(expected, html)
+        self.assertNotIn('id="Sub1"', html)
+        self.assertEqual((1, 2), self._section_counts())
+
+    def test_sections_page_outline(self):
+        text = "= A =\n[[PageOutline(2, , inline)]]\n\n= B =\n== Sub ==\n"
+        self._render_sections(text)
+        self._section_counts()
+        # The outline in the first section follows the headings
+        html, expected = self._render_sections(text.replace('Sub', 'Other'))
+        self.assertEqual(expected, html)
+        self.assertIn('href="#Other"', html)
+        self.assertEqual((0, 2), self._section_counts())
+        # The headings of the cached sections are kept with them
+        text = text.replace('Sub', 'Other').replace('= A =', '= Intro =')
+        html, expected = self._render_sections(text)
+        self.assertEqual(expected, html)
+        self.assertIn('href="#Other"', html)
+        self.assertEqual((1, 1), self._section_counts())
+
+    def test_sections_disabled(self):
+        self.env.config.set('wiki', 'section_cache_size', 0)
+        html, expected = self._render_sections(self.sections_text)
+        self.assertEqual(expected, html)
+        self.assertEqual((0, 0), self._section_counts())
+
+
+def test_suite():
+    return unittest.makeSuite(WikiHtmlCacheTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
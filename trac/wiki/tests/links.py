@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+import trac.ticket.roadmap  # provides the milestone links
+from trac.test import EnvironmentStub, MockRequest
+from trac.wiki.links import WikiLinkIndex
+from trac.wiki.model import WikiPage, update_latest_version
+from trac.wiki.web_ui import WikiModule
+
+
+class WikiLinkIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.links = WikiLinkIndex(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _insert_page(self, name, text):
+        page = WikiPage(self.env, name)
+        page.text = text
+        page.save('joe', 'Comment')
+        return page
+
+    def test_links_collected(self):
+        self._insert_page('SomePage', """\
+= Heading with a link to HeadingPage =
+See SandBox, [wiki:Other other page], [[Creole|page]], [./Child],
+#1, ticket:2, milestone:milestone1, #1-3, [#anchor] and SomePage.
+[[Image(MacroPage)]]
+{{{
+CodeBlockPage
+}}}
+""")
+        self.assertEqual([('milestone', 'milestone1'), ('ticket', '1'),
+                          ('ticket', '2'), ('wiki', 'Creole'),
+                          ('wiki', 'HeadingPage'), ('wiki', 'Other'),
+                          ('wiki', 'SandBox'), ('wiki', 'SomePage/Child')],
+                         self.links.get_links('wiki', 'SomePage'))
+        self.assertEqual([('wiki', 'SomePage', 1)],
+                         self.links.get_backlinks('ticket', 1))
+
+    def test_page_changed(self):
+        page = self._insert_page('SomePage', 'See SandBox and #1')
+        page.text = 'See OtherPage'
+        page.save('joe', 'Comment')
+        self.assertEqual([('wiki', 'OtherPage')],
+                         self.links.get_links('wiki', 'SomePage'))
+        self.assertEqual([('wiki', 'SomePage', 2)],
+                         self.links.get_backlinks('wiki', 'OtherPage'))
+        self.assertEqual([], self.links.get_backlinks('wiki', 'SandBox'))
+
+        page.delete(version=2)
+        self.assertEqual([('wiki', 'SomePage', 1)],
+                         self.links.get_backlinks('wiki', 'SandBox'))
+
+    def test_page_renamed(self):
+        self._insert_page('Parent/SiblingPage', 'Text')
+        page = self._insert_page('Parent/SomePage', 'See SiblingPage')
+        self.assertEqual([('wiki', 'Parent/SomePage', 1)],
+                         self.links.get_backlinks('wiki',
+                                                  'Parent/SiblingPage'))
+        page.rename('SomePage')
+        self.assertEqual([('wiki', 'SomePage', 1)],
+                         self.links.get_backlinks('wiki', 'SiblingPage'))
+        self.assertEqual([], self.links.get_backlinks('wiki',
+                                                      'Parent/SiblingPage'))
+
+    def test_page_deleted(self):
+        page = self._insert_page('SomePage', 'See SandBox')
+        page.delete()
+        self.assertEqual([], self.links.get_links('wiki', 'SomePage'))
+        self.assertEqual([], self.links.get_backlinks('wiki', 'SandBox'))
+
+    def test_orphaned_pages(self):
+        self._insert_page('WikiStart', 'See SandBox and WikiStart')
+        self._insert_page('SandBox', 'See WikiStart')
+        self._insert_page('Orphan', 'See SandBox and Orphan')
+        self.assertEqual(['Orphan'], self.links.get_orphaned_pages())
+
+    def test_rebuild(self):
+        self._insert_page('SomePage', 'See SandBox')
+        with self.env.db_transaction as db:
+            db("""INSERT INTO wiki (name, version, time, author, text)
+                  VALUES ('SomePage',2,0,'joe','See #1 and #2')""")
+            update_latest_version(db, 'SomePage')
+        self.assertEqual(2, self.links.rebuild())
+        self.assertEqual([('ticket', '1'), ('ticket', '2')],
+                         self.links.get_links('wiki', 'SomePage'))
+
+    def test_backlinks_view(self):
+        self._insert_page('SandBox', 'Text')
+        self._insert_page('SomePage', 'See SandBox')
+        self._insert_page('OtherPage', 'See SandBox')
+        req = MockRequest(self.env, path_info='/wiki/SandBox',
+                          args={'action': 'backlinks'})
+        self.assertTrue(WikiModule(self.env).match_request(req))
+        template, data = WikiModule(self.env).process_request(req)[:2]
+        self.assertEqual('wiki_backlinks.html', template)
+        self.assertEqual(['OtherPage', 'SomePage'], data['backlinks'])
+
+
+def test_suite():
+    return unittest.makeSuite(WikiLinkIndexTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
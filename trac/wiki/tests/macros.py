@@ -20,7 +20,7 @@ from trac.config import BoolOption, ConfigSection, IntOption, ListOption, \
                         Option
 from trac.test import locale_en, mkdtemp, rmtree
 from trac.util.datefmt import datetime_now, format_date, utc
-from trac.wiki.model import WikiPage
+from trac.wiki.model import WikiPage, rebuild_latest_versions
 from trac.wiki.tests import formatter
 
 
@@ -624,6 +624,9 @@ def recentchanges_setup(tc):
         'WikiMid',
         'WikiEnd',
         ])
+    # WikiStart is inserted directly in the wiki table by WikiTestCase
+    with tc.env.db_transaction as db:
+        rebuild_latest_versions(db)
     tc.expected = tc.expected % {'date': format_date(tzinfo=utc,
                                                      locale=locale_en)}
 
@@ -725,6 +728,61 @@ PAGEOUTLINE_MACRO_TEST_CASES = u""""
 <h4 class="section" id="HeadingLevel4">Heading Level 4</h4>
 <h5 class="section" id="HeadingLevel5">Heading Level 5</h5>
 <h6 class="section" id="HeadingLevel6">Heading Level 6</h6>
+============================== PageOutline, headings after the macro
+[[PageOutline(1-2, Contents, inline)]]
+= Intro =
+== Part [wiki:WikiStart link] ==
+{{{#!div
+= In div =
+}}}
+= Other =
+== Part [wiki:WikiStart link] ==
+------------------------------
+<p>
+<h4 class="section">Contents</h4>
+<ol>
+  <li>
+    <a href="#Intro">Intro</a>
+    <ol>
+      <li>
+        <a href="#Partlink">Part link</a>
+      </li>
+    </ol>
+  </li>
+  <li>
+    <a href="#Other">Other</a>
+    <ol>
+      <li>
+        <a href="#Partlink1">Part link</a>
+      </li>
+    </ol>
+  </li>
+</ol>
+
+</p>
+<h1 class="section" id="Intro">Intro</h1>
+<h2 class="section" id="Partlink">Part <a class="wiki" href="/wiki/WikiStart">link</a></h2>
+<div class="wikipage"><h1 class="section" id="Indiv">In div</h1>
+</div><h1 class="section" id="Other">Other</h1>
+<h2 class="section" id="Partlink1">Part <a class="wiki" href="/wiki/WikiStart">link</a></h2>
+============================== PageOutline, anchors of the code blocks
+[[PageOutline]]
+{{{#!text/plain lineno
+Text
+}}}
+= a =
+------------------------------
+<p>
+</p><div class="wiki-toc">
+<ol>
+  <li>
+    <a href="#a1">a</a>
+  </li>
+</ol>
+</div><p>
+</p>
+<div class="wiki-code"><table class="code"><thead><tr><th class="lineno" title="Line numbers">Line</th><th class="content">\xa0</th></tr></thead><tbody><tr><th id="a-L1"><a href="#a-L1">1</a></th><td>Text
+</td></tr></tbody></table></div><h1 class="section" id="a1">a</h1>
 """
 
 
@@ -21,6 +21,7 @@ from trac.resource import Resource
 from trac.test import EnvironmentStub, mkdtemp
 from trac.util.datefmt import utc, to_utimestamp
 from trac.wiki import WikiPage, IWikiChangeListener
+from trac.wiki.model import rebuild_latest_versions, update_latest_version
 
 
 class TestWikiChangeListener(Component):
@@ -237,9 +238,10 @@ class WikiPageTestCase(unittest.TestCase):
 
     def test_rename_page(self):
         data = (1, 42, 'joe', 'Bla bla', 'Testing', 0)
-        self.env.db_transaction(
-            "INSERT INTO wiki VALUES(%s,%s,%s,%s,%s,%s,%s)",
-            ('TestPage',) + data)
+        with self.env.db_transaction as db:
+            db("INSERT INTO wiki VALUES(%s,%s,%s,%s,%s,%s,%s)",
+               ('TestPage',) + data)
+            update_latest_version(db, 'TestPage')
         attachment = Attachment(self.env, 'wiki', 'TestPage')
         attachment.insert('foo.txt', io.BytesIO(), 0, 1)
 
@@ -343,6 +345,47 @@ class WikiPageTestCase(unittest.TestCase):
         page = WikiPage(self.env, resource, 1)
         self.assertEqual(1, page.version)
 
+    def _get_latest_versions(self):
+        return self.env.db_query("""
+            SELECT name, version, time FROM wiki_latest ORDER BY name""")
+
+    def test_latest_version(self):
+        t1 = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+        t2 = datetime(2002, 1, 1, 1, 1, 1, 0, utc)
+        page = WikiPage(self.env, 'TestPage')
+        page.text = 'Bla bla'
+        page.save('joe', 'Testing', t=t1)
+        self.assertEqual([('TestPage', 1, to_utimestamp(t1))],
+                         self._get_latest_versions())
+
+        page.text = 'Bla'
+        page.save('kate', 'Changing', t=t2)
+        self.assertEqual([('TestPage', 2, to_utimestamp(t2))],
+                         self._get_latest_versions())
+
+        page.delete(version=2)
+        self.assertEqual([('TestPage', 1, to_utimestamp(t1))],
+                         self._get_latest_versions())
+
+        page.rename('PageRenamed')
+        self.assertEqual([('PageRenamed', 1, to_utimestamp(t1))],
+                         self._get_latest_versions())
+
+        page.delete()
+        self.assertEqual([], self._get_latest_versions())
+
+    def test_rebuild_latest_versions(self):
+        with self.env.db_transaction as db:
+            db.executemany("""
+                INSERT INTO wiki (name, version, time, author, text)
+                VALUES (%s,%s,%s,'joe','Text')
+                """, [('PageA', 1, 10), ('PageA', 2, 20), ('PageB', 1, 30)])
+            db("INSERT INTO wiki_latest (name, version, time) "
+               "VALUES ('PageC',1,40)")
+            self.assertEqual(2, rebuild_latest_versions(db))
+        self.assertEqual([('PageA', 2, 20), ('PageB', 1, 30)],
+                         self._get_latest_versions())
+
 
 def test_suite():
     return unittest.makeSuite(WikiPageTestCase)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import io
+import unittest
+
+from trac.test import EnvironmentStub, MockRequest
+from trac.web.chrome import web_context
+from trac.wiki.formatter import Formatter, format_to_html, \
+                               format_to_oneliner
+from trac.wiki.model import WikiPage
+from trac.wiki.parser import WikiDocument, WikiParser
+
+
+class WikiParserTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.parser = WikiParser(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_tokenize(self):
+        tokens = self.parser.tokenize(u"Some '''bold''' and !WikiStart")
+        self.assertEqual(u'Some ', tokens[0])
+        self.assertEqual(('bold', u"'''"), tokens[1][:2])
+        self.assertEqual(u'bold', tokens[2])
+        self.assertEqual(('bold', u"'''"), tokens[3][:2])
+        self.assertEqual(u' and ', tokens[4])
+        self.assertEqual(u'!WikiStart', tokens[5][1])
+        self.assertEqual(6, len(tokens))
+
+    def test_parse(self):
+        document = self.parser.parse("First line\n\vSecond 'line'")
+        self.assertIsInstance(document, WikiDocument)
+        self.assertEqual([u'First line', u" Second 'line'"], document.lines)
+        self.assertIs(document, self.parser.parse(document))
+        self.assertTrue(document)
+        self.assertFalse(self.parser.parse(''))
+
+    def test_parse_lines(self):
+        document = self.parser.parse(['First line', u'Second line'])
+        self.assertEqual(u'First line\nSecond line', document.text)
+        self.assertIsNot(document,
+                         self.parser.parse(['First line', u'Second line']))
+
+    def test_documents_are_cached(self):
+        self.parser.min_cached_length = 4
+        self.env.config.set('wiki', 'parse_cache_size', 14)
+        document = self.parser.parse(u'Text', cache=True)
+        tokens = document.tokenize(u'Text')
+        self.assertIs(tokens, document.tokenize(u'Text'))
+        self.assertIs(document, self.parser.parse(u'Text', cache=True))
+        self.parser.parse(u'Other text', cache=True)
+        self.assertIs(document, self.parser.parse(u'Text', cache=True))
+        self.parser.parse(u'Other text', cache=True)
+        self.parser.parse(u'Third text', cache=True)
+        self.assertIsNot(document, self.parser.parse(u'Text', cache=True))
+
+    def test_documents_are_not_cached(self):
+        self.parser.min_cached_length = 4
+        self.env.config.set('wiki', 'parse_cache_size', 14)
+        document = self.parser.parse(u'Text')
+        self.assertIsNot(document, self.parser.parse(u'Text'))
+        document = self.parser.parse(u'Txt', cache=True)
+        self.assertIsNot(document, self.parser.parse(u'Txt', cache=True))
+        document = self.parser.parse(u'Too long text', cache=True)
+        self.parser.parse(u'Text', cache=True)
+        self.assertIsNot(document,
+                         self.parser.parse(u'Too long text', cache=True))
+        self.env.config.set('wiki', 'parse_cache_size', 0)
+        document = self.parser.parse(u'Text', cache=True)
+        self.assertIsNot(document, self.parser.parse(u'Text', cache=True))
+
+    def test_formatted_documents_are_cached(self):
+        text = u"Some ''text''\n" * 50
+        context = web_context(MockRequest(self.env))
+        format_to_oneliner(self.env, context, text)
+        self.assertEqual([], list(self.parser._documents))
+        format_to_html(self.env, context, text)
+        self.assertEqual([text], list(self.parser._documents))
+
+    def test_format_document_in_contexts(self):
+        """A document is formatted according to the context."""
+        document = self.parser.parse(u"See SomePage, ''now''")
+        context = web_context(MockRequest(self.env))
+
+        self.assertEqual(u'<p>\nSee <a class="missing wiki" '
+                         u'href="/trac.cgi/wiki/SomePage" rel="nofollow">'
+                         u'SomePage</a>, <em>now</em>\n</p>\n',
+                         unicode(format_to_html(self.env, context,
+                                                document)))
+        page = WikiPage(self.env, 'SomePage')
+        page.text = 'Text'
+        page.save('joe', 'Comment')
+        self.assertEqual(u'See <a class="wiki" href="/trac.cgi/wiki/SomePage">'
+                         u'SomePage</a>, <em>now</em>',
+                         unicode(format_to_oneliner(self.env, context,
+                                                    document)))
+
+    def test_formatter_source_is_text(self):
+        context = web_context(MockRequest(self.env))
+        formatter = Formatter(self.env, context)
+        text = u"Some ''text''\n" * 50
+        formatter.format(text, io.StringIO())
+
+        self.assertEqual(text, formatter.source)
+        self.assertIs(self.parser.parse(text, cache=True),
+                      formatter.document)
+
+
+def test_suite():
+    return unittest.makeSuite(WikiParserTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -16,6 +16,7 @@ import unittest
 from trac.mimeview.patch import PatchRenderer
 from trac.test import EnvironmentStub, MockRequest
 from trac.web.api import RequestDone
+from trac.wiki.htmlcache import WikiHtmlCache
 from trac.wiki.web_api import WikiRenderer
 
 
@@ -49,6 +50,35 @@ class WikiRendererTestCase(unittest.TestCase):
             self.assertIn('jQuery.loadStyleSheet("'
                           '/trac.cgi/chrome/common/css/diff.css"', output)
 
+    def test_sections_cached(self):
+        text = """\
+= One =
+See #1
+
+= Two =
+{{{#!text/x-diff
+--- a/file.txt  2014-11-13 01:16:06 +0000
++++ b/file.txt  2014-11-13 01:16:06 +0000
+@@ -1 +1 @@
+-old line
++new line
+}}}
+"""
+        outputs = []
+        for edited in (text, text.replace('See #1', 'Changed')):
+            req = MockRequest(self.env, method='POST',
+                              path_info='/wiki_render',
+                              args={'id': 'WikiStart', 'text': edited})
+            self.assertRaises(RequestDone, self.mod.process_request, req)
+            outputs.append(req.response_sent.getvalue())
+
+        cache = WikiHtmlCache(self.env)
+        self.assertEqual((1, 3), (cache.section_hits, cache.section_misses))
+        self.assertIn('Changed', outputs[1])
+        for output in outputs:
+            self.assertIn('jQuery.loadStyleSheet("'
+                          '/trac.cgi/chrome/common/css/diff.css"', output)
+
 
 def test_suite():
     return unittest.makeSuite(WikiRendererTestCase)
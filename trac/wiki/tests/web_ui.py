@@ -147,6 +147,19 @@ class WikiModuleTestCase(unittest.TestCase):
         self.assertNotIn('version', resp[1])
         self.assertEqual('NewPage', resp[1]['page'].name)
 
+    def test_preview(self):
+        req = MockRequest(self.env, path_info='/wiki/NewPage', method='POST',
+                          args={'action': 'edit', 'page': 'NewPage',
+                                'preview': 'Preview', 'version': '0',
+                                'text': '= Title =\nSee WikiStart'})
+
+        resp = WikiModule(self.env).process_request(req)
+
+        self.assertEqual('wiki_edit.html', resp[0])
+        self.assertEqual('preview', resp[1]['action'])
+        self.assertIn('<h1 class="section" id="Title">Title</h1>',
+                      unicode(resp[1]['page_html']))
+
 
 def test_suite():
     suite = unittest.TestSuite()
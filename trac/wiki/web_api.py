@@ -17,6 +17,7 @@ from trac.web.api import IRequestHandler
 from trac.web.chrome import chrome_info_script, web_context
 from trac.wiki.api import WikiSystem
 from trac.wiki.formatter import format_to
+from trac.wiki.htmlcache import WikiHtmlCache
 
 
 class WikiRenderer(Component):
@@ -51,6 +52,12 @@ class WikiRenderer(Component):
 
         resource = Resource(realm, id=id, version=version)
         context = web_context(req, resource)
-        rendered = format_to(self.env, flavor, context, text, **options) + \
-                   chrome_info_script(req)
+        html_cache = self.env[WikiHtmlCache]
+        if html_cache and realm == WikiSystem.realm and not flavor and \
+                not options:
+            # Only format the sections of the previewed page which changed
+            rendered = html_cache.render_sections(context, text)
+        else:
+            rendered = format_to(self.env, flavor, context, text, **options)
+        rendered += chrome_info_script(req)
         req.send(rendered.encode('utf-8'))
@@ -16,6 +16,7 @@
 # Author: Jonas Borgström <jonas@edgewall.com>
 #         Christopher Lenz <cmlenz@gmx.de>
 
+from functools import partial
 import pkg_resources
 import re
 
@@ -25,9 +26,12 @@ from trac.core import *
 from trac.mimeview.api import IContentConverter, Mimeview
 from trac.perm import IPermissionPolicy, IPermissionRequestor
 from trac.resource import *
-from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search import ISearchSource, search_result_key, search_to_sql, \
+                        shorten_result, sorted_search_results
+from trac.search.index import SearchIndex
 from trac.timeline.api import ITimelineEventProvider
-from trac.util import as_int, get_reporter_id
+from trac.timeline.index import TimelineChangeTracker
+from trac.util import as_int, chunked, get_reporter_id
 from trac.util.datefmt import from_utimestamp, to_utimestamp
 from trac.util.html import tag
 from trac.util.text import shorten_line
@@ -39,7 +43,9 @@ from trac.web.chrome import (Chrome, INavigationContributor, ITemplateProvider,
                              add_notice, add_script, add_stylesheet,
                              add_warning, prevnext_nav, web_context)
 from trac.wiki.api import IWikiPageManipulator, WikiSystem, validate_page_name
-from trac.wiki.formatter import format_to, OneLinerFormatter
+from trac.wiki.formatter import format_to, format_to_html, OneLinerFormatter
+from trac.wiki.htmlcache import WikiHtmlCache
+from trac.wiki.links import WikiLinkIndex
 from trac.wiki.model import WikiPage
 
 
@@ -178,6 +184,8 @@ class WikiModule(Component):
             return self._render_diff(req, versioned_page)
         elif action == 'history':
             return self._render_history(req, versioned_page)
+        elif action == 'backlinks':
+            return self._render_backlinks(req, page)
         else:
             format = req.args.get('format')
             if format:
@@ -196,6 +204,22 @@ class WikiModule(Component):
 
     # Internal methods
 
+    _search_query = """
+        SELECT w1.name, w1.time, w1.author, w1.text
+        FROM wiki_latest w2
+        INNER JOIN wiki w1 ON (w1.name=w2.name AND w1.version=w2.version)
+        WHERE %s"""
+
+    def _make_search_result(self, req, terms, matches, row):
+        name, ts, author, text = row
+        page = Resource(self.realm, name)
+        if 'WIKI_VIEW' in req.perm(page):
+            score = () if matches is None else (matches[name],)
+            return (get_resource_url(self.env, page, req.href),
+                    '%s: %s' % (name, shorten_line(text)),
+                    from_utimestamp(ts), author,
+                    shorten_result(text, terms)) + score
+
     def _validate(self, req, page):
         valid = True
 
@@ -379,6 +403,20 @@ class WikiModule(Component):
         req.redirect(get_resource_url(self.env, page.resource, req.href,
                                       version=None))
 
+    def _render_backlinks(self, req, page):
+        """Show the wiki pages linking to the page."""
+        links = self.env[WikiLinkIndex]
+        if links is None:
+            raise TracError(_("The wiki links are not collected."))
+        data = self._page_data(req, page, 'backlinks')
+        data['backlinks'] = [
+            name for realm, name, version
+            in links.get_backlinks(self.realm, page.name)
+            if realm == self.realm and 'WIKI_VIEW' in req.perm(realm, name)]
+        add_ctxtnav(req, _("Back to %(wikipage)s", wikipage=page.name),
+                    req.href.wiki(page.name))
+        return 'wiki_backlinks.html', data
+
     def _render_confirm_delete(self, req, page):
         req.perm(page.resource).require('WIKI_DELETE')
 
@@ -581,6 +619,14 @@ class WikiModule(Component):
                          'longcol': 'Version', 'shortcol': 'v'})
         elif sidebyside and action != 'collision':
             data['action'] = 'preview'
+        if data['action'] == 'preview' and not data['diff']:
+            html_cache = self.env[WikiHtmlCache]
+            if html_cache:
+                data['page_html'] = html_cache.render_sections(context,
+                                                               page.text)
+            else:
+                data['page_html'] = format_to_html(self.env, context,
+                                                   page.text)
 
         self._wiki_ctxtnav(req, page)
         Chrome(self.env).add_wiki_toolbars(req)
@@ -660,7 +706,6 @@ class WikiModule(Component):
             related = [each for each in ws.pages
                        if name in each.lower()
                           and 'WIKI_VIEW' in req.perm(self.realm, each)]
-            related.sort()
             related = [ws._format_link(formatter, 'wiki', '/' + each, each,
                                        False)
                        for each in related]
@@ -721,9 +766,16 @@ class WikiModule(Component):
             manipulator.prepare_wiki_page(req, page, fields)
         text = fields.get('text', '')
 
+        html_cache = self.env[WikiHtmlCache]
+        if html_cache:
+            page_html = html_cache.render(context, page, text)
+        else:
+            page_html = format_to_html(self.env, context, text)
+
         data.update({
             'context': context,
             'text': text,
+            'page_html': page_html,
             'latest_version': latest_page.version,
             'attachments': AttachmentModule(self.env).attachment_data(context),
             'start_page': self.START_PAGE,
@@ -746,6 +798,9 @@ class WikiModule(Component):
         if page.exists:
             add_ctxtnav(req, _("History"), req.href.wiki(page.name,
                                                          action='history'))
+            if self.env[WikiLinkIndex]:
+                add_ctxtnav(req, _("Backlinks"),
+                            req.href.wiki(page.name, action='backlinks'))
 
     # ITimelineEventProvider methods
 
@@ -771,6 +826,13 @@ class WikiModule(Component):
                     req, wiki_realm, start, stop):
                 yield event
 
+    def get_timeline_last_modified(self, req, filters):
+        for ts, in self.env.db_query("SELECT MAX(time) FROM wiki"):
+            return max(from_utimestamp(ts), AttachmentModule(self.env)
+                       .get_timeline_last_modified(req, Resource(self.realm)),
+                       TimelineChangeTracker(self.env)
+                       .get_last_changed(self.realm))
+
     def render_timeline_event(self, context, field, event):
         wiki_page, comment = event[3]
         if field == 'url':
@@ -800,28 +862,66 @@ class WikiModule(Component):
     def get_search_results(self, req, terms, filters):
         if not 'wiki' in filters:
             return
+        wiki_realm = Resource(self.realm)
+        matches = SearchIndex(self.env).search(self.realm, terms)
         with self.env.db_query as db:
-            sql_query, args = search_to_sql(db, ['w1.name', 'w1.author',
-                                                 'w1.text'], terms)
-            wiki_realm = Resource(self.realm)
-            for name, ts, author, text in db("""
-                    SELECT w1.name, w1.time, w1.author, w1.text
-                    FROM wiki w1,(SELECT name, max(version) AS ver
-                                  FROM wiki GROUP BY name) w2
-                    WHERE w1.version = w2.ver AND w1.name = w2.name
-                    AND """ + sql_query, args):
-                page = wiki_realm(id=name)
-                if 'WIKI_VIEW' in req.perm(page):
-                    yield (get_resource_url(self.env, page, req.href),
-                           '%s: %s' % (name, shorten_line(text)),
-                           from_utimestamp(ts), author,
-                           shorten_result(text, terms))
+            if matches is None:
+                sql_query, args = search_to_sql(db, ['w1.name', 'w1.author',
+                                                     'w1.text'], terms)
+                rows = db(self._search_query % sql_query, args)
+            else:
+                rows = []
+                for names in chunked(list(matches)):
+                    rows.extend(db(self._search_query
+                                   % ('w2.name IN (%s)'
+                                      % ','.join(['%s'] * len(names))),
+                                   names))
+            for row in rows:
+                result = self._make_search_result(req, terms, matches, row)
+                if result is not None:
+                    yield result
 
         # Attachments
         for result in AttachmentModule(self.env).get_search_results(
                 req, wiki_realm, terms):
             yield result
 
+    def get_sorted_search_results(self, req, terms, filters, limit):
+        if not 'wiki' in filters:
+            return [], 0
+        matches = SearchIndex(self.env).search(self.realm, terms)
+        with self.env.db_query as db:
+            if matches is None:
+                sql_query, args = search_to_sql(db, ['w1.name', 'w1.author',
+                                                     'w1.text'], terms)
+                query = self._search_query % sql_query
+                count = db("SELECT COUNT(*) FROM (%s) AS w" % query,
+                           args)[0][0]
+                def fetch(offset, size):
+                    return db(query + " ORDER BY w1.time DESC "
+                                      "LIMIT %d OFFSET %d" % (size, offset),
+                              args)
+            else:
+                names = sorted(matches, key=matches.get, reverse=True)
+                count = len(names)
+                def fetch(offset, size):
+                    chunk = names[offset:offset + size]
+                    return db(self._search_query
+                              % ('w2.name IN (%s)'
+                                 % ','.join(['%s'] * len(chunk))),
+                              chunk) if chunk else []
+            results = sorted_search_results(
+                fetch, partial(self._make_search_result, req, terms, matches),
+                limit)
+
+        # Attachments
+        attachments, attachments_count = \
+            AttachmentModule(self.env).get_sorted_search_results(
+                req, Resource(self.realm), terms, limit)
+        results.extend(attachments)
+        results.sort(key=search_result_key, reverse=True)
+        return results[:limit], count + attachments_count
+
 
 class DefaultWikiPolicy(Component):
     """Default permission policy for the wiki system.
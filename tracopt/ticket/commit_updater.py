@@ -36,23 +36,44 @@
 # ----------------------------------------------------------------------------
 
 import re
+import time
+from datetime import timedelta
 
+from trac.admin import AdminCommandError, IAdminCommandProvider
+from trac.api import IEnvironmentSetupParticipant
 from trac.config import BoolOption, Option
 from trac.core import Component, implements
+from trac.db import Column, DatabaseManager, Table
 from trac.notification.api import NotificationSystem
 from trac.perm import PermissionCache
 from trac.resource import Resource
 from trac.ticket import Ticket
 from trac.ticket.notification import TicketChangeEvent
-from trac.util.datefmt import datetime_now, utc
+from trac.util import as_int, chunked
+from trac.util.datefmt import datetime_now, to_utimestamp, utc
 from trac.util.html import tag
-from trac.util.text import exception_to_unicode
+from trac.util.text import exception_to_unicode, printout
 from trac.util.translation import _, cleandoc_
 from trac.versioncontrol import IRepositoryChangeListener, RepositoryManager
 from trac.versioncontrol.web_ui.changeset import ChangesetModule
 from trac.wiki.formatter import format_to_html
 from trac.wiki.macros import WikiMacroBase
 
+db_version_name = 'commit_ticket_update_version'
+db_version = 2
+
+schema = [
+    Table('commit_ticket_update_queue', key='id')[
+        Column('id', auto_increment=True),
+        Column('time', type='int64'),
+        Column('repos'),
+        Column('rev'),
+        Column('old_message'),
+        Column('claimed', type='int64'),
+        Column('attempts', type='int'),
+        Column('tickets')],
+]
+
 
 class CommitTicketUpdater(Component):
     """Update tickets based on commit messages.
@@ -104,9 +125,17 @@ class CommitTicketUpdater(Component):
         and refs #12.
 
     This will close #10 and #12, and add a note to #12.
+
+    When `commit_ticket_update_queue` is enabled, the changesets are only
+    recorded when they are added or modified, and the tickets are updated
+    by `trac-admin $ENV changeset process`. A ticket referenced by several
+    changesets of the same author is then updated and notified once. A
+    changeset which can't be processed is kept in the queue and retried
+    by the next runs, at most `max_attempts` times.
     """
 
-    implements(IRepositoryChangeListener)
+    implements(IAdminCommandProvider, IEnvironmentSetupParticipant,
+               IRepositoryChangeListener)
 
     envelope = Option('ticket', 'commit_ticket_update_envelope', '',
         """Require commands to be enclosed in an envelope.
@@ -136,6 +165,14 @@ class CommitTicketUpdater(Component):
     notify = BoolOption('ticket', 'commit_ticket_update_notify', 'true',
         """Send ticket change notification when updating a ticket.""")
 
+    queue = BoolOption('ticket', 'commit_ticket_update_queue', 'false',
+        """Queue the added and modified changesets rather than updating the
+        tickets when the repository is synchronized, for example from a
+        post-commit hook. The queued changesets are processed by
+        `trac-admin $ENV changeset process`, which updates each ticket
+        once for all the changesets of an author that reference it.
+        (''since 1.3.3'')""")
+
     ticket_prefix = '(?:#|(?:ticket|issue|bug)[: ]?)'
     ticket_reference = ticket_prefix + \
                        '[0-9]+(?:#comment:([0-9]+|description))?'
@@ -151,13 +188,56 @@ class CommitTicketUpdater(Component):
 
     ticket_re = re.compile(ticket_prefix + '([0-9]+)')
 
+    # Number of times the processing of a queued changeset is attempted
+    max_attempts = 5
+
+    # Time in seconds after which the queued changesets claimed by a
+    # processing run which didn't complete can be claimed again
+    claim_timeout = 3600
+
     _last_cset_id = None
 
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('changeset process', '[interval]',
+               """Update the tickets referenced by the queued changesets
+
+               The changesets are queued when the [ticket]
+               commit_ticket_update_queue option is enabled. When an
+               interval in seconds is given, keep running and process
+               the queue at the given interval.""",
+               None, self._do_process)
+
+    # IEnvironmentSetupParticipant methods
+
+    def environment_created(self):
+        dbm = DatabaseManager(self.env)
+        with self.env.db_transaction:
+            dbm.create_tables(schema)
+            dbm.set_database_version(db_version, db_version_name)
+
+    def environment_needs_upgrade(self):
+        dbm = DatabaseManager(self.env)
+        return dbm.needs_upgrade(db_version, db_version_name)
+
+    def upgrade_environment(self):
+        dbm = DatabaseManager(self.env)
+        with self.env.db_transaction:
+            if dbm.get_database_version(db_version_name):
+                dbm.upgrade_tables(schema)
+            else:
+                dbm.create_tables(schema)
+            dbm.set_database_version(db_version, db_version_name)
+
     # IRepositoryChangeListener methods
 
     def changeset_added(self, repos, changeset):
         if self._is_duplicate(changeset):
             return
+        if self.queue:
+            self._enqueue(repos, changeset)
+            return
         tickets = self._parse_message(changeset.message)
         comment = self.make_ticket_comment(repos, changeset)
         self._update_tickets(tickets, changeset, comment, datetime_now(utc))
@@ -165,6 +245,9 @@ class CommitTicketUpdater(Component):
     def changeset_modified(self, repos, changeset, old_changeset):
         if self._is_duplicate(changeset):
             return
+        if self.queue:
+            self._enqueue(repos, changeset, old_changeset)
+            return
         tickets = self._parse_message(changeset.message)
         old_tickets = {}
         if old_changeset is not None:
@@ -174,6 +257,124 @@ class CommitTicketUpdater(Component):
         comment = self.make_ticket_comment(repos, changeset)
         self._update_tickets(tickets, changeset, comment, datetime_now(utc))
 
+    def process(self):
+        """Update the tickets referenced by the queued changesets.
+
+        The changes of an author to a ticket are saved at once, with the
+        comments of all the changesets, and a single notification is
+        sent.
+
+        The queued changesets are claimed before being processed, so
+        that concurrent runs don't process the same changesets. The
+        changesets which can't be retrieved, and the tickets which
+        can't be updated, are left in the queue for the next runs.
+
+        :return: the number of changesets processed.
+        """
+        claim = self._claim()
+        rows = self.env.db_query("""
+            SELECT id, repos, rev, old_message, attempts, tickets
+            FROM commit_ticket_update_queue WHERE claimed=%s ORDER BY id
+            """, (claim,))
+        if not rows:
+            return 0
+        rm = RepositoryManager(self.env)
+        updates = {}
+        keys = []
+        row_keys = {}
+        done = []
+        failed = {}
+        for id_, reponame, rev, old_message, attempts, pending in rows:
+            try:
+                repos = rm.get_repository(reponame)
+                changeset = repos.get_changeset(rev)
+            except Exception as e:
+                self.log.error("Unable to process changeset %s in "
+                               "repository '%s': %s", rev, reponame,
+                               exception_to_unicode(e))
+                failed[id_] = pending
+                continue
+            tickets = self._parse_message(changeset.message)
+            if old_message is not None:
+                old_tickets = self._parse_message(old_message)
+                tickets = dict(each for each in tickets.iteritems()
+                               if each[0] not in old_tickets)
+            if pending is not None:
+                # Only the tickets which failed to be updated previously
+                pending = set(int(tkt_id) for tkt_id in pending.split(','))
+                tickets = dict(each for each in tickets.iteritems()
+                               if each[0] in pending)
+            if not tickets:
+                done.append(id_)
+                continue
+            comment = self.make_ticket_comment(repos, changeset)
+            authname = self._authname(changeset)
+            row_keys[id_] = []
+            for tkt_id in sorted(tickets):
+                key = (tkt_id, authname)
+                if key not in updates:
+                    updates[key] = []
+                    keys.append(key)
+                updates[key].append((changeset, tickets[tkt_id], comment))
+                row_keys[id_].append(key)
+
+        now = datetime_now(utc)
+        updated = set()
+        for idx, (tkt_id, authname) in enumerate(keys):
+            # Distinct times for the changes of several authors to a ticket
+            date = now + timedelta(microseconds=idx)
+            if self._update_ticket(tkt_id, authname,
+                                   updates[tkt_id, authname], date):
+                updated.add((tkt_id, authname))
+        for id_, keys in row_keys.iteritems():
+            remaining = [key[0] for key in keys if key not in updated]
+            if remaining:
+                failed[id_] = ','.join(str(tkt_id) for tkt_id in remaining)
+            else:
+                done.append(id_)
+
+        attempts = dict((row[0], row[4] or 0) for row in rows)
+        with self.env.db_transaction as db:
+            for ids in chunked(sorted(done)):
+                db("""
+                    DELETE FROM commit_ticket_update_queue WHERE id IN (%s)
+                    """ % ','.join(['%s'] * len(ids)), ids)
+            for id_, pending in sorted(failed.iteritems()):
+                if attempts[id_] + 1 >= self.max_attempts:
+                    self.log.error("Giving up processing the queued "
+                                   "changeset %s after %d attempts", id_,
+                                   attempts[id_] + 1)
+                    db("""
+                        DELETE FROM commit_ticket_update_queue WHERE id=%s
+                        """, (id_,))
+                else:
+                    db("""
+                        UPDATE commit_ticket_update_queue
+                        SET claimed=NULL, attempts=%s, tickets=%s
+                        WHERE id=%s
+                        """, (attempts[id_] + 1, pending, id_))
+        return len(done)
+
+    def _claim(self):
+        """Claim the queued changesets which aren't claimed by another
+        run, or whose claim is stale, and return the claim."""
+        claim = to_utimestamp(datetime_now(utc))
+        self.env.db_transaction("""
+            UPDATE commit_ticket_update_queue SET claimed=%s
+            WHERE claimed IS NULL OR claimed<%s
+            """, (claim, claim - self.claim_timeout * 1000000))
+        return claim
+
+    def _enqueue(self, repos, changeset, old_changeset=None):
+        self.env.db_transaction("""
+            INSERT INTO commit_ticket_update_queue
+                (time, repos, rev, old_message, attempts)
+            VALUES (%s,%s,%s,%s,0)
+            """, (to_utimestamp(datetime_now(utc)), repos.reponame,
+                  unicode(changeset.rev),
+                  old_changeset.message if old_changeset is not None
+                                        else None))
+
     def _is_duplicate(self, changeset):
         # Avoid duplicate changes with multiple scoped repositories
         cset_id = (changeset.rev, changeset.message, changeset.author,
@@ -216,24 +417,41 @@ In [changeset:"%s" %s]:
     def _update_tickets(self, tickets, changeset, comment, date):
         """Update the tickets with the given comment."""
         authname = self._authname(changeset)
-        perm = PermissionCache(self.env, authname)
         for tkt_id, cmds in tickets.iteritems():
-            self.log.debug("Updating ticket #%d", tkt_id)
-            save = False
-            try:
-                with self.env.db_transaction:
-                    ticket = Ticket(self.env, tkt_id)
-                    ticket_perm = perm(ticket.resource)
+            self._update_ticket(tkt_id, authname,
+                                [(changeset, cmds, comment)], date)
+
+    def _update_ticket(self, tkt_id, authname, updates, date):
+        """Update a ticket for a list of `(changeset, cmds, comment)`
+        tuples, saving the ticket once with the comments of the
+        changesets for which a command succeeded.
+
+        :return: `False` if the ticket couldn't be updated.
+        """
+        self.log.debug("Updating ticket #%d", tkt_id)
+        perm = PermissionCache(self.env, authname)
+        comments = []
+        try:
+            with self.env.db_transaction:
+                ticket = Ticket(self.env, tkt_id)
+                ticket_perm = perm(ticket.resource)
+                for changeset, cmds, comment in updates:
+                    save = False
                     for cmd in cmds:
                         if cmd(ticket, changeset, ticket_perm) is not False:
                             save = True
                     if save:
-                        ticket.save_changes(authname, comment, date)
-                if save:
-                    self._notify(ticket, date, changeset.author, comment)
-            except Exception as e:
-                self.log.error("Unexpected error while processing ticket "
-                               "#%s: %s", tkt_id, exception_to_unicode(e))
+                        comments.append(comment)
+                if comments:
+                    comment = '\n\n'.join(comments)
+                    ticket.save_changes(authname, comment, date)
+        except Exception as e:
+            self.log.error("Unexpected error while processing ticket "
+                           "#%s: %s", tkt_id, exception_to_unicode(e))
+            return False
+        if comments:
+            self._notify(ticket, date, updates[0][0].author, comment)
+        return True
 
     def _notify(self, ticket, date, author, comment):
         """Send a ticket update notification."""
@@ -265,6 +483,24 @@ In [changeset:"%s" %s]:
                if self.env.config.getbool('trac', 'ignore_auth_case') \
                else changeset.author
 
+    def _do_process(self, interval=None):
+        if interval is not None:
+            value = as_int(interval, None)
+            if value is None or value < 1:
+                raise AdminCommandError(_("Invalid interval '%(interval)s'",
+                                          interval=interval))
+            interval = value
+        while True:
+            count = self.process()
+            if count:
+                printout(_("%(count)d changesets processed", count=count))
+            if interval is None:
+                break
+            try:
+                time.sleep(interval)
+            except KeyboardInterrupt:
+                break
+
     # Command-specific behavior
     # The ticket isn't updated if all extracted commands return False.
 
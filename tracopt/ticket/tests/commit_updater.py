@@ -14,6 +14,7 @@
 import unittest
 from datetime import datetime
 
+from trac.db.api import DatabaseManager
 from trac.test import EnvironmentStub, Mock
 from trac.tests.contentgen import random_sentence
 from trac.ticket.model import Ticket
@@ -105,6 +106,153 @@ This is the first comment after an edit. Refs #1, #2.
                 self.assertEqual(comment, change['fields']['comment']['new'])
 
 
+class QueuedCommitTicketUpdaterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*',
+                                           'tracopt.ticket.commit_updater.*'])
+        self.env.config.set('ticket', 'commit_ticket_update_check_perms', False)
+        self.env.config.set('ticket', 'commit_ticket_update_queue', True)
+        self.changesets = {}
+        self.repos = Mock(Repository, 'repos1', {'name': 'repos1', 'id': 1},
+                          self.env.log, normalize_rev=lambda rev: rev,
+                          get_changeset=lambda rev: self.changesets[int(rev)])
+        setattr(RepositoryManager(self.env), 'get_repository',
+                lambda reponame: self.repos)
+        self.updater = CommitTicketUpdater(self.env)
+        self.updater.upgrade_environment()
+        self.notified = []
+        self.updater._notify = lambda ticket, date, author, comment: \
+                               self.notified.append((ticket.id, author))
+        for idx in xrange(2):
+            insert_ticket(self.env, reporter='someone', summary='Summary')
+
+    def tearDown(self):
+        DatabaseManager(self.env).drop_tables(['commit_ticket_update_queue'])
+        self.env.reset_db()
+
+    def _add_changeset(self, rev, message, author='joe'):
+        changeset = Mock(repos=self.repos, rev=rev, message=message,
+                         author=author,
+                         date=datetime(2001, 1, 1, 1, 1, rev, 0, utc))
+        self.changesets[rev] = changeset
+        self.updater.changeset_added(self.repos, changeset)
+        return changeset
+
+    def _get_comments(self, tkt_id):
+        return [value for value, in self.env.db_query("""
+            SELECT newvalue FROM ticket_change
+            WHERE ticket=%s AND field='comment' ORDER BY time
+            """, (tkt_id,))]
+
+    def test_changeset_added_is_queued(self):
+        changeset = self._add_changeset(1, 'Refs #1.')
+
+        self.assertEqual([], self._get_comments(1))
+        self.assertEqual(1, self.updater.process())
+        self.assertEqual([self.updater.make_ticket_comment(self.repos,
+                                                           changeset)],
+                         self._get_comments(1))
+        self.assertEqual([(1, 'joe')], self.notified)
+        self.assertEqual(0, self.updater.process())
+
+    def test_changesets_are_coalesced(self):
+        changesets = [self._add_changeset(1, 'Refs #1.'),
+                      self._add_changeset(2, 'Refs #1 and #2.'),
+                      self._add_changeset(3, 'Fixes #1.')]
+
+        self.assertEqual(3, self.updater.process())
+        comments = [self.updater.make_ticket_comment(self.repos, changeset)
+                    for changeset in changesets]
+        self.assertEqual(['\n\n'.join(comments)], self._get_comments(1))
+        self.assertEqual([comments[1]], self._get_comments(2))
+        self.assertEqual('closed', Ticket(self.env, 1)['status'])
+        self.assertEqual([(1, 'joe'), (2, 'joe')], self.notified)
+
+    def test_changesets_of_several_authors(self):
+        self._add_changeset(1, 'Refs #1.', author='joe')
+        self._add_changeset(2, 'Refs #1.', author='jim')
+
+        self.assertEqual(2, self.updater.process())
+        self.assertEqual(2, len(self._get_comments(1)))
+        self.assertEqual([(1, 'joe'), (1, 'jim')], self.notified)
+
+    def test_changeset_modified_is_queued(self):
+        old_changeset = self._add_changeset(1, 'Refs #1.')
+        self.assertEqual(1, self.updater.process())
+        changeset = Mock(repos=self.repos, rev=1, message='Refs #1, #2.',
+                         author='joe',
+                         date=datetime(2001, 1, 1, 1, 1, 1, 0, utc))
+        self.changesets[1] = changeset
+        self.updater.changeset_modified(self.repos, changeset, old_changeset)
+
+        self.assertEqual([], self._get_comments(2))
+        self.assertEqual(1, self.updater.process())
+        self.assertEqual(1, len(self._get_comments(1)))
+        self.assertEqual([self.updater.make_ticket_comment(self.repos,
+                                                           changeset)],
+                         self._get_comments(2))
+
+    def _get_queue(self):
+        return self.env.db_query("""
+            SELECT rev, attempts, tickets FROM commit_ticket_update_queue
+            ORDER BY id""")
+
+    def test_changeset_not_found_is_kept(self):
+        changeset = self._add_changeset(1, 'Refs #1.')
+        self._add_changeset(2, 'Refs #2.')
+        del self.changesets[1]
+
+        self.assertEqual(1, self.updater.process())
+        self.assertEqual([('1', 1, None)], self._get_queue())
+        self.assertEqual([], self._get_comments(1))
+        self.assertEqual(1, len(self._get_comments(2)))
+
+        self.changesets[1] = changeset
+        self.assertEqual(1, self.updater.process())
+        self.assertEqual([], self._get_queue())
+        self.assertEqual(1, len(self._get_comments(1)))
+
+    def test_changeset_not_found_is_dropped_after_max_attempts(self):
+        self._add_changeset(1, 'Refs #1.')
+        del self.changesets[1]
+
+        for idx in xrange(self.updater.max_attempts - 1):
+            self.assertEqual(0, self.updater.process())
+            self.assertEqual([('1', idx + 1, None)], self._get_queue())
+        self.assertEqual(0, self.updater.process())
+        self.assertEqual([], self._get_queue())
+
+    def test_failed_ticket_update_is_retried_alone(self):
+        self._add_changeset(1, 'Refs #1 and #3.')
+
+        self.assertEqual(0, self.updater.process())
+        self.assertEqual([('1', 1, '3')], self._get_queue())
+        self.assertEqual(1, len(self._get_comments(1)))
+
+        insert_ticket(self.env, reporter='someone', summary='Summary')
+        self.assertEqual(1, self.updater.process())
+        self.assertEqual([], self._get_queue())
+        self.assertEqual(1, len(self._get_comments(1)))
+        self.assertEqual(1, len(self._get_comments(3)))
+        self.assertEqual([(1, 'joe'), (3, 'joe')], self.notified)
+
+    def test_claimed_changesets_are_skipped(self):
+        self._add_changeset(1, 'Refs #1.')
+        claim = self.updater._claim()
+        self._add_changeset(2, 'Refs #2.')
+
+        self.assertEqual(1, self.updater.process())
+        self.assertEqual([], self._get_comments(1))
+        self.assertEqual(1, len(self._get_comments(2)))
+
+        self.env.db_transaction("""
+            UPDATE commit_ticket_update_queue SET claimed=%s
+            """, (claim - self.updater.claim_timeout * 1000000 - 1,))
+        self.assertEqual(1, self.updater.process())
+        self.assertEqual(1, len(self._get_comments(1)))
+
+
 def macro_setup(tc):
     tc.env = EnvironmentStub(enable=('trac.*',
                                      'tracopt.ticket.commit_updater.*',))
@@ -133,6 +281,7 @@ the message. refs <a class="new ticket" href="/ticket/1" title="#1: the summary
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(CommitTicketUpdaterTestCase))
+    suite.addTest(unittest.makeSuite(QueuedCommitTicketUpdaterTestCase))
     suite.addTest(formatter.test_suite(COMMIT_TICKET_REF_MACRO_TEST_CASES,
                                        macro_setup, __file__,
                                        context=('ticket', 1)))